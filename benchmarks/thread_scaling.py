@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Measure the throughput of rule evaluation from 1 to N threads.
+
+Each thread repeatedly evaluates the same rule, which itself evaluates
+nested rules, for a fixed period.  Run it under both a standard and a
+free-threaded ("python3.13t") interpreter to compare scaling; on the
+former, throughput is expected to stay roughly flat as threads are
+added, while on the latter it should increase with the number of
+cores.  For example::
+
+    python benchmarks/thread_scaling.py --threads 8
+    python3.13t -X gil=0 benchmarks/thread_scaling.py --threads 8
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import threading
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import policies  # noqa
+
+
+def make_policy():
+    """
+    Construct the policy to benchmark.
+
+    :returns: A ``policies.Policy``.
+    """
+
+    pol = policies.Policy()
+    pol['is_admin'] = '"admin" in roles'
+    pol['is_owner'] = 'user == target.owner'
+    pol['check'] = ('rule("is_admin") or (rule("is_owner") and '
+                    'target.size < 100) {{ level=len(roles) }}')
+    pol.warmup()
+
+    return pol
+
+
+class Target(object):
+    owner = 'alice'
+    size = 10
+
+
+def run(target, nthreads, duration):
+    """
+    Evaluate the rule from several threads at once.
+
+    :param target: The ``Policy`` or ``FrozenPolicy`` to evaluate
+                   against.
+    :param nthreads: The number of threads.
+    :param duration: The time, in seconds, for which to evaluate.
+
+    :returns: The total number of evaluations per second.
+    """
+
+    counts = [0] * nthreads
+    barrier = threading.Event()
+    stop = threading.Event()
+    variables = {'roles': ['user'], 'user': 'alice', 'target': Target()}
+
+    def worker(idx):
+        evaluate = target.evaluate
+        count = 0
+        barrier.wait()
+        while not stop.is_set():
+            for _i in range(100):
+                evaluate('check', variables)
+            count += 100
+        counts[idx] = count
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(nthreads)]
+    for thread in threads:
+        thread.start()
+
+    start = timeit.default_timer()
+    barrier.set()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = timeit.default_timer() - start
+
+    return sum(counts) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure rule evaluation throughput from 1 to N "
+        "threads.",
+    )
+    parser.add_argument('--threads', '-t', type=int,
+                        default=os.cpu_count() if hasattr(os, 'cpu_count')
+                        else 4,
+                        help="The maximum number of threads.")
+    parser.add_argument('--duration', '-d', type=float, default=2.0,
+                        help="The time, in seconds, to run each "
+                        "measurement for.")
+    args = parser.parse_args()
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print("Python %s (GIL %s)" %
+          (sys.version.split()[0], 'enabled' if gil else 'disabled'))
+
+    pol = make_policy()
+    targets = [('Policy', pol), ('FrozenPolicy', pol.freeze())]
+
+    print("%-8s %16s %16s %8s" % ('threads', targets[0][0], targets[1][0],
+                                  'scaling'))
+    base = None
+    for nthreads in range(1, args.threads + 1):
+        rates = [run(target, nthreads, args.duration)
+                 for _name, target in targets]
+        if base is None:
+            base = rates[0]
+        print("%-8d %14.0f/s %14.0f/s %7.2fx" %
+              (nthreads, rates[0], rates[1], rates[0] / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,10 +15,20 @@
 # <http://www.gnu.org/licenses/>.
 
 from policies.authorization import Authorization
-from policies.policy import (Policy, PolicyException,
-                             PolicyContext, want_context)
+from policies.cache import (DecisionCache, DependencyCache, cached,
+                            tagged)
+from policies.engines import Engine, StackEngine
+from policies.lazy import Lazy
+from policies.policy import (FrozenPolicy, Policy, PolicyContext,
+                             PolicyException, PolicyOverlay, pure,
+                             want_context)
 from policies.rules import Rule, RuleDoc
+from policies.store import PolicyStore
+from policies.versioned import VersionedPolicy
 
 
-__all__ = ['Authorization', 'Policy', 'PolicyException', 'Rule', 'RuleDoc',
-           'PolicyContext', 'want_context']
+__all__ = ['Authorization', 'DecisionCache', 'DependencyCache', 'Engine',
+           'FrozenPolicy', 'Lazy', 'Policy', 'PolicyException',
+           'PolicyOverlay', 'PolicyStore', 'Rule', 'RuleDoc',
+           'PolicyContext', 'StackEngine', 'VersionedPolicy', 'cached',
+           'pure', 'tagged', 'want_context']
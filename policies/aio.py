@@ -0,0 +1,621 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Support for evaluating rules from ``asyncio`` code.  This module
+requires Python 3.5 or later, and is not imported by the ``policies``
+package itself; ``Policy.evaluate_async()`` imports it on first use.
+"""
+
+import asyncio
+import inspect
+import logging
+import threading
+import timeit
+
+from policies import analysis
+from policies import authorization
+from policies import cache
+from policies import instructions
+from policies import lazy
+from policies import policy as policy_mod
+
+
+class AsyncLazy(lazy.Lazy):
+    """
+    A variable whose value is computed by a coroutine, and which is
+    only computed if a rule may read it.  The ``provider`` must be a
+    callable taking no arguments which returns an awaitable, such as a
+    coroutine function.  Variables of this type are resolved by
+    ``prefetch()``.
+    """
+
+    pass
+
+
+class _Failed(lazy.Lazy):
+    """
+    A variable whose provider failed, or did not complete in time,
+    during ``prefetch()``.  Reading it raises the exception, so a rule
+    which reads it fails closed, while a rule which does not need it
+    is unaffected.
+    """
+
+    def __init__(self, exc):
+        """
+        Initialize a ``_Failed`` object.
+
+        :param exc: The exception to raise.
+        """
+
+        super(_Failed, self).__init__()
+        self.exc = exc
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.exc)
+
+    def resolve(self):
+        raise self.exc
+
+
+class Coalescer(object):
+    """
+    Coalesces identical evaluations made concurrently with
+    ``Policy.evaluate_async()``, so that only one evaluation runs and
+    every caller receives the same
+    ``policies.authorization.Authorization``, which must therefore not
+    be modified.  Evaluations are identical if they are of the same
+    rule of the same ``Policy``, unchanged since the first began, and
+    a caller-supplied function computes the same key from their
+    variables; it must examine every variable the rules read.  The
+    variables of a coalesced evaluation are not used, so awaitables
+    among them are never awaited.  The evaluation continues even if
+    the callers waiting on it are cancelled.
+
+    The ``evaluations``, ``coalesced``, and ``bypasses`` attributes
+    count, respectively, the evaluations actually run, the evaluations
+    which instead waited for an identical evaluation in progress, and
+    the evaluations for which the key function declined to compute a
+    key.
+    """
+
+    def __init__(self, key):
+        """
+        Initialize a ``Coalescer`` object.
+
+        :param key: A callable which will be passed the dictionary of
+                    variables, and which must return a hashable key
+                    identifying the variables, or ``None`` if the
+                    evaluation should not be coalesced.
+        """
+
+        self.key = key
+
+        self.evaluations = 0
+        self.coalesced = 0
+        self.bypasses = 0
+
+        # The evaluations in progress, and a lock protecting them and
+        # the counters, since each event loop has its own evaluations
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        """
+        Retrieve the number of evaluations in progress.
+        """
+
+        return len(self._flights)
+
+    async def evaluate(self, policy, name, variables, evaluate):
+        """
+        Evaluate a rule, waiting for an identical evaluation if one is
+        in progress.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule to evaluate.
+        :param variables: A dictionary of variables.
+        :param evaluate: A callable which will be passed the name and
+                         the variables, and which must return an
+                         awaitable evaluating the rule.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        key = self.key(variables)
+        if key is None:
+            with self._lock:
+                self.bypasses += 1
+            return await evaluate(name, variables)
+
+        # Futures belong to a single event loop
+        flight_key = (id(policy), getattr(policy, 'generation', None),
+                      id(asyncio.get_event_loop()), name, key)
+        with self._lock:
+            task = self._flights.get(flight_key)
+            if task is None:
+                self.evaluations += 1
+                task = asyncio.ensure_future(evaluate(name, variables))
+                self._flights[flight_key] = task
+                task.add_done_callback(
+                    lambda _task: self._complete(flight_key, task))
+            else:
+                self.coalesced += 1
+
+        # Shield the evaluation from the cancellation of any one
+        # caller
+        return await asyncio.shield(task)
+
+    def _complete(self, flight_key, task):
+        """
+        Forget a completed evaluation, so that later evaluations are
+        not coalesced with it.
+
+        :param flight_key: The key of the evaluation.
+        :param task: The task which performed the evaluation.
+        """
+
+        with self._lock:
+            if self._flights.get(flight_key) is task:
+                del self._flights[flight_key]
+
+
+def needed(policy, name, variables):
+    """
+    Determine which variables a rule, or any nested rule it calls, may
+    read.  If this cannot be determined--because a rule calls
+    ``rule()`` with a name which is not a constant, for instance, or
+    calls a function which wants the evaluation context, and so may
+    read any variable--all the variables are assumed to be needed.
+
+    :param policy: The ``Policy`` the rule belongs to.
+    :param name: The name of the rule.
+    :param variables: A dictionary of variables.
+
+    :returns: A set of the names of the variables which may be read.
+    """
+
+    idents = analysis.identifiers(policy, name)
+    if idents is None:
+        return set(variables)
+
+    for ident in idents:
+        if (ident not in variables and ident != 'rule' and
+                getattr(policy.resolve(ident), '_policies_want_context',
+                        False)):
+            return set(variables)
+
+    return set(ident for ident in idents if ident in variables)
+
+
+async def _fetch(name, value, stats):
+    """
+    Resolve an asynchronous variable.
+
+    :param name: The name of the variable.
+    :param value: The ``AsyncLazy`` or awaitable.
+    :param stats: An optional ``policies.lazy.LazyStats`` to record
+                  the resolution in.
+
+    :returns: The value of the variable.
+    """
+
+    start = timeit.default_timer()
+    try:
+        if isinstance(value, AsyncLazy):
+            value = value.resolve()
+        value = await value
+    except BaseException:
+        if stats is not None:
+            stats.record(name, timeit.default_timer() - start, True)
+        raise
+    if stats is not None:
+        stats.record(name, timeit.default_timer() - start)
+
+    return value
+
+
+async def prefetch(policy, name, variables, timeout=None):
+    """
+    Concurrently resolve the asynchronous variables a rule may read.
+    Variables whose values are ``AsyncLazy`` objects or awaitables are
+    resolved, but only if ``needed()`` determines that the rule may
+    read them; all are awaited at once.  A variable whose provider
+    raises an exception, or which is not resolved within the timeout,
+    is replaced by a lazy variable which raises the exception when
+    read, so that the rule fails closed only if it actually reads the
+    variable.  Resolution is recorded in the ``lazy_stats`` of the
+    ``Policy``.
+
+    :param policy: The ``Policy`` the rule belongs to.
+    :param name: The name of the rule.
+    :param variables: A dictionary of variables.
+    :param timeout: An optional limit, in seconds, on the time to wait
+                    for the variables.
+
+    :returns: A new dictionary of variables, with the needed
+              asynchronous variables resolved.
+    """
+
+    stats = getattr(policy, 'lazy_stats', None)
+    result = dict(variables)
+
+    # Only analyze the rule if there is something to fetch
+    pending = set(var for var, value in variables.items()
+                  if isinstance(value, AsyncLazy) or
+                  inspect.isawaitable(value))
+    if not pending:
+        return result
+
+    tasks = {}
+    for var in pending & needed(policy, name, variables):
+        tasks[var] = asyncio.ensure_future(_fetch(var, variables[var], stats))
+    if not tasks:
+        return result
+
+    _done, pending = await asyncio.wait(list(tasks.values()),
+                                        timeout=timeout)
+    for task in pending:
+        task.cancel()
+
+    for var, task in tasks.items():
+        if task in pending:
+            result[var] = _Failed(asyncio.TimeoutError(
+                "variable %r not resolved within %s seconds" %
+                (var, timeout)))
+        elif task.exception() is not None:
+            result[var] = _Failed(task.exception())
+        else:
+            result[var] = task.result()
+
+    return result
+
+
+async def _execute(ctxt, insts, no_authz=False):
+    """
+    Execute instructions, suspending whenever a policy function
+    returns an awaitable.  This mirrors
+    ``policies.instructions.Instructions.__call__()``, except that
+    calls, nested rules, and memoized subexpressions, which may need
+    to await, are handled here; all other instructions are simply
+    executed.
+
+    :param ctxt: The evaluation context.
+    :param insts: The ``policies.instructions.Instructions`` to
+                  execute.
+    :param no_authz: If ``True``, execution will stop at the
+                     set_authz instruction.
+    """
+
+    program = insts.instructions
+    while ctxt.pc < len(program):
+        inst = program[ctxt.pc]
+        if no_authz and inst == instructions.set_authz:
+            break
+
+        # Default jump
+        ctxt.step = 1
+
+        # Execute the addressed instruction
+        kind = type(inst)
+        if kind is instructions.CallOperator:
+            await _call(ctxt, inst.count)
+        elif kind is instructions.Memoize:
+            await _memoize(ctxt, inst)
+        else:
+            inst(ctxt)
+
+        # Advance to the next instruction
+        ctxt.pc += ctxt.step
+
+
+async def _call(ctxt, count):
+    """
+    Perform a function or method call, as
+    ``policies.instructions.CallOperator`` does, awaiting the result
+    if it is awaitable.
+
+    :param ctxt: The evaluation context.
+    :param count: The number of elements on the stack making up the
+                  call.
+    """
+
+    args = ctxt.stack[-count:]
+    func = args.pop(0)
+    fcache = getattr(func, 'cache', None)
+
+    if func is policy_mod.rule:
+        ctxt.stack = ctxt.stack[:-count]
+        await _rule(ctxt, *args)
+    elif isinstance(fcache, cache.FunctionCache):
+        if fcache.want_context:
+            ctxt.stack = ctxt.stack[:-count]
+            ctxt.stack.append(await _call_cached(fcache, [ctxt] + args))
+        else:
+            ctxt.stack[-count:] = [await _call_cached(fcache, args)]
+    elif getattr(func, '_policies_want_context', False):
+        # A coroutine function updates the stack when awaited
+        ctxt.stack = ctxt.stack[:-count]
+        result = func(ctxt, *args)
+        if inspect.isawaitable(result):
+            await result
+        if ctxt.stack and inspect.isawaitable(ctxt.stack[-1]):
+            ctxt.stack[-1] = await ctxt.stack[-1]
+    elif getattr(func, '_policies_pure', False):
+        ctxt.stack[-count:] = [await _call_pure(ctxt, func, args)]
+    else:
+        result = func(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        ctxt.stack[-count:] = [result]
+
+
+async def _call_pure(ctxt, func, args):
+    """
+    Call a pure function, memoizing the result, as
+    ``policies.instructions.CallOperator`` does.  The awaited result
+    is memoized, rather than the awaitable, which could only be
+    awaited once.
+
+    :param ctxt: The evaluation context.
+    :param func: The function, which must have been decorated with
+                 ``policies.pure()``.
+    :param args: A list of the arguments.
+
+    :returns: The result of calling the function.
+    """
+
+    key = (func, tuple(args), tuple(type(arg) for arg in args))
+    try:
+        result = ctxt.call_cache[key]
+    except KeyError:
+        pass
+    except TypeError:
+        # Unhashable arguments
+        result = func(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    else:
+        with instructions._pure_lock:
+            func.pure_hits += 1
+        return result
+
+    result = func(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    ctxt.call_cache[key] = result
+    with instructions._pure_lock:
+        func.pure_misses += 1
+
+    return result
+
+
+async def _call_cached(fcache, args):
+    """
+    Call a function decorated with ``policies.cached()``, as
+    ``policies.cache.FunctionCache.call()`` does.  The awaited result
+    is cached, rather than the awaitable, which could only be awaited
+    once, and callers waiting for a call in progress do not block the
+    event loop.
+
+    :param fcache: The ``policies.cache.FunctionCache`` of the
+                   function.
+    :param args: A list of the arguments of the call, including the
+                 evaluation context if the function wants it.
+
+    :returns: The result of the call.
+    """
+
+    args = tuple(args)
+    try:
+        key = fcache._make_key(args)
+    except TypeError:
+        with fcache._lock:
+            fcache.bypasses += 1
+        return await _awaited(fcache._invoke(args))
+
+    entry, flight, leader = fcache._begin(key)
+    if entry is not None:
+        if entry[2] is not None:
+            raise entry[2]
+        return entry[0]
+
+    if not leader:
+        await _wait(fcache, flight)
+        return flight.outcome()
+
+    try:
+        flight.result = await _awaited(fcache._invoke(args))
+    except Exception as exc:
+        flight.exc = exc
+    except BaseException:
+        flight.interrupt(fcache.func)
+        raise
+    finally:
+        fcache._complete(key, flight)
+
+    return flight.outcome()
+
+
+async def _awaited(value):
+    """
+    Await a value if it is awaitable.
+
+    :param value: The value.
+
+    :returns: The awaited value, or the value itself if it is not
+              awaitable.
+    """
+
+    if inspect.isawaitable(value):
+        value = await value
+    return value
+
+
+async def _wait(fcache, flight):
+    """
+    Wait, without blocking the event loop, for a call in progress to
+    complete.  The call may be in progress in another thread.
+
+    :param fcache: The ``policies.cache.FunctionCache`` of the
+                   function.
+    :param flight: The ``policies.cache._Flight`` of the call.
+    """
+
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def wake():
+        if not future.done():
+            future.set_result(None)
+
+    def callback():
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(wake)
+
+    with fcache._lock:
+        if flight.callbacks is None:
+            # Already complete
+            return
+        flight.callbacks.append(callback)
+
+    await future
+
+
+async def _memoize(ctxt, inst):
+    """
+    Push the value of a memoized subexpression, as
+    ``policies.instructions.Memoize`` does, computing it first if
+    necessary.
+
+    :param ctxt: The evaluation context.
+    :param inst: The ``policies.instructions.Memoize`` instruction.
+    """
+
+    try:
+        ctxt.stack.append(ctxt.memo[inst.slot])
+        return
+    except KeyError:
+        pass
+
+    pc = ctxt.pc
+    ctxt.pc = 0
+    await _execute(ctxt, inst.instructions)
+    ctxt.pc = pc
+    ctxt.step = 1
+
+    ctxt.memo[inst.slot] = ctxt.stack[-1]
+
+
+async def _rule(ctxt, name):
+    """
+    Evaluate another rule while evaluating a rule, as
+    ``policies.policy.rule()`` does, allowing the nested rule to
+    await.
+
+    :param ctxt: The evaluation context for the rule.
+    :param name: The name of the rule to evaluate.
+    """
+
+    if name in ctxt.rule_cache:
+        ctxt.stack.append(ctxt.rule_cache[name])
+        return
+
+    try:
+        rule = ctxt.policy[name]
+    except KeyError:
+        log = logging.getLogger('policies')
+        log.warn("Request to evaluate non-existant rule %r "
+                 "while evaluating rule %r" % (name, ctxt.name))
+        ctxt.stack.append(False)
+        ctxt.rule_cache[name] = False
+        return
+
+    with ctxt.push_rule(name):
+        await _execute(ctxt, rule.instructions, True)
+
+    ctxt.rule_cache[name] = ctxt.stack[-1]
+
+
+async def run(policy, name, compiled, attrs, variables, timeout=None):
+    """
+    Evaluate a compiled rule, suspending whenever a policy function
+    called by the rule, or by any rule it calls with ``rule()``,
+    returns an awaitable.  The variables the rule may read are first
+    resolved by ``prefetch()``.  As with the synchronous evaluation,
+    the rule fails closed if an exception is raised.  Rules compiled
+    by engines other than the ``policies.engines.StackEngine`` cannot
+    be suspended, and are evaluated synchronously.
+
+    :param policy: The ``Policy`` object.
+    :param name: The name of the rule being evaluated.
+    :param compiled: The compiled form of the rule, or ``None`` if
+                     the rule does not exist.
+    :param attrs: A dictionary of authorization attribute default
+                  values.
+    :param variables: A dictionary of variables to be defined for the
+                      evaluation.
+    :param timeout: An optional limit, in seconds, on the time to wait
+                    for the variables.
+
+    :returns: An instance of ``policies.authorization.Authorization``
+              with the result of the rule evaluation.
+    """
+
+    if compiled is None:
+        return authorization.Authorization(False)
+
+    variables = await prefetch(policy, name, variables, timeout)
+
+    if not isinstance(compiled, instructions.Instructions):
+        return policy.engine.evaluate(policy, name, compiled, attrs,
+                                      variables)
+
+    # Construct the context
+    ctxt = policy.context_class(policy, attrs, variables)
+
+    # Execute the rule
+    try:
+        with ctxt.push_rule(name):
+            await _execute(ctxt, compiled)
+    except Exception:
+        # Fail closed
+        return authorization.Authorization(False, attrs)
+
+    return ctxt.authz
+
+
+async def evaluate(policy, name, variables=None, timeout=None):
+    """
+    Evaluate a named rule; see ``Policy.evaluate_async()``.
+
+    :param policy: The ``Policy`` the rule belongs to.
+    :param name: The name of the rule to evaluate.
+    :param variables: An optional dictionary of variables to make
+                      available during evaluation of the rule.
+    :param timeout: An optional limit, in seconds, on the time to wait
+                    for the variables.
+
+    :returns: An instance of ``policies.authorization.Authorization``
+              with the result of the rule evaluation.
+    """
+
+    return await policy.evaluate_async(name, variables, timeout)
@@ -0,0 +1,642 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import six
+
+from policies import instructions
+
+
+class DecompileError(Exception):
+    """
+    Raised when a sequence of instructions cannot be decompiled into
+    an expression tree.
+    """
+
+    pass
+
+
+class Node(object):
+    """
+    A node of an expression tree.  Expression trees are recovered from
+    the instructions for a rule by ``decompile()``, and may be
+    compiled back into instructions.  Nodes are immutable, and compare
+    and hash structurally; two nodes with the same ``key`` always
+    compute the same value given the same variables.
+    """
+
+    def __init__(self, *children):
+        """
+        Initialize a ``Node`` object.
+
+        :param children: The child nodes.
+        """
+
+        self.children = children
+        self._key = None
+
+    def __eq__(self, other):
+        """
+        Compare two nodes for equivalence.
+
+        :param other: Another ``Node`` to compare to.
+
+        :returns: A ``True`` value if the ``other`` node is
+                  equivalent to this one, ``False`` otherwise.
+        """
+
+        return isinstance(other, Node) and self.key == other.key
+
+    def __ne__(self, other):
+        """
+        Compare two nodes for inequivalence.
+
+        :param other: Another ``Node`` to compare to.
+
+        :returns: A ``False`` value if the ``other`` node is
+                  equivalent to this one, ``True`` otherwise.
+        """
+
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        """
+        Return a hash value for this node.
+
+        :returns: The hash value.
+        """
+
+        return hash(self.key)
+
+    def __repr__(self):
+        """
+        Return a representation of this node.
+
+        :returns: A string representation of this node.
+        """
+
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join(repr(arg) for arg in self._args()))
+
+    @property
+    def key(self):
+        """
+        A hashable structural key for the node.  Constants are keyed
+        by type as well as value, so that, for instance, ``1`` and
+        ``True`` are distinguished.
+        """
+
+        if self._key is None:
+            self._key = (self.__class__.__name__,) + tuple(
+                arg.key if isinstance(arg, Node) else arg
+                for arg in self._flat_args())
+
+        return self._key
+
+    def _args(self):
+        """
+        Retrieve the constructor arguments of the node.
+
+        :returns: A tuple of the arguments.
+        """
+
+        return self.children
+
+    def _flat_args(self):
+        """
+        Retrieve the arguments of the node, with any tuples of nodes
+        expanded, for computing the key.
+
+        :returns: A tuple of the arguments.
+        """
+
+        return self._args()
+
+    @property
+    def trivial(self):
+        """
+        A ``True`` value if the node is cheaper to compute than to
+        look up in a cache.
+        """
+
+        return False
+
+    def rebuild(self, children):
+        """
+        Construct a copy of the node with different children.
+
+        :param children: A sequence of the new child nodes.
+
+        :returns: The new ``Node``.
+        """
+
+        return self.__class__(*children) if children else self
+
+    def walk(self):
+        """
+        Iterate over this node and all its descendants, parents
+        before children.
+
+        :returns: An iterator over ``Node`` objects.
+        """
+
+        yield self
+        for child in self.children:
+            for node in child.walk():
+                yield node
+
+    def compile(self, memo=None):
+        """
+        Compile the node into instructions.
+
+        :param memo: An optional dictionary mapping node keys to
+                     memoization slots.  Any node whose key is in the
+                     dictionary is compiled into a
+                     ``policies.instructions.Memoize`` instruction.
+
+        :returns: A list of instructions.
+        """
+
+        insts = self._compile(memo)
+        if memo and self.key in memo:
+            return [instructions.Memoize(memo[self.key],
+                                         instructions.Instructions(insts))]
+
+        return insts
+
+    def _compile(self, memo):
+        """
+        Compile the node into instructions.  Must be implemented by
+        subclasses.
+
+        :param memo: An optional dictionary mapping node keys to
+                     memoization slots.
+
+        :returns: A list of instructions.
+        """
+
+        raise NotImplementedError()  # pragma: nocover
+
+
+class Const(Node):
+    """
+    A constant value.
+    """
+
+    def __init__(self, value):
+        """
+        Initialize a ``Const`` object.
+
+        :param value: The value.
+        """
+
+        super(Const, self).__init__()
+        self.value = value
+
+    def _args(self):
+        return (self.value,)
+
+    def _flat_args(self):
+        return (type(self.value), repr(self.value))
+
+    @property
+    def trivial(self):
+        return True
+
+    def _compile(self, memo):
+        return [instructions.Constant(self.value)]
+
+
+class Name(Node):
+    """
+    A reference to a variable, builtin, or entrypoint.
+    """
+
+    def __init__(self, ident):
+        """
+        Initialize a ``Name`` object.
+
+        :param ident: The identifier.
+        """
+
+        super(Name, self).__init__()
+        self.ident = ident
+
+    def _args(self):
+        return (self.ident,)
+
+    @property
+    def trivial(self):
+        return True
+
+    def _compile(self, memo):
+        return [instructions.Ident(self.ident)]
+
+
+class Attr(Node):
+    """
+    An attribute reference.
+    """
+
+    def __init__(self, obj, attribute):
+        """
+        Initialize an ``Attr`` object.
+
+        :param obj: The ``Node`` computing the object.
+        :param attribute: The name of the attribute.
+        """
+
+        super(Attr, self).__init__(obj)
+        self.obj = obj
+        self.attribute = attribute
+
+    def _args(self):
+        return (self.obj, self.attribute)
+
+    def rebuild(self, children):
+        return Attr(children[0], self.attribute)
+
+    def _compile(self, memo):
+        return self.obj.compile(memo) + [
+            instructions.Attribute(self.attribute)]
+
+
+class Op(Node):
+    """
+    An operation, such as addition or comparison.
+    """
+
+    def __init__(self, operator, args):
+        """
+        Initialize an ``Op`` object.
+
+        :param operator: The ``policies.instructions.Operator``
+                         instruction performing the operation.
+        :param args: A sequence of ``Node`` objects computing the
+                     operands.
+        """
+
+        super(Op, self).__init__(*args)
+        self.operator = operator
+        self.args = tuple(args)
+
+    def _args(self):
+        return (self.operator, self.args)
+
+    def rebuild(self, children):
+        return Op(self.operator, children)
+
+    def _flat_args(self):
+        return (self.operator,) + self.args
+
+    def _compile(self, memo):
+        insts = []
+        for arg in self.args:
+            insts.extend(arg.compile(memo))
+        insts.append(self.operator)
+        return insts
+
+
+class Call(Node):
+    """
+    A function call.
+    """
+
+    def __init__(self, func, args):
+        """
+        Initialize a ``Call`` object.
+
+        :param func: The ``Node`` computing the function to call.
+        :param args: A sequence of ``Node`` objects computing the
+                     arguments.
+        """
+
+        super(Call, self).__init__(func, *args)
+        self.func = func
+        self.args = tuple(args)
+
+    def _args(self):
+        return (self.func, self.args)
+
+    def rebuild(self, children):
+        return Call(children[0], children[1:])
+
+    def _flat_args(self):
+        return (self.func,) + self.args
+
+    def _compile(self, memo):
+        insts = self.func.compile(memo)
+        for arg in self.args:
+            insts.extend(arg.compile(memo))
+        insts.append(instructions.CallOperator(len(self.args) + 1))
+        return insts
+
+    @property
+    def rule_name(self):
+        """
+        If the call is a call to the ``rule()`` builtin with a
+        constant string argument, the name of the rule; otherwise,
+        ``None``.
+        """
+
+        if (isinstance(self.func, Name) and self.func.ident == 'rule' and
+                len(self.args) == 1 and isinstance(self.args[0], Const) and
+                isinstance(self.args[0].value, six.string_types)):
+            return self.args[0].value
+
+        return None
+
+
+class And(Node):
+    """
+    A short-circuiting logical "and".
+    """
+
+    def __init__(self, lhs, rhs):
+        """
+        Initialize an ``And`` object.
+
+        :param lhs: The ``Node`` computing the left-hand operand.
+        :param rhs: The ``Node`` computing the right-hand operand.
+        """
+
+        super(And, self).__init__(lhs, rhs)
+        self.lhs = lhs
+        self.rhs = rhs
+
+    def _compile(self, memo):
+        rhs = self.rhs.compile(memo)
+        return (self.lhs.compile(memo) +
+                [instructions.JumpIfNot(len(rhs) + 1), instructions.pop] +
+                rhs)
+
+
+class Or(Node):
+    """
+    A short-circuiting logical "or".
+    """
+
+    def __init__(self, lhs, rhs):
+        """
+        Initialize an ``Or`` object.
+
+        :param lhs: The ``Node`` computing the left-hand operand.
+        :param rhs: The ``Node`` computing the right-hand operand.
+        """
+
+        super(Or, self).__init__(lhs, rhs)
+        self.lhs = lhs
+        self.rhs = rhs
+
+    def _compile(self, memo):
+        rhs = self.rhs.compile(memo)
+        return (self.lhs.compile(memo) +
+                [instructions.JumpIf(len(rhs) + 1), instructions.pop] +
+                rhs)
+
+
+class Cond(Node):
+    """
+    A conditional ("trinary") expression.
+    """
+
+    def __init__(self, cond, if_true, if_false):
+        """
+        Initialize a ``Cond`` object.
+
+        :param cond: The ``Node`` computing the condition.
+        :param if_true: The ``Node`` computing the value if the
+                        condition is true.
+        :param if_false: The ``Node`` computing the value if the
+                         condition is false.
+        """
+
+        super(Cond, self).__init__(cond, if_true, if_false)
+        self.cond = cond
+        self.if_true = if_true
+        self.if_false = if_false
+
+    def _compile(self, memo):
+        if_true = self.if_true.compile(memo)
+        if_false = self.if_false.compile(memo)
+        return (self.cond.compile(memo) +
+                [instructions.JumpIfNot(len(if_true) + 2),
+                 instructions.pop] + if_true +
+                [instructions.Jump(len(if_false) + 1), instructions.pop] +
+                if_false)
+
+
+def _decompile(insts, start, end):
+    """
+    Decompile a range of instructions computing a single value.
+
+    :param insts: A sequence of instructions.
+    :param start: The index of the first instruction.
+    :param end: The index after the last instruction.
+
+    :returns: The ``Node`` computing the value.
+    """
+
+    stack = []
+    pc = start
+    while pc < end:
+        inst = insts[pc]
+
+        if isinstance(inst, (instructions.JumpIf, instructions.JumpIfNot)):
+            # The jump is followed by a pop of the condition
+            target = pc + 1 + inst.count
+            if (not stack or target > end or
+                    insts[pc + 1] != instructions.pop):
+                raise DecompileError("unexpected jump at %d" % pc)
+            lhs = stack.pop()
+
+            # A trinary is distinguished by the jump over the false
+            # branch at the end of the true branch
+            last = insts[target - 1]
+            if (isinstance(inst, instructions.JumpIfNot) and
+                    type(last) is instructions.Jump):
+                false_end = target + last.count
+                if (false_end > end or target - 1 <= pc + 2 or
+                        insts[target] != instructions.pop):
+                    raise DecompileError("malformed trinary at %d" % pc)
+                stack.append(Cond(lhs,
+                                  _decompile(insts, pc + 2, target - 1),
+                                  _decompile(insts, target + 1, false_end)))
+                pc = false_end
+                continue
+
+            rhs = _decompile(insts, pc + 2, target)
+            if isinstance(inst, instructions.JumpIfNot):
+                stack.append(And(lhs, rhs))
+            else:
+                stack.append(Or(lhs, rhs))
+            pc = target
+            continue
+
+        if isinstance(inst, instructions.Constant):
+            stack.append(Const(inst.value))
+        elif isinstance(inst, instructions.Ident):
+            stack.append(Name(inst.ident))
+        elif isinstance(inst, instructions.Attribute):
+            if not stack:
+                raise DecompileError("stack underflow at %d" % pc)
+            stack.append(Attr(stack.pop(), inst.attribute))
+        elif isinstance(inst, instructions.Operator):
+            if len(stack) < inst.count:
+                raise DecompileError("stack underflow at %d" % pc)
+            args = stack[len(stack) - inst.count:]
+            del stack[len(stack) - inst.count:]
+            stack.append(Op(inst, args))
+        elif isinstance(inst, instructions.CallOperator):
+            if len(stack) < inst.count:
+                raise DecompileError("stack underflow at %d" % pc)
+            args = stack[len(stack) - inst.count:]
+            del stack[len(stack) - inst.count:]
+            stack.append(Call(args[0], args[1:]))
+        else:
+            raise DecompileError("cannot decompile %r at %d" % (inst, pc))
+
+        pc += 1
+
+    if len(stack) != 1:
+        raise DecompileError("expected one value, found %d" % len(stack))
+
+    return stack[0]
+
+
+def decompile_expr(insts):
+    """
+    Decompile the instructions for an expression into an expression
+    tree.
+
+    :param insts: An instance of
+                  ``policies.instructions.Instructions``, or a
+                  sequence of instructions, which compute a single
+                  value.
+
+    :returns: The ``Node`` computing the value.  Raises
+              ``DecompileError`` if the instructions do not have the
+              form produced by the parser.
+    """
+
+    if isinstance(insts, instructions.Instructions):
+        insts = insts.instructions
+    else:
+        insts = instructions.Instructions(insts).instructions
+
+    return _decompile(insts, 0, len(insts))
+
+
+def decompile(insts):
+    """
+    Decompile the instructions for a rule into expression trees.
+
+    :param insts: An instance of
+                  ``policies.instructions.Instructions`` for a rule.
+
+    :returns: A tuple of the ``Node`` computing the result of the
+              rule and a list of (name, ``Node``) tuples computing the
+              authorization attributes, in order.  Raises
+              ``DecompileError`` if the instructions do not have the
+              form produced by the parser.
+    """
+
+    insts = insts.instructions
+    try:
+        split = insts.index(instructions.set_authz)
+    except ValueError:
+        raise DecompileError("missing set_authz instruction")
+
+    expr = _decompile(insts, 0, split)
+
+    # Each authorization attribute is computed by an expression
+    # followed by an AuthorizationAttr instruction
+    attrs = []
+    start = split + 1
+    for pc in range(start, len(insts)):
+        if isinstance(insts[pc], instructions.AuthorizationAttr):
+            attrs.append((insts[pc].attribute, _decompile(insts, start, pc)))
+            start = pc + 1
+    if start != len(insts):
+        raise DecompileError("trailing instructions after %d" % start)
+
+    return expr, attrs
+
+
+def compile_rule(expr, attrs=(), memo=None):
+    """
+    Compile expression trees into the instructions for a rule.
+
+    :param expr: The ``Node`` computing the result of the rule.
+    :param attrs: A sequence of (name, ``Node``) tuples computing the
+                  authorization attributes.
+    :param memo: An optional dictionary mapping node keys to
+                 memoization slots; see ``Node.compile()``.
+
+    :returns: An instance of ``policies.instructions.Instructions``.
+    """
+
+    insts = expr.compile(memo) + [instructions.set_authz]
+    for name, node in attrs:
+        insts.extend(node.compile(memo))
+        insts.append(instructions.AuthorizationAttr(name))
+
+    return instructions.Instructions(insts)
+
+
+def identifiers(policy, name):
+    """
+    Determine the identifiers which a rule, or any nested rule it
+    calls using ``rule()``, may read.
+
+    :param policy: The ``Policy`` the rule belongs to.
+    :param name: The name of the rule.
+
+    :returns: A frozen set of the identifiers, or ``None`` if they
+              cannot be determined, either because a rule could not be
+              decompiled or because ``rule()`` is called with a name
+              which is not a constant.
+    """
+
+    idents = set()
+    pending = [name]
+    seen = set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+
+        rule = policy._lookup(current)[0]
+        if rule is None:
+            continue
+
+        try:
+            expr, attrs = decompile(rule.instructions)
+        except DecompileError:
+            return None
+
+        for tree in [expr] + [node for _attr, node in attrs]:
+            for node in tree.walk():
+                if isinstance(node, Name):
+                    idents.add(node.ident)
+                elif isinstance(node, Call) and node.rule_name is not None:
+                    pending.append(node.rule_name)
+                elif (isinstance(node, Call) and
+                        isinstance(node.func, Name) and
+                        node.func.ident == 'rule'):
+                    return None
+
+    return frozenset(idents)
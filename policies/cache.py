@@ -0,0 +1,1292 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import collections
+import functools
+import threading
+import timeit
+import weakref
+
+from policies import analysis
+from policies import authorization
+from policies import instructions
+from policies import lazy
+from policies import partial
+
+
+class _Cache(object):
+    """
+    The machinery common to the decision caches: a bounded, least
+    recently used mapping from keys to (``Authorization``, expiry
+    time, ...) tuples, discarded when the generation of the
+    ``Policy`` changes.  Since the generations of different policies
+    are unrelated, a cache serves only the one ``Policy`` it is bound
+    to.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0, allow_ttl=None,
+                 deny_ttl=None):
+        """
+        Initialize a ``_Cache`` object.
+
+        :param maxsize: The maximum number of results to cache.
+        :param ttl: The time, in seconds, for which results remain
+                    valid.  If ``None``, results do not expire.
+        :param allow_ttl: The time, in seconds, for which results
+                          which allow remain valid.  Defaults to
+                          ``ttl``.
+        :param deny_ttl: The time, in seconds, for which results which
+                         deny remain valid.  Defaults to ``ttl``.
+        """
+
+        self.maxsize = maxsize
+        self.allow_ttl = ttl if allow_ttl is None else allow_ttl
+        self.deny_ttl = ttl if deny_ttl is None else deny_ttl
+
+        self._entries = collections.OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+        # A weak reference to the bound Policy
+        self._policy = None
+
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        """
+        Obtain the number of cached results.
+
+        :returns: The number of cached results, including any which
+                  have expired but have not yet been discarded.
+        """
+
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self):
+        """
+        The fraction of cache look-ups which found a result, or
+        ``None`` if there have been no look-ups.
+        """
+
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else None
+
+    def bind(self, policy):
+        """
+        Bind the cache to a ``Policy``.  A cache may be bound to
+        another ``Policy`` only once the one it was bound to no longer
+        exists, in which case the cache is discarded.  This is called
+        by the ``Policy`` constructor, and on each evaluation.
+
+        :param policy: The ``Policy``.
+
+        :raises ValueError: The cache is bound to a different
+                            ``Policy``.
+        """
+
+        with self._lock:
+            bound = self._policy() if self._policy is not None else None
+            if bound is policy:
+                return
+            elif bound is not None:
+                raise ValueError("%s is already in use by another Policy" %
+                                 self.__class__.__name__)
+
+            self._reset()
+            self._generation = None
+            self._policy = weakref.ref(policy)
+
+    def _check_generation(self, generation):
+        """
+        Discard the cache if the generation of the ``Policy`` has
+        changed.  Must be called with the lock held.
+
+        :param generation: The generation of the ``Policy``.
+        """
+
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._reset()
+            self._generation = generation
+
+    def _reset(self):
+        """
+        Discard all cached results.  Must be called with the lock
+        held.
+        """
+
+        self._entries.clear()
+
+    def _discard(self, key, entry):
+        """
+        Called when an entry is removed from the cache other than by
+        ``_reset()``.  Must be called with the lock held.
+
+        :param key: The key of the entry.
+        :param entry: The entry.
+        """
+
+        pass
+
+    def _expiry(self, authz):
+        """
+        Compute the expiry time for a result.
+
+        :param authz: The ``policies.authorization.Authorization``.
+
+        :returns: The expiry time, ``None`` if the result does not
+                  expire, or ``False`` if the result should not be
+                  cached at all.
+        """
+
+        ttl = self.allow_ttl if authz else self.deny_ttl
+        if ttl is None:
+            return None
+        elif ttl <= 0:
+            return False
+
+        return timeit.default_timer() + ttl
+
+    def _get(self, key):
+        """
+        Look up a cached entry.  Must be called with the lock held.
+        The hit and miss counters are not updated.
+
+        :param key: The key of the entry.
+
+        :returns: The entry, or ``None`` if there is no valid entry.
+        """
+
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            if entry[1] is None or entry[1] > timeit.default_timer():
+                # Reinsert as the most recently used
+                self._entries[key] = entry
+                return entry
+
+            self.expirations += 1
+            self._discard(key, entry)
+
+        return None
+
+    def _put(self, key, entry):
+        """
+        Cache an entry, evicting the least recently used entries if
+        the cache is full.  Must be called with the lock held.
+
+        :param key: The key of the entry.
+        :param entry: The entry.
+        """
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._discard(key, old)
+        self._entries[key] = entry
+        while len(self._entries) > self.maxsize:
+            self._discard(*self._entries.popitem(last=False))
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Discard all cached results.  The statistics are not reset.
+        """
+
+        with self._lock:
+            self._reset()
+
+
+class DecisionCache(_Cache):
+    """
+    A cache of the results of rule evaluations, for use in front of
+    ``Policy.evaluate()``.  Results are keyed by the name of the rule
+    and a key computed from the variables by a caller-supplied
+    function; only the variables the key function examines distinguish
+    cached results, so it must examine every variable the rules read.
+    The cache holds at most ``maxsize`` results, evicting the least
+    recently used, and results expire after a time which may differ
+    for allowed and denied results.  The entire cache is discarded
+    when the generation of the ``Policy``--which changes whenever a
+    rule is set, deleted, or declared--changes; as rules of the same
+    name may differ between policies, a cache may not be shared
+    between them (see ``bind()``).
+
+    The ``hits``, ``misses``, ``bypasses``, ``evictions``,
+    ``expirations``, and ``invalidations`` attributes count,
+    respectively, the results found in the cache, the results not
+    found, the evaluations for which the key function declined to
+    compute a key, the results evicted to make room for others, the
+    results discarded because they had expired, and the number of
+    times the cache was discarded because the ``Policy`` changed.
+    """
+
+    def __init__(self, key, maxsize=1024, ttl=60.0, allow_ttl=None,
+                 deny_ttl=None):
+        """
+        Initialize a ``DecisionCache`` object.
+
+        :param key: A callable which will be passed the dictionary of
+                    variables, and which must return a hashable key
+                    identifying the variables, or ``None`` if the
+                    result should not be cached.
+        :param maxsize: The maximum number of results to cache.
+        :param ttl: The time, in seconds, for which results remain
+                    valid.  If ``None``, results do not expire.
+        :param allow_ttl: The time, in seconds, for which results
+                          which allow remain valid.  Defaults to
+                          ``ttl``.
+        :param deny_ttl: The time, in seconds, for which results which
+                         deny remain valid.  Defaults to ``ttl``.
+        """
+
+        super(DecisionCache, self).__init__(maxsize, ttl, allow_ttl,
+                                            deny_ttl)
+        self.key = key
+
+    def get(self, name, key, generation):
+        """
+        Look up a cached result.
+
+        :param name: The name of the rule.
+        :param key: The key computed from the variables.
+        :param generation: The generation of the ``Policy``.
+
+        :returns: The cached ``policies.authorization.Authorization``,
+                  or ``None`` if there is no valid cached result.
+        """
+
+        with self._lock:
+            self._check_generation(generation)
+
+            entry = self._get((name, key))
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, name, key, generation, authz):
+        """
+        Cache a result.
+
+        :param name: The name of the rule.
+        :param key: The key computed from the variables.
+        :param generation: The generation of the ``Policy`` when the
+                           rule was evaluated.  The result is not
+                           cached if the ``Policy`` has since changed.
+        :param authz: The ``policies.authorization.Authorization``.
+        """
+
+        expiry = self._expiry(authz)
+        if expiry is False:
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                # The policy changed while the rule was evaluated
+                return
+
+            self._put((name, key), (authz, expiry))
+
+    def evaluate(self, policy, name, variables, evaluate):
+        """
+        Evaluate a rule, using a cached result if available.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule to evaluate.
+        :param variables: A dictionary of variables.
+        :param evaluate: A callable which will be passed the name and
+                         the variables, and which must evaluate the
+                         rule.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        self.bind(policy)
+
+        key = self.key(variables)
+        if key is None:
+            with self._lock:
+                self.bypasses += 1
+            return evaluate(name, variables)
+
+        generation = policy.generation
+        authz = self.get(name, key, generation)
+        if authz is None:
+            authz = evaluate(name, variables)
+            self.put(name, key, generation, authz)
+
+        return authz
+
+
+class _Flight(object):
+    """
+    A call in progress, on which concurrent callers with the same
+    arguments wait.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``_Flight`` object.
+        """
+
+        self.event = threading.Event()
+        self.result = None
+        self.exc = None
+
+        # Cleared if there is no outcome to cache, as when the call
+        # was interrupted by an exception which is not an Exception,
+        # such as KeyboardInterrupt
+        self.cacheable = True
+
+        # Callables to call, in addition to setting the event, when
+        # the call completes; used by waiters in asyncio event loops
+        self.callbacks = []
+
+    def interrupt(self, func):
+        """
+        Record that the call was interrupted.  The waiters receive a
+        ``RuntimeError``, rather than sharing the interruption.
+
+        :param func: The function which was called.
+        """
+
+        self.cacheable = False
+        self.exc = RuntimeError("call of %r was interrupted" % func)
+
+    def outcome(self):
+        """
+        Retrieve the outcome of the completed call.
+
+        :returns: The result of the call.  If the call raised an
+                  exception, it is raised instead.
+        """
+
+        if self.exc is not None:
+            raise self.exc
+        return self.result
+
+
+class FunctionCache(_Cache):
+    """
+    A process-wide cache of the results of a policy function; see
+    ``cached()``.  Results are keyed by the arguments of the call.  The
+    cache holds at most ``maxsize`` results, evicting the least
+    recently used; true results expire after ``ttl`` seconds, false
+    results--such as a user not being a member of a group--after
+    ``negative_ttl`` seconds, and exceptions, which are only cached if
+    ``error_ttl`` is set, after ``error_ttl`` seconds.  Concurrent
+    calls with the same arguments which all miss the cache result in a
+    single call to the function, the other callers waiting for and
+    sharing its result.
+
+    The ``hits``, ``misses``, ``coalesced``, ``bypasses``,
+    ``errors``, ``evictions``, and ``expirations`` attributes count,
+    respectively, the calls answered from the cache, the calls which
+    called the function, the calls which waited for a concurrent call
+    with the same arguments, the calls whose arguments could not be
+    used as a key, the calls which raised an exception, the results
+    evicted to make room for others, and the results discarded because
+    they had expired.
+    """
+
+    def __init__(self, func, maxsize=1024, ttl=60.0, negative_ttl=None,
+                 error_ttl=0, key=None, want_context=False):
+        """
+        Initialize a ``FunctionCache`` object.
+
+        :param func: The function.
+        :param maxsize: The maximum number of results to cache.
+        :param ttl: The time, in seconds, for which results remain
+                    valid.  If ``None``, results do not expire.
+        :param negative_ttl: The time, in seconds, for which false
+                             results remain valid.  Defaults to
+                             ``ttl``.
+        :param error_ttl: The time, in seconds, for which exceptions
+                          raised by the function are cached.  If 0,
+                          the default, exceptions are not cached.
+        :param key: An optional callable which will be passed the
+                    arguments of a call, and which must return a
+                    hashable key identifying them.  By default, the
+                    arguments and their types form the key; the
+                    evaluation context passed to functions which want
+                    it is not part of the default key.
+        :param want_context: If ``True``, the function wants the
+                             evaluation context; see
+                             ``policies.want_context()``.
+        """
+
+        super(FunctionCache, self).__init__(maxsize, ttl, None,
+                                            negative_ttl)
+        self.func = func
+        self.error_ttl = error_ttl
+        self.key = key
+        self.want_context = want_context
+
+        # Maps keys to the calls in progress
+        self._flights = {}
+
+        self.coalesced = 0
+        self.errors = 0
+
+    def _make_key(self, args):
+        """
+        Compute the key for a call.
+
+        :param args: A tuple of the arguments of the call, including
+                     the evaluation context if the function wants it.
+
+        :returns: The key.  Raises ``TypeError`` if the key is not
+                  hashable.
+        """
+
+        if self.key is not None:
+            key = self.key(*args)
+        else:
+            if self.want_context:
+                args = args[1:]
+            key = (args, tuple(type(arg) for arg in args))
+
+        hash(key)
+        return key
+
+    def _invoke(self, args):
+        """
+        Call the function.
+
+        :param args: A tuple of the arguments of the call, including
+                     the evaluation context if the function wants it.
+
+        :returns: The result of the call.
+        """
+
+        if not self.want_context:
+            return self.func(*args)
+
+        # The function pushes its result onto the stack
+        ctxt = args[0]
+        depth = len(ctxt.stack)
+        self.func(*args)
+        if len(ctxt.stack) != depth + 1:
+            raise ValueError("function %r did not push exactly one value" %
+                             self.func)
+
+        return ctxt.stack.pop()
+
+    def call(self, args):
+        """
+        Call the function, using a cached result if available.
+
+        :param args: A tuple of the arguments of the call, including
+                     the evaluation context if the function wants it.
+
+        :returns: The result of the call.
+        """
+
+        try:
+            key = self._make_key(args)
+        except TypeError:
+            with self._lock:
+                self.bypasses += 1
+            return self._invoke(args)
+
+        entry, flight, leader = self._begin(key)
+        if entry is not None:
+            if entry[2] is not None:
+                raise entry[2]
+            return entry[0]
+
+        if not leader:
+            # Wait for the call in progress
+            flight.event.wait()
+            return flight.outcome()
+
+        try:
+            result = self._invoke(args)
+            if hasattr(result, '__await__'):
+                # Only Policy.evaluate_async() can await it
+                flight.cacheable = False
+                instructions._reject_awaitable(self.func, result)
+            flight.result = result
+        except Exception as exc:
+            flight.exc = exc
+        except BaseException:
+            flight.interrupt(self.func)
+            raise
+        finally:
+            self._complete(key, flight)
+
+        return flight.outcome()
+
+    def _begin(self, key):
+        """
+        Look up a cached result, or join or start a call in progress.
+
+        :param key: The key for the call.
+
+        :returns: A tuple of the cache entry, which is ``None`` if
+                  there is no valid cached result; the ``_Flight`` for
+                  the call in progress; and a flag which is ``True``
+                  if the caller must make the call.
+        """
+
+        with self._lock:
+            entry = self._get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry, None, False
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        return None, flight, leader
+
+    def _complete(self, key, flight):
+        """
+        Cache the result of a call and release any waiting callers.
+
+        :param key: The key for the call.
+        :param flight: The ``_Flight`` for the call.
+        """
+
+        if not flight.cacheable:
+            expiry = False
+        elif flight.exc is None:
+            expiry = self._expiry(flight.result)
+        elif self.error_ttl is None:
+            expiry = None
+        elif self.error_ttl > 0:
+            expiry = timeit.default_timer() + self.error_ttl
+        else:
+            expiry = False
+
+        with self._lock:
+            del self._flights[key]
+            if flight.exc is not None:
+                self.errors += 1
+            if expiry is not False:
+                self._put(key, (flight.result, expiry, flight.exc))
+
+            # No more callbacks may be added
+            callbacks, flight.callbacks = flight.callbacks, None
+
+        flight.event.set()
+        for callback in callbacks:
+            callback()
+
+
+def cached(maxsize=1024, ttl=60.0, negative_ttl=None, error_ttl=0,
+           key=None):
+    """
+    A decorator for policy functions which caches their results across
+    evaluations, for functions which are expensive to call, such as
+    those looking up group membership in a directory.  It may be
+    applied to functions decorated with ``policies.want_context()``,
+    in which case it must be applied after (that is, above) that
+    decorator.  The ``cache`` attribute of the decorated function is
+    the ``FunctionCache``, which provides statistics and allows the
+    cache to be cleared.  Coroutine functions, and others returning
+    awaitables, may be decorated; when called by rules evaluated with
+    ``Policy.evaluate_async()``, the awaited result is cached.  Results
+    which are awaitable are never cached otherwise.
+
+    :param maxsize: The maximum number of results to cache.
+    :param ttl: The time, in seconds, for which results remain valid.
+                If ``None``, results do not expire.
+    :param negative_ttl: The time, in seconds, for which false results
+                         remain valid.  Defaults to ``ttl``.
+    :param error_ttl: The time, in seconds, for which exceptions
+                      raised by the function are cached.  If 0, the
+                      default, exceptions are not cached.
+    :param key: An optional callable which will be passed the
+                arguments of a call, and which must return a hashable
+                key identifying them.  By default, the arguments and
+                their types form the key; the evaluation context
+                passed to functions which want it is not part of the
+                default key, so such functions should supply a key
+                function if their results depend on the context.
+
+    :returns: A decorator.
+    """
+
+    def decorator(func):
+        want_context = getattr(func, '_policies_want_context', False)
+        fcache = FunctionCache(func, maxsize, ttl, negative_ttl, error_ttl,
+                               key, want_context)
+
+        if want_context:
+            @functools.wraps(func)
+            def wrapper(ctxt, *args):
+                ctxt.stack.append(fcache.call((ctxt,) + args))
+        else:
+            @functools.wraps(func)
+            def wrapper(*args):
+                return fcache.call(args)
+
+        wrapper.cache = fcache
+
+        return wrapper
+
+    return decorator
+
+
+class Trace(object):
+    """
+    A record of what an evaluation read.  The ``reads`` attribute is
+    a list of (path, value) tuples, in the order in which each path
+    was first read; a path is a tuple of the name of a variable
+    followed by the attribute names and item keys applied to it, with
+    each item key wrapped in a one-element tuple.  The ``calls``
+    attribute is a list of (function, arguments, result) tuples for
+    the calls made to functions decorated with ``tagged()``, and
+    ``tags`` is the set of tags the result depends on.  The
+    ``untraceable`` attribute is set if the evaluation called a
+    function which wants the evaluation context, and so may have read
+    values which are not recorded.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``Trace`` object.
+        """
+
+        self.reads = []
+        self.calls = []
+        self.tags = set()
+        self.untraceable = False
+
+        self._paths = set()
+
+    def read(self, path, value):
+        """
+        Record a read.  Only the first read of a given path is
+        recorded.
+
+        :param path: The path read.
+        :param value: The value read.
+        """
+
+        if path not in self._paths:
+            self._paths.add(path)
+            self.reads.append((path, value))
+
+    @property
+    def paths(self):
+        """
+        A tuple of the paths read, in order.
+        """
+
+        return tuple(path for path, _value in self.reads)
+
+
+def _follow(value, steps):
+    """
+    Apply the attribute and item references of a path to a value.
+
+    :param value: The value of the variable named by the path.
+    :param steps: The remainder of the path; see ``Trace``.
+
+    :returns: The value.
+    """
+
+    for step in steps:
+        if isinstance(step, tuple):
+            value = value[step[0]]
+        else:
+            value = getattr(value, step)
+
+    return value
+
+
+def _get_path(variables, path, memo, stats=None):
+    """
+    Read a path from a dictionary of variables.
+
+    :param variables: The dictionary of variables.
+    :param path: The path; see ``Trace``.
+    :param memo: A dictionary of the values of the lazy variables
+                 already resolved; see ``policies.lazy.resolve()``.
+    :param stats: An optional ``policies.lazy.LazyStats``.
+
+    :returns: The value.
+    """
+
+    return _follow(lazy.resolve(path[0], variables[path[0]], memo, stats),
+                   path[1:])
+
+
+def _read(ctxt, path):
+    """
+    Read a path from the variables of the evaluation, recording it in
+    the trace of the evaluation context, if any.  Calls to this
+    function replace variable references in traced rules.
+
+    :param ctxt: The evaluation context for the rule.
+    :param path: The path; see ``Trace``.
+    """
+
+    value = _follow(ctxt.resolve(path[0]), path[1:])
+    if ctxt.trace is not None:
+        ctxt.trace.read(path, value)
+    ctxt.stack.append(value)
+
+
+# Equivalent to policy.want_context(), which cannot be imported here
+_read._policies_want_context = True
+
+
+def _call(ctxt, func, *args):
+    """
+    Call a function computed from the variables, such as a function
+    passed as a variable.  Calls to this function replace such calls
+    in traced rules, since whether the function wants the evaluation
+    context, and so may read values which are not traced, can only be
+    determined when it is called.
+
+    :param ctxt: The evaluation context for the rule.
+    :param func: The function.
+    :param args: The arguments of the call.
+    """
+
+    if (ctxt.trace is not None and
+            getattr(func, '_policies_want_context', False) and
+            not hasattr(func, '_policies_tags')):
+        ctxt.trace.untraceable = True
+
+    ctxt.stack.extend((func,) + args)
+    instructions.CallOperator(len(args) + 1)(ctxt)
+
+
+_call._policies_want_context = True
+
+
+def tagged(tags):
+    """
+    A decorator for policy functions whose results depend on data
+    other than their arguments, such as a function which looks up the
+    roles assigned to a user.  When a rule calls the function during
+    an evaluation cached by a ``DependencyCache``, the call is
+    recorded, and the result is tagged with the tags returned by
+    ``tags``; ``DependencyCache.invalidate()`` may then be used to
+    discard the results which depend on changed data.  The function
+    is never called in advance of the evaluation.
+
+    :param tags: A callable which will be passed the arguments of a
+                 call to the function, and which must return an
+                 iterable of hashable tags identifying the data the
+                 result depends on.
+
+    :returns: A decorator.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(ctxt, *args):
+            result = func(*args)
+            if ctxt.trace is not None:
+                ctxt.trace.calls.append((func, args, result))
+                ctxt.trace.tags.update(tags(*args))
+            ctxt.stack.append(result)
+
+        wrapper._policies_want_context = True
+        wrapper._policies_tags = tags
+
+        return wrapper
+
+    return decorator
+
+
+def _freeze(value):
+    """
+    Convert a value into a hashable form, suitable for use in a cache
+    key.  Values of different types are distinguished, and lists,
+    tuples, dictionaries, and sets are frozen recursively.
+
+    :param value: The value.
+
+    :returns: The hashable form.  Raises ``TypeError`` if the value
+              cannot be converted.
+    """
+
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(item) for item in value))
+    elif isinstance(value, dict):
+        return (type(value), frozenset((_freeze(key), _freeze(item))
+                                       for key, item in value.items()))
+    elif isinstance(value, (set, frozenset)):
+        return (type(value), frozenset(_freeze(item) for item in value))
+
+    hash(value)
+    return (type(value), value)
+
+
+def _path(node, names):
+    """
+    Compute the path read by an expression tree, if it consists only
+    of a variable reference followed by attribute references and item
+    references with constant keys.
+
+    :param node: The ``policies.analysis.Node``.
+    :param names: A set of the names of the variables.
+
+    :returns: The path, or ``None``.
+    """
+
+    if isinstance(node, analysis.Name):
+        return (node.ident,) if node.ident in names else None
+    elif isinstance(node, analysis.Attr):
+        path = _path(node.obj, names)
+        return None if path is None else path + (node.attribute,)
+    elif (isinstance(node, analysis.Op) and
+            node.operator is instructions.item_op and
+            isinstance(node.args[1], analysis.Const)):
+        try:
+            hash(node.args[1].value)
+        except TypeError:
+            return None
+        path = _path(node.args[0], names)
+        return None if path is None else path + ((node.args[1].value,),)
+
+    return None
+
+
+def _trace_reads(node, names):
+    """
+    Rewrite an expression tree so that the longest paths it reads
+    from the variables are read by ``_read()``.
+
+    :param node: The ``policies.analysis.Node``.
+    :param names: A set of the names of the variables.
+
+    :returns: The rewritten ``Node``.
+    """
+
+    path = _path(node, names)
+    if path is not None:
+        return analysis.Call(analysis.Const(_read), [analysis.Const(path)])
+
+    node = node.rebuild([_trace_reads(child, names)
+                         for child in node.children])
+    if (isinstance(node, analysis.Call) and
+            not isinstance(node.func, analysis.Const)):
+        return analysis.Call(analysis.Const(_call),
+                             (node.func,) + node.args)
+
+    return node
+
+
+def _traceable(node):
+    """
+    Determine whether an expression tree may be traced.  Functions
+    which want the evaluation context, other than those decorated with
+    ``tagged()``, may read anything, and so cannot be traced; this
+    includes calls to ``rule()`` which could not be inlined.  Calls to
+    functions computed from the variables are checked by ``_call()``
+    instead.
+
+    :param node: The ``policies.analysis.Node``.
+
+    :returns: A ``True`` value if the tree may be traced.
+    """
+
+    for sub in node.walk():
+        if (isinstance(sub, analysis.Call) and
+                isinstance(sub.func, analysis.Const) and
+                getattr(sub.func.value, '_policies_want_context', False) and
+                sub.func.value not in (_read, _call) and
+                not hasattr(sub.func.value, '_policies_tags')):
+            return False
+
+    return True
+
+
+class DependencyCache(_Cache):
+    """
+    A cache of the results of rule evaluations, for use in front of
+    ``Policy.evaluate()``, which is keyed only on the values the
+    evaluation actually read.  Each rule is rewritten, once per
+    generation of the ``Policy`` and set of variable names, so that
+    nested rules called with ``rule()`` are inlined and every read of
+    a variable, an attribute of a variable, or an item of a variable
+    with a constant key is recorded in a ``Trace``.  The result is
+    then cached under the paths read and their values; since
+    evaluation only depends on what it reads, a later evaluation which
+    would read the same values along the same paths is answered from
+    the cache, no matter what else differs in the variables.  As with
+    the caching of nested rules, functions called by the rules are
+    assumed to return the same values when called with the same
+    arguments; functions whose results depend on other data should be
+    decorated with ``tagged()``, so that the affected results may be
+    discarded with ``invalidate()`` when the data changes.
+
+    Rules which call other functions which want the evaluation
+    context, or which call ``rule()`` with a name which is not a
+    constant, are not cached; nor are results which depend on values
+    which cannot be made hashable (see ``_freeze()``), or evaluations
+    which raise an exception.  Beyond the statistics kept by
+    ``DecisionCache``, the ``tag_invalidations`` attribute counts the
+    results discarded by ``invalidate()``.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0, allow_ttl=None,
+                 deny_ttl=None, tagger=None):
+        """
+        Initialize a ``DependencyCache`` object.
+
+        :param maxsize: The maximum number of results to cache.
+        :param ttl: The time, in seconds, for which results remain
+                    valid.  If ``None``, results do not expire.
+        :param allow_ttl: The time, in seconds, for which results
+                          which allow remain valid.  Defaults to
+                          ``ttl``.
+        :param deny_ttl: The time, in seconds, for which results which
+                         deny remain valid.  Defaults to ``ttl``.
+        :param tagger: An optional callable which will be passed each
+                       path read by an evaluation and the value read,
+                       and which must return an iterable of hashable
+                       tags for the result.  This allows, for
+                       instance, a result which read a user name to be
+                       tagged with that user.
+        """
+
+        super(DependencyCache, self).__init__(maxsize, ttl, allow_ttl,
+                                              deny_ttl)
+        self.tagger = tagger
+
+        # Maps rule names to the identifiers the rules may read
+        self._identifiers = {}
+
+        # Maps (name, variable names) to traced programs, or None
+        self._programs = {}
+
+        # Maps (name, variable names) to an ordered dictionary of the
+        # sequences of paths of the cached results, least recently
+        # used first, with reference counts
+        self._shapes = {}
+
+        # Maps tags to sets of keys
+        self._tags = {}
+
+        self.tag_invalidations = 0
+
+    def _reset(self):
+        super(DependencyCache, self)._reset()
+        self._identifiers.clear()
+        self._programs.clear()
+        self._shapes.clear()
+        self._tags.clear()
+
+    def _discard(self, key, entry):
+        shapes = self._shapes[key[:2]]
+        shapes[key[2]] -= 1
+        if not shapes[key[2]]:
+            del shapes[key[2]]
+            if not shapes:
+                del self._shapes[key[:2]]
+
+        for tag in entry[2]:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def _get_program(self, policy, name, names):
+        """
+        Construct the traced program for a rule.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule.
+        :param names: A frozen set of the names of the variables the
+                      rule may read.
+
+        :returns: An instance of
+                  ``policies.instructions.Instructions``, or ``None``
+                  if the rule cannot be traced.
+        """
+
+        rule = policy._lookup(name)[0]
+        if rule is None:
+            return None
+
+        residual = partial.Residual(policy, name, rule, {}, {}, names)
+        if residual.expr is None:
+            return None
+
+        expr = _trace_reads(residual.expr, names)
+        attrs = [(attr, _trace_reads(node, names))
+                 for attr, node in residual.attrs]
+        if not all(_traceable(node)
+                   for node in [expr] + [node for _attr, node in attrs]):
+            return None
+
+        return analysis.compile_rule(expr, attrs)
+
+    def _prepare(self, policy, name, variables, generation):
+        """
+        Look up, or construct, the traced program for a rule.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule.
+        :param variables: A dictionary of variables.
+        :param generation: The generation of the ``Policy``.
+
+        :returns: A tuple of the frozen set of the names of the
+                  variables the rule may read and the traced program,
+                  which is ``None`` if the rule cannot be traced.
+        """
+
+        self.bind(policy)
+
+        with self._lock:
+            self._check_generation(generation)
+            idents = self._identifiers.get(name, False)
+
+        if idents is False:
+            idents = analysis.identifiers(policy, name)
+            with self._lock:
+                if generation == self._generation:
+                    self._identifiers[name] = idents
+        if idents is None:
+            return None, None
+
+        names = frozenset(ident for ident in idents if ident in variables)
+        with self._lock:
+            program = self._programs.get((name, names), False)
+
+        if program is False:
+            program = self._get_program(policy, name, names)
+            with self._lock:
+                if generation == self._generation:
+                    self._programs[(name, names)] = program
+
+        return names, program
+
+    def _lookup_result(self, policy, name, names, variables, memo):
+        """
+        Look up a cached result.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule.
+        :param names: A frozen set of the names of the variables the
+                      rule may read.
+        :param variables: A dictionary of variables.
+        :param memo: A dictionary in which to save the values of any
+                     lazy variables resolved.
+
+        :returns: The cached ``policies.authorization.Authorization``,
+                  or ``None`` if there is no valid cached result.
+        """
+
+        with self._lock:
+            shapes = list(reversed(self._shapes.get((name, names), {})))
+
+        for shape in shapes:
+            try:
+                values = tuple(_freeze(_get_path(variables, path, memo,
+                                                 policy.lazy_stats))
+                               for path in shape)
+            except Exception:
+                continue
+
+            key = (name, names, shape, values)
+            with self._lock:
+                entry = self._get(key)
+                if entry is not None:
+                    # Reinsert the shape as the most recently used
+                    shapes = self._shapes[key[:2]]
+                    shapes[shape] = shapes.pop(shape)
+                    return entry[0]
+
+        return None
+
+    def trace(self, policy, name, variables):
+        """
+        Evaluate a rule, recording what the evaluation reads.  The
+        cache is neither consulted nor updated.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule to evaluate.
+        :param variables: A dictionary of variables.
+
+        :returns: A tuple of an instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation and the ``Trace``, or
+                  ``None`` if the rule could not be traced or the
+                  evaluation raised an exception.
+        """
+
+        names, program = self._prepare(policy, name, variables,
+                                       policy.generation)
+        if program is None:
+            return policy._evaluate(name, variables), None
+
+        return self._trace(policy, name, program, variables)
+
+    def _trace(self, policy, name, program, variables, memo=None):
+        """
+        Evaluate a traced program.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule.
+        :param program: The traced program.
+        :param variables: A dictionary of variables.
+        :param memo: An optional dictionary of the values of the lazy
+                     variables already resolved.
+
+        :returns: A tuple of the
+                  ``policies.authorization.Authorization`` and the
+                  ``Trace``, or ``None`` if the evaluation raised an
+                  exception or called a function which could not be
+                  traced.
+        """
+
+        attrs = policy._lookup(name)[1]
+        ctxt = policy.context_class(policy, attrs, variables)
+        ctxt.trace = Trace()
+        if memo:
+            ctxt.lazy_cache.update(memo)
+
+        try:
+            with ctxt.push_rule(name):
+                program(ctxt)
+        except Exception:
+            # Fail closed
+            return authorization.Authorization(False, attrs), None
+
+        if ctxt.trace.untraceable:
+            return ctxt.authz, None
+
+        return ctxt.authz, ctxt.trace
+
+    def evaluate(self, policy, name, variables, evaluate):
+        """
+        Evaluate a rule, using a cached result if available.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule to evaluate.
+        :param variables: A dictionary of variables.
+        :param evaluate: A callable which will be passed the name and
+                         the variables, and which must evaluate the
+                         rule.  It is used for rules which cannot be
+                         traced.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        generation = policy.generation
+        names, program = self._prepare(policy, name, variables, generation)
+        if program is None:
+            with self._lock:
+                self.bypasses += 1
+            return evaluate(name, variables)
+
+        # Lazy variables resolved while looking up the result are not
+        # resolved again if the rule must be evaluated
+        memo = {}
+        authz = self._lookup_result(policy, name, names, variables, memo)
+        with self._lock:
+            if authz is not None:
+                self.hits += 1
+                return authz
+            self.misses += 1
+
+        authz, trace = self._trace(policy, name, program, variables, memo)
+        if trace is not None:
+            self._store(name, names, generation, authz, trace)
+
+        return authz
+
+    def _store(self, name, names, generation, authz, trace):
+        """
+        Cache a result.
+
+        :param name: The name of the rule.
+        :param names: A frozen set of the names of the variables the
+                      rule may read.
+        :param generation: The generation of the ``Policy`` when the
+                           rule was evaluated.
+        :param authz: The ``policies.authorization.Authorization``.
+        :param trace: The ``Trace`` of the evaluation.
+        """
+
+        expiry = self._expiry(authz)
+        if expiry is False:
+            return
+
+        try:
+            values = tuple(_freeze(value) for _path, value in trace.reads)
+        except TypeError:
+            return
+
+        tags = set(trace.tags)
+        if self.tagger:
+            for path, value in trace.reads:
+                tags.update(self.tagger(path, value))
+
+        shape = trace.paths
+        key = (name, names, shape, values)
+        with self._lock:
+            if generation != self._generation:
+                # The policy changed while the rule was evaluated
+                return
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._discard(key, old)
+
+            shapes = self._shapes.setdefault(
+                (name, names), collections.OrderedDict())
+            shapes[shape] = shapes.pop(shape, 0) + 1
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            self._put(key, (authz, expiry, frozenset(tags)))
+
+    def invalidate(self, *tags):
+        """
+        Discard the cached results tagged with any of the given tags.
+
+        :param tags: The tags.
+
+        :returns: The number of results discarded.
+        """
+
+        count = 0
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    entry = self._entries.pop(key)
+                    self._discard(key, entry)
+                    count += 1
+            self.tag_invalidations += count
+
+        return count
@@ -0,0 +1,551 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import numbers
+import operator
+
+import six
+
+from policies import analysis
+from policies import instructions
+from policies import partial
+
+try:
+    import numpy
+except ImportError:  # pragma: nocover
+    numpy = None
+
+
+# Kinds of numpy arrays which may be operated on directly; other
+# arrays hold Python objects, and are operated on element by element
+_NUMERIC = 'biuf'
+_STRING = 'U'
+
+# Integer magnitudes below which vectorized operations are exact:
+# products and sums of integers below _ARITH_BOUND do not overflow a
+# 64-bit integer, integers below _FLOAT_BOUND convert exactly to
+# floating point, and integers below _INT64_BOUND fit in a 64-bit
+# integer
+_ARITH_BOUND = 2 ** 31
+_FLOAT_BOUND = 2 ** 53
+_INT64_BOUND = 2 ** 63
+
+# Vectorized binary operators: the numpy function, the acceptable
+# operand kinds, the integer bound, and whether booleans must be
+# converted to integers, as they are in Python arithmetic
+_binary = {
+    instructions.eq_op: ('equal', _NUMERIC + _STRING, _INT64_BOUND, False),
+    instructions.ne_op: ('not_equal', _NUMERIC + _STRING, _INT64_BOUND,
+                         False),
+    instructions.lt_op: ('less', _NUMERIC + _STRING, _INT64_BOUND, False),
+    instructions.gt_op: ('greater', _NUMERIC + _STRING, _INT64_BOUND, False),
+    instructions.le_op: ('less_equal', _NUMERIC + _STRING, _INT64_BOUND,
+                         False),
+    instructions.ge_op: ('greater_equal', _NUMERIC + _STRING, _INT64_BOUND,
+                         False),
+    instructions.add_op: ('add', _NUMERIC, _ARITH_BOUND, True),
+    instructions.sub_op: ('subtract', _NUMERIC, _ARITH_BOUND, True),
+    instructions.mul_op: ('multiply', _NUMERIC, _ARITH_BOUND, True),
+    instructions.bit_and_op: ('bitwise_and', 'biu', _INT64_BOUND, False),
+    instructions.bit_or_op: ('bitwise_or', 'biu', _INT64_BOUND, False),
+    instructions.bit_xor_op: ('bitwise_xor', 'biu', _INT64_BOUND, False),
+}
+
+# Vectorized division operators, which fail for a zero divisor, and
+# the acceptable operand kinds
+_division = {
+    instructions.true_div_op: ('true_divide', _NUMERIC),
+    instructions.floor_div_op: ('floor_divide', 'biu'),
+    instructions.mod_op: ('remainder', 'biu'),
+}
+
+# Vectorized unary operators, and the acceptable operand kinds
+_unary = {
+    instructions.neg_op: ('negative', _NUMERIC),
+    instructions.pos_op: ('positive', _NUMERIC),
+    instructions.inv_op: ('invert', 'biu'),
+}
+
+
+def _prepare(values, kinds, bound, arith):
+    """
+    Prepare numpy arrays to be operated on directly.  Integers and
+    floating point numbers are widened to 64 bits, so that the
+    results are those Python would compute.
+
+    :param values: A list of numpy arrays.
+    :param kinds: A string of the acceptable numpy kind characters.
+                  Numeric kinds may be mixed; others may not.
+    :param bound: The magnitude below which integer elements must
+                  lie.
+    :param arith: If ``True``, booleans are converted to integers.
+
+    :returns: A list of the prepared arrays, or ``None`` if the
+              operation cannot be performed directly.
+    """
+
+    found = set(value.dtype.kind for value in values)
+    if not found <= set(kinds):
+        return None
+    elif not found <= set(_NUMERIC) and len(found) > 1:
+        return None
+
+    # Integers compared to floating point numbers are converted
+    if 'f' in found and found & set('iu'):
+        bound = min(bound, _FLOAT_BOUND)
+
+    for value in values:
+        if value.dtype.kind in 'iu' and len(value) and (
+                value.max() >= bound or value.min() <= -bound):
+            return None
+
+    return [_widen(value, arith) for value in values]
+
+
+def _widen(value, arith=True):
+    """
+    Widen a numpy array to 64 bits.
+
+    :param value: A numpy array.
+    :param arith: If ``True``, booleans are converted to integers.
+                  Python booleans are integers, whereas numpy treats
+                  arithmetic on booleans as logical operations.
+
+    :returns: The widened array.
+    """
+
+    kind = value.dtype.kind
+    if kind in 'iu' or (kind == 'b' and arith):
+        return value.astype(numpy.int64)
+    elif kind == 'f':
+        return value.astype(numpy.float64)
+
+    return value
+
+
+def column(values):
+    """
+    Construct a numpy array from a list of Python values.  An array
+    of a numeric or string type is constructed if all the values are
+    of the same type and are faithfully represented; otherwise, an
+    array of objects is constructed.
+
+    :param values: A list of values.
+
+    :returns: A numpy array.
+    """
+
+    types = set(type(value) for value in values)
+    if len(types) == 1:
+        kind = types.pop()
+        if kind is int and all(-2 ** 63 < value < 2 ** 63
+                               for value in values):
+            return numpy.array(values, dtype=numpy.int64)
+        elif kind in (bool, float, six.text_type):
+            return numpy.array(values)
+
+    # Assign elements individually, so that sequences aren't unpacked
+    result = numpy.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        result[i] = value
+    return result
+
+
+def repeat(value, length):
+    """
+    Construct a numpy array containing a single value repeatedly.
+
+    :param value: The value.
+    :param length: The length of the array.
+
+    :returns: A numpy array, with the type ``column()`` would give.
+    """
+
+    single = column([value])
+    if single.dtype.kind != 'O':
+        return numpy.repeat(single, length)
+
+    result = numpy.empty(length, dtype=object)
+    result.fill(value)
+    return result
+
+
+class ColumnarEvaluator(object):
+    """
+    Evaluate an expression tree against columns of values, one element
+    of each column for each row.  Each node is evaluated for a set of
+    rows, given as a numpy array of row indices, and produces a numpy
+    array of values with one element for each of those rows.  Rows
+    for which evaluating a node raises an exception are recorded in
+    ``failed``, and are not evaluated further.
+
+    Comparisons, arithmetic, boolean operations, and membership in
+    constant sets are vectorized where the operands have numeric or
+    string types; other operations, such as attribute access and
+    function calls, are performed row by row, with the same semantics
+    as the ``StackEngine``.  The short-circuiting operators are
+    evaluated by masking: the right-hand operand of an "and", for
+    instance, is only evaluated for those rows for which the left-hand
+    operand is true.
+    """
+
+    def __init__(self, policy, name, columns, variables, length):
+        """
+        Initialize a ``ColumnarEvaluator`` object.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule being evaluated.
+        :param columns: A dictionary mapping variable names to numpy
+                        arrays.
+        :param variables: A dictionary of variables with the same
+                          value for all rows.
+        :param length: The number of rows.
+        """
+
+        self.policy = policy
+        self.name = name
+        self.columns = columns
+        self.variables = variables
+        self.failed = numpy.zeros(length, dtype=bool)
+
+        self._lists = {}
+        self._compiled = {}
+
+    def row_variables(self, row):
+        """
+        Construct the variables for a single row.
+
+        :param row: The index of the row.
+
+        :returns: A dictionary of variables.
+        """
+
+        result = dict(self.variables)
+        for name, values in self.columns.items():
+            if name not in self._lists:
+                self._lists[name] = values.tolist()
+            result[name] = self._lists[name][row]
+
+        return result
+
+    def elementwise(self, func, idx, *values):
+        """
+        Apply a function element by element.  Rows for which the
+        function raises an exception are marked as failed.
+
+        :param func: The function to apply.
+        :param idx: A numpy array of the indices of the rows.
+        :param values: Numpy arrays of the arguments to pass to the
+                       function.
+
+        :returns: A numpy array of the results.
+        """
+
+        args = [value.tolist() for value in values]
+        failed = self.failed
+        result = []
+        for i, row in enumerate(idx.tolist()):
+            if failed[row]:
+                result.append(None)
+                continue
+
+            try:
+                value = func(*[arg[i] for arg in args])
+                if hasattr(value, '__await__'):
+                    instructions._reject_awaitable(func, value)
+                result.append(value)
+            except Exception:
+                failed[row] = True
+                result.append(None)
+
+        return column(result)
+
+    def per_row(self, node, idx):
+        """
+        Evaluate a node row by row using the stack interpreter.  This
+        is used for calls to functions which want the evaluation
+        context, such as ``rule()``.
+
+        :param node: The ``Node`` to evaluate.
+        :param idx: A numpy array of the indices of the rows.
+
+        :returns: A numpy array of the results.
+        """
+
+        key = node.key
+        if key not in self._compiled:
+            self._compiled[key] = instructions.Instructions(node.compile())
+        insts = self._compiled[key]
+
+        def evaluate(row):
+            ctxt = self.policy.context_class(self.policy, {},
+                                             self.row_variables(row))
+            ctxt.reset(self.name, ctxt.variables)
+            insts(ctxt)
+            return ctxt.stack[-1]
+
+        return self.elementwise(evaluate, idx, idx)
+
+    def truth(self, values, idx):
+        """
+        Compute the truth values of values.
+
+        :param values: A numpy array of values.
+        :param idx: A numpy array of the indices of the rows.
+
+        :returns: A numpy array of booleans.
+        """
+
+        kind = values.dtype.kind
+        if kind == 'b':
+            return values
+        elif kind in _NUMERIC:
+            return values != 0
+        elif kind == _STRING:
+            return numpy.char.str_len(values) > 0
+
+        result = self.elementwise(bool, idx, values)
+        return result.astype(bool) if result.dtype.kind == 'O' else result
+
+    def _merge(self, values, mask, other):
+        """
+        Merge the values computed for a subset of rows into the values
+        computed for all the rows.
+
+        :param values: A numpy array of values for all rows.
+        :param mask: A numpy array of booleans selecting the subset.
+        :param other: A numpy array of values for the subset.
+
+        :returns: A numpy array of the merged values.
+        """
+
+        if values.dtype != other.dtype:
+            values = values.astype(object)
+        else:
+            values = values.copy()
+        values[mask] = other
+
+        return values
+
+    def __call__(self, node, idx):
+        """
+        Evaluate a node.
+
+        :param node: The ``Node`` to evaluate.
+        :param idx: A numpy array of the indices of the rows to
+                    evaluate the node for.
+
+        :returns: A numpy array of values, one for each row.
+        """
+
+        method = getattr(self, '_eval_%s' % node.__class__.__name__.lower())
+        return method(node, idx)
+
+    def _eval_const(self, node, idx):
+        return repeat(node.value, len(idx))
+
+    def _eval_name(self, node, idx):
+        if node.ident in self.columns:
+            return self.columns[node.ident][idx]
+
+        # Not folded, so it resolves to None
+        return repeat(None, len(idx))
+
+    def _eval_attr(self, node, idx):
+        return self.elementwise(
+            lambda obj: getattr(obj, node.attribute), idx,
+            self(node.obj, idx))
+
+    def _eval_call(self, node, idx):
+        func = node.func
+        if not (isinstance(func, analysis.Const) and
+                not getattr(func.value, '_policies_want_context', False)):
+            return self.per_row(node, idx)
+
+        return self.elementwise(
+            func.value, idx, *[self(arg, idx) for arg in node.args])
+
+    def _eval_op(self, node, idx):
+        op = node.operator
+
+        # Identity depends on the Python objects bound to the variables
+        if op in (instructions.is_op, instructions.is_not_op):
+            return self.per_row(node, idx)
+
+        # Membership in a constant collection
+        if (op in (instructions.in_op, instructions.not_in_op) and
+                isinstance(node.args[1], analysis.Const)):
+            values = self(node.args[0], idx)
+            result = self._membership(values, node.args[1].value)
+            if result is not None:
+                return ~result if op == instructions.not_in_op else result
+            return self.elementwise(lambda x: op.op(x, node.args[1].value),
+                                    idx, values)
+
+        values = [self(arg, idx) for arg in node.args]
+
+        if op == instructions.not_op:
+            return ~self.truth(values[0], idx)
+        elif op in _binary:
+            func, kinds, bound, arith = _binary[op]
+            prepared = _prepare(values, kinds, bound, arith)
+            if prepared is not None:
+                return getattr(numpy, func)(*prepared)
+        elif op in _division:
+            func, kinds = _division[op]
+            prepared = _prepare(values, kinds, _FLOAT_BOUND, True)
+            if prepared is not None:
+                # Division by zero raises an exception
+                zero = prepared[1] == 0
+                self.failed[idx[zero]] = True
+                divisor = numpy.where(zero, 1, prepared[1])
+                return getattr(numpy, func)(prepared[0], divisor)
+        elif op in _unary:
+            func, kinds = _unary[op]
+            prepared = _prepare(values, kinds, _INT64_BOUND // 2, True)
+            if prepared is not None:
+                return getattr(numpy, func)(*prepared)
+
+        return self.elementwise(op.op, idx, *values)
+
+    def _membership(self, values, collection):
+        """
+        Compute membership in a constant collection, if it can be
+        vectorized.
+
+        :param values: A numpy array of values.
+        :param collection: The collection.
+
+        :returns: A numpy array of booleans, or ``None`` if the
+                  membership cannot be vectorized.
+        """
+
+        if not isinstance(collection, (set, frozenset, list, tuple)):
+            return None
+
+        kind = values.dtype.kind
+        if kind in _NUMERIC:
+            if not all(isinstance(elem, numbers.Real) and elem == elem and
+                       abs(elem) < _FLOAT_BOUND for elem in collection):
+                return None
+            values = _prepare([values], _NUMERIC, _FLOAT_BOUND, False)
+            if values is None:
+                return None
+            values = values[0]
+        elif kind == _STRING:
+            if not all(isinstance(elem, six.text_type)
+                       for elem in collection):
+                return None
+        else:
+            return None
+
+        if not collection:
+            return numpy.zeros(len(values), dtype=bool)
+
+        return numpy.isin(values, list(collection))
+
+    def _eval_and(self, node, idx):
+        values = self(node.lhs, idx)
+        mask = self.truth(values, idx) & ~self.failed[idx]
+        return self._merge(values, mask, self(node.rhs, idx[mask]))
+
+    def _eval_or(self, node, idx):
+        values = self(node.lhs, idx)
+        mask = ~self.truth(values, idx) & ~self.failed[idx]
+        return self._merge(values, mask, self(node.rhs, idx[mask]))
+
+    def _eval_cond(self, node, idx):
+        cond = self.truth(self(node.cond, idx), idx)
+        live = ~self.failed[idx]
+        if_true = self(node.if_true, idx[cond & live])
+        if_false = self(node.if_false, idx[~cond & live])
+
+        values = repeat(None, len(idx))
+        values = self._merge(values, cond & live, if_true)
+        return self._merge(values, ~cond & live, if_false)
+
+
+def evaluate(policy, name, columns, variables=None, chunk_size=65536):
+    """
+    Evaluate a named rule for every row of a set of columns.  Each
+    row binds the variables named by the keys of ``columns`` to the
+    corresponding elements of the columns, converted to Python values;
+    the result is the same as evaluating the rule once for each row,
+    but the evaluation is vectorized where possible.  The rule is
+    first partially evaluated with the ``variables`` which are the
+    same for all rows.
+
+    :param policy: The ``Policy``.
+    :param name: The name of the rule to evaluate.
+    :param columns: A dictionary mapping variable names to
+                    one-dimensional numpy arrays, all of the same
+                    length.  Memory-mapped arrays (``numpy.memmap``)
+                    may be used, and are read in chunks.
+    :param variables: An optional dictionary of variables with the
+                      same value for all rows.
+    :param chunk_size: The number of rows to evaluate at a time.
+
+    :returns: A numpy array of booleans, one for each row, which are
+              ``True`` where the rule succeeded.
+    """
+
+    if numpy is None:  # pragma: nocover
+        raise ImportError("numpy is required for columnar evaluation")
+
+    lengths = set(len(values) for values in columns.values())
+    if len(lengths) > 1:
+        raise ValueError("columns must all have the same length")
+    length = lengths.pop() if lengths else 0
+
+    # Fold everything which is the same for all rows
+    variables = dict(variables or {})
+    for column_name in columns:
+        variables.pop(column_name, None)
+    residual = partial.Residual(policy, name, policy._lookup(name)[0], {},
+                                variables, unknowns=columns)
+
+    result = numpy.zeros(length, dtype=bool)
+    if residual.decision is not None or residual.expr is None:
+        if residual.decision:
+            result[:] = True
+        elif residual.expr is None:
+            # The rule can't be analyzed; evaluate it row by row
+            evaluator = ColumnarEvaluator(policy, name, columns,
+                                          variables, length)
+            result[:] = [bool(authz) for authz in policy.evaluate_many(
+                name, (evaluator.row_variables(row)
+                       for row in six.moves.range(length)))]
+        return result
+
+    for start in six.moves.range(0, length, chunk_size):
+        stop = min(start + chunk_size, length)
+        chunk = dict((column_name, numpy.asarray(values[start:stop]))
+                     for column_name, values in columns.items())
+        evaluator = ColumnarEvaluator(policy, name, chunk, variables,
+                                      stop - start)
+        idx = numpy.arange(stop - start)
+
+        mask = evaluator.truth(evaluator(residual.expr, idx), idx)
+
+        # Computing an authorization attribute could fail
+        for _attr, node in residual.attrs:
+            if not isinstance(node, analysis.Const):
+                evaluator(node, idx[~evaluator.failed])
+
+        result[start:stop] = mask & ~evaluator.failed
+
+    return result
@@ -0,0 +1,291 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import abc
+import logging
+
+import six
+
+from policies import authorization
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Engine(object):
+    """
+    An evaluation engine.  An engine is responsible for compiling a
+    ``Rule`` into some executable form, then evaluating that compiled
+    form against a set of variables to produce an ``Authorization``.
+    Alternate engines must produce results identical to those of the
+    reference ``StackEngine``; the ``policies.fuzz`` module provides a
+    differential tester for verifying this.
+    """
+
+    # If True, the engine accepts rules whose instructions have been
+    # rewritten to include policies.instructions.Memoize
+    supports_memoize = False
+
+    @abc.abstractmethod
+    def compile(self, rule):
+        """
+        Compile a rule.  This is called on every evaluation, so
+        engines should cache the compiled form, preferably on the
+        ``Rule`` itself or keyed by it.
+
+        :param rule: The ``policies.rules.Rule`` object to compile.
+
+        :returns: The compiled form of the rule.  This is opaque to
+                  the ``Policy``; it is simply passed to
+                  ``evaluate()``.
+        """
+
+        pass  # pragma: nocover
+
+    @abc.abstractmethod
+    def evaluate(self, policy, name, compiled, attrs, variables):
+        """
+        Evaluate a compiled rule.  Engines must fail closed; that is,
+        if an exception is raised while evaluating the rule, an
+        ``Authorization`` evaluating to ``False`` and carrying the
+        default authorization attributes must be returned.
+
+        :param policy: The ``Policy`` object.  Nested rules are
+                       looked up and identifiers are resolved through
+                       this object.
+        :param name: The name of the rule being evaluated.
+        :param compiled: The compiled form of the rule, as returned by
+                         ``compile()``.
+        :param attrs: A dictionary of authorization attribute default
+                      values.
+        :param variables: A dictionary of variables to be defined for
+                          the evaluation.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        pass  # pragma: nocover
+
+    def evaluate_many(self, policy, name, compiled, attrs, variables_iter,
+                      memo=None):
+        """
+        Evaluate a compiled rule once for each of a sequence of sets
+        of variables.  The default implementation simply calls
+        ``evaluate()`` for each set; engines may override this to
+        share per-evaluation setup.  Results must be identical to
+        those of ``evaluate()``.
+
+        :param policy: The ``Policy`` object.
+        :param name: The name of the rule being evaluated.
+        :param compiled: The compiled form of the rule, as returned by
+                         ``compile()``.
+        :param attrs: A dictionary of authorization attribute default
+                      values.
+        :param variables_iter: An iterable of dictionaries of
+                               variables.
+        :param memo: An optional dictionary to use as the ``memo`` of
+                     every evaluation, for engines which support
+                     ``policies.instructions.Memoize``.  This allows
+                     subexpressions which do not depend on the
+                     varying variables to be computed only once.
+
+        :returns: An iterator over instances of
+                  ``policies.authorization.Authorization``, one for
+                  each set of variables, in order.  Results are
+                  computed as the iterator is consumed.
+        """
+
+        for variables in variables_iter:
+            yield self.evaluate(policy, name, compiled, attrs, variables)
+
+    def evaluate_all(self, policy, entries, variables):
+        """
+        Evaluate several compiled rules against the same set of
+        variables.  The default implementation simply calls
+        ``evaluate()`` for each rule; engines may override this to
+        share the results of nested rules and common subexpressions
+        between the rules.  Results must be identical to those of
+        ``evaluate()``.
+
+        :param policy: The ``Policy`` object, or a view of it.
+        :param entries: A list of (name, compiled, attrs) tuples, one
+                        for each rule to evaluate.  The compiled form
+                        is as returned by ``compile()``, or ``None``
+                        if the rule does not exist.
+        :param variables: A dictionary of variables to be defined for
+                          the evaluations.
+
+        :returns: A dictionary mapping the rule names to instances of
+                  ``policies.authorization.Authorization``.
+        """
+
+        results = {}
+        for name, compiled, attrs in entries:
+            if compiled is None:
+                results[name] = authorization.Authorization(False)
+            else:
+                results[name] = self.evaluate(policy, name, compiled, attrs,
+                                              variables)
+
+        return results
+
+
+class StackEngine(Engine):
+    """
+    The reference evaluation engine.  Rules are compiled into
+    ``policies.instructions.Instructions`` and executed by the stack
+    interpreter, using the ``context_class`` of the ``Policy``.
+    """
+
+    supports_memoize = True
+
+    def compile(self, rule):
+        """
+        Compile a rule.  The compiled instructions are cached by the
+        ``Rule`` itself.
+
+        :param rule: The ``policies.rules.Rule`` object to compile.
+
+        :returns: The ``policies.instructions.Instructions`` for the
+                  rule.
+        """
+
+        return rule.instructions
+
+    def evaluate(self, policy, name, compiled, attrs, variables):
+        """
+        Evaluate a compiled rule.
+
+        :param policy: The ``Policy`` object.
+        :param name: The name of the rule being evaluated.
+        :param compiled: The ``policies.instructions.Instructions``
+                         for the rule.
+        :param attrs: A dictionary of authorization attribute default
+                      values.
+        :param variables: A dictionary of variables to be defined for
+                          the evaluation.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        # Construct the context
+        ctxt = policy.context_class(policy, attrs, variables)
+
+        # Execute the rule
+        try:
+            with ctxt.push_rule(name):
+                compiled(ctxt)
+        except Exception:
+            # Fail closed
+            return authorization.Authorization(False, attrs)
+
+        # Return the authorization result
+        return ctxt.authz
+
+    def evaluate_many(self, policy, name, compiled, attrs, variables_iter,
+                      memo=None):
+        """
+        Evaluate a compiled rule once for each of a sequence of sets
+        of variables.  A single context is constructed and reset
+        between evaluations.
+
+        :param policy: The ``Policy`` object.
+        :param name: The name of the rule being evaluated.
+        :param compiled: The ``policies.instructions.Instructions``
+                         for the rule.
+        :param attrs: A dictionary of authorization attribute default
+                      values.
+        :param variables_iter: An iterable of dictionaries of
+                               variables.
+        :param memo: An optional dictionary to use as the ``memo`` of
+                     every evaluation.
+
+        :returns: An iterator over instances of
+                  ``policies.authorization.Authorization``, one for
+                  each set of variables, in order.
+        """
+
+        ctxt = policy.context_class(policy, attrs, {})
+
+        for variables in variables_iter:
+            ctxt.reset(name, variables)
+            if memo is not None:
+                ctxt.memo = memo
+
+            # Execute the rule
+            try:
+                compiled(ctxt)
+            except Exception as exc:
+                # Report only if a nested rule hasn't reported it
+                if not ctxt.reported:
+                    log = logging.getLogger('policies')
+                    log.warn("Exception raised while evaluating rule %r: "
+                             "%s" % (name, exc))
+
+                # Fail closed
+                yield authorization.Authorization(False, attrs)
+                continue
+
+            yield ctxt.authz
+
+    def evaluate_all(self, policy, entries, variables):
+        """
+        Evaluate several compiled rules against the same set of
+        variables.  A single context is used, so the results of
+        nested rules and memoized subexpressions are shared between
+        the rules.
+
+        :param policy: The ``Policy`` object, or a view of it.
+        :param entries: A list of (name, compiled, attrs) tuples, one
+                        for each rule to evaluate.  The compiled form
+                        is ``None`` if the rule does not exist.
+        :param variables: A dictionary of variables to be defined for
+                          the evaluations.
+
+        :returns: A dictionary mapping the rule names to instances of
+                  ``policies.authorization.Authorization``.
+        """
+
+        ctxt = policy.context_class(policy, None, variables)
+
+        results = {}
+        for name, compiled, attrs in entries:
+            if compiled is None:
+                results[name] = authorization.Authorization(False)
+                continue
+
+            ctxt.attrs = attrs
+            ctxt.reset(name, variables, clear_caches=False)
+
+            # Execute the rule
+            try:
+                compiled(ctxt)
+            except Exception as exc:
+                # Report only if a nested rule hasn't reported it
+                if not ctxt.reported:
+                    log = logging.getLogger('policies')
+                    log.warn("Exception raised while evaluating rule %r: "
+                             "%s" % (name, exc))
+
+                # Fail closed
+                results[name] = authorization.Authorization(False, attrs)
+                continue
+
+            results[name] = ctxt.authz
+
+        return results
@@ -0,0 +1,159 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import threading
+import timeit
+
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:  # pragma: nocover
+    importlib_metadata = None
+
+
+# Records a failure to load an entrypoint
+LoadFailure = collections.namedtuple('LoadFailure',
+                                     ['name', 'entrypoint', 'exc', 'elapsed'])
+
+
+def iter_entry_points(group):
+    """
+    Iterate over all the entrypoints in a given group.  Uses
+    ``importlib.metadata`` if it is available, falling back to
+    ``pkg_resources`` otherwise.
+
+    :param group: The name of the entrypoint group.
+
+    :returns: An iterator over the entrypoints in the group.  Each
+              entrypoint has ``name`` and ``load()`` attributes.
+    """
+
+    if importlib_metadata is None:  # pragma: nocover
+        import pkg_resources
+        return pkg_resources.iter_entry_points(group)
+
+    try:
+        return iter(importlib_metadata.entry_points(group=group))
+    except TypeError:  # pragma: nocover
+        # Python versions prior to 3.10 return a dictionary
+        return iter(importlib_metadata.entry_points().get(group, ()))
+
+
+class EntryPointIndex(object):
+    """
+    An index of the entrypoints in a given group.  The group is
+    scanned only once, on first use, and the entrypoints are indexed
+    by name; each entrypoint is only loaded when it is looked up.  The
+    time taken to scan the group is available as ``scan_time``; the
+    time taken to load each entrypoint is available in the
+    ``load_times`` dictionary; and any failures to load an entrypoint
+    are recorded in the ``failures`` list as ``LoadFailure`` tuples.
+    """
+
+    def __init__(self, group):
+        """
+        Initialize an ``EntryPointIndex`` object.
+
+        :param group: The name of the entrypoint group.
+        """
+
+        self.group = group
+
+        self._index = None
+        self._lock = threading.Lock()
+
+        self.scan_time = None
+        self.load_times = {}
+        self.failures = []
+
+    def _get_index(self):
+        """
+        Retrieve the index, scanning the entrypoint group if
+        necessary.
+
+        :returns: A dictionary mapping entrypoint names to lists of
+                  entrypoints.
+        """
+
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    start = timeit.default_timer()
+                    index = {}
+                    for ep in iter_entry_points(self.group):
+                        index.setdefault(ep.name, []).append(ep)
+                    self.scan_time = timeit.default_timer() - start
+                    self._index = index
+                index = self._index
+
+        return index
+
+    def __contains__(self, name):
+        """
+        Determine whether an entrypoint with the given name exists in
+        the group.
+
+        :param name: The name of the entrypoint.
+
+        :returns: A ``True`` value if the entrypoint exists, ``False``
+                  otherwise.
+        """
+
+        return name in self._get_index()
+
+    def load(self, name):
+        """
+        Load the entrypoint with the given name.  If more than one
+        entrypoint has the name, the first one which loads
+        successfully is used.
+
+        :param name: The name of the entrypoint.
+
+        :returns: The loaded object, or ``None`` if the entrypoint
+                  does not exist or could not be loaded.
+        """
+
+        for ep in self._get_index().get(name, ()):
+            start = timeit.default_timer()
+            try:
+                result = ep.load()
+            except Exception as exc:
+                elapsed = timeit.default_timer() - start
+                self.failures.append(LoadFailure(name, ep, exc, elapsed))
+
+                # Get the logger and emit a log message
+                log = logging.getLogger('policies')
+                log.warn("Failed to load entrypoint %r from group %r "
+                         "(%.3f seconds): %s" %
+                         (name, self.group, elapsed, exc))
+                continue
+
+            self.load_times[name] = timeit.default_timer() - start
+            return result
+
+        return None
+
+    def invalidate(self):
+        """
+        Invalidate the index.  The entrypoint group will be rescanned
+        the next time an entrypoint is looked up.  This should be
+        called when plugins have been installed or removed.
+        """
+
+        with self._lock:
+            self._index = None
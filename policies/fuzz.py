@@ -0,0 +1,294 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import collections
+import random
+
+from policies import policy
+from policies import rules
+
+
+# Records a disagreement between engines.  The ``results`` element is
+# a list of (engine, signature) tuples, where the signature is the
+# result of ``signature()``.
+Mismatch = collections.namedtuple('Mismatch',
+                                  ['text', 'helper', 'variables', 'results'])
+
+
+def signature(authz):
+    """
+    Compute a comparable signature for an authorization result.
+
+    :param authz: An instance of
+                  ``policies.authorization.Authorization``.
+
+    :returns: A tuple of the boolean result and a sorted tuple of
+              (name, value) pairs for the authorization attributes.
+    """
+
+    return (bool(authz), tuple(sorted(authz._attrs.items())))
+
+
+def _same(sig1, sig2):
+    """
+    Compare two signatures.  Falls back to comparing the
+    representations, so that values which do not compare equal to
+    themselves (such as NaN) are handled sensibly.
+
+    :param sig1: The first signature.
+    :param sig2: The second signature.
+
+    :returns: A ``True`` value if the signatures are the same,
+              ``False`` otherwise.
+    """
+
+    try:
+        if sig1 == sig2:
+            return True
+    except Exception:
+        pass
+
+    return repr(sig1) == repr(sig2)
+
+
+class DifferentialTester(object):
+    """
+    A randomized differential tester for evaluation engines.  Rule
+    texts are generated from the grammar accepted by
+    ``policies.parser``, along with random sets of variables, and each
+    rule is evaluated with each engine.  Any engine which returns a
+    different result or different authorization attributes than the
+    first engine is reported as a ``Mismatch``.
+    """
+
+    # Operators, by the number of operands; "**", "<<", and "*" are
+    # handled specially to avoid generating runaway computations
+    unary_ops = ['-', '+', '~', 'not ']
+    binary_ops = ['/', '//', '%', '+', '-', '>>', '&', '^', '|',
+                  'in', 'not in', 'is', 'is not',
+                  '<', '>', '<=', '>=', '!=', '==', 'and', 'or']
+    bounded_ops = ['**', '<<', '*']
+
+    # Attribute names and callables for the top precedence level
+    attributes = ['real', 'imag', 'upper', 'keys', 'missing']
+    functions = ['len', 'abs', 'str', 'bool', 'int', 'sorted']
+
+    # Names of the variables to generate
+    variable_names = ['a', 'b', 'c', 's', 'l']
+
+    def __init__(self, engines, seed=None, max_depth=3):
+        """
+        Initialize a ``DifferentialTester`` object.
+
+        :param engines: A list of ``policies.engines.Engine``
+                        instances to compare.  The first engine is the
+                        reference.
+        :param seed: An optional seed for the random number
+                     generator, allowing failures to be reproduced.
+        :param max_depth: The maximum nesting depth of generated
+                          expressions.
+        """
+
+        self.engines = engines
+        self.rand = random.Random(seed)
+        self.max_depth = max_depth
+
+    def generate_atom(self):
+        """
+        Generate a random primitive value or identifier.
+
+        :returns: The text of the atom.
+        """
+
+        choice = self.rand.randrange(8)
+        if choice == 0:
+            return self.rand.choice(['True', 'False', 'None'])
+        elif choice == 1:
+            return str(self.rand.randint(-5, 5))
+        elif choice == 2:
+            return self.rand.choice(['0.5', '2.5', '-1.0', '1e1'])
+        elif choice == 3:
+            return self.rand.choice(['"a"', '"ab"', "''", '"a" "b"'])
+        elif choice == 4:
+            return '{%s}' % ', '.join(
+                str(self.rand.randint(0, 3))
+                for _i in range(self.rand.randrange(3)))
+
+        return self.rand.choice(self.variable_names)
+
+    def generate_expr(self, depth=0):
+        """
+        Generate a random expression.
+
+        :param depth: The current nesting depth.
+
+        :returns: The text of the expression.
+        """
+
+        return self._expr(depth)[0]
+
+    def _expr(self, depth):
+        """
+        Generate a random expression.  Subexpressions are only
+        parenthesized when necessary, since each level of parentheses
+        is expensive for the parser.
+
+        :param depth: The current nesting depth.
+
+        :returns: A tuple of the text of the expression and a flag
+                  indicating whether the expression is primary--that
+                  is, whether it may be used as an operand without
+                  parentheses.
+        """
+
+        if depth >= self.max_depth:
+            return self.generate_atom(), True
+
+        def sub():
+            text, primary = self._expr(depth + 1)
+            return text if primary else '(%s)' % text
+
+        def base():
+            # Literals can't be directly followed by "." or "["
+            text = self._expr(depth + 1)[0]
+            return text if text in self.variable_names else '(%s)' % text
+
+        choice = self.rand.randrange(10)
+        if choice == 0:
+            return self.generate_atom(), True
+        elif choice == 1:
+            return '%s%s' % (self.rand.choice(self.unary_ops), sub()), False
+        elif choice in (2, 3, 4):
+            return '%s %s %s' % (sub(), self.rand.choice(self.binary_ops),
+                                 sub()), False
+        elif choice == 5:
+            # Keep the right-hand operand small
+            return '%s %s %s' % (sub(), self.rand.choice(self.bounded_ops),
+                                 self.rand.choice(['0', '1', '2', 'a'])), False
+        elif choice == 6:
+            return '%s if %s else %s' % (sub(), sub(), sub()), False
+        elif choice == 7:
+            return '%s[%s]' % (base(), self._expr(depth + 1)[0]), True
+        elif choice == 8:
+            return '%s.%s' % (base(), self.rand.choice(self.attributes)), True
+
+        # Function calls, including nested rules
+        if self.rand.randrange(4) == 0:
+            return 'rule("%s")' % self.rand.choice(['helper', 'missing']), True
+        return '%s(%s)' % (self.rand.choice(self.functions),
+                           self._expr(depth + 1)[0]), True
+
+    def generate_rule(self, depth=0):
+        """
+        Generate a random rule, possibly including authorization
+        attribute assignments.
+
+        :param depth: The initial nesting depth.
+
+        :returns: The text of the rule.
+        """
+
+        text = self.generate_expr(depth)
+
+        count = self.rand.randrange(3)
+        if count:
+            text += ' {{ %s }}' % ', '.join(
+                '%s=%s' % (attr, self.generate_expr(depth + 1))
+                for attr in self.rand.sample(['x', 'y', 'z'], count))
+
+        return text
+
+    def generate_variables(self):
+        """
+        Generate a random set of variables.
+
+        :returns: A dictionary of variables.
+        """
+
+        values = [
+            lambda: self.rand.randint(-5, 5),
+            lambda: self.rand.choice([True, False, None]),
+            lambda: self.rand.choice(['', 'a', 'ab', 'abc']),
+            lambda: [self.rand.randint(0, 3)
+                     for _i in range(self.rand.randrange(4))],
+            lambda: frozenset(self.rand.randint(0, 3)
+                              for _i in range(self.rand.randrange(4))),
+        ]
+
+        return dict((name, self.rand.choice(values)())
+                    for name in self.variable_names
+                    if self.rand.randrange(5))
+
+    def check(self, text, helper, variables):
+        """
+        Evaluate a rule with each engine and compare the results.
+
+        :param text: The text of the rule to evaluate.
+        :param helper: The text of a rule named "helper", which is
+                       available to the rule through the ``rule()``
+                       builtin.
+        :param variables: A dictionary of variables for the
+                          evaluation.
+
+        :returns: A ``Mismatch`` if the engines disagree, or ``None``
+                  if all engines produced identical results.
+        """
+
+        # The rules are shared by all the engines, so they are only
+        # parsed once
+        fuzz_rule = rules.Rule('fuzz', text)
+        helper_rule = rules.Rule('helper', helper)
+
+        results = []
+        for engine in self.engines:
+            pol = policy.Policy(engine=engine)
+            pol.declare('fuzz', attrs={'z': 'default'})
+            pol.set_rule(fuzz_rule)
+            pol.set_rule(helper_rule)
+
+            try:
+                sig = signature(pol.evaluate('fuzz', dict(variables)))
+            except Exception as exc:
+                # Engines must fail closed; an exception is a mismatch
+                sig = ('raised', repr(exc))
+
+            results.append((engine, sig))
+
+        if all(_same(results[0][1], sig) for _engine, sig in results[1:]):
+            return None
+
+        return Mismatch(text, helper, variables, results)
+
+    def run(self, iterations=1000):
+        """
+        Run the differential test.
+
+        :param iterations: The number of random rules to generate and
+                           check.
+
+        :returns: A list of ``Mismatch`` objects, one for each rule
+                  for which the engines disagreed.
+        """
+
+        mismatches = []
+        for _i in range(iterations):
+            mismatch = self.check(self.generate_rule(),
+                                  self.generate_expr(1),
+                                  self.generate_variables())
+            if mismatch is not None:
+                mismatches.append(mismatch)
+
+        return mismatches
@@ -0,0 +1,181 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from policies import analysis
+
+
+class Dependencies(object):
+    """
+    Determine which subexpressions of a rule depend on a given set of
+    variables.  Nested rules evaluated with ``rule()`` are analyzed
+    as well; calls to ``rule()`` with a name which is not constant,
+    and calls to other functions which want the evaluation context,
+    are assumed to depend on all variables.
+    """
+
+    def __init__(self, policy, names, variables=None):
+        """
+        Initialize a ``Dependencies`` object.
+
+        :param policy: The ``Policy`` the rule belongs to.
+        :param names: A set of the names of the variables.
+        :param variables: An optional dictionary of the values of
+                          other variables, used to determine which
+                          functions are called.
+        """
+
+        self.policy = policy
+        self.names = frozenset(names)
+        self.variables = variables or {}
+
+        self._rules = {}
+        self._nodes = {}
+
+    def _wants_context(self, node):
+        """
+        Determine whether a called function wants the evaluation
+        context.
+
+        :param node: The ``Node`` computing the function.
+
+        :returns: A ``True`` value if the function wants the context
+                  or cannot be determined, ``False`` otherwise.
+        """
+
+        if not isinstance(node, analysis.Name):
+            return True
+
+        if node.ident in self.variables:
+            func = self.variables[node.ident]
+        else:
+            func = self.policy.resolve(node.ident)
+
+        return getattr(func, '_policies_want_context', False)
+
+    def rule(self, name):
+        """
+        Determine whether a nested rule depends on the variables.
+
+        :param name: The name of the rule.
+
+        :returns: A ``True`` value if the rule depends on the
+                  variables, ``False`` otherwise.
+        """
+
+        if name not in self._rules:
+            try:
+                rule = self.policy[name]
+            except KeyError:
+                # rule() evaluates a missing rule as False
+                self._rules[name] = False
+                return False
+
+            # Assume a recursive rule is dependent
+            self._rules[name] = True
+            try:
+                expr, _attrs = analysis.decompile(rule.instructions)
+            except analysis.DecompileError:
+                return True
+            self._rules[name] = self(expr)
+
+        return self._rules[name]
+
+    def __call__(self, node):
+        """
+        Determine whether a subexpression depends on the variables.
+
+        :param node: The ``Node`` computing the subexpression.
+
+        :returns: A ``True`` value if the subexpression depends on
+                  the variables, ``False`` otherwise.
+        """
+
+        key = node.key
+        if key not in self._nodes:
+            if isinstance(node, analysis.Name):
+                result = node.ident in self.names
+            elif isinstance(node, analysis.Call) and self._wants_context(
+                    node.func):
+                name = node.rule_name
+                result = True if name is None else self.rule(name)
+            else:
+                result = False
+
+            # Evaluate all children, so that their results are cached
+            for child in node.children:
+                result = self(child) or result
+
+            self._nodes[key] = result
+
+        return self._nodes[key]
+
+
+def invariants(expr, dependent):
+    """
+    Find the largest non-trivial subexpressions which do not depend
+    on the variables.
+
+    :param expr: The ``Node`` to search.
+    :param dependent: A ``Dependencies`` object.
+
+    :returns: A list of the invariant ``Node`` objects.
+    """
+
+    if not dependent(expr):
+        return [] if expr.trivial else [expr]
+
+    result = []
+    for child in expr.children:
+        result.extend(invariants(child, dependent))
+
+    return result
+
+
+def hoist(policy, rule, names, variables=None):
+    """
+    Rewrite a rule so that its subexpressions which do not depend on
+    the named variables are computed only once when the rule is
+    evaluated many times with different values of those variables.
+    The subexpressions are wrapped in
+    ``policies.instructions.Memoize`` instructions, so they are still
+    computed lazily, and only if the rule would compute them; the
+    ``memo`` of the evaluation context must be preserved between
+    evaluations.
+
+    :param policy: The ``Policy`` the rule belongs to.
+    :param rule: The ``Rule`` to rewrite.
+    :param names: A set of the names of the variables which change
+                  between evaluations.
+    :param variables: An optional dictionary of the values of the
+                      variables which do not change.
+
+    :returns: An instance of ``policies.instructions.Instructions``.
+              If the rule cannot be analyzed, its instructions are
+              returned unchanged.
+    """
+
+    try:
+        expr, attrs = analysis.decompile(rule.instructions)
+    except analysis.DecompileError:
+        return rule.instructions
+
+    dependent = Dependencies(policy, names, variables)
+    memo = {}
+    for tree in [expr] + [node for _name, node in attrs]:
+        for node in invariants(tree, dependent):
+            memo.setdefault(node.key, len(memo))
+
+    return analysis.compile_rule(expr, attrs, memo)
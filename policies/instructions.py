@@ -16,6 +16,7 @@
 
 import abc
 import operator
+import threading
 
 import six
 
@@ -24,7 +25,7 @@ from policies import authorization
 
 __all__ = ['Instructions', 'Jump', 'JumpIf', 'JumpIfNot',
            'Constant', 'Attribute', 'Ident', 'SetOperator', 'CallOperator',
-           'AuthorizationAttr',
+           'AuthorizationAttr', 'Memoize',
            'pop',
            'inv_op', 'pos_op', 'neg_op', 'not_op',
            'pow_op', 'mul_op', 'true_div_op', 'floor_div_op', 'mod_op',
@@ -37,6 +38,17 @@ __all__ = ['Instructions', 'Jump', 'JumpIf', 'JumpIfNot',
            'set_authz']
 
 
+# Bounds on constant folding.  Folding happens while the rule is being
+# parsed, so an operation on constants whose result would exceed these
+# bounds is not folded; it is left to be evaluated (and fail) at
+# runtime instead of stalling the parser.
+FOLD_MAX_BITS = 4096
+FOLD_MAX_LENGTH = 4096
+
+# Protects the hit and miss counters of pure functions
+_pure_lock = threading.Lock()
+
+
 @six.add_metaclass(abc.ABCMeta)
 class AbstractInstruction(object):
     """
@@ -661,10 +673,35 @@ class Operator(AbstractInstruction, AbstractOperator):
 
         # Are the elements constants?
         if all(isinstance(e, Constant) for e in elems):
-            return [Constant(self.op(*[e.value for e in elems]))]
+            args = [e.value for e in elems]
+
+            # Only fold operations that are cheap and that produce
+            # reasonably sized results; errors are also left to be
+            # reported at evaluation time
+            if self.foldable(*args):
+                try:
+                    value = self.op(*args)
+                except Exception:
+                    pass
+                else:
+                    if _fold_bounded(value):
+                        return [Constant(value)]
 
         return [Instructions(elems[:] + [self])]
 
+    def foldable(self, *args):
+        """
+        Determine whether the operation may be performed on the given
+        constant operands during constant folding.  Subclasses may
+        override this to refuse operations that would be too
+        expensive to perform at parse time.
+
+        :returns: A ``True`` value if the operation may be folded,
+                  ``False`` otherwise.
+        """
+
+        return True
+
     @abc.abstractmethod
     def op(self, *args):
         """
@@ -682,7 +719,7 @@ class GenericOperator(Operator):
     constructor.
     """
 
-    def __init__(self, count, op, opstr):
+    def __init__(self, count, op, opstr, guard=None):
         """
         Initialize a ``GenericOperator`` object.
 
@@ -692,10 +729,15 @@ class GenericOperator(Operator):
         :param opstr: A string representing the operation that will be
                       performed.  This is used when a representation
                       of this operator is requested.
+        :param guard: An optional callable which will be passed the
+                      constant operands during constant folding.  It
+                      should return ``False`` if the operation would
+                      be too expensive to perform at parse time.
         """
 
         super(GenericOperator, self).__init__(count, opstr)
         self._op = op
+        self._guard = guard
 
     def __hash__(self):
         """
@@ -729,6 +771,18 @@ class GenericOperator(Operator):
 
         return self._op(*args)
 
+    def foldable(self, *args):
+        """
+        Determine whether the operation may be performed on the given
+        constant operands during constant folding.  Consults the guard
+        passed to the constructor, if any.
+
+        :returns: A ``True`` value if the operation may be folded,
+                  ``False`` otherwise.
+        """
+
+        return self._guard is None or self._guard(*args)
+
 
 class SetOperator(Operator):
     """
@@ -804,13 +858,62 @@ class CallOperator(AbstractInstruction):
 
         # If the function wants the context, add the context and call
         # it; it is assumed the function will do its own updates to
-        # the context stack
+        # the context stack, unless it is a coroutine function
         if getattr(func, '_policies_want_context', False):
             ctxt.stack = ctxt.stack[:-self.count]
-            func(ctxt, *args)
+            result = func(ctxt, *args)
+            if hasattr(result, '__await__'):
+                _reject_awaitable(func, result)
+            if ctxt.stack and hasattr(ctxt.stack[-1], '__await__'):
+                _reject_awaitable(func, ctxt.stack.pop())
+        elif getattr(func, '_policies_pure', False):
+            ctxt.stack[-self.count:] = [self._call_pure(ctxt, func, args)]
         else:
             # Call the function and update the stack
-            ctxt.stack[-self.count:] = [func(*args)]
+            result = func(*args)
+            if hasattr(result, '__await__'):
+                _reject_awaitable(func, result)
+            ctxt.stack[-self.count:] = [result]
+
+    @staticmethod
+    def _call_pure(ctxt, func, args):
+        """
+        Call a pure function, memoizing the result in the
+        ``call_cache`` of the evaluation context.
+
+        :param ctxt: The evaluation context.
+        :param func: The function, which must have been decorated
+                     with ``policies.pure()``.
+        :param args: A list of the arguments.
+
+        :returns: The result of calling the function.
+        """
+
+        # The types distinguish, for instance, 1 from True
+        key = (func, tuple(args), tuple(type(arg) for arg in args))
+        try:
+            result = ctxt.call_cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable arguments
+            result = func(*args)
+            if hasattr(result, '__await__'):
+                _reject_awaitable(func, result)
+            return result
+        else:
+            with _pure_lock:
+                func.pure_hits += 1
+            return result
+
+        result = func(*args)
+        if hasattr(result, '__await__'):
+            _reject_awaitable(func, result)
+        ctxt.call_cache[key] = result
+        with _pure_lock:
+            func.pure_misses += 1
+
+        return result
 
     def __hash__(self):
         """
@@ -951,6 +1054,90 @@ class AuthorizationAttr(AbstractInstruction):
                 self.attribute == other.attribute)
 
 
+class Memoize(AbstractInstruction):
+    """
+    An instruction that computes the value of a subexpression at most
+    once per evaluation context.  The first time the instruction is
+    executed, the contained instructions are executed and the
+    resulting value is saved in the ``memo`` dictionary of the
+    evaluation context under the instruction's slot; later executions
+    simply push the saved value.  This allows a subexpression common
+    to several rules to be computed only once when the rules are
+    evaluated in the same context.
+    """
+
+    def __init__(self, slot, instructions):
+        """
+        Initialize a ``Memoize`` object.
+
+        :param slot: The key under which to save the value.
+        :param instructions: An instance of ``Instructions`` which
+                             computes the value.
+        """
+
+        self.slot = slot
+        self.instructions = instructions
+
+    def __repr__(self):
+        """
+        Return a representation of this instruction.  Should provide
+        enough information for a user to understand what operation
+        will be performed.
+
+        :returns: A string representation of this instruction.
+        """
+
+        return 'Memoize(%r, %r)' % (self.slot, self.instructions)
+
+    def __call__(self, ctxt):
+        """
+        Evaluate this instruction.  Pushes the saved value of the
+        subexpression onto the evaluation context stack, computing it
+        first if necessary.
+
+        :param ctxt: The evaluation context.
+        """
+
+        try:
+            ctxt.stack.append(ctxt.memo[self.slot])
+            return
+        except KeyError:
+            pass
+
+        # Execute the contained instructions, preserving the program
+        # counter
+        pc = ctxt.pc
+        ctxt.pc = 0
+        self.instructions(ctxt)
+        ctxt.pc = pc
+        ctxt.step = 1
+
+        ctxt.memo[self.slot] = ctxt.stack[-1]
+
+    def __hash__(self):
+        """
+        Return a hash value for this instruction.
+
+        :returns: The hash value.
+        """
+
+        return super(Memoize, self).__hash__(self.slot, self.instructions)
+
+    def __eq__(self, other):
+        """
+        Compare two instructions for equivalence.
+
+        :param other: Another ``AbstractInstruction`` to compare to.
+
+        :returns: A ``True`` value if the ``other`` instruction is
+                  equivalent to this one, ``False`` otherwise.
+        """
+
+        return (super(Memoize, self).__eq__(other) and
+                self.slot == other.slot and
+                self.instructions == other.instructions)
+
+
 class TrinaryOperator(AbstractOperator):
     """
     A special operator which is not an instruction.  This class
@@ -1040,6 +1227,145 @@ class OrOperator(object):
         return [Instructions([lhs, JumpIf(len(rhs) + 1), pop, rhs])]
 
 
+def _reject_awaitable(func, result):
+    """
+    Reject the awaitable result of a call to a policy function, such
+    as a coroutine.  Awaitables are always true, so treating one as
+    the result of the call would silently allow access; instead, the
+    evaluation is failed, and the awaitable is closed, if possible, to
+    suppress the warning about it never being awaited.  Rules which
+    call such functions must be evaluated with
+    ``Policy.evaluate_async()``.
+
+    :param func: The function which was called.
+    :param result: The awaitable it returned.
+    """
+
+    close = getattr(result, 'close', None)
+    if close is not None:
+        close()
+
+    raise TypeError("Policy function %r returned an awaitable; use "
+                    "evaluate_async() to evaluate rules which call it" %
+                    (func,))
+
+
+def _fold_bounded(value):
+    """
+    Determine whether the result of a constant folding operation is
+    small enough to be stored in the compiled rule.
+
+    :param value: The result of the operation.
+
+    :returns: A ``True`` value if the result is within the folding
+              bounds, ``False`` otherwise.
+    """
+
+    if isinstance(value, six.integer_types):
+        return value.bit_length() <= FOLD_MAX_BITS
+    elif isinstance(value, (six.string_types, six.binary_type,
+                            tuple, list, frozenset)):
+        return len(value) <= FOLD_MAX_LENGTH
+
+    return True
+
+
+def _is_int(value):
+    """
+    Determine whether a value is an integer.
+
+    :param value: The value to check.
+
+    :returns: A ``True`` value if the value is an integer, ``False``
+              otherwise.
+    """
+
+    return isinstance(value, six.integer_types)
+
+
+def _is_seq(value):
+    """
+    Determine whether a value is a sequence that can be repeated
+    using the ``*`` operator.
+
+    :param value: The value to check.
+
+    :returns: A ``True`` value if the value is a repeatable sequence,
+              ``False`` otherwise.
+    """
+
+    return isinstance(value, (six.string_types, six.binary_type,
+                              tuple, list))
+
+
+def _pow_guard(base, exp):
+    """
+    Guard constant folding of the ``**`` operator.  The size of an
+    integer power grows with the exponent, so refuse to compute those
+    which would exceed the folding bounds.
+
+    :param base: The base.
+    :param exp: The exponent.
+
+    :returns: A ``True`` value if the operation may be folded.
+    """
+
+    if _is_int(base) and _is_int(exp) and exp > 0 and abs(base) > 1:
+        return abs(base).bit_length() * exp <= FOLD_MAX_BITS
+
+    return True
+
+
+def _mul_guard(lhs, rhs):
+    """
+    Guard constant folding of the ``*`` operator.  Refuse to repeat
+    sequences beyond the folding bounds.
+
+    :param lhs: The left-hand operand.
+    :param rhs: The right-hand operand.
+
+    :returns: A ``True`` value if the operation may be folded.
+    """
+
+    if _is_seq(lhs) and _is_int(rhs):
+        return len(lhs) * rhs <= FOLD_MAX_LENGTH
+    elif _is_int(lhs) and _is_seq(rhs):
+        return lhs * len(rhs) <= FOLD_MAX_LENGTH
+
+    return True
+
+
+def _lshift_guard(lhs, rhs):
+    """
+    Guard constant folding of the ``<<`` operator.  Refuse to shift
+    integers beyond the folding bounds.
+
+    :param lhs: The value to shift.
+    :param rhs: The number of bits to shift by.
+
+    :returns: A ``True`` value if the operation may be folded.
+    """
+
+    if _is_int(lhs) and _is_int(rhs):
+        return abs(lhs).bit_length() + rhs <= FOLD_MAX_BITS
+
+    return True
+
+
+def _mod_guard(lhs, rhs):
+    """
+    Guard constant folding of the ``%`` operator.  String formatting
+    can request arbitrary field widths, so it is never folded.
+
+    :param lhs: The left-hand operand.
+    :param rhs: The right-hand operand.
+
+    :returns: A ``True`` value if the operation may be folded.
+    """
+
+    return not isinstance(lhs, (six.string_types, six.binary_type))
+
+
 # The pop instruction
 pop = Pop()
 
@@ -1050,14 +1376,15 @@ neg_op = GenericOperator(1, operator.neg, '-')
 not_op = GenericOperator(1, operator.not_, 'not')
 
 # Binary operators
-pow_op = GenericOperator(2, operator.pow, '**')
-mul_op = GenericOperator(2, operator.mul, '*')
+pow_op = GenericOperator(2, operator.pow, '**', _pow_guard)
+mul_op = GenericOperator(2, operator.mul, '*', _mul_guard)
 true_div_op = GenericOperator(2, operator.truediv, '/')
 floor_div_op = GenericOperator(2, operator.floordiv, '//')
-mod_op = GenericOperator(2, operator.mod, '%')
+mod_op = GenericOperator(2, operator.mod, '%', _mod_guard)
 add_op = GenericOperator(2, operator.add, '+')
 sub_op = GenericOperator(2, operator.sub, '-')
-left_shift_op = GenericOperator(2, operator.lshift, '<<')
+left_shift_op = GenericOperator(2, operator.lshift, '<<',
+                                _lshift_guard)
 right_shift_op = GenericOperator(2, operator.rshift, '>>')
 bit_and_op = GenericOperator(2, operator.and_, '&')
 bit_xor_op = GenericOperator(2, operator.xor, '^')
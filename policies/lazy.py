@@ -0,0 +1,169 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import threading
+import timeit
+
+
+class Lazy(object):
+    """
+    A variable whose value is only computed if a rule reads it.  Pass
+    a ``Lazy`` in place of the value in the dictionary of variables;
+    the first time the variable is read during an evaluation, the
+    ``resolve()`` method is called, and its result is used for the
+    remainder of the evaluation, including the evaluation of nested
+    rules.  If ``resolve()`` raises an exception, the rule fails
+    closed.  Subclasses may override ``resolve()`` rather than
+    supplying a provider.
+    """
+
+    def __init__(self, provider=None):
+        """
+        Initialize a ``Lazy`` object.
+
+        :param provider: A callable taking no arguments which returns
+                         the value of the variable.
+        """
+
+        self.provider = provider
+
+    def __repr__(self):
+        """
+        Return a representation of this variable.
+
+        :returns: A string representation of this variable.
+        """
+
+        return '<%s %r>' % (self.__class__.__name__, self.provider)
+
+    def resolve(self):
+        """
+        Compute the value of the variable.
+
+        :returns: The value.
+        """
+
+        return self.provider()
+
+
+class LazyStats(object):
+    """
+    Statistics on the resolution of lazy variables, by variable name.
+    The ``counts``, ``errors``, ``total_time``, and ``max_time``
+    attributes are dictionaries mapping variable names to,
+    respectively, the number of times the variable was resolved, the
+    number of those times resolution raised an exception, and the
+    total and maximum times, in seconds, taken to resolve it.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``LazyStats`` object.
+        """
+
+        self._lock = threading.Lock()
+
+        self.counts = {}
+        self.errors = {}
+        self.total_time = {}
+        self.max_time = {}
+
+    def record(self, name, elapsed, failed=False):
+        """
+        Record the resolution of a lazy variable.
+
+        :param name: The name of the variable.
+        :param elapsed: The time, in seconds, taken to resolve it.
+        :param failed: If ``True``, resolution raised an exception.
+        """
+
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            self.total_time[name] = self.total_time.get(name, 0.0) + elapsed
+            self.max_time[name] = max(self.max_time.get(name, 0.0), elapsed)
+
+    def mean_time(self, name):
+        """
+        Compute the mean time taken to resolve a lazy variable.
+
+        :param name: The name of the variable.
+
+        :returns: The mean time, in seconds, or ``None`` if the
+                  variable has not been resolved.
+        """
+
+        with self._lock:
+            count = self.counts.get(name)
+            return self.total_time[name] / count if count else None
+
+    def reset(self):
+        """
+        Discard all the statistics.
+        """
+
+        with self._lock:
+            self.counts = {}
+            self.errors = {}
+            self.total_time = {}
+            self.max_time = {}
+
+
+def resolve(name, value, memo, stats=None):
+    """
+    Resolve the value of a variable, which may be a ``Lazy``.
+
+    :param name: The name of the variable.
+    :param value: The value from the dictionary of variables.
+    :param memo: A dictionary mapping variable names to the values of
+                 the lazy variables already resolved.  It is updated.
+    :param stats: An optional ``LazyStats`` to record the resolution
+                  in.
+
+    :returns: The value of the variable.  An awaitable, such as the
+              coroutine returned by the provider of an unfetched
+              ``policies.aio.AsyncLazy``, is always true, so rather
+              than returning one, the awaitable is closed and a
+              ``TypeError`` is raised, failing the rule closed.
+    """
+
+    if not isinstance(value, Lazy):
+        return value
+    elif name in memo:
+        return memo[name]
+
+    start = timeit.default_timer()
+    try:
+        result = value.resolve()
+        if hasattr(result, '__await__'):
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+            raise TypeError("Lazy variable %r resolved to an awaitable; "
+                            "use evaluate_async() to evaluate rules which "
+                            "read it" % name)
+    except Exception:
+        if stats is not None:
+            stats.record(name, timeit.default_timer() - start, True)
+        raise
+    if stats is not None:
+        stats.record(name, timeit.default_timer() - start)
+
+    memo[name] = result
+
+    return result
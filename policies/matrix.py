@@ -0,0 +1,651 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import six
+
+from policies import analysis
+from policies import columnar
+from policies import partial
+
+numpy = columnar.numpy
+
+
+# Flags describing which variables a subexpression depends on
+PRINCIPAL = 1
+RESOURCE = 2
+CONTEXT = 4
+
+
+class FactorError(Exception):
+    """
+    Raised by ``Factorizer`` when an expression cannot be split into
+    principal and resource subexpressions.
+    """
+
+    pass
+
+
+def _fail():
+    """
+    Stand in for a subexpression which raised an exception.
+
+    :raises ValueError: Always.
+    """
+
+    raise ValueError("subexpression raised an exception")
+
+
+def _value_key(value):
+    """
+    Compute a key for a value computed from the variables.  Unlike
+    the keys of ``policies.analysis.Const`` nodes, which use the
+    representation of the value, values with the same key are equal:
+    hashable values are keyed by type and value, and others by
+    identity.
+
+    :param value: The value.
+
+    :returns: A hashable key.
+    """
+
+    key = ('value', type(value), value)
+    try:
+        hash(key)
+    except TypeError:
+        return ('id', id(value))
+
+    return key
+
+
+def _node_key(node):
+    """
+    Compute a structural key for a node, like its ``key``, but keying
+    constants with ``_value_key()``.
+
+    :param node: The ``Node``.
+
+    :returns: A hashable key.
+    """
+
+    if isinstance(node, analysis.Const):
+        return ('Const', _value_key(node.value))
+
+    return (node.__class__.__name__,) + tuple(
+        _node_key(arg) if isinstance(arg, analysis.Node) else arg
+        for arg in node._flat_args())
+
+
+def substitute(node, mapping):
+    """
+    Replace references to variables in an expression tree.
+
+    :param node: The ``Node`` to rewrite.
+    :param mapping: A dictionary mapping identifiers to the ``Node``
+                    objects to replace references to them with.
+
+    :returns: The rewritten ``Node``.
+    """
+
+    if isinstance(node, analysis.Name):
+        return mapping.get(node.ident, node)
+
+    return node.rebuild([substitute(child, mapping)
+                         for child in node.children])
+
+
+class Factorizer(object):
+    """
+    Split an expression tree into atoms: the largest subexpressions
+    which depend only on the principal variables, or only on the
+    resource variables.  Each atom is replaced by a reference to a
+    placeholder variable, leaving a "joint" expression which combines
+    them.  The same atom appearing more than once is replaced by the
+    same placeholder.
+    """
+
+    def __init__(self, principal_names, resource_names):
+        """
+        Initialize a ``Factorizer`` object.
+
+        :param principal_names: A set of the names of the principal
+                                variables.
+        :param resource_names: A set of the names of the resource
+                               variables.
+        """
+
+        self.principal_names = frozenset(principal_names)
+        self.resource_names = frozenset(resource_names)
+
+        # Map atom keys to (placeholder, node) tuples
+        self.principal_atoms = {}
+        self.resource_atoms = {}
+
+        self._sides = {}
+
+    def sides(self, node):
+        """
+        Determine which variables a subexpression depends on.
+
+        :param node: The ``Node`` computing the subexpression.
+
+        :returns: A combination of the ``PRINCIPAL``, ``RESOURCE``,
+                  and ``CONTEXT`` flags.  ``CONTEXT`` is included if
+                  the subexpression calls a function which wants the
+                  evaluation context, since such functions can read
+                  any variable.
+        """
+
+        key = node.key
+        if key not in self._sides:
+            result = 0
+            if isinstance(node, analysis.Name):
+                if node.ident in self.principal_names:
+                    result = PRINCIPAL
+                elif node.ident in self.resource_names:
+                    result = RESOURCE
+            elif (isinstance(node, analysis.Call) and
+                  isinstance(node.func, analysis.Const) and
+                  getattr(node.func.value, '_policies_want_context',
+                          False)):
+                result = CONTEXT
+
+            for child in node.children:
+                result |= self.sides(child)
+
+            self._sides[key] = result
+
+        return self._sides[key]
+
+    def _atom(self, atoms, prefix, node):
+        """
+        Replace an atom by a reference to its placeholder.
+
+        :param atoms: The dictionary of atoms to add the atom to.
+        :param prefix: The prefix for the placeholder's name.
+        :param node: The ``Node`` computing the atom.
+
+        :returns: A ``Node`` referring to the placeholder.
+        """
+
+        if node.key not in atoms:
+            # Placeholders can't be spelled in a rule, so can't clash
+            atoms[node.key] = ('<%s %d>' % (prefix, len(atoms)), node)
+
+        return analysis.Name(atoms[node.key][0])
+
+    def __call__(self, node):
+        """
+        Factorize an expression tree.
+
+        :param node: The ``Node`` to factorize.
+
+        :returns: The joint ``Node``, referring to the placeholders
+                  of the atoms.
+
+        :raises FactorError: The expression calls a function which
+                             wants the evaluation context with
+                             arguments which could not be folded.
+        """
+
+        sides = self.sides(node)
+        if sides & CONTEXT:
+            raise FactorError("cannot factorize %r" % node)
+        elif sides == PRINCIPAL:
+            return self._atom(self.principal_atoms, 'principal', node)
+        elif sides == RESOURCE:
+            return self._atom(self.resource_atoms, 'resource', node)
+        elif not sides:
+            return node
+
+        return node.rebuild([self(child) for child in node.children])
+
+
+class _Evaluator(columnar.ColumnarEvaluator):
+    """
+    A ``ColumnarEvaluator`` for which some elements of the columns
+    stand for subexpressions which raised an exception.  Reading such
+    an element fails the row.
+    """
+
+    def __init__(self, policy, name, columns, failures, length):
+        """
+        Initialize an ``_Evaluator`` object.
+
+        :param policy: The ``Policy``.
+        :param name: The name of the rule being evaluated.
+        :param columns: A dictionary mapping variable names to numpy
+                        arrays.
+        :param failures: A dictionary mapping variable names to numpy
+                         arrays of booleans, ``True`` where reading
+                         the corresponding element fails.
+        :param length: The number of rows.
+        """
+
+        super(_Evaluator, self).__init__(policy, name, columns, {}, length)
+        self.failures = failures
+
+    def _eval_name(self, node, idx):
+        if node.ident in self.failures:
+            self.failed[idx[self.failures[node.ident][idx]]] = True
+
+        return super(_Evaluator, self)._eval_name(node, idx)
+
+    def per_row(self, node, idx):
+        """
+        Evaluate a node row by row using the stack interpreter.  For
+        rows in which some of the variables the node reads stand for
+        subexpressions which raised an exception, references to those
+        variables are replaced by a subexpression which raises an
+        exception, so the row fails only if the variable is read.
+
+        :param node: The ``Node`` to evaluate.
+        :param idx: A numpy array of the indices of the rows.
+
+        :returns: A numpy array of the results.
+        """
+
+        names = sorted(set(
+            child.ident for child in node.walk()
+            if isinstance(child, analysis.Name) and
+            child.ident in self.failures))
+        if not names:
+            return super(_Evaluator, self).per_row(node, idx)
+
+        # Group the rows by which of the variables failed
+        patterns = {}
+        for i, row in enumerate(idx.tolist()):
+            pattern = tuple(name for name in names
+                            if self.failures[name][row])
+            patterns.setdefault(pattern, []).append(i)
+
+        failed = analysis.Call(analysis.Const(_fail), [])
+        result = numpy.empty(len(idx), dtype=object)
+        for pattern, positions in patterns.items():
+            positions = numpy.array(positions, dtype=int)
+            values = super(_Evaluator, self).per_row(
+                substitute(node, dict((name, failed) for name in pattern)),
+                idx[positions])
+            for position, value in zip(positions.tolist(),
+                                       values.tolist()):
+                result[position] = value
+
+        return columnar.column(result.tolist())
+
+
+class AuthorizationMatrix(object):
+    """
+    The results of evaluating a rule for every combination of a list
+    of principals and a list of resources.  The results for each
+    principal are stored as a row of bits, one for each resource;
+    principals with identical results share a row.  The ``shape``
+    attribute is a tuple of the numbers of principals and resources.
+    """
+
+    def __init__(self, shape, rows, index):
+        """
+        Initialize an ``AuthorizationMatrix`` object.
+
+        :param shape: A tuple of the number of principals and the
+                      number of resources.
+        :param rows: A list of the distinct rows, each a numpy array
+                     of bytes packed by ``numpy.packbits()``.
+        :param index: A numpy array giving the index in ``rows`` of
+                      the row for each principal.
+        """
+
+        self.shape = shape
+        self.rows = rows
+        self.index = index
+
+    def __getitem__(self, position):
+        """
+        Determine whether the rule allows a principal access to a
+        resource.
+
+        :param position: A tuple of the index of the principal and
+                         the index of the resource.
+
+        :returns: A ``True`` value if the rule succeeded, ``False``
+                  otherwise.
+        """
+
+        principal, resource = position
+        if not 0 <= resource < self.shape[1]:
+            raise IndexError("resource index out of range")
+
+        row = self.rows[self.index[principal]]
+        return bool(row[resource >> 3] & (0x80 >> (resource & 7)))
+
+    def __iter__(self):
+        """
+        Iterate over the allowed combinations.
+
+        :returns: An iterator over tuples of the index of a principal
+                  and the index of a resource, in order.
+        """
+
+        for principal in six.moves.range(self.shape[0]):
+            for resource in self.allowed(principal).tolist():
+                yield principal, resource
+
+    def packed(self, principal):
+        """
+        Retrieve the results for a principal as a string of bits.
+
+        :param principal: The index of the principal.
+
+        :returns: A byte string with one bit for each resource, most
+                  significant bit first; the bit is set if the rule
+                  succeeded.
+        """
+
+        return self.rows[self.index[principal]].tobytes()
+
+    def row(self, principal):
+        """
+        Retrieve the results for a principal.
+
+        :param principal: The index of the principal.
+
+        :returns: A numpy array of booleans, one for each resource,
+                  which are ``True`` where the rule succeeded.
+        """
+
+        return numpy.unpackbits(self.rows[self.index[principal]],
+                                count=self.shape[1]).astype(bool)
+
+    def allowed(self, principal):
+        """
+        Retrieve the resources a principal is allowed access to.
+
+        :param principal: The index of the principal.
+
+        :returns: A numpy array of the indices of the resources for
+                  which the rule succeeded.
+        """
+
+        return numpy.flatnonzero(self.row(principal))
+
+    def count(self):
+        """
+        Count the allowed combinations.
+
+        :returns: The number of combinations for which the rule
+                  succeeded.
+        """
+
+        users = numpy.bincount(self.index, minlength=len(self.rows))
+        return sum(int(numpy.unpackbits(row).sum()) * int(n)
+                   for row, n in zip(self.rows, users))
+
+    def toarray(self):
+        """
+        Construct a dense array of the results.
+
+        :returns: A two-dimensional numpy array of booleans, with one
+                  row for each principal and one column for each
+                  resource.
+        """
+
+        if not self.rows:
+            return numpy.zeros(self.shape, dtype=bool)
+
+        rows = numpy.unpackbits(numpy.array(self.rows), axis=1,
+                                count=self.shape[1]).astype(bool)
+        return rows[self.index]
+
+
+def _columns(policy, dicts, names, variables):
+    """
+    Construct columns of values from a list of dictionaries of
+    variables.
+
+    :param policy: The ``Policy``.
+    :param dicts: A list of dictionaries of variables.
+    :param names: A set of the names of the variables.
+    :param variables: A dictionary of variables which are shared;
+                      these supply the values of variables missing
+                      from some of the dictionaries.
+
+    :returns: A dictionary mapping variable names to numpy arrays.
+    """
+
+    result = {}
+    for name in names:
+        default = (variables[name] if name in variables else
+                   policy.resolve(name))
+        result[name] = columnar.column([values.get(name, default)
+                                        for values in dicts])
+
+    return result
+
+
+def _atoms(evaluator, atoms, length):
+    """
+    Compute the values of atoms for every row.
+
+    :param evaluator: The ``ColumnarEvaluator``.
+    :param atoms: A dictionary of atoms from ``Factorizer``.
+    :param length: The number of rows.
+
+    :returns: A tuple of a dictionary mapping placeholders to numpy
+              arrays of values, and a dictionary mapping placeholders
+              to numpy arrays of booleans, ``True`` for rows where
+              computing the atom raised an exception.
+    """
+
+    idx = numpy.arange(length)
+    values = {}
+    failures = {}
+    for placeholder, node in atoms.values():
+        evaluator.failed[:] = False
+        values[placeholder] = evaluator(node, idx)
+        if evaluator.failed.any():
+            failures[placeholder] = evaluator.failed.copy()
+
+    return values, failures
+
+
+def evaluate(policy, name, principals, resources, variables=None):
+    """
+    Evaluate a named rule for every combination of a principal and a
+    resource.  The rule is split into atoms which depend only on the
+    principal variables, atoms which depend only on the resource
+    variables, and a joint expression combining them.  Each principal
+    atom is computed once for each principal, and each resource atom
+    once for each resource.  Principals for which all the principal
+    atoms have the same values share the joint expression, which is
+    partially evaluated with those values and then evaluated for all
+    the resources at once by a ``ColumnarEvaluator``.  Rules which
+    call functions wanting the evaluation context with arguments
+    which can't be folded, such as ``rule()`` with a variable name,
+    are evaluated for each combination individually.
+
+    :param policy: The ``Policy``.
+    :param name: The name of the rule to evaluate.
+    :param principals: A list of dictionaries of the variables
+                       describing each principal.
+    :param resources: A list of dictionaries of the variables
+                      describing each resource.  A variable may not
+                      describe both principals and resources.
+    :param variables: An optional dictionary of variables with the
+                      same value for all combinations.
+
+    :returns: An instance of ``AuthorizationMatrix``.
+    """
+
+    if numpy is None:  # pragma: nocover
+        raise ImportError("numpy is required for matrix evaluation")
+
+    principals = list(principals)
+    resources = list(resources)
+    shape = (len(principals), len(resources))
+    principal_names = set(key for values in principals for key in values)
+    resource_names = set(key for values in resources for key in values)
+    if principal_names & resource_names:
+        raise ValueError("variables %s describe both principals and "
+                         "resources" %
+                         ', '.join(sorted(principal_names & resource_names)))
+
+    # Fold everything which is the same for all combinations
+    variables = variables or {}
+    fixed = dict(variables)
+    for var in principal_names | resource_names:
+        fixed.pop(var, None)
+    residual = partial.Residual(policy, name, policy._lookup(name)[0], {},
+                                fixed, principal_names | resource_names)
+
+    if residual.decision is not None:
+        row = numpy.packbits(numpy.full(shape[1], residual.decision))
+        return AuthorizationMatrix(shape, [row],
+                                   numpy.zeros(shape[0], dtype=int))
+
+    factorizer = Factorizer(principal_names, resource_names)
+    try:
+        if residual.expr is None:
+            raise FactorError("cannot analyze rule %r" % name)
+        checks = [factorizer(residual.expr)] + [
+            factorizer(node) for _attr, node in residual.attrs
+            if not isinstance(node, analysis.Const)]
+    except FactorError:
+        return _evaluate_pairs(policy, name, principals, resources,
+                               variables)
+
+    # Compute the atoms for each side
+    columns = _columns(policy, principals, principal_names, variables)
+    evaluator = columnar.ColumnarEvaluator(policy, name, columns, fixed,
+                                           shape[0])
+    principal_values, principal_failures = _atoms(
+        evaluator, factorizer.principal_atoms, shape[0])
+    columns = _columns(policy, resources, resource_names, variables)
+    evaluator = columnar.ColumnarEvaluator(policy, name, columns, fixed,
+                                           shape[1])
+    resource_values, resource_failures = _atoms(
+        evaluator, factorizer.resource_atoms, shape[1])
+    principal_values = dict((placeholder, values.tolist())
+                            for placeholder, values
+                            in principal_values.items())
+
+    folder = partial.Folder(policy, {}, name, resource_values)
+    failed = analysis.Call(analysis.Const(_fail), [])
+    placeholders = sorted(principal_values)
+    idx = numpy.arange(shape[1])
+    groups = {}
+    rows = []
+    row_index = {}
+    index = numpy.zeros(shape[0], dtype=int)
+    for principal in six.moves.range(shape[0]):
+        mapping = {}
+        for placeholder in placeholders:
+            if (placeholder in principal_failures and
+                    principal_failures[placeholder][principal]):
+                mapping[placeholder] = failed
+            else:
+                mapping[placeholder] = analysis.Const(
+                    principal_values[placeholder][principal])
+
+        # Principals with the same atom values share a row; values
+        # which merely look the same must not
+        group = tuple(_node_key(mapping[placeholder])
+                      for placeholder in placeholders)
+        if group not in groups:
+            folded = [folder(substitute(checks[0], mapping), True)] + [
+                folder(substitute(node, mapping)) for node in checks[1:]]
+            key = tuple(_node_key(node) for node in folded)
+            if key not in row_index:
+                row_index[key] = len(rows)
+                rows.append(_evaluate_row(policy, name, folded,
+                                          resource_values,
+                                          resource_failures, idx))
+            groups[group] = row_index[key]
+        index[principal] = groups[group]
+
+    return AuthorizationMatrix(shape, rows, index)
+
+
+def _evaluate_row(policy, name, checks, columns, failures, idx):
+    """
+    Evaluate the joint expression for a group of principals against
+    all the resources.
+
+    :param policy: The ``Policy``.
+    :param name: The name of the rule.
+    :param checks: A list of the folded joint ``Node`` objects.  The
+                   first computes the result of the rule; the
+                   remainder compute authorization attributes, and
+                   need only succeed.
+    :param columns: A dictionary mapping resource placeholders to
+                    numpy arrays of the values of the resource atoms.
+    :param failures: A dictionary mapping resource placeholders to
+                     numpy arrays of booleans, ``True`` for resources
+                     for which computing the atom raised an exception.
+    :param idx: A numpy array of the indices of the resources.
+
+    :returns: A numpy array of the results, packed by
+              ``numpy.packbits()``.
+    """
+
+    evaluator = _Evaluator(policy, name, columns, failures, len(idx))
+    mask = evaluator.truth(evaluator(checks[0], idx), idx)
+
+    # Computing an authorization attribute could fail
+    for node in checks[1:]:
+        evaluator(node, idx[~evaluator.failed])
+
+    return numpy.packbits(mask & ~evaluator.failed)
+
+
+def _evaluate_pairs(policy, name, principals, resources, variables):
+    """
+    Evaluate a named rule for every combination of a principal and a
+    resource, one combination at a time.
+
+    :param policy: The ``Policy``.
+    :param name: The name of the rule to evaluate.
+    :param principals: A list of dictionaries of the variables
+                       describing each principal.
+    :param resources: A list of dictionaries of the variables
+                      describing each resource.
+    :param variables: A dictionary of variables with the same value
+                      for all combinations.
+
+    :returns: An instance of ``AuthorizationMatrix``.
+    """
+
+    def combine(principal, resource):
+        result = dict(variables)
+        result.update(principal)
+        result.update(resource)
+        return result
+
+    rows = []
+    row_index = {}
+    index = numpy.zeros(len(principals), dtype=int)
+    for i, principal in enumerate(principals):
+        bitmap = policy.evaluate_many(
+            name, (combine(principal, resource) for resource in resources),
+            bitmap=True)
+        row = numpy.packbits(numpy.frombuffer(bytes(bitmap),
+                                              dtype=numpy.uint8))
+        key = row.tobytes()
+        if key not in row_index:
+            row_index[key] = len(rows)
+            rows.append(row)
+        index[i] = row_index[key]
+
+    return AuthorizationMatrix((len(principals), len(resources)), rows,
+                               index)
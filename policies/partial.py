@@ -0,0 +1,354 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import six
+
+from policies import analysis
+from policies import authorization
+from policies import engines
+from policies import instructions
+from policies import lazy
+
+
+# Residual rules are always executed by the reference engine
+_engine = engines.StackEngine()
+
+
+class Folder(object):
+    """
+    Fold the parts of expression trees which can be computed from a
+    set of known variables.  Identifiers which are not known
+    variables are resolved through the ``Policy``; those which do not
+    resolve are the unknowns.  Calls to ``rule()`` with a constant
+    name are replaced by the folded expression of the nested rule.
+
+    Subexpressions which raise an exception while being folded are
+    left in place, so that the exception is raised, and the rule
+    fails closed, when the residual is evaluated.  As with the
+    caching of rules, functions called by the rules are assumed to
+    return the same values when called with the same arguments.
+    """
+
+    def __init__(self, policy, variables, name=None, unknowns=()):
+        """
+        Initialize a ``Folder`` object.
+
+        :param policy: The ``Policy`` the rules belong to.
+        :param variables: A dictionary of the known variables.
+        :param name: The name of the rule being folded, if any.  Calls
+                     to it from nested rules are recursive, and are
+                     not folded.
+        :param unknowns: A sequence of the names of unknown variables
+                         which are not to be resolved through the
+                         ``Policy``, even if a builtin or entrypoint
+                         has the same name.
+        """
+
+        self.policy = policy
+        self.variables = variables
+        self.unknowns = frozenset(unknowns)
+
+        self._rule_func = policy.resolve('rule')
+        self._lazy = {}
+        self._rules = {}
+        self._active = set() if name is None else set([name])
+
+    def rule(self, name, boolean=False):
+        """
+        Fold the expression of a nested rule.
+
+        :param name: The name of the rule.
+        :param boolean: If ``True``, only the truth value of the
+                        result is significant.
+
+        :returns: The folded ``Node``, or ``None`` if the rule cannot
+                  be folded.
+        """
+
+        key = (name, boolean)
+        if key not in self._rules:
+            try:
+                rule = self.policy[name]
+            except KeyError:
+                # rule() evaluates a missing rule as False
+                return analysis.Const(False)
+
+            try:
+                expr = analysis.decompile(rule.instructions)[0]
+            except analysis.DecompileError:
+                return None
+
+            self._active.add(name)
+            try:
+                self._rules[key] = self(expr, boolean)
+            finally:
+                self._active.discard(name)
+
+        return self._rules[key]
+
+    def __call__(self, node, boolean=False):
+        """
+        Fold an expression tree.
+
+        :param node: The ``Node`` to fold.
+        :param boolean: If ``True``, only the truth value of the
+                        result is significant, which permits some
+                        additional simplifications.
+
+        :returns: The folded ``Node``.  If the result is an instance
+                  of ``policies.analysis.Const``, the expression does
+                  not depend on the unknowns.
+        """
+
+        method = getattr(self, '_fold_%s' % node.__class__.__name__.lower())
+        return method(node, boolean)
+
+    def _fold_const(self, node, boolean):
+        return node
+
+    def _fold_name(self, node, boolean):
+        if node.ident in self.variables:
+            try:
+                return analysis.Const(lazy.resolve(
+                    node.ident, self.variables[node.ident], self._lazy))
+            except Exception:
+                # Leave the failure to the evaluation
+                return node
+        elif node.ident in self.unknowns:
+            return node
+
+        value = self.policy.resolve(node.ident)
+        if value is not None:
+            return analysis.Const(value)
+
+        return node
+
+    def _fold_attr(self, node, boolean):
+        obj = self(node.obj)
+        if isinstance(obj, analysis.Const):
+            try:
+                return analysis.Const(getattr(obj.value, node.attribute))
+            except Exception:
+                pass
+
+        return analysis.Attr(obj, node.attribute)
+
+    def _fold_op(self, node, boolean):
+        args = [self(arg) for arg in node.args]
+        if all(isinstance(arg, analysis.Const) for arg in args):
+            try:
+                return analysis.Const(
+                    node.operator.op(*[arg.value for arg in args]))
+            except Exception:
+                pass
+
+        return analysis.Op(node.operator, args)
+
+    def _fold_call(self, node, boolean):
+        func = self(node.func)
+        args = [self(arg) for arg in node.args]
+
+        if (isinstance(func, analysis.Const) and
+                all(isinstance(arg, analysis.Const) for arg in args)):
+            if getattr(func.value, '_policies_want_context', False):
+                # Only rule() is understood; inline the nested rule
+                if (func.value is self._rule_func and len(args) == 1 and
+                        isinstance(args[0].value, six.string_types) and
+                        args[0].value not in self._active):
+                    result = self.rule(args[0].value, boolean)
+                    if result is not None:
+                        return result
+            else:
+                try:
+                    value = func.value(*[arg.value for arg in args])
+                    if hasattr(value, '__await__'):
+                        # Leave it to the interpreter to await
+                        instructions._reject_awaitable(func.value, value)
+                    return analysis.Const(value)
+                except Exception:
+                    pass
+
+        return analysis.Call(func, args)
+
+    def _fold_and(self, node, boolean):
+        lhs = self(node.lhs, boolean)
+        if isinstance(lhs, analysis.Const):
+            return self(node.rhs, boolean) if lhs.value else lhs
+
+        rhs = self(node.rhs, boolean)
+        if boolean and isinstance(rhs, analysis.Const) and rhs.value:
+            return lhs
+
+        return analysis.And(lhs, rhs)
+
+    def _fold_or(self, node, boolean):
+        lhs = self(node.lhs, boolean)
+        if isinstance(lhs, analysis.Const):
+            return lhs if lhs.value else self(node.rhs, boolean)
+
+        rhs = self(node.rhs, boolean)
+        if boolean and isinstance(rhs, analysis.Const) and not rhs.value:
+            return lhs
+
+        return analysis.Or(lhs, rhs)
+
+    def _fold_cond(self, node, boolean):
+        cond = self(node.cond, True)
+        if isinstance(cond, analysis.Const):
+            return self(node.if_true if cond.value else node.if_false,
+                        boolean)
+
+        return analysis.Cond(cond, self(node.if_true, boolean),
+                             self(node.if_false, boolean))
+
+
+class Residual(object):
+    """
+    The residue of a rule after partial evaluation: the rule with
+    everything which can be computed from a set of known variables
+    folded away, leaving only the parts which depend on the remaining
+    unknown variables.  The ``expr`` attribute is the folded
+    ``policies.analysis.Node`` computing the result, or ``None`` if
+    the rule could not be analyzed; ``attrs`` is a list of (name,
+    ``Node``) tuples computing the authorization attributes; and
+    ``instructions`` is the compiled residual rule.
+    """
+
+    def __init__(self, policy, name, rule, attrs, variables, unknowns=()):
+        """
+        Initialize a ``Residual`` object.
+
+        :param policy: The ``Policy`` the rule belongs to.
+        :param name: The name of the rule.
+        :param rule: The ``Rule``, or ``None`` if the rule does not
+                     exist.
+        :param attrs: A dictionary of authorization attribute default
+                      values.
+        :param variables: A dictionary of the known variables.
+        :param unknowns: A sequence of the names of unknown variables
+                         which are not to be resolved through the
+                         ``Policy``; see ``Folder``.
+        """
+
+        self.policy = policy
+        self.name = name
+        self.defaults = attrs
+        self.variables = variables
+
+        if rule is None:
+            # Missing rules always deny
+            self.expr = analysis.Const(False)
+            self.attrs = []
+            self.instructions = None
+            return
+
+        try:
+            expr, attrs = analysis.decompile(rule.instructions)
+        except analysis.DecompileError:
+            # Evaluate the original rule
+            self.expr = None
+            self.attrs = []
+            self.instructions = rule.instructions
+            return
+
+        folder = Folder(policy, variables, name, unknowns)
+        self.expr = folder(expr, True)
+        self.attrs = [(attr, folder(node)) for attr, node in attrs]
+        self.instructions = analysis.compile_rule(self.expr, self.attrs)
+
+    @property
+    def decision(self):
+        """
+        The result of the rule if it does not depend on the unknown
+        variables: ``True`` if the rule always allows, or ``False`` if
+        it always denies.  If the result depends on the unknowns, this
+        is ``None``.
+        """
+
+        if not isinstance(self.expr, analysis.Const):
+            return None
+        elif not self.expr.value:
+            return False
+
+        # An exception while computing an attribute denies
+        if all(isinstance(node, analysis.Const) for _attr, node in self.attrs):
+            return True
+
+        return None
+
+    @property
+    def constant(self):
+        """
+        A ``True`` value if the rule collapsed to a constant allow or
+        deny.
+        """
+
+        return self.decision is not None
+
+    def _variables(self, variables):
+        """
+        Combine the known variables with the values of the unknowns.
+        Parts of the rule which could not be folded may still refer to
+        the known variables.
+
+        :param variables: A dictionary of the values of the unknowns.
+
+        :returns: A dictionary of all the variables.
+        """
+
+        result = dict(self.variables)
+        result.update(variables or {})
+        return result
+
+    def evaluate(self, variables=None):
+        """
+        Evaluate the residual rule.
+
+        :param variables: A dictionary of the values of the unknown
+                          variables.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        if self.instructions is None:
+            return authorization.Authorization(False)
+
+        return _engine.evaluate(self.policy, self.name, self.instructions,
+                                self.defaults, self._variables(variables))
+
+    def evaluate_many(self, variables_iter):
+        """
+        Evaluate the residual rule once for each of a sequence of sets
+        of values of the unknown variables.
+
+        :param variables_iter: An iterable of dictionaries of the
+                               values of the unknown variables.
+
+        :returns: An iterator over instances of
+                  ``policies.authorization.Authorization``, one for
+                  each set of variables, in order.
+        """
+
+        if self.instructions is None:
+            return (authorization.Authorization(False)
+                    for _variables in variables_iter)
+
+        return _engine.evaluate_many(
+            self.policy, self.name, self.instructions, self.defaults,
+            (self._variables(variables) for variables in variables_iter))
@@ -16,14 +16,24 @@
 
 import collections
 import contextlib
+import itertools
 import logging
 import sys
+import threading
 
-import pkg_resources
 import six
 
 from policies import authorization
+from policies import columnar
+from policies import engines
+from policies import entrypoints
+from policies import hoist
+from policies import lazy
+from policies import matrix
+from policies import partial as partial_mod
 from policies import rules
+from policies import shared
+from policies import warmup
 
 
 class PolicyException(Exception):
@@ -71,14 +81,24 @@ class PolicyContext(object):
         self._pc = []
         self._step = []
 
-        # Add a cache for rules
+        # Add a cache for rules, one for memoized subexpressions, and
+        # one for the results of calls to pure functions
         self.rule_cache = {}
+        self.memo = {}
+        self.call_cache = {}
+
+        # The values of the lazy variables read so far
+        self.lazy_cache = {}
 
         # Used to keep track of error reporting, to ensure that an
         # exception raised at one level of nesting isn't reported
         # multiple times
         self.reported = False
 
+        # When set to a policies.cache.Trace, records what the
+        # evaluation reads
+        self.trace = None
+
     def resolve(self, symbol):
         """
         Resolve a symbol encountered during a rule evaluation into the
@@ -89,15 +109,61 @@ class PolicyContext(object):
         :returns: The value of that symbol.  If the symbol was not
                   declared in the ``variables`` parameter of the
                   constructor, a call will be made to the ``Policy``'s
-                  ``resolve()`` method.
+                  ``resolve()`` method.  Variables whose values are
+                  ``policies.lazy.Lazy`` objects are resolved the
+                  first time they are read, and the result is saved
+                  in ``lazy_cache``.
         """
 
         # Try the variables first
         if symbol in self.variables:
-            return self.variables[symbol]
+            value = self.variables[symbol]
+            if isinstance(value, lazy.Lazy):
+                value = lazy.resolve(symbol, value, self.lazy_cache,
+                                     getattr(self.policy, 'lazy_stats',
+                                             None))
+            return value
 
         return self.policy.resolve(symbol)
 
+    def reset(self, name, variables, clear_caches=True):
+        """
+        Prepare the context for a new top-level evaluation of a rule,
+        discarding all state left by any previous evaluation.  This
+        allows a single context to be used to evaluate a rule against
+        many sets of variables.  Subclasses which maintain additional
+        per-evaluation state should extend this method to reset it.
+
+        :param name: The name of the rule to be evaluated.
+        :param variables: A dictionary of variables to be defined for
+                          the evaluation.
+        :param clear_caches: If ``False``, the ``rule_cache``,
+                             ``memo``, ``call_cache``, and
+                             ``lazy_cache`` dictionaries are
+                             preserved.
+                             This is only appropriate when the
+                             variables are unchanged, and allows
+                             several rules to share the results of
+                             nested rules and common subexpressions.
+        """
+
+        self.variables = variables
+
+        self.stack = []
+        self.authz = None
+        self.reported = False
+
+        if clear_caches:
+            self.rule_cache = {}
+            self.memo = {}
+            self.call_cache = {}
+            self.lazy_cache = {}
+
+        # Set up the program counter for the rule
+        self._name = [name]
+        self._pc = [0]
+        self._step = [1]
+
     @contextlib.contextmanager
     def push_rule(self, name):
         """
@@ -263,7 +329,14 @@ class Policy(collections.MutableMapping):
     # The context class to use
     context_class = PolicyContext
 
-    def __init__(self, group=None, builtins=None):
+    # The evaluation engine class to use
+    engine_class = engines.StackEngine
+
+    # The maximum number of rule sets to prepare for evaluate_all()
+    max_shared = 32
+
+    def __init__(self, group=None, builtins=None, engine=None,
+                 decision_cache=None, coalescer=None):
         """
         Initialize a ``Policy`` object.
 
@@ -277,23 +350,64 @@ class Policy(collections.MutableMapping):
                          entrypoint group.  If not provided, a default
                          of select Python builtins will be used
                          instead.
+        :param engine: An instance of ``policies.engines.Engine`` to
+                       use for compiling and evaluating rules.  If not
+                       provided, an instance of ``engine_class`` will
+                       be used.
+        :param decision_cache: An optional instance of
+                               ``policies.cache.DecisionCache`` to
+                               cache the results of ``evaluate()``.
+                               It is bound to this ``Policy``, and
+                               may not be shared with another.
+        :param coalescer: An optional instance of
+                          ``policies.aio.Coalescer`` to coalesce
+                          identical concurrent calls to
+                          ``evaluate_async()``.
         """
 
-        # Save the entrypoint group
+        # Save the entrypoint group and the engine
         self._group = group
+        self._entrypoints = (None if group is None else
+                             entrypoints.EntryPointIndex(group))
+        self.engine = engine or self.engine_class()
 
         # Set up the mappings
         self._defaults = {}
         self._docs = {}
         self._rules = {}
 
-        # Seed the resolve cache
-        if builtins is None:
-            builtins = self.builtins
-        self._resolve_cache = builtins.copy()
+        # Rule sets prepared for evaluate_all()
+        self._shared = {}
+
+        # Changed whenever the rules change, invalidating the cache
+        self._generation = 0
+        self.decision_cache = decision_cache
+        self.coalescer = coalescer
+        if decision_cache is not None:
+            decision_cache.bind(self)
+
+        # Statistics on the resolution of lazy variables
+        self.lazy_stats = lazy.LazyStats()
+
+        # Seed the resolve cache; the lock serializes only cache
+        # misses, and is never taken for symbols already resolved
+        self._builtins = self.builtins if builtins is None else builtins
+        self._resolve_cache = self._seed_cache()
+        self._resolve_lock = threading.Lock()
+
+    def _seed_cache(self):
+        """
+        Construct a fresh resolve cache, containing only the builtins.
+
+        :returns: A dictionary to use as the resolve cache.
+        """
+
+        cache = self._builtins.copy()
 
         # Add the default rule
-        self._resolve_cache.setdefault('rule', rule)
+        cache.setdefault('rule', rule)
+
+        return cache
 
     def __getitem__(self, key):
         """
@@ -306,12 +420,14 @@ class Policy(collections.MutableMapping):
         """
 
         # Check to see if the rule has been set
-        if key in self._rules:
-            return self._rules[key]
+        rule = self._get_rule(key)
+        if rule is not None:
+            return rule
 
         # If it's been declared, return the default
-        if key in self._defaults:
-            return self._defaults[key]
+        default = self._get_default(key)
+        if default is not None:
+            return default
 
         raise KeyError(key)
 
@@ -334,6 +450,7 @@ class Policy(collections.MutableMapping):
                                   (key, rule.name))
 
         self._rules[key] = rule
+        self._generation += 1
 
     def __delitem__(self, key):
         """
@@ -343,6 +460,7 @@ class Policy(collections.MutableMapping):
         """
 
         del self._rules[key]
+        self._generation += 1
 
     def __iter__(self):
         """
@@ -384,6 +502,7 @@ class Policy(collections.MutableMapping):
 
         self._defaults[name] = rules.Rule(name, text, attrs)
         self._docs[name] = rules.RuleDoc(name, doc, attr_docs)
+        self._generation += 1
 
         return self._defaults[name]
 
@@ -395,6 +514,7 @@ class Policy(collections.MutableMapping):
         """
 
         self._rules[rule.name] = rule
+        self._generation += 1
 
     def del_rule(self, rule):
         """
@@ -405,6 +525,16 @@ class Policy(collections.MutableMapping):
         """
 
         del self._rules[rule.name]
+        self._generation += 1
+
+    @property
+    def generation(self):
+        """
+        A number which increases whenever a rule is set, deleted, or
+        declared, or the entrypoints are invalidated.
+        """
+
+        return self._generation
 
     def get_doc(self, name):
         """
@@ -419,11 +549,13 @@ class Policy(collections.MutableMapping):
                   for the rule.
         """
 
-        # Create one if there isn't one already
-        if name not in self._docs:
-            self._docs[name] = rules.RuleDoc(name)
+        # Create one if there isn't one already; setdefault() ensures
+        # that concurrent callers all get the same object
+        doc = self._get_doc(name)
+        if doc is None:
+            doc = self._docs.setdefault(name, rules.RuleDoc(name))
 
-        return self._docs[name]
+        return doc
 
     def get_docs(self):
         """
@@ -450,7 +582,7 @@ class Policy(collections.MutableMapping):
                   ``name``.
         """
 
-        return name in self._defaults
+        return self._get_default(name) is not None
 
     def get_default(self, name):
         """
@@ -462,7 +594,48 @@ class Policy(collections.MutableMapping):
         :returns: The ``Rule`` object describing the default rule.
         """
 
-        return self._defaults[name]
+        default = self._get_default(name)
+        if default is None:
+            raise KeyError(name)
+
+        return default
+
+    def _get_rule(self, name):
+        """
+        Retrieve the ``Rule`` set with a given name.
+
+        :param name: The name of the rule.
+
+        :returns: The ``Rule`` object, or ``None`` if no rule has been
+                  set with that name.
+        """
+
+        return self._rules.get(name)
+
+    def _get_default(self, name):
+        """
+        Retrieve the default ``Rule`` declared with a given name.
+
+        :param name: The name of the rule.
+
+        :returns: The default ``Rule`` object, or ``None`` if the rule
+                  has not been declared.
+        """
+
+        return self._defaults.get(name)
+
+    def _get_doc(self, name):
+        """
+        Retrieve the ``RuleDoc`` for a given name, without creating
+        one.
+
+        :param name: The name of the rule.
+
+        :returns: The ``RuleDoc`` object, or ``None`` if there is no
+                  documentation for the rule.
+        """
+
+        return self._docs.get(name)
 
     def resolve(self, symbol):
         """
@@ -475,30 +648,45 @@ class Policy(collections.MutableMapping):
                   constructor, will return ``None``.
         """
 
-        # Search for a corresponding symbol
-        if symbol not in self._resolve_cache:
-            result = None
+        # Fast path: the symbol has already been resolved
+        cache = self._resolve_cache
+        if symbol in cache:
+            return cache[symbol]
+
+        with self._resolve_lock:
+            # Another thread may have resolved it while we waited
+            cache = self._resolve_cache
+            if symbol not in cache:
+                result = None
 
-            # Search through entrypoints only if we have a group
-            if self._group is not None:
-                for ep in pkg_resources.iter_entry_points(self._group, symbol):
-                    try:
-                        result = ep.load()
-                    except (ImportError, AttributeError,
-                            pkg_resources.UnknownExtra):
-                        continue
+                # Search through entrypoints only if we have a group
+                if self._entrypoints is not None:
+                    result = self._entrypoints.load(symbol)
 
-                    # We found the result we were looking for
-                    break
+                # Cache the result
+                cache[symbol] = result
 
-            # Cache the result
-            self._resolve_cache[symbol] = result
+            return cache[symbol]
 
-        return self._resolve_cache[symbol]
+    def invalidate_entrypoints(self):
+        """
+        Discard all symbols resolved using the entrypoint group, and
+        arrange for the entrypoint group to be rescanned the next
+        time an unknown symbol is resolved.  This should be called
+        when plugins have been installed or removed.
+        """
+
+        with self._resolve_lock:
+            if self._entrypoints is not None:
+                self._entrypoints.invalidate()
+
+            self._resolve_cache = self._seed_cache()
+            self._generation += 1
 
     def evaluate(self, name, variables=None):
         """
-        Evaluate a named rule.
+        Evaluate a named rule.  If a ``decision_cache`` is set, a
+        cached result is returned if available.
 
         :param name: The name of the rule to evaluate.
         :param variables: An optional dictionary of variables to make
@@ -510,13 +698,333 @@ class Policy(collections.MutableMapping):
                   any authorization attributes.
         """
 
+        if self.decision_cache is not None:
+            return self.decision_cache.evaluate(self, name, variables or {},
+                                                self._evaluate)
+
+        return self._evaluate(name, variables)
+
+    def _evaluate(self, name, variables):
+        """
+        Evaluate a named rule, bypassing the ``decision_cache``.
+
+        :param name: The name of the rule to evaluate.
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rule.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        # Get the rule and its attribute defaults
+        rule, attrs = self._lookup(name)
+
+        # Short-circuit if we don't have either
+        if rule is None:
+            return authorization.Authorization(False)
+
+        # Compile and evaluate the rule
+        return self.engine.evaluate(self, name, self.engine.compile(rule),
+                                    attrs, variables or {})
+
+    def evaluate_async(self, name, variables=None, timeout=None):
+        """
+        Evaluate a named rule from ``asyncio`` code.  This requires
+        Python 3.5 or later.  Evaluation is suspended whenever a
+        policy function called by the rule, or by any rule it calls,
+        returns an awaitable, such as a coroutine, and resumed with
+        the awaited result.  Before evaluation, the variables which
+        are ``policies.aio.AsyncLazy`` objects or awaitables, and
+        which the rule may read, are resolved concurrently; see
+        ``policies.aio.prefetch()``.  The ``decision_cache`` is not
+        consulted; if a ``coalescer`` is set, an identical evaluation
+        already in progress is waited for instead.
+
+        :param name: The name of the rule to evaluate.
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rule.
+        :param timeout: An optional limit, in seconds, on the time to
+                        wait for the variables.
+
+        :returns: An awaitable yielding an instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        if self.coalescer is not None:
+            return self.coalescer.evaluate(
+                self, name, variables or {},
+                lambda name, variables: self._evaluate_async(
+                    name, variables, timeout))
+
+        return self._evaluate_async(name, variables, timeout)
+
+    def _evaluate_async(self, name, variables, timeout):
+        """
+        Evaluate a named rule from ``asyncio`` code, bypassing the
+        ``coalescer``.
+
+        :param name: The name of the rule to evaluate.
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rule.
+        :param timeout: An optional limit, in seconds, on the time to
+                        wait for the variables.
+
+        :returns: An awaitable yielding an instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        from policies import aio
+
+        rule, attrs = self._lookup(name)
+        compiled = None if rule is None else self.engine.compile(rule)
+
+        return aio.run(self, name, compiled, attrs, variables or {}, timeout)
+
+    def evaluate_many(self, name, variables_iter, bitmap=False):
+        """
+        Evaluate a named rule once for each of a sequence of sets of
+        variables.  The rule is looked up and compiled only once, and
+        a single evaluation context is reused, making this much faster
+        than calling ``evaluate()`` repeatedly.
+
+        :param name: The name of the rule to evaluate.
+        :param variables_iter: An iterable of dictionaries of
+                               variables.  It is consumed lazily,
+                               unless ``bitmap`` is ``True``.
+        :param bitmap: If ``True``, all the sets of variables are
+                       evaluated immediately, and a ``bytearray`` is
+                       returned instead of an iterator.  Each byte of
+                       the ``bytearray`` is 1 if the corresponding
+                       evaluation succeeded, or 0 if it did not.
+
+        :returns: An iterator over instances of
+                  ``policies.authorization.Authorization``, one for
+                  each set of variables, in order.  Evaluation is
+                  performed as the iterator is consumed.  If
+                  ``bitmap`` is ``True``, a ``bytearray`` is returned
+                  instead.
+        """
+
+        # Get the rule and its attribute defaults
+        rule, attrs = self._lookup(name)
+
+        if rule is None:
+            results = (authorization.Authorization(False)
+                       for _variables in variables_iter)
+        else:
+            results = self.engine.evaluate_many(
+                self, name, self.engine.compile(rule), attrs,
+                (variables or {} for variables in variables_iter))
+
+        if bitmap:
+            return bytearray(1 if authz else 0 for authz in results)
+
+        return results
+
+    def filter(self, name, items, item_var='item', fixed=None,
+               chunk_size=1000):
+        """
+        Filter a collection of items, yielding only those items for
+        which a named rule succeeds.  The rule is evaluated once for
+        each item, with the item as the variable named by
+        ``item_var``; however, subexpressions of the rule which do
+        not depend on that variable--such as tests of the user
+        requesting the items--are computed only once.  Items are
+        consumed lazily, ``chunk_size`` at a time.
+
+        :param name: The name of the rule to evaluate.
+        :param items: An iterable of items to filter.
+        :param item_var: The name of the variable to bind each item
+                         to.  Defaults to "item".
+        :param fixed: An optional dictionary of variables which are
+                      the same for all the items.
+        :param chunk_size: The maximum number of items to consume from
+                           ``items`` at a time.
+
+        :returns: An iterator over the items for which the rule
+                  succeeds, in order.
+        """
+
+        # Get the rule and its attribute defaults
+        rule, attrs = self._lookup(name)
+        if rule is None:
+            return
+
+        # Rewrite the rule so the invariant subexpressions are
+        # computed only once
+        if self.engine.supports_memoize:
+            compiled = hoist.hoist(self, rule, [item_var], fixed)
+        else:
+            compiled = self.engine.compile(rule)
+
+        # The memo of invariant values is shared by all the items
+        memo = {}
+        variables = dict(fixed or {})
+
+        def bind(chunk):
+            for item in chunk:
+                variables[item_var] = item
+                yield variables
+
+        items = iter(items)
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                break
+
+            results = self.engine.evaluate_many(
+                self, name, compiled, attrs, bind(chunk), memo=memo)
+            for item, authz in six.moves.zip(chunk, results):
+                if authz:
+                    yield item
+
+    def evaluate_columns(self, name, columns, variables=None,
+                         chunk_size=65536):
+        """
+        Evaluate a named rule for every row of a set of columns of
+        values, such as the fields of a large number of records.
+        Requires numpy.  The result is the same as evaluating the rule
+        once for each row, but comparisons, arithmetic, boolean
+        operations, and membership in constant sets are vectorized;
+        attribute access and function calls are performed row by row.
+
+        :param name: The name of the rule to evaluate.
+        :param columns: A dictionary mapping variable names to
+                        one-dimensional numpy arrays of the same
+                        length.  Each row binds each variable to the
+                        corresponding element of its column.
+                        Memory-mapped arrays may be used.
+        :param variables: An optional dictionary of variables with the
+                          same value for all rows.
+        :param chunk_size: The number of rows to evaluate at a time.
+
+        :returns: A numpy array of booleans, ``True`` for each row for
+                  which the rule succeeded.
+        """
+
+        return columnar.evaluate(self, name, columns, variables,
+                                 chunk_size)
+
+    def evaluate_matrix(self, name, principals, resources, variables=None):
+        """
+        Evaluate a named rule for every combination of a principal and
+        a resource, such as for an access review.  Requires numpy.
+        The result is the same as evaluating the rule once for each
+        combination, but the parts of the rule which depend only on
+        the principal are computed once for each principal, the parts
+        which depend only on the resource are computed once for each
+        resource, and the parts which combine them are vectorized
+        across the resources.
+
+        :param name: The name of the rule to evaluate.
+        :param principals: A list of dictionaries of the variables
+                           describing each principal.
+        :param resources: A list of dictionaries of the variables
+                          describing each resource.  A variable may
+                          not describe both principals and resources.
+        :param variables: An optional dictionary of variables with the
+                          same value for all combinations.
+
+        :returns: An instance of
+                  ``policies.matrix.AuthorizationMatrix``, which
+                  stores the results as packed bits.
+        """
+
+        return matrix.evaluate(self, name, principals, resources, variables)
+
+    def partial(self, name, variables=None):
+        """
+        Partially evaluate a named rule.  Everything in the rule which
+        can be computed from the known variables--including nested
+        rules evaluated with ``rule()``--is computed now, leaving a
+        residual rule over the remaining, unknown variables which may
+        then be evaluated cheaply many times.  Identifiers which are
+        neither known variables nor builtins or entrypoints are
+        treated as unknown.
+
+        :param name: The name of the rule to evaluate.
+        :param variables: A dictionary of the known variables.
+
+        :returns: An instance of ``policies.partial.Residual``.  Its
+                  ``decision`` attribute is ``True`` or ``False`` if
+                  the rule collapsed to a constant allow or deny, and
+                  its ``evaluate()`` method evaluates the residual rule
+                  given the values of the unknown variables.
+        """
+
+        rule, attrs = self._lookup(name)
+
+        return partial_mod.Residual(self, name, rule, attrs,
+                                    dict(variables or {}))
+
+    def evaluate_all(self, variables=None, names=None):
+        """
+        Evaluate several rules against the same set of variables.  The
+        rules are evaluated in a single context, so each nested rule
+        is evaluated at most once; further, subexpressions which occur
+        in more than one of the rules, or in the nested rules they
+        evaluate, are computed at most once.  This assumes, as does
+        the caching of nested rules, that functions called by the
+        rules return the same value when called with the same
+        arguments.  The rules are analyzed the first time a given
+        list of names is evaluated, and again whenever any of the
+        rules changes.
+
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rules.
+        :param names: An optional sequence of the names of the rules
+                      to evaluate.  If not provided, all rules are
+                      evaluated.
+
+        :returns: A dictionary mapping the rule names to instances of
+                  ``policies.authorization.Authorization``.
+        """
+
+        names = tuple(sorted(self) if names is None else names)
+
+        # Get the prepared rule set
+        view = self._shared.get(names)
+        if view is None or not view.current(self):
+            view = shared.SharedRules(self, names,
+                                      self.engine.supports_memoize)
+
+            # Don't let the cache grow without bound
+            if len(self._shared) >= self.max_shared:
+                self._shared.clear()
+            self._shared[names] = view
+
+        entries = []
+        for name in names:
+            rule, attrs = view.lookup(name)
+            entries.append((name, None if rule is None else
+                            self.engine.compile(rule), attrs))
+
+        return self.engine.evaluate_all(view, entries, variables or {})
+
+    def _lookup(self, name):
+        """
+        Look up the rule that will actually be used for a given name,
+        along with the authorization attribute defaults, which are
+        drawn from both the declared default and the set rule.
+
+        :param name: The name of the rule to look up.
+
+        :returns: A tuple of the ``Rule`` object and a dictionary of
+                  authorization attribute defaults.  If the rule is
+                  both undefined and undeclared, returns ``(None,
+                  None)``.
+        """
+
         # Get the rule and predeclaration
-        rule = self._rules.get(name)
-        default = self._defaults.get(name)
+        rule = self._get_rule(name)
+        default = self._get_default(name)
 
         # Short-circuit if we don't have either
         if rule is None and default is None:
-            return authorization.Authorization(False)
+            return None, None
 
         # Marry the attribute defaults
         attrs = {}
@@ -526,22 +1034,394 @@ class Policy(collections.MutableMapping):
             attrs.update(rule.attrs)
 
         # Select the rule we'll actually use
-        if rule is None:
-            rule = default
+        return (default if rule is None else rule), attrs
 
-        # Construct the context
-        ctxt = self.context_class(self, attrs, variables or {})
+    def warmup(self, background=False):
+        """
+        Compile all rules and resolve all identifiers referenced by
+        any rule, so that the first evaluation of each rule does not
+        bear those costs.  Identifiers which cannot be resolved using
+        the builtins or the entrypoint group are reported; these must
+        be provided as variables when the rules are evaluated.
+
+        :param background: If ``True``, the warm-up is performed in a
+                           background thread.
+
+        :returns: An instance of ``policies.warmup.WarmupReport``.  If
+                  ``background`` is ``True``, the started
+                  ``policies.warmup.Warmup`` thread is returned
+                  instead; its ``report`` attribute will contain the
+                  report once the thread completes.
+        """
 
-        # Execute the rule
-        try:
-            with ctxt.push_rule(name):
-                rule.instructions(ctxt)
-        except Exception as exc:
-            # Fail closed
-            return authorization.Authorization(False, attrs)
+        if background:
+            thread = warmup.Warmup(self)
+            thread.start()
+            return thread
+
+        return warmup.warmup(self)
+
+    def freeze(self, version=None):
+        """
+        Construct an immutable snapshot of the ``Policy``.  All rules
+        are compiled, and the authorization attribute defaults for
+        each rule are computed up front, so evaluating a rule on the
+        snapshot performs no look-up or merging work.  Later changes
+        to the ``Policy`` do not affect the snapshot, which may be
+        shared between threads.
+
+        :param version: An optional version identifier for the
+                        snapshot.
+
+        :returns: An instance of ``FrozenPolicy``.
+        """
 
-        # Return the authorization result
-        return ctxt.authz
+        return FrozenPolicy(self, version)
+
+    def overlay(self):
+        """
+        Construct a copy-on-write child of the ``Policy``.  The child
+        initially has exactly the rules, defaults, and documentation
+        of this ``Policy``, and shares its builtins, entrypoint group,
+        resolve cache, and engine; only rules set or declared on the
+        child are stored there.  Since ``Rule`` objects are shared,
+        each inherited rule is compiled only once for all children.
+        This ``Policy`` should not be altered while it has children,
+        since the changes will be visible through all of them.
+
+        :returns: An instance of ``PolicyOverlay``.
+        """
+
+        return PolicyOverlay(self)
+
+
+class PolicyOverlay(Policy):
+    """
+    A copy-on-write child of a ``Policy``.  Rules, defaults, and
+    documentation are looked up first on the overlay, then on the
+    parent; setting or declaring a rule stores it only on the
+    overlay.  Deleting a rule removes only the overlay's version,
+    exposing the parent's rule again.  Symbols are resolved using the
+    parent.
+    """
+
+    def __init__(self, parent):
+        """
+        Initialize a ``PolicyOverlay`` object.
+
+        :param parent: The parent ``Policy``.
+        """
+
+        self.parent = parent
+
+        # Share everything but the mappings with the parent; in
+        # particular, the builtins are not copied
+        self._group = parent._group
+        self._entrypoints = parent._entrypoints
+        self._builtins = parent._builtins
+        self.engine = parent.engine
+        self.context_class = parent.context_class
+        self.lazy_stats = parent.lazy_stats
+
+        # Only overrides are stored here
+        self._defaults = {}
+        self._docs = {}
+        self._rules = {}
+        self._shared = {}
+
+        # The parent's decision cache is not valid for the overlay,
+        # and neither is its coalescer
+        self._generation = 0
+        self.decision_cache = None
+        self.coalescer = None
+
+    def __iter__(self):
+        """
+        Iterate over the rule names, including those of the parent.
+
+        :returns: An iterator over the rule names.
+        """
+
+        return iter(set(self.parent) | set(self._defaults.keys()) |
+                    set(self._rules.keys()))
+
+    def __len__(self):
+        """
+        Obtain the number of rules available on the ``PolicyOverlay``,
+        including those of the parent.
+
+        :returns: The number of independent rules on the
+                  ``PolicyOverlay``.
+        """
+
+        return len(set(self.parent) | set(self._defaults.keys()) |
+                   set(self._rules.keys()))
+
+    def get_docs(self):
+        """
+        Retrieve all declared ``RuleDoc`` objects from the
+        ``PolicyOverlay``, including those of the parent.  The
+        ``RuleDoc`` object contains all documentation for the declared
+        rules.
+
+        :returns: A list of ``RuleDoc`` objects containing
+                  documentation for the declared rules.
+        """
+
+        docs = dict((doc.name, doc) for doc in self.parent.get_docs())
+        docs.update(self._docs)
+
+        return list(docs.values())
+
+    def _get_rule(self, name):
+        """
+        Retrieve the ``Rule`` set with a given name, falling through
+        to the parent.
+
+        :param name: The name of the rule.
+
+        :returns: The ``Rule`` object, or ``None`` if no rule has been
+                  set with that name.
+        """
+
+        rule = self._rules.get(name)
+        return self.parent._get_rule(name) if rule is None else rule
+
+    def _get_default(self, name):
+        """
+        Retrieve the default ``Rule`` declared with a given name,
+        falling through to the parent.
+
+        :param name: The name of the rule.
+
+        :returns: The default ``Rule`` object, or ``None`` if the rule
+                  has not been declared.
+        """
+
+        default = self._defaults.get(name)
+        return self.parent._get_default(name) if default is None else default
+
+    def _get_doc(self, name):
+        """
+        Retrieve the ``RuleDoc`` for a given name, without creating
+        one, falling through to the parent.
+
+        :param name: The name of the rule.
+
+        :returns: The ``RuleDoc`` object, or ``None`` if there is no
+                  documentation for the rule.
+        """
+
+        doc = self._docs.get(name)
+        return self.parent._get_doc(name) if doc is None else doc
+
+    @property
+    def generation(self):
+        """
+        A number which increases whenever a rule is set, deleted, or
+        declared on the ``PolicyOverlay`` or its parent.
+        """
+
+        return self.parent.generation + self._generation
+
+    def resolve(self, symbol):
+        """
+        Resolve a symbol using the parent.
+
+        :param symbol: The symbol being resolved.
+
+        :returns: The value of that symbol.
+        """
+
+        return self.parent.resolve(symbol)
+
+    def invalidate_entrypoints(self):
+        """
+        Discard all symbols resolved using the entrypoint group.  Since
+        the resolve cache is shared, this affects the parent and all
+        its children.
+        """
+
+        self.parent.invalidate_entrypoints()
+
+
+class FrozenPolicy(collections.Mapping):
+    """
+    An immutable snapshot of a ``Policy``.  Maps rule names to the
+    ``Rule`` objects that will actually be used for them, and allows
+    evaluation of those rules.  Symbols are resolved using the
+    ``Policy`` the snapshot was taken from.
+    """
+
+    def __init__(self, policy, version=None):
+        """
+        Initialize a ``FrozenPolicy`` object.
+
+        :param policy: The ``Policy`` to take a snapshot of.
+        :param version: An optional version identifier for the
+                        snapshot.
+        """
+
+        self.policy = policy
+        self.version = version
+        self.context_class = policy.context_class
+        self.engine = policy.engine
+        self.lazy_stats = policy.lazy_stats
+        self.coalescer = policy.coalescer
+
+        # Precompile the effective rules and premerge their
+        # authorization attribute defaults
+        entries = {}
+        for name in policy:
+            rule, attrs = policy._lookup(name)
+            entries[name] = (rule, self.engine.compile(rule), attrs)
+        self._entries = entries
+
+    def __getitem__(self, key):
+        """
+        Retrieve a ``Rule`` given its name.  Raises a ``KeyError`` if
+        the rule was both undefined and undeclared when the snapshot
+        was taken.
+
+        :param key: The name of the rule to get.
+
+        :returns: The ``Rule`` object describing the rule.
+        """
+
+        return self._entries[key][0]
+
+    def __iter__(self):
+        """
+        Iterate over the rule names.
+
+        :returns: An iterator over the rule names.
+        """
+
+        return iter(self._entries)
+
+    def __len__(self):
+        """
+        Obtain the number of rules available on the ``FrozenPolicy``.
+
+        :returns: The number of independent rules on the
+                  ``FrozenPolicy``.
+        """
+
+        return len(self._entries)
+
+    def resolve(self, symbol):
+        """
+        Resolve a symbol using the ``Policy`` the snapshot was taken
+        from.
+
+        :param symbol: The symbol being resolved.
+
+        :returns: The value of that symbol.
+        """
+
+        return self.policy.resolve(symbol)
+
+    def evaluate(self, name, variables=None):
+        """
+        Evaluate a named rule.
+
+        :param name: The name of the rule to evaluate.
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rule.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.  This will include
+                  any authorization attributes.
+        """
+
+        entry = self._entries.get(name)
+        if entry is None:
+            return authorization.Authorization(False)
+
+        return self.engine.evaluate(self, name, entry[1], entry[2],
+                                    variables or {})
+
+    def evaluate_async(self, name, variables=None, timeout=None):
+        """
+        Evaluate a named rule from ``asyncio`` code.  See
+        ``Policy.evaluate_async()``.  Evaluations are coalesced by the
+        ``coalescer`` of the ``Policy`` the snapshot was taken from,
+        if any, but never with those of the ``Policy`` itself.
+
+        :param name: The name of the rule to evaluate.
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rule.
+        :param timeout: An optional limit, in seconds, on the time to
+                        wait for the variables.
+
+        :returns: An awaitable yielding an instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        if self.coalescer is not None:
+            return self.coalescer.evaluate(
+                self, name, variables or {},
+                lambda name, variables: self._evaluate_async(
+                    name, variables, timeout))
+
+        return self._evaluate_async(name, variables, timeout)
+
+    def _evaluate_async(self, name, variables, timeout):
+        """
+        Evaluate a named rule from ``asyncio`` code, bypassing the
+        ``coalescer``.
+
+        :param name: The name of the rule to evaluate.
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rule.
+        :param timeout: An optional limit, in seconds, on the time to
+                        wait for the variables.
+
+        :returns: An awaitable yielding an instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        from policies import aio
+
+        entry = self._entries.get(name)
+        if entry is None:
+            return aio.run(self, name, None, None, {}, timeout)
+
+        return aio.run(self, name, entry[1], entry[2], variables or {},
+                       timeout)
+
+    def evaluate_many(self, name, variables_iter, bitmap=False):
+        """
+        Evaluate a named rule once for each of a sequence of sets of
+        variables.  See ``Policy.evaluate_many()``.
+
+        :param name: The name of the rule to evaluate.
+        :param variables_iter: An iterable of dictionaries of
+                               variables.
+        :param bitmap: If ``True``, a ``bytearray`` of results is
+                       returned instead of an iterator.
+
+        :returns: An iterator over instances of
+                  ``policies.authorization.Authorization``, or a
+                  ``bytearray`` if ``bitmap`` is ``True``.
+        """
+
+        entry = self._entries.get(name)
+        if entry is None:
+            results = (authorization.Authorization(False)
+                       for _variables in variables_iter)
+        else:
+            results = self.engine.evaluate_many(
+                self, name, entry[1], entry[2],
+                (variables or {} for variables in variables_iter))
+
+        if bitmap:
+            return bytearray(1 if authz else 0 for authz in results)
+
+        return results
 
 
 def want_context(func):
@@ -559,6 +1439,31 @@ def want_context(func):
     return func
 
 
+def pure(func):
+    """
+    A decorator that marks a policy function as pure--that is, as
+    always returning the same value when called with the same
+    arguments.  The results of calls to a pure function are memoized
+    for the duration of an evaluation, including the evaluation of
+    nested rules, so that the function is called at most once for each
+    distinct set of arguments.  Calls with arguments which are not
+    hashable are not memoized.  The ``pure_hits`` and ``pure_misses``
+    attributes of the function count, across all evaluations, the
+    calls answered from the memo and the calls which invoked the
+    function.
+
+    :param func: The function to be decorated.
+
+    :returns: The decorated function.
+    """
+
+    func._policies_pure = True
+    func.pure_hits = 0
+    func.pure_misses = 0
+
+    return func
+
+
 @want_context
 def rule(ctxt, name):
     """
@@ -14,9 +14,17 @@
 # along with this program.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+import threading
+
 from policies import parser
 
 
+# Serializes rule compilation.  The parser is not safe for concurrent
+# use, and this also ensures each rule is compiled only once, no matter
+# how many threads first evaluate it at the same time.
+_compile_lock = threading.Lock()
+
+
 class Rule(object):
     """
     Describe one policy rule.  A policy rule has a name and some text
@@ -55,13 +63,41 @@ class Rule(object):
         Retrieve the instructions for the rule.
         """
 
-        if self._instructions is None:
-            # Compile the rule into an Instructions instance; we do
-            # this lazily to amortize the cost of the compilation,
-            # then cache that result for efficiency...
-            self._instructions = parser.parse_rule(self.name, self.text)
+        # Reading the compiled instructions requires no locking
+        instructions = self._instructions
+        if instructions is None:
+            with _compile_lock:
+                if self._instructions is None:
+                    # Compile the rule into an Instructions instance;
+                    # we do this lazily to amortize the cost of the
+                    # compilation, then cache that result for
+                    # efficiency...
+                    self._instructions = parser.parse_rule(self.name,
+                                                           self.text)
+                instructions = self._instructions
+
+        return instructions
+
+    def compile(self, do_raise=False):
+        """
+        Compile the rule immediately, rather than on demand.
+
+        :param do_raise: If ``True`` and the rule fails to parse, a
+                         ``pyparsing.ParseException`` will be raised,
+                         and the rule will be left uncompiled.
+                         Otherwise, a failure to parse results in a
+                         rule which always denies authorization.
+
+        :returns: The instructions for the rule.
+        """
+
+        if self._instructions is None and do_raise:
+            with _compile_lock:
+                if self._instructions is None:
+                    self._instructions = parser.parse_rule(
+                        self.name, self.text, do_raise=True)
 
-        return self._instructions
+        return self.instructions
 
 
 class RuleDoc(object):
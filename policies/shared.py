@@ -0,0 +1,189 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import collections
+
+from policies import analysis
+from policies import rules
+
+
+def common_subexpressions(trees):
+    """
+    Find the subexpressions which occur more than once in a collection
+    of expression trees.  Trivial subexpressions, such as constants
+    and variable references, are ignored.
+
+    :param trees: An iterable of ``policies.analysis.Node`` objects.
+
+    :returns: A dictionary mapping the keys of the common
+              subexpressions to consecutive integer slots, suitable
+              for passing to ``policies.analysis.compile_rule()``.
+    """
+
+    counts = collections.Counter()
+    order = []
+    for tree in trees:
+        for node in tree.walk():
+            if node.trivial:
+                continue
+
+            if node.key not in counts:
+                order.append(node.key)
+            counts[node.key] += 1
+
+    return dict((key, slot) for slot, key in
+                enumerate(key for key in order if counts[key] > 1))
+
+
+class SharedRules(object):
+    """
+    A view of a set of rules of a ``Policy``, rewritten so that
+    subexpressions common to several of the rules are computed only
+    once when the rules are evaluated in the same context.  The set
+    includes the named rules and any rules they evaluate through
+    ``rule()``.  Rules outside the set, and symbols, are looked up in
+    the ``Policy``.
+    """
+
+    def __init__(self, policy, names, memoize=True):
+        """
+        Initialize a ``SharedRules`` object.
+
+        :param policy: The ``Policy``.
+        :param names: A sequence of the names of the rules.
+        :param memoize: If ``False``, the rules are not rewritten; the
+                        view then only allows the results of nested
+                        rules to be shared.
+        """
+
+        self.policy = policy
+        self.context_class = policy.context_class
+        self.lazy_stats = policy.lazy_stats
+
+        # Collect the rules, including the nested rules they call
+        lookups = {}
+        trees = {}
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name in lookups:
+                continue
+
+            lookups[name] = policy._lookup(name)
+            rule = lookups[name][0]
+            if rule is None:
+                continue
+
+            try:
+                trees[name] = analysis.decompile(rule.instructions)
+            except analysis.DecompileError:
+                # Evaluate this rule as is
+                continue
+
+            for expr in [trees[name][0]] + [e for _n, e in trees[name][1]]:
+                todo.extend(node.rule_name for node in expr.walk()
+                            if isinstance(node, analysis.Call) and
+                            node.rule_name is not None)
+
+        # Remember the rules used, so that staleness can be detected
+        self._sources = dict(
+            (name, (policy._get_rule(name), policy._get_default(name)))
+            for name in lookups)
+
+        memo = {}
+        if memoize:
+            memo = common_subexpressions(
+                expr for expr, attrs in trees.values()
+                for expr in [expr] + [e for _n, e in attrs])
+        self.slots = len(memo)
+
+        # Rewrite the rules
+        self._entries = {}
+        for name, (rule, attrs) in lookups.items():
+            if memo and name in trees:
+                expr, attr_exprs = trees[name]
+                shared = rules.Rule(rule.name, rule.text, rule.attrs)
+                shared._instructions = analysis.compile_rule(
+                    expr, attr_exprs, memo)
+                rule = shared
+
+            self._entries[name] = (rule, attrs)
+
+    def __getitem__(self, name):
+        """
+        Retrieve a ``Rule`` given its name.  Raises a ``KeyError`` if
+        the rule is both undefined and undeclared.
+
+        :param name: The name of the rule to get.
+
+        :returns: The ``Rule`` object describing the rule.
+        """
+
+        entry = self._entries.get(name)
+        if entry is None:
+            return self.policy[name]
+        elif entry[0] is None:
+            raise KeyError(name)
+
+        return entry[0]
+
+    def current(self, policy):
+        """
+        Determine whether the view is still current; that is, whether
+        none of the rules it contains have been altered.
+
+        :param policy: The ``Policy`` the view was constructed from.
+
+        :returns: A ``True`` value if the view is current, ``False``
+                  otherwise.
+        """
+
+        for name, (rule, default) in self._sources.items():
+            if (policy._get_rule(name) is not rule or
+                    policy._get_default(name) is not default):
+                return False
+
+        return True
+
+    def lookup(self, name):
+        """
+        Look up the rule that will actually be used for a given name,
+        along with the authorization attribute defaults.
+
+        :param name: The name of the rule to look up.
+
+        :returns: A tuple of the ``Rule`` object and a dictionary of
+                  authorization attribute defaults.  If the rule is
+                  both undefined and undeclared, returns ``(None,
+                  None)``.
+        """
+
+        entry = self._entries.get(name)
+        if entry is None:
+            return self.policy._lookup(name)
+
+        return entry
+
+    def resolve(self, symbol):
+        """
+        Resolve a symbol using the ``Policy``.
+
+        :param symbol: The symbol being resolved.
+
+        :returns: The value of that symbol.
+        """
+
+        return self.policy.resolve(symbol)
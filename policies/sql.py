@@ -0,0 +1,505 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import itertools
+import numbers
+
+import six
+
+from policies import analysis
+from policies import instructions
+
+
+# Comparison operators, with the SQL operator and the operator to use
+# when the operands are swapped
+_comparisons = {
+    instructions.eq_op: ('=', instructions.eq_op),
+    instructions.ne_op: ('<>', instructions.ne_op),
+    instructions.lt_op: ('<', instructions.gt_op),
+    instructions.gt_op: ('>', instructions.lt_op),
+    instructions.le_op: ('<=', instructions.ge_op),
+    instructions.ge_op: ('>=', instructions.le_op),
+}
+
+# Types of constants which may be bound as parameters
+_scalar_types = (bool, numbers.Real, six.text_type, six.binary_type)
+
+# Types of constants which may appear on the right of "in"
+_collection_types = (set, frozenset, list, tuple)
+
+
+class TranslateError(Exception):
+    """
+    Raised when an expression cannot be translated into SQL.
+    """
+
+    pass
+
+
+class Translation(object):
+    """
+    The translation of a residual rule into a SQL predicate.  The
+    ``where`` attribute contains the text of the predicate, suitable
+    for use in a ``WHERE`` clause, and ``params`` contains the values
+    to bind to its placeholders.  Any row for which the rule would
+    succeed satisfies the predicate; if ``exact`` is ``True``, the
+    converse is also true.  Otherwise, the parts of the rule which
+    could not be translated are listed in ``untranslated`` as (node,
+    reason) tuples, and the rows selected by the predicate must be
+    post-filtered with ``filter()``.
+    """
+
+    def __init__(self, residual, row_var, where, params, untranslated):
+        """
+        Initialize a ``Translation`` object.
+
+        :param residual: The ``policies.partial.Residual``.
+        :param row_var: The name of the variable denoting the row.
+        :param where: The text of the SQL predicate.
+        :param params: A list of the values to bind to the
+                       placeholders in the predicate.
+        :param untranslated: A list of (node, reason) tuples
+                             describing the parts of the rule which
+                             could not be translated.
+        """
+
+        self.residual = residual
+        self.row_var = row_var
+        self.where = where
+        self.params = params
+        self.untranslated = untranslated
+
+    @property
+    def exact(self):
+        """
+        A ``True`` value if the predicate selects exactly the rows for
+        which the rule succeeds.
+        """
+
+        return not self.untranslated
+
+    def filter(self, rows):
+        """
+        Post-filter the rows selected by the predicate, evaluating the
+        residual rule for each row.  If the predicate is exact, the
+        rows are returned without evaluation.
+
+        :param rows: An iterable of rows.  Each row is bound to the
+                     row variable, so the columns must be available as
+                     attributes of the row.
+
+        :returns: An iterator over the rows for which the rule
+                  succeeds.
+        """
+
+        if self.exact:
+            return iter(rows)
+
+        return self._filter(rows)
+
+    def _filter(self, rows):
+        """
+        Evaluate the residual rule for each row.
+
+        :param rows: An iterable of rows.
+
+        :returns: An iterator over the rows for which the rule
+                  succeeds.
+        """
+
+        rows, bound = itertools.tee(rows)
+        results = self.residual.evaluate_many(
+            {self.row_var: row} for row in bound)
+        for row, authz in six.moves.zip(rows, results):
+            if authz:
+                yield row
+
+
+class Translator(object):
+    """
+    Translate expression trees into SQL predicates.  Attributes of the
+    row variable are translated into columns; constants are bound as
+    parameters.  Comparisons, ``in`` and ``not in`` with constant
+    collections, tests against ``None``, and ``and``, ``or``, ``not``,
+    and conditional expressions are translated.  A subexpression which
+    cannot be translated is replaced by a predicate which is true if
+    the subexpression might be--so that the result selects every row
+    for which the rule succeeds--and recorded in ``untranslated``.
+
+    Every predicate produced is two-valued--it is never ``NULL``--so
+    that predicates combine exactly as the rule would.  Comparisons
+    with a ``NULL`` column follow the rule: ``==`` is false and ``!=``
+    is true.  Ordering comparisons with ``None`` raise an exception in
+    the rule, which then fails closed; a translated ordering
+    comparison is false for a ``NULL`` column, which is only exact if
+    the comparison is not negated or an operand of "or".  Column
+    values are assumed to have types compatible with the constants
+    they are compared to.  A column used as a truth value is only
+    translated if it is declared to be boolean or numeric; the truth
+    of other values, such as strings, cannot be tested portably.
+    """
+
+    def __init__(self, row_var, columns=None, not_null=(), placeholder='?',
+                 numeric=()):
+        """
+        Initialize a ``Translator`` object.
+
+        :param row_var: The name of the variable denoting the row.
+        :param columns: An optional dictionary mapping the attribute
+                        names of the row to SQL column expressions,
+                        which are used verbatim.  If not provided,
+                        attribute names are quoted and used as column
+                        names.
+        :param not_null: A sequence of the attribute names of columns
+                         which are never ``NULL``.
+        :param placeholder: The parameter placeholder of the database
+                            module.  Defaults to "?".
+        :param numeric: A sequence of the attribute names of columns
+                        which are boolean or numeric.
+        """
+
+        self.row_var = row_var
+        self.columns = columns
+        self.not_null = frozenset(not_null)
+        self.placeholder = placeholder
+        self.numeric = frozenset(numeric)
+
+        self.untranslated = []
+
+    def column(self, node):
+        """
+        Translate a reference to a column.
+
+        :param node: The ``Node``.
+
+        :returns: A tuple of the SQL column expression and a boolean
+                  indicating whether the column may be ``NULL``.
+        """
+
+        if not (isinstance(node, analysis.Attr) and
+                isinstance(node.obj, analysis.Name) and
+                node.obj.ident == self.row_var):
+            if isinstance(node, analysis.Name):
+                raise TranslateError("refers to variable %r" % node.ident)
+            raise TranslateError("not a column or constant: %r" % node)
+
+        if self.columns is None:
+            column = _quote(node.attribute)
+        elif node.attribute in self.columns:
+            column = self.columns[node.attribute]
+        else:
+            raise TranslateError("unknown column %r" % node.attribute)
+
+        return column, node.attribute not in self.not_null
+
+    def param(self, value):
+        """
+        Check that a constant may be bound as a parameter.
+
+        :param value: The value of the constant.
+
+        :returns: The value.
+        """
+
+        if not isinstance(value, _scalar_types):
+            raise TranslateError("cannot bind constant %r" % (value,))
+
+        return value
+
+    def _is_null(self, column, nullable, negate):
+        if not nullable:
+            return _TRUE if negate else _FALSE
+        return ('%s IS %sNULL' % (column, 'NOT ' if negate else ''), ())
+
+    def _compare(self, node, strict):
+        lhs, rhs = node.args
+        sql_op, swapped = _comparisons[node.operator]
+        if isinstance(lhs, analysis.Const):
+            lhs, rhs = rhs, lhs
+            sql_op = _comparisons[swapped][0]
+        if not isinstance(rhs, analysis.Const):
+            raise TranslateError("compares two non-constants: %r" % node)
+        column, nullable = self.column(lhs)
+
+        if rhs.value is None:
+            if sql_op not in ('=', '<>'):
+                raise TranslateError("orders against None: %r" % node)
+            return self._is_null(column, nullable, sql_op == '<>')
+
+        test = '%s %s %s' % (column, sql_op, self.placeholder)
+        params = (self.param(rhs.value),)
+        if not nullable:
+            return '(%s)' % test, params
+        elif sql_op == '<>':
+            return '(%s IS NULL OR %s)' % (column, test), params
+        elif sql_op != '=' and not strict:
+            self.untranslated.append(
+                (node, "ordering comparison with a NULL column "
+                 "raises an exception"))
+
+        return '(%s IS NOT NULL AND %s)' % (column, test), params
+
+    def _membership(self, node):
+        lhs, rhs = node.args
+        if not (isinstance(rhs, analysis.Const) and
+                isinstance(rhs.value, _collection_types)):
+            raise TranslateError("membership in a non-constant: %r" % node)
+        column, nullable = self.column(lhs)
+
+        values = tuple(self.param(value) for value in rhs.value
+                       if value is not None)
+        if values:
+            test = ('%s IN (%s)' % (column, ', '.join(
+                [self.placeholder] * len(values))), values)
+            if nullable:
+                test = _and(('%s IS NOT NULL' % column, ()), test)
+        else:
+            test = _FALSE
+        if nullable and len(values) != len(rhs.value):
+            test = _or(('%s IS NULL' % column, ()), test)
+
+        if node.operator == instructions.not_in_op:
+            return _not(test)
+        return test
+
+    def _identity(self, node):
+        lhs, rhs = node.args
+        if isinstance(lhs, analysis.Const):
+            lhs, rhs = rhs, lhs
+        if not (isinstance(rhs, analysis.Const) and rhs.value is None):
+            raise TranslateError("identity test against a value other "
+                                 "than None: %r" % node)
+        column, nullable = self.column(lhs)
+
+        return self._is_null(column, nullable,
+                             node.operator == instructions.is_not_op)
+
+    def _translate(self, node, polarity, strict):
+        if isinstance(node, analysis.Const):
+            return _TRUE if node.value else _FALSE
+        elif isinstance(node, analysis.And):
+            return _and(self(node.lhs, polarity, strict),
+                        self(node.rhs, polarity, strict))
+        elif isinstance(node, analysis.Or):
+            return _or(self(node.lhs, polarity, False),
+                       self(node.rhs, polarity, False))
+        elif isinstance(node, analysis.Cond):
+            cond, if_true, if_false = (
+                self(node.cond, 0, False), self(node.if_true, polarity, False),
+                self(node.if_false, polarity, False))
+            return ('(CASE WHEN %s THEN %s ELSE %s END)' % (
+                cond[0], if_true[0], if_false[0]),
+                cond[1] + if_true[1] + if_false[1])
+        elif isinstance(node, analysis.Op):
+            if node.operator == instructions.not_op:
+                return _not(self(node.args[0], -polarity, False))
+            elif node.operator in _comparisons:
+                return self._compare(node, strict)
+            elif node.operator in (instructions.in_op,
+                                   instructions.not_in_op):
+                return self._membership(node)
+            elif node.operator in (instructions.is_op,
+                                   instructions.is_not_op):
+                return self._identity(node)
+            raise TranslateError("unsupported operator %r" %
+                                 node.operator.opstr)
+        elif isinstance(node, (analysis.Attr, analysis.Name)):
+            # A column used as a truth value
+            column, nullable = self.column(node)
+            if node.attribute not in self.numeric:
+                raise TranslateError("truth value of column %r, which is "
+                                     "not declared numeric" %
+                                     node.attribute)
+            test = '%s <> 0' % column
+            if nullable:
+                return '(%s IS NOT NULL AND %s)' % (column, test), ()
+            return '(%s)' % test, ()
+
+        raise TranslateError("unsupported expression %r" % node)
+
+    def __call__(self, node, polarity=1, strict=True):
+        """
+        Translate an expression tree used as a truth value.
+
+        :param node: The ``Node`` to translate.
+        :param polarity: 1 if the predicate is not negated, -1 if it
+                         is, or 0 if it is used both ways, as the
+                         condition of a conditional expression is.
+                         If the expression cannot be translated, it is
+                         replaced by a true or false predicate
+                         according to its polarity.
+        :param strict: If ``True``, an exception raised while
+                       evaluating the expression would deny the row
+                       regardless of the rest of the rule.
+
+        :returns: A tuple of the text of the SQL predicate and a tuple
+                  of the values to bind to its placeholders.  Raises
+                  ``TranslateError`` if the expression cannot be
+                  translated and ``polarity`` is 0.
+        """
+
+        untranslated = len(self.untranslated)
+        try:
+            return self._translate(node, polarity, strict)
+        except TranslateError as exc:
+            if not polarity:
+                raise
+
+            del self.untranslated[untranslated:]
+            self.untranslated.append((node, str(exc)))
+            return _TRUE if polarity > 0 else _FALSE
+
+
+# Constant predicates
+_TRUE = ('(1 = 1)', ())
+_FALSE = ('(1 = 0)', ())
+
+
+def _quote(name):
+    """
+    Quote a name as an SQL identifier, so that names which are
+    reserved words or which contain special characters are treated as
+    column names.
+
+    :param name: The name.
+
+    :returns: The quoted identifier.
+    """
+
+    return '"%s"' % name.replace('"', '""')
+
+
+def _and(lhs, rhs):
+    """
+    Combine two predicates with "AND".
+
+    :param lhs: The first predicate, as a tuple of text and
+                parameters.
+    :param rhs: The second predicate.
+
+    :returns: The combined predicate.
+    """
+
+    if _FALSE in (lhs, rhs):
+        return _FALSE
+    elif lhs == _TRUE:
+        return rhs
+    elif rhs == _TRUE:
+        return lhs
+
+    return '(%s AND %s)' % (lhs[0], rhs[0]), lhs[1] + rhs[1]
+
+
+def _or(lhs, rhs):
+    """
+    Combine two predicates with "OR".
+
+    :param lhs: The first predicate, as a tuple of text and
+                parameters.
+    :param rhs: The second predicate.
+
+    :returns: The combined predicate.
+    """
+
+    if _TRUE in (lhs, rhs):
+        return _TRUE
+    elif lhs == _FALSE:
+        return rhs
+    elif rhs == _FALSE:
+        return lhs
+
+    return '(%s OR %s)' % (lhs[0], rhs[0]), lhs[1] + rhs[1]
+
+
+def _not(pred):
+    """
+    Negate a predicate.
+
+    :param pred: The predicate, as a tuple of text and parameters.
+
+    :returns: The negated predicate.
+    """
+
+    if pred in (_TRUE, _FALSE):
+        return _FALSE if pred == _TRUE else _TRUE
+
+    return 'NOT %s' % pred[0], pred[1]
+
+
+def _trivial(node, row_var):
+    """
+    Determine whether computing an authorization attribute is unable
+    to raise an exception.
+
+    :param node: The ``Node`` computing the attribute.
+    :param row_var: The name of the variable denoting the row.
+
+    :returns: A ``True`` value if the node is a constant or a column.
+    """
+
+    return (isinstance(node, analysis.Const) or
+            (isinstance(node, analysis.Attr) and
+             isinstance(node.obj, analysis.Name) and
+             node.obj.ident == row_var))
+
+
+def translate(residual, row_var='row', columns=None, not_null=(),
+              placeholder='?', numeric=()):
+    """
+    Translate a residual rule into a parameterized SQL predicate.  The
+    rule should first be partially evaluated with
+    ``policies.Policy.partial()``, so that the only unknown is the row
+    variable.  Parts of the rule which cannot be translated are
+    replaced so that the predicate selects a superset of the rows for
+    which the rule succeeds, and are reported in the ``untranslated``
+    attribute of the result.
+
+    :param residual: The ``policies.partial.Residual``.
+    :param row_var: The name of the variable denoting the row.
+                    Defaults to "row".
+    :param columns: An optional dictionary mapping the attribute names
+                    of the row to SQL column expressions, which are
+                    used verbatim.  If not provided, attribute names
+                    are quoted and used as column names.
+    :param not_null: A sequence of the attribute names of columns
+                     which are never ``NULL``.
+    :param placeholder: The parameter placeholder of the database
+                        module.  Defaults to "?".
+    :param numeric: A sequence of the attribute names of columns which
+                    are boolean or numeric.  Only these columns may be
+                    translated when used as truth values.
+
+    :returns: An instance of ``Translation``.
+    """
+
+    if residual.expr is None:
+        return Translation(residual, row_var, _TRUE[0], [],
+                           [(None, "rule could not be analyzed")])
+
+    translator = Translator(row_var, columns, not_null, placeholder,
+                            numeric)
+    where, params = translator(residual.expr)
+
+    # Computing an authorization attribute could deny the row
+    untranslated = translator.untranslated
+    for attr, node in residual.attrs:
+        if not _trivial(node, row_var):
+            untranslated.append((node, "authorization attribute %r may "
+                                 "raise an exception" % attr))
+
+    return Translation(residual, row_var, where, list(params),
+                       untranslated)
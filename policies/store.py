@@ -0,0 +1,344 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import sys
+import threading
+import timeit
+
+import six
+
+
+def policy_size(pol):
+    """
+    Estimate the memory used by a ``Policy``.  The estimate includes
+    the text and the compiled instructions of each rule stored on the
+    ``Policy`` itself; rules which have not yet been compiled are
+    compiled, since they would be on first evaluation.  For a
+    ``policies.PolicyOverlay``, rules inherited from the parent are
+    not counted, since they are shared.  Objects other than a
+    ``Policy`` are measured with ``sys.getsizeof()``.
+
+    :param pol: The ``Policy`` to measure.
+
+    :returns: The approximate size, in bytes.
+    """
+
+    if not hasattr(pol, '_rules'):
+        return sys.getsizeof(pol)
+
+    size = sys.getsizeof(pol)
+    for mapping in (pol._rules, pol._defaults, pol._docs):
+        size += sys.getsizeof(mapping)
+
+    for mapping in (pol._rules, pol._defaults):
+        for rule in mapping.values():
+            size += sys.getsizeof(rule) + sys.getsizeof(rule.text)
+
+            insts = rule.compile()
+            size += sys.getsizeof(insts.instructions)
+            size += sum(sys.getsizeof(inst) for inst in insts.instructions)
+
+    return size
+
+
+class _Flight(object):
+    """
+    Tracks a load in progress, allowing concurrent requests for the
+    same tenant to wait for a single load.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``_Flight`` object.
+        """
+
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.discard = False
+
+
+class PolicyStore(object):
+    """
+    A store of ``Policy`` objects, keyed by tenant.  Policies are
+    loaded on demand using a loader callback, and the least recently
+    used policies are evicted when the store exceeds its budget.
+    Concurrent requests for a tenant which is not loaded result in
+    only one call to the loader; the other requests wait for its
+    result.
+
+    The ``hits`` and ``misses`` attributes count the requests which
+    were and were not satisfied by a loaded policy; ``loads`` counts
+    the calls to the loader, and ``load_errors`` the calls which
+    raised an exception; ``load_time`` and ``max_load_time`` give the
+    total and the maximum time, in seconds, spent in the loader; and
+    ``evictions`` counts the policies evicted to stay within the
+    budget.
+    """
+
+    def __init__(self, loader, max_policies=None, max_size=None,
+                 sizer=policy_size, warmup=False):
+        """
+        Initialize a ``PolicyStore`` object.
+
+        :param loader: A callable which will be passed a tenant ID and
+                       must return the ``Policy`` for that tenant.  It
+                       may raise an exception, which is passed on to
+                       all callers waiting for the policy; nothing is
+                       stored in that case.
+        :param max_policies: The maximum number of policies to keep
+                             loaded.  If ``None``, the number is not
+                             limited.
+        :param max_size: The maximum total size, in bytes, of the
+                         loaded policies, as estimated by ``sizer``.
+                         If ``None``, the size is not limited.
+        :param sizer: A callable which will be passed a ``Policy``
+                      and must return an estimate of its size in
+                      bytes.  Defaults to ``policy_size()``, which
+                      compiles the rules of the policy in order to
+                      measure them.  The size of each policy is
+                      computed once, when it is loaded.
+        :param warmup: If ``True``, the ``warmup()`` method of each
+                       loaded ``Policy`` is called before it is
+                       stored, so that all its identifiers are also
+                       resolved.
+        """
+
+        self.loader = loader
+        self.max_policies = max_policies
+        self.max_size = max_size
+        self.sizer = sizer
+        self.warmup = warmup
+
+        # Maps tenant IDs to (policy, size) tuples in order of use
+        self._policies = collections.OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.load_time = 0.0
+        self.max_load_time = 0.0
+        self.evictions = 0
+
+    def __getitem__(self, tenant):
+        """
+        Retrieve the ``Policy`` for a tenant, loading it if necessary.
+
+        :param tenant: The tenant ID.
+
+        :returns: The ``Policy`` for the tenant.
+        """
+
+        return self.get(tenant)
+
+    def __contains__(self, tenant):
+        """
+        Determine whether the ``Policy`` for a tenant is loaded.  This
+        does not load the policy or affect its eviction order.
+
+        :param tenant: The tenant ID.
+
+        :returns: A ``True`` value if the policy is loaded, ``False``
+                  otherwise.
+        """
+
+        return tenant in self._policies
+
+    def __len__(self):
+        """
+        Obtain the number of loaded policies.
+
+        :returns: The number of loaded policies.
+        """
+
+        return len(self._policies)
+
+    @property
+    def size(self):
+        """
+        Retrieve the estimated total size, in bytes, of the loaded
+        policies.
+        """
+
+        return self._size
+
+    def get(self, tenant):
+        """
+        Retrieve the ``Policy`` for a tenant, loading it if necessary.
+
+        :param tenant: The tenant ID.
+
+        :returns: The ``Policy`` for the tenant.
+        """
+
+        with self._lock:
+            entry = self._policies.pop(tenant, None)
+            if entry is not None:
+                # Move it to the most recently used end
+                self._policies[tenant] = entry
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+
+            # Join a load already in progress, or start one
+            flight = self._flights.get(tenant)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[tenant] = flight
+
+        if leader:
+            self._load(tenant, flight)
+        else:
+            flight.event.wait()
+
+        if flight.exc_info is not None:
+            exc_type, exc_value, exc_tb = flight.exc_info
+            six.reraise(exc_type, exc_value, exc_tb)
+
+        return flight.result
+
+    def _load(self, tenant, flight):
+        """
+        Load the ``Policy`` for a tenant and store it, evicting other
+        policies as needed.
+
+        :param tenant: The tenant ID.
+        :param flight: The ``_Flight`` tracking the load.
+        """
+
+        start = timeit.default_timer()
+        size = None
+        try:
+            pol = self.loader(tenant)
+            if self.warmup:
+                pol.warmup()
+            size = self.sizer(pol)
+        except Exception:
+            flight.exc_info = sys.exc_info()
+
+            # Get the logger and emit a log message
+            log = logging.getLogger('policies')
+            log.warn("Failed to load policy for tenant %r: %s" %
+                     (tenant, flight.exc_info[1]))
+        except BaseException:
+            # Release the waiters, but do not share the interruption
+            exc = RuntimeError("load of policy for tenant %r was "
+                               "interrupted" % (tenant,))
+            flight.exc_info = (RuntimeError, exc, None)
+            self._complete(tenant, flight, size,
+                           timeit.default_timer() - start)
+            raise
+        else:
+            flight.result = pol
+
+        self._complete(tenant, flight, size, timeit.default_timer() - start)
+
+    def _complete(self, tenant, flight, size, elapsed):
+        """
+        Record the outcome of a load, storing the loaded ``Policy`` if
+        there is one, and release any waiting requests.
+
+        :param tenant: The tenant ID.
+        :param flight: The ``_Flight`` tracking the load.
+        :param size: The size of the loaded ``Policy``.
+        :param elapsed: The time, in seconds, the load took.
+        """
+
+        with self._lock:
+            del self._flights[tenant]
+
+            self.loads += 1
+            self.load_time += elapsed
+            self.max_load_time = max(self.max_load_time, elapsed)
+
+            if flight.exc_info is not None:
+                self.load_errors += 1
+            elif not flight.discard:
+                self._policies[tenant] = (flight.result, size)
+                self._size += size
+                self._evict()
+
+        flight.event.set()
+
+    def _evict(self):
+        """
+        Evict the least recently used policies until the store is
+        within its budget.  The most recently used policy is never
+        evicted.  Must be called with the lock held.
+        """
+
+        while len(self._policies) > 1 and (
+                (self.max_policies is not None and
+                 len(self._policies) > self.max_policies) or
+                (self.max_size is not None and self._size > self.max_size)):
+            _tenant, (_pol, size) = self._policies.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+
+    def invalidate(self, tenant):
+        """
+        Discard the ``Policy`` for a tenant, so that it is reloaded the
+        next time it is requested.  If the policy is being loaded, the
+        result of that load is returned to the waiting callers but not
+        stored.
+
+        :param tenant: The tenant ID.
+        """
+
+        with self._lock:
+            entry = self._policies.pop(tenant, None)
+            if entry is not None:
+                self._size -= entry[1]
+
+            flight = self._flights.get(tenant)
+            if flight is not None:
+                flight.discard = True
+
+    def clear(self):
+        """
+        Discard all loaded policies.
+        """
+
+        with self._lock:
+            self._policies.clear()
+            self._size = 0
+
+            for flight in self._flights.values():
+                flight.discard = True
+
+    def evaluate(self, tenant, name, variables=None):
+        """
+        Evaluate a named rule using the ``Policy`` for a tenant.
+
+        :param tenant: The tenant ID.
+        :param name: The name of the rule to evaluate.
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rule.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        return self.get(tenant).evaluate(name, variables)
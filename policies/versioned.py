@@ -0,0 +1,140 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import contextlib
+import threading
+import weakref
+
+from policies import policy as policy_mod
+
+
+class VersionedPolicy(object):
+    """
+    A versioned handle on a ``Policy``.  Readers evaluate rules
+    against an immutable ``FrozenPolicy`` snapshot, obtained once per
+    evaluation without locking; writers alter the underlying
+    ``Policy`` and publish a new snapshot, which is swapped in
+    atomically.  Evaluations already in progress, including any
+    nested rule evaluations, complete using the snapshot they started
+    with.
+    """
+
+    def __init__(self, policy=None):
+        """
+        Initialize a ``VersionedPolicy`` object.
+
+        :param policy: The ``Policy`` to publish snapshots of.  If not
+                       provided, an empty ``Policy`` is created.  The
+                       initial snapshot is published immediately.
+        """
+
+        self.policy = policy_mod.Policy() if policy is None else policy
+
+        # Writers are serialized; readers never take this lock
+        self._lock = threading.RLock()
+        self._version = 0
+        self._live = weakref.WeakValueDictionary()
+        self._current = None
+
+        self.publish()
+
+    @property
+    def current(self):
+        """
+        Retrieve the current ``FrozenPolicy`` snapshot.  To perform
+        several evaluations against the same version of the policy,
+        retrieve the snapshot once and evaluate against it.
+        """
+
+        return self._current
+
+    @property
+    def version(self):
+        """
+        Retrieve the version number of the current snapshot.
+        """
+
+        return self._current.version
+
+    @property
+    def live_versions(self):
+        """
+        Retrieve a sorted list of the version numbers of all snapshots
+        which are still in use--the current snapshot, plus any older
+        snapshots still referenced by in-flight evaluations.
+        """
+
+        return sorted(self._live.keys())
+
+    def publish(self, policy=None):
+        """
+        Freeze the ``Policy`` and atomically swap the new snapshot in.
+
+        :param policy: An optional replacement ``Policy``.  If
+                       provided, it replaces the ``policy`` attribute
+                       before the snapshot is taken.
+
+        :returns: The version number of the new snapshot.
+        """
+
+        with self._lock:
+            if policy is not None:
+                self.policy = policy
+
+            # Build the complete snapshot before it becomes visible
+            version = self._version + 1
+            snapshot = self.policy.freeze(version)
+            self._live[version] = snapshot
+
+            # The swap itself is a single reference assignment
+            self._version = version
+            self._current = snapshot
+
+        return version
+
+    @contextlib.contextmanager
+    def update(self):
+        """
+        Alter the ``Policy``.  The ``Policy`` is yielded for
+        modification, and a new snapshot is published when the
+        ``with`` block exits without raising an exception; note that
+        changes made before an exception are not rolled back, and
+        will be included in the next published snapshot.  Other
+        writers are excluded for the duration; readers are not
+        affected until the new snapshot is published.
+
+        :returns: A context manager, suitable for use with the
+                  ``with`` statement.  The ``Policy`` is generated.
+        """
+
+        with self._lock:
+            yield self.policy
+            self.publish()
+
+    def evaluate(self, name, variables=None):
+        """
+        Evaluate a named rule using the current snapshot.
+
+        :param name: The name of the rule to evaluate.
+        :param variables: An optional dictionary of variables to make
+                          available during evaluation of the rule.
+
+        :returns: An instance of
+                  ``policies.authorization.Authorization`` with the
+                  result of the rule evaluation.
+        """
+
+        return self._current.evaluate(name, variables)
@@ -0,0 +1,134 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import threading
+import timeit
+
+from policies import instructions
+
+
+def identifiers(insts):
+    """
+    Determine the identifiers referenced by a compiled rule.
+
+    :param insts: An instance of
+                  ``policies.instructions.Instructions``.
+
+    :returns: A set of the identifiers referenced.
+    """
+
+    return set(inst.ident for inst in insts.instructions
+               if isinstance(inst, instructions.Ident))
+
+
+class WarmupReport(object):
+    """
+    Describes the result of warming up a ``Policy``.  The
+    ``compile_times`` attribute maps rule names to the time, in
+    seconds, taken to compile them; ``resolve_times`` maps identifiers
+    to the time taken to resolve them; ``unresolved`` is the set of
+    identifiers which could not be resolved from the builtins or the
+    entrypoint group (these must be provided as variables when rules
+    are evaluated); ``errors`` maps rule names to any exception raised
+    while compiling them; and ``elapsed`` is the total time taken.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``WarmupReport`` object.
+        """
+
+        self.compile_times = {}
+        self.resolve_times = {}
+        self.unresolved = set()
+        self.errors = {}
+        self.elapsed = 0.0
+
+
+def warmup(policy):
+    """
+    Warm up a ``Policy``.  All rules are compiled, and all identifiers
+    referenced by any rule are resolved, so that the costs of parsing
+    and entrypoint resolution are not borne by the first evaluation of
+    each rule.
+
+    :param policy: The ``Policy`` to warm up.
+
+    :returns: An instance of ``WarmupReport``.
+    """
+
+    report = WarmupReport()
+    start = timeit.default_timer()
+
+    # Compile all the rules, collecting the identifiers they use
+    idents = set()
+    for name in policy:
+        rule = policy[name]
+
+        begin = timeit.default_timer()
+        try:
+            rule.compile(True)
+        except Exception as exc:
+            # Record the error; the rule will fail closed
+            report.errors[name] = exc
+            rule.compile()
+        try:
+            policy.engine.compile(rule)
+            idents |= identifiers(rule.instructions)
+        except Exception as exc:
+            report.errors.setdefault(name, exc)
+        report.compile_times[name] = timeit.default_timer() - begin
+
+    # Now resolve all the identifiers
+    for ident in sorted(idents):
+        begin = timeit.default_timer()
+        value = policy.resolve(ident)
+        report.resolve_times[ident] = timeit.default_timer() - begin
+
+        if value is None:
+            report.unresolved.add(ident)
+
+    report.elapsed = timeit.default_timer() - start
+
+    return report
+
+
+class Warmup(threading.Thread):
+    """
+    A thread which warms up a ``Policy`` in the background.  Once the
+    thread has completed, the ``report`` attribute will contain the
+    ``WarmupReport``.
+    """
+
+    def __init__(self, policy):
+        """
+        Initialize a ``Warmup`` object.
+
+        :param policy: The ``Policy`` to warm up.
+        """
+
+        super(Warmup, self).__init__(name='policies-warmup')
+        self.daemon = True
+
+        self.policy = policy
+        self.report = None
+
+    def run(self):
+        """
+        Warm up the policy.
+        """
+
+        self.report = warmup(self.policy)
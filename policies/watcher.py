@@ -0,0 +1,374 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import fnmatch
+import json
+import logging
+import os
+import select
+import threading
+import timeit
+
+import six
+
+from policies import rules
+from policies import versioned
+
+
+def load_json(path):
+    """
+    Load policy rules from a JSON file.  The file must contain a
+    single object mapping rule names to rule text.
+
+    :param path: The path of the file to load.
+
+    :returns: A dictionary mapping rule names to rule text.
+    """
+
+    with open(path) as f:
+        data = json.load(f)
+
+    if not isinstance(data, dict):
+        raise ValueError("%s: expected a JSON object" % path)
+
+    return data
+
+
+class Inotify(object):
+    """
+    A minimal interface to the Linux ``inotify`` facility, used to
+    wake the watcher when a watched directory changes.  Only available
+    where the C library provides ``inotify_init1()``; construction
+    raises ``OSError`` otherwise.
+    """
+
+    # Events of interest
+    MASK = (0x00000002 |  # IN_MODIFY
+            0x00000004 |  # IN_ATTRIB
+            0x00000008 |  # IN_CLOSE_WRITE
+            0x00000040 |  # IN_MOVED_FROM
+            0x00000080 |  # IN_MOVED_TO
+            0x00000100 |  # IN_CREATE
+            0x00000200)   # IN_DELETE
+
+    def __init__(self):
+        """
+        Initialize an ``Inotify`` object.
+        """
+
+        libname = ctypes.util.find_library('c')
+        if not libname:
+            raise OSError("C library not found")
+
+        self._libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK |
+                                           getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1() failed")
+
+    def watch(self, path):
+        """
+        Watch a directory for changes.
+
+        :param path: The path of the directory.
+        """
+
+        if isinstance(path, six.text_type):
+            path = path.encode('utf-8')
+
+        if self._libc.inotify_add_watch(self.fd, path, self.MASK) < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch() failed")
+
+    def wait(self, timeout):
+        """
+        Wait for a change to a watched directory.
+
+        :param timeout: The maximum time to wait, in seconds.
+
+        :returns: A ``True`` value if a change occurred, ``False`` if
+                  the timeout expired.
+        """
+
+        ready = select.select([self.fd], [], [], timeout)[0]
+        if not ready:
+            return False
+
+        # Drain the pending events; the watcher rescans anyway
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except OSError:
+            pass
+
+        return True
+
+    def close(self):
+        """
+        Release the ``inotify`` file descriptor.
+        """
+
+        os.close(self.fd)
+
+
+class PolicyWatcher(threading.Thread):
+    """
+    A thread which watches policy files and reloads the rules they
+    contain when they change.  Files are polled for changes to their
+    modification time and size; where ``inotify`` is available, it is
+    used to wake the watcher as soon as a watched directory changes.
+    Bursts of changes are debounced, and changed rules are parsed and
+    compiled in the watcher thread before being applied to the target,
+    so threads evaluating rules never bear the cost of parsing.
+
+    The ``reload_duration`` attribute gives the time taken by the last
+    reload; ``errors`` maps the names of rules which failed to compile
+    during the last reload to the error messages; ``load_errors`` maps
+    the paths of files which could not be loaded to the error
+    messages; and ``version`` is the last applied version.
+    """
+
+    def __init__(self, target, paths, loader=load_json, pattern='*.json',
+                 interval=1.0, debounce=0.25, use_inotify=True):
+        """
+        Initialize a ``PolicyWatcher`` object.
+
+        :param target: The ``policies.VersionedPolicy`` or
+                       ``policies.Policy`` to load rules into.  A
+                       ``VersionedPolicy`` is recommended, since
+                       reloaded rules are then swapped in atomically.
+        :param paths: A list of paths of files or directories to
+                      watch.  All files within a directory matching
+                      ``pattern`` are loaded.  Files are loaded in
+                      sorted order, and rules in later files override
+                      rules in earlier files.
+        :param loader: A callable which will be passed the path of a
+                       file and which must return a dictionary mapping
+                       rule names to rule text.  Defaults to
+                       ``load_json()``.
+        :param pattern: A glob pattern for the files to load from
+                        watched directories.
+        :param interval: The polling interval, in seconds.
+        :param debounce: The time, in seconds, for which the files
+                         must be unchanged before they are reloaded.
+        :param use_inotify: If ``True``, ``inotify`` is used where
+                            available.
+        """
+
+        super(PolicyWatcher, self).__init__(name='policies-watcher')
+        self.daemon = True
+
+        self.target = target
+        self.paths = list(paths)
+        self.loader = loader
+        self.pattern = pattern
+        self.interval = interval
+        self.debounce = debounce
+        self.use_inotify = use_inotify
+
+        self._stop_event = threading.Event()
+        self._signature = None
+        self._texts = {}
+
+        self.reload_duration = None
+        self.errors = {}
+        self.load_errors = {}
+        self.version = None
+
+    def files(self):
+        """
+        Determine the files to load.
+
+        :returns: A sorted list of file paths.
+        """
+
+        result = []
+        for path in self.paths:
+            if os.path.isdir(path):
+                result.extend(os.path.join(path, fname)
+                              for fname in os.listdir(path)
+                              if fnmatch.fnmatch(fname, self.pattern))
+            elif os.path.exists(path):
+                result.append(path)
+
+        return sorted(result)
+
+    def scan(self):
+        """
+        Compute a signature for the watched files.
+
+        :returns: A tuple of (path, modification time, size) tuples.
+        """
+
+        result = []
+        for path in self.files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            result.append((path, stat.st_mtime, stat.st_size))
+
+        return tuple(result)
+
+    def _apply(self, pol, changed, removed):
+        """
+        Apply reloaded rules to a ``Policy``.
+
+        :param pol: The ``Policy``.
+        :param changed: A list of changed ``Rule`` objects.
+        :param removed: A list of the names of removed rules.
+        """
+
+        for name in removed:
+            try:
+                del pol[name]
+            except KeyError:
+                pass
+
+        for rule in changed:
+            pol.set_rule(rule)
+
+    def reload(self):
+        """
+        Reload the watched files, compiling any changed rules and
+        applying them to the target.
+
+        :returns: A ``True`` value if the rules were applied, or
+                  ``False`` if a file could not be loaded, in which
+                  case the target is left unchanged.
+        """
+
+        start = timeit.default_timer()
+        signature = self.scan()
+
+        # Load all the files
+        texts = {}
+        load_errors = {}
+        for path, _mtime, _size in signature:
+            try:
+                texts.update(self.loader(path))
+            except Exception as exc:
+                load_errors[path] = str(exc)
+
+        self.load_errors = load_errors
+        if load_errors:
+            log = logging.getLogger('policies')
+            for path, msg in sorted(load_errors.items()):
+                log.warn("Failed to load policy file %r: %s" % (path, msg))
+            return False
+
+        # Compile the changed rules
+        if isinstance(self.target, versioned.VersionedPolicy):
+            engine = self.target.policy.engine
+        else:
+            engine = self.target.engine
+        changed = []
+        errors = {}
+        for name, text in sorted(texts.items()):
+            if self._texts.get(name) == text:
+                continue
+
+            rule = rules.Rule(name, text)
+            try:
+                rule.compile(True)
+            except Exception as exc:
+                # Record the error; the rule will fail closed
+                errors[name] = str(exc)
+                rule.compile()
+            engine.compile(rule)
+            changed.append(rule)
+        removed = [name for name in self._texts if name not in texts]
+
+        # Apply the changes
+        if isinstance(self.target, versioned.VersionedPolicy):
+            with self.target.update() as pol:
+                self._apply(pol, changed, removed)
+            self.version = self.target.version
+        else:
+            self._apply(self.target, changed, removed)
+            self.version = (self.version or 0) + 1
+
+        self._texts = texts
+        self._signature = signature
+        self.errors = errors
+        self.reload_duration = timeit.default_timer() - start
+
+        return True
+
+    def _waiter(self):
+        """
+        Construct a function which waits for a possible change to the
+        watched files.
+
+        :returns: A tuple of a callable taking a timeout and a cleanup
+                  callable.
+        """
+
+        if self.use_inotify:
+            try:
+                notifier = Inotify()
+            except (OSError, AttributeError):
+                pass
+            else:
+                try:
+                    for path in self.paths:
+                        notifier.watch(path if os.path.isdir(path) else
+                                       os.path.dirname(path) or '.')
+                except OSError:
+                    notifier.close()
+                else:
+                    return notifier.wait, notifier.close
+
+        return self._stop_event.wait, lambda: None
+
+    def run(self):
+        """
+        Watch the files, reloading them when they change.
+        """
+
+        wait, cleanup = self._waiter()
+        try:
+            while not self._stop_event.is_set():
+                signature = self.scan()
+                if signature != self._signature:
+                    # Debounce: wait for the files to settle
+                    while not self._stop_event.wait(self.debounce):
+                        latest = self.scan()
+                        if latest == signature:
+                            break
+                        signature = latest
+                    if self._stop_event.is_set():
+                        break
+
+                    if not self.reload():
+                        # Don't retry until the files change again
+                        self._signature = signature
+
+                wait(self.interval)
+        finally:
+            cleanup()
+
+    def stop(self):
+        """
+        Stop watching the files.  The thread exits within one polling
+        interval.
+        """
+
+        self._stop_event.set()
@@ -53,4 +53,7 @@ setup(
     packages=['policies'],
     install_requires=readreq('requirements.txt'),
     tests_require=readreq('test-requirements.txt'),
+    extras_require={
+        'numpy': ['numpy'],
+    },
 )
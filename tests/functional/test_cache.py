@@ -0,0 +1,134 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import mock
+
+import policies
+
+import tests
+
+
+class TestDecisionCache(tests.TestCase):
+    def setUp(self):
+        self.check = mock.Mock(spec=[],
+                               side_effect=lambda user: user == 'alice')
+        self.cache = policies.DecisionCache(lambda v: v.get('user'),
+                                            maxsize=2)
+        self.policy = policies.Policy(builtins={'check': self.check},
+                                      decision_cache=self.cache)
+        self.policy['is_admin'] = 'check(user)'
+        self.policy['edit'] = 'rule("is_admin") or user == owner'
+
+    def test_cached(self):
+        results = [bool(self.policy.evaluate('edit', {'user': user}))
+                   for user in ['alice', 'bob', 'alice', 'bob']]
+
+        self.assertEqual(results, [True, False, True, False])
+        self.assertEqual(self.check.call_count, 2)
+        self.assertEqual(self.cache.hit_ratio, 0.5)
+
+    def test_invalidated(self):
+        self.policy.evaluate('edit', {'user': 'alice'})
+
+        self.policy['is_admin'] = 'False'
+        result = self.policy.evaluate('edit', {'user': 'alice'})
+
+        self.assertFalse(result)
+        self.assertEqual(self.cache.invalidations, 1)
+
+    def test_evicted(self):
+        for user in ['alice', 'bob', 'carol', 'alice']:
+            self.policy.evaluate('edit', {'user': user})
+
+        self.assertEqual(self.check.call_count, 4)
+        self.assertEqual(self.cache.evictions, 2)
+
+
+class TestDependencyCache(tests.TestCase):
+    def setUp(self):
+        self.assignments = {'alice': ['admin'], 'bob': []}
+        self.lookups = []
+
+        @policies.tagged(lambda user: [('roles', user)])
+        def roles_of(user):
+            self.lookups.append(user)
+            return self.assignments.get(user, [])
+
+        self.cache = policies.DependencyCache()
+        self.policy = policies.Policy(
+            builtins=dict(policies.Policy.builtins, roles_of=roles_of),
+            decision_cache=self.cache)
+        self.policy['is_admin'] = '"admin" in roles_of(user)'
+        self.policy['edit'] = 'rule("is_admin") or user == target.owner'
+
+    def evaluate(self, user, owner, **kwargs):
+        kwargs.update(user=user, target=mock.Mock(owner=owner))
+        return bool(self.policy.evaluate('edit', kwargs))
+
+    def test_cached(self):
+        results = [
+            self.evaluate('alice', 'bob', request_id=1),
+            self.evaluate('alice', 'carol', request_id=2),
+            self.evaluate('bob', 'bob', request_id=3),
+            self.evaluate('bob', 'bob', request_id=4),
+            self.evaluate('bob', 'carol', request_id=5),
+        ]
+
+        self.assertEqual(results, [True, True, True, True, False])
+        self.assertEqual(self.lookups, ['alice', 'bob', 'bob'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 3))
+
+    def test_invalidate(self):
+        self.evaluate('alice', 'bob')
+        self.evaluate('bob', 'carol')
+        self.assignments = {'alice': [], 'bob': ['admin']}
+
+        self.cache.invalidate(('roles', 'bob'))
+        results = [self.evaluate('alice', 'bob'),
+                   self.evaluate('bob', 'carol')]
+
+        # The result for alice is stale until it, too, is invalidated
+        self.assertEqual(results, [True, True])
+        self.assertEqual(self.lookups, ['alice', 'bob', 'bob'])
+
+
+class TestCached(tests.TestCase):
+    def test_cached(self):
+        lookups = []
+
+        @policies.cached(ttl=None)
+        def member(user, group):
+            lookups.append((user, group))
+            return user == 'alice'
+
+        @policies.cached(key=lambda ctxt, group: (ctxt.variables['user'],
+                                                  group))
+        @policies.want_context
+        def in_group(ctxt, group):
+            ctxt.stack.append(member(ctxt.variables['user'], group))
+
+        pol = policies.Policy(builtins=dict(
+            policies.Policy.builtins, member=member, in_group=in_group))
+        pol['admin'] = 'in_group("admins") or member(user, "admins")'
+
+        results = [bool(pol.evaluate('admin', {'user': user}))
+                   for user in ['alice', 'bob', 'alice', 'bob']]
+
+        self.assertEqual(results, [True, False, True, False])
+        self.assertEqual(lookups, [('alice', 'admins'), ('bob', 'admins')])
+        self.assertEqual((in_group.cache.hits, in_group.cache.misses),
+                         (2, 2))
+        self.assertEqual((member.cache.hits, member.cache.misses), (2, 2))
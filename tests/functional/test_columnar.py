@@ -0,0 +1,85 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import collections
+import random
+import unittest
+
+import policies
+from policies import columnar
+
+import tests
+
+numpy = columnar.numpy
+
+
+Account = collections.namedtuple('Account', ['tier', 'flags'])
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestColumnar(tests.TestCase):
+    def setUp(self):
+        self.policy = policies.Policy()
+        self.policy['is_admin'] = '"admin" in roles'
+        self.policy['small'] = 'size * 2 < limit'
+        self.policy['get_doc'] = """
+            rule("is_admin") or owner == user or
+            (public and state in {"open", "review"} and rule("small")) or
+            (account.tier > 2 and 100 // size > 1)
+        """
+        self.policy['ratio'] = 'size > 0 {{ per_unit=limit / size }}'
+
+        rand = random.Random(41)
+        length = 500
+        self.columns = {
+            'owner': numpy.array([rand.randrange(5) for _i in range(length)],
+                                 dtype=numpy.int16),
+            'size': numpy.array([rand.randrange(-3, 100)
+                                 for _i in range(length)]),
+            'public': numpy.array([rand.random() < 0.5
+                                   for _i in range(length)]),
+            'state': numpy.array([rand.choice([u'open', u'review', u'draft'])
+                                  for _i in range(length)]),
+            'account': columnar.column([Account(rand.randrange(5), ())
+                                        for _i in range(length)]),
+        }
+
+    def expected(self, name, variables):
+        lists = dict((key, values.tolist())
+                     for key, values in self.columns.items())
+        return [bool(self.policy.evaluate(name, dict(
+            variables, **dict((key, values[i])
+                              for key, values in lists.items()))))
+                for i in range(len(lists['owner']))]
+
+    def test_differential(self):
+        for variables in ({'user': 1, 'roles': [], 'limit': 50},
+                          {'user': 3, 'roles': ['user'], 'limit': 10},
+                          {'user': 0, 'roles': ['admin'], 'limit': 0}):
+            result = self.policy.evaluate_columns('get_doc', self.columns,
+                                                  variables, chunk_size=64)
+
+            self.assertEqual(result.tolist(),
+                             self.expected('get_doc', variables))
+
+    def test_attrs(self):
+        variables = {'limit': 7}
+
+        result = self.policy.evaluate_columns('ratio', self.columns,
+                                              variables)
+
+        self.assertEqual(result.tolist(), self.expected('ratio', variables))
@@ -0,0 +1,81 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import logging
+
+from policies import authorization
+from policies import engines
+from policies import fuzz
+
+import tests
+
+
+class InvertingEngine(engines.StackEngine):
+    def evaluate(self, policy, name, compiled, attrs, variables):
+        authz = super(InvertingEngine, self).evaluate(
+            policy, name, compiled, attrs, variables)
+        return authorization.Authorization(not authz, authz._attrs)
+
+
+class TestDifferential(tests.TestCase):
+    def setUp(self):
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_generate_reproducible(self):
+        tester1 = fuzz.DifferentialTester([], seed=42)
+        tester2 = fuzz.DifferentialTester([], seed=42)
+
+        for _i in range(20):
+            self.assertEqual(tester1.generate_rule(), tester2.generate_rule())
+            self.assertEqual(tester1.generate_variables(),
+                             tester2.generate_variables())
+
+    def test_check_agree(self):
+        tester = fuzz.DifferentialTester([engines.StackEngine(),
+                                          engines.StackEngine()])
+
+        result = tester.check('a + 1 == rule("helper") {{ x=a }}',
+                              'a * 2', {'a': 1})
+
+        self.assertEqual(result, None)
+
+    def test_check_disagree(self):
+        reference = engines.StackEngine()
+        inverting = InvertingEngine()
+        tester = fuzz.DifferentialTester([reference, inverting])
+
+        result = tester.check('a {{ x=a }}', 'False', {'a': 1})
+
+        self.assertEqual(result.text, 'a {{ x=a }}')
+        self.assertEqual(result.results, [
+            (reference, (True, (('x', 1), ('z', 'default')))),
+            (inverting, (False, (('x', 1), ('z', 'default')))),
+        ])
+
+    def test_run_reference(self):
+        tester = fuzz.DifferentialTester([engines.StackEngine(),
+                                          engines.StackEngine()], seed=1)
+
+        self.assertEqual(tester.run(50), [])
+
+    def test_run_detects(self):
+        tester = fuzz.DifferentialTester([engines.StackEngine(),
+                                          InvertingEngine()], seed=1)
+
+        self.assertEqual(len(tester.run(10)), 10)
@@ -17,6 +17,7 @@
 import mock
 import pyparsing
 
+from policies import lazy
 from policies import parser
 from policies import policy
 
@@ -336,3 +337,59 @@ class TestEvaluation(tests.TestCase):
         if errors > 0:
             self.fail("Evaluation failures encountered; see output "
                       "for information")
+
+
+class TestPure(tests.TestCase):
+    def test_memoized(self):
+        calls = []
+
+        @policy.pure
+        def has_role(user, role):
+            calls.append((user, role))
+            return role in ('admin', 'reader')
+
+        pol = policy.Policy(builtins=dict(policy.Policy.builtins,
+                                          has_role=has_role))
+        pol['is_admin'] = 'has_role(user, "admin")'
+        pol['is_reader'] = 'has_role(user, "reader") and rule("is_admin")'
+        pol['edit'] = ('has_role(user, "reader") and rule("is_reader") '
+                       '{{ admin=has_role(user, "admin") }}')
+
+        results = [pol.evaluate('edit', {'user': 'alice'}) for _i in range(2)]
+
+        self.assertEqual([bool(result) for result in results], [True, True])
+        self.assertEqual(calls, [('alice', 'reader'), ('alice', 'admin')] * 2)
+        self.assertEqual((has_role.pure_hits, has_role.pure_misses), (4, 4))
+
+
+class TestLazy(tests.TestCase):
+    def test_lazy(self):
+        roles = mock.Mock(return_value=['admin'])
+        projects = mock.Mock(return_value=['p1'])
+        pol = policy.Policy()
+        pol['is_admin'] = '"admin" in roles'
+        pol['edit'] = ('rule("is_admin") or project in projects '
+                       '{{ count=len(roles) }}')
+        variables = {
+            'roles': lazy.Lazy(roles),
+            'projects': lazy.Lazy(projects),
+            'project': 'p2',
+        }
+
+        result = pol.evaluate('edit', variables)
+
+        self.assertTrue(result)
+        self.assertEqual(result.count, 1)
+        roles.assert_called_once_with()
+        self.assertFalse(projects.called)
+        self.assertEqual(pol.lazy_stats.counts, {'roles': 1})
+
+    def test_lazy_fails_closed(self):
+        pol = policy.Policy()
+        pol['edit'] = 'bool(roles)'
+
+        result = pol.evaluate('edit', {'roles': lazy.Lazy(
+            mock.Mock(side_effect=IOError('unavailable')))})
+
+        self.assertFalse(result)
+        self.assertEqual(pol.lazy_stats.errors, {'roles': 1})
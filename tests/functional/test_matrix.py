@@ -0,0 +1,71 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import collections
+import random
+import unittest
+
+import policies
+from policies import matrix
+
+import tests
+
+numpy = matrix.numpy
+
+
+User = collections.namedtuple('User', ['name', 'roles', 'dept'])
+Document = collections.namedtuple('Document',
+                                  ['owner', 'dept', 'public', 'size'])
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestMatrix(tests.TestCase):
+    def setUp(self):
+        self.policy = policies.Policy()
+        self.policy['is_admin'] = '"admin" in user.roles'
+        self.policy['review'] = """
+            rule("is_admin") or doc.owner == user.name or
+            (doc.dept == user.dept and "reviewer" in user.roles) or
+            (doc.public and 100 // doc.size < limit)
+        """
+
+        rand = random.Random(42)
+        self.principals = [
+            {'user': User('u%d' % i,
+                          rand.choice([[], ['reviewer'], ['admin']]),
+                          rand.choice(['eng', 'ops', None]))}
+            for i in range(30)
+        ]
+        self.resources = [
+            {'doc': Document('u%d' % rand.randrange(40),
+                             rand.choice(['eng', 'ops', 'hr']),
+                             rand.random() < 0.5, rand.randrange(5))}
+            for _i in range(200)
+        ]
+
+    def test_differential(self):
+        variables = {'limit': 30}
+
+        result = self.policy.evaluate_matrix(
+            'review', self.principals, self.resources, variables)
+
+        expected = [[bool(self.policy.evaluate(
+            'review', dict(variables, **dict(principal, **resource))))
+            for resource in self.resources]
+            for principal in self.principals]
+        self.assertEqual(result.toarray().tolist(), expected)
+        self.assertEqual(result.count(), sum(map(sum, expected)))
+        self.assertLess(len(result.rows), len(self.principals))
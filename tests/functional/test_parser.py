@@ -307,6 +307,23 @@ class TestParseRule(tests.TestCase):
             Ident('level'), Constant(400), gt_op, set_authz,
             Ident('level'), AuthorizationAttr('level'),
         ])),
+
+        # Folding must be bounded and must not raise
+        ('1 / 0', Instructions([
+            Constant(1), Constant(0), true_div_op, set_authz,
+        ])),
+        ('2 ** 10 ** 9', Instructions([
+            Constant(2), Constant(10 ** 9), pow_op, set_authz,
+        ])),
+        ('"x" * 10 ** 10', Instructions([
+            Constant('x'), Constant(10 ** 10), mul_op, set_authz,
+        ])),
+        ('1 << 10 ** 9', Instructions([
+            Constant(1), Constant(10 ** 9), left_shift_op, set_authz,
+        ])),
+        ('"%999999999d" % 1', Instructions([
+            Constant('%999999999d'), Constant(1), mod_op, set_authz,
+        ])),
     ]
 
     def test_parse(self):
@@ -14,7 +14,12 @@
 # along with this program.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+import random
+
+import mock
+
 import policies
+from policies import fuzz
 
 import tests
 
@@ -99,3 +104,229 @@ class TestRules(tests.TestCase):
         self.assertFalse(result)
         self.assertEqual(result.payment, None)
         self.assertEqual(result.name, None)
+
+
+class TestFrozenRules(TestRules):
+    def evaluate(self, user, target):
+        return self.policy.freeze().evaluate('user_update',
+                                             {'user': user, 'target': target})
+
+    def test_snapshot_isolation(self):
+        pol = policies.Policy()
+        pol.update(self.policy)
+        frozen = pol.freeze()
+
+        pol['is_admin'] = 'True'
+
+        result = frozen.evaluate('user_update',
+                                 {'user': self.alice, 'target': self.bob})
+        self.assertFalse(result)
+
+        result = pol.freeze().evaluate('user_update',
+                                       {'user': self.alice,
+                                        'target': self.bob})
+        self.assertTrue(result)
+
+
+class TestOverlayRules(TestRules):
+    def evaluate(self, user, target):
+        return self.policy.overlay().evaluate('user_update',
+                                              {'user': user, 'target': target})
+
+    def test_override(self):
+        overlay = self.policy.overlay()
+        overlay['is_admin'] = 'True'
+
+        # The nested rule is taken from the overlay
+        result = overlay.evaluate('user_update',
+                                  {'user': self.alice, 'target': self.bob})
+        self.assertTrue(result)
+        self.assertTrue(result.payment)
+
+        # The parent is unaffected
+        result = self.policy.evaluate('user_update',
+                                      {'user': self.alice,
+                                       'target': self.bob})
+        self.assertFalse(result)
+
+        # Only the override is stored on the overlay
+        self.assertEqual(list(overlay._rules), ['is_admin'])
+        self.assertTrue(overlay['user_update'] is
+                        self.policy['user_update'])
+
+
+class TestEvaluateMany(TestRules):
+    def evaluate(self, user, target):
+        return next(self.policy.evaluate_many(
+            'user_update', [{'user': user, 'target': target}]))
+
+    def test_many(self):
+        users = [self.alice, self.bob, self.charlie, self.charlie_admin,
+                 self.deborah]
+        variables = [{'user': user, 'target': target}
+                     for user in users for target in users]
+
+        expected = [self.policy.evaluate('user_update', v) for v in variables]
+        results = list(self.policy.evaluate_many('user_update', variables))
+        bitmap = self.policy.evaluate_many('user_update', variables,
+                                           bitmap=True)
+
+        self.assertEqual([(bool(a), a.payment, a.name) for a in results],
+                         [(bool(a), a.payment, a.name) for a in expected])
+        self.assertEqual(list(bitmap), [int(bool(a)) for a in expected])
+
+    def test_recursion(self):
+        pol = policies.Policy()
+        pol['loop'] = 'rule("loop") or x'
+
+        results = pol.evaluate_many('loop', [{'x': True}, {'x': True}])
+
+        self.assertEqual([bool(a) for a in results], [False, False])
+
+
+class TestFilter(tests.TestCase):
+    def test_filter(self):
+        users = [User('alice'), User('bob'), User('charlie', ['admins']),
+                 User('charlie', ['admins'], True), User('deborah', [], True)]
+        pol = policies.Policy()
+        pol['is_admin'] = 'user.in_group("admins") and user.admin'
+        pol['user_update'] = 'user == target or rule("is_admin")'
+
+        for user in users:
+            expected = [target for target in users
+                        if pol.evaluate('user_update',
+                                        {'user': user, 'target': target})]
+            result = list(pol.filter('user_update', users, 'target',
+                                     {'user': user}, chunk_size=2))
+
+            self.assertEqual(result, expected)
+
+    def test_hoisted(self):
+        calls = []
+
+        def check(role):
+            calls.append(role)
+            return role == 'admin'
+
+        pol = policies.Policy(builtins={'check': check})
+        pol['is_admin'] = 'check(role)'
+        pol['get'] = 'rule("is_admin") or item.in_group("public")'
+
+        items = [User('u%d' % i, ['public'] if i % 2 == 0 else [])
+                 for i in range(10)]
+        result = list(pol.filter('get', items, fixed={'role': 'user'},
+                                 chunk_size=3))
+
+        self.assertEqual(result, items[::2])
+        self.assertEqual(calls, ['user'])
+
+    def test_lazy(self):
+        pol = policies.Policy()
+        pol['get'] = 'item > 1'
+
+        def items():
+            for i in range(5):
+                yield i
+            raise AssertionError("consumed too far")
+
+        result = pol.filter('get', items(), chunk_size=2)
+
+        self.assertEqual([next(result), next(result)], [2, 3])
+
+
+class TestPartial(TestRules):
+    def evaluate(self, user, target):
+        return self.policy.partial('user_update', {'user': user}).evaluate(
+            {'target': target})
+
+    def test_decision(self):
+        pol = policies.Policy()
+        pol['is_admin'] = '"admin" in user.roles'
+        pol['get'] = 'rule("is_admin") or item.owner == user.name'
+        admin = mock.Mock(roles=['admin'])
+        other = mock.Mock(roles=[])
+        other.name = 'bob'
+
+        allowed = pol.partial('get', {'user': admin})
+        residual = pol.partial('get', {'user': other})
+        denied = pol.partial('get', {'item': mock.Mock(owner='alice'),
+                                     'user': other})
+
+        self.assertEqual(allowed.decision, True)
+        self.assertEqual(residual.decision, None)
+        self.assertEqual(denied.decision, False)
+        self.assertTrue(residual.evaluate({'item': mock.Mock(owner='bob')}))
+        self.assertFalse(residual.evaluate(
+            {'item': mock.Mock(owner='alice')}))
+
+    def test_differential(self):
+        tester = fuzz.DifferentialTester([], seed=39, max_depth=2)
+        rand = random.Random(39)
+
+        for _i in range(20):
+            pol = policies.Policy()
+            pol.declare('fuzz', attrs={'z': 'default'})
+            pol['fuzz'] = tester.generate_rule()
+            pol['helper'] = tester.generate_expr(1)
+            variables = tester.generate_variables()
+            known = dict((k, v) for k, v in variables.items()
+                         if rand.randrange(2))
+            unknown = dict((k, v) for k, v in variables.items()
+                           if k not in known)
+
+            expected = pol.evaluate('fuzz', variables)
+            residual = pol.partial('fuzz', known)
+            result = residual.evaluate(unknown)
+
+            self.assertEqual(fuzz.signature(result),
+                             fuzz.signature(expected))
+            if residual.constant:
+                self.assertEqual(residual.decision, bool(expected))
+
+
+class TestEvaluateAll(TestRules):
+    def evaluate(self, user, target):
+        return self.policy.evaluate_all(
+            {'user': user, 'target': target})['user_update']
+
+    def test_shared(self):
+        calls = []
+
+        def check(role):
+            calls.append(role)
+            return role == 'admin'
+
+        pol = policies.Policy(builtins={'check': check})
+        pol['is_admin'] = 'check("admin")'
+        pol['a'] = 'rule("is_admin") or check("editor")'
+        pol['b'] = 'check("editor") and not rule("is_admin")'
+        pol['c'] = 'check("admin") {{ editor=check("editor") }}'
+
+        result = pol.evaluate_all()
+
+        self.assertEqual(dict((k, bool(v)) for k, v in result.items()), {
+            'is_admin': True,
+            'a': True,
+            'b': False,
+            'c': True,
+        })
+        self.assertFalse(result['c'].editor)
+        self.assertEqual(sorted(calls), ['admin', 'editor'])
+
+    def test_differential(self):
+        tester = fuzz.DifferentialTester([], seed=37, max_depth=2)
+
+        for _i in range(20):
+            pol = policies.Policy()
+            pol['helper'] = tester.generate_expr(1)
+            pol.declare('r0', attrs={'z': 'default'})
+            for j in range(4):
+                pol['r%d' % j] = tester.generate_rule()
+
+            variables = tester.generate_variables()
+            results = pol.evaluate_all(dict(variables))
+
+            for name in pol:
+                expected = pol.evaluate(name, dict(variables))
+                self.assertTrue(fuzz._same(fuzz.signature(results[name]),
+                                           fuzz.signature(expected)))
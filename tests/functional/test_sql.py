@@ -0,0 +1,116 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import collections
+import sqlite3
+
+import policies
+from policies import sql
+
+import tests
+
+
+Document = collections.namedtuple('Document',
+                                  ['id', 'owner', 'state', 'size', 'public'])
+
+
+class TestSQL(tests.TestCase):
+    documents = [
+        Document(1, 'alice', 'open', 10, 1),
+        Document(2, 'bob', 'open', 500, 0),
+        Document(3, 'bob', 'closed', 20, 1),
+        Document(4, None, None, None, None),
+        Document(5, 'carol', 'draft', 50, 1),
+        Document(6, 'alice', None, 1000, 0),
+    ]
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute('CREATE TABLE docs (id INTEGER, owner TEXT, '
+                        'state TEXT, size INTEGER, public INTEGER)')
+        self.db.executemany('INSERT INTO docs VALUES (?, ?, ?, ?, ?)',
+                            self.documents)
+        self.db.row_factory = lambda cursor, row: Document(*row)
+
+        self.policy = policies.Policy()
+        self.policy['is_admin'] = '"admin" in user.roles'
+        self.policy['get_doc'] = """
+            rule("is_admin") or doc.owner == user.name or
+            (doc.public and doc.state not in {"draft", None} and
+             not doc.size > limit)
+        """
+
+    def tearDown(self):
+        self.db.close()
+
+    def select(self, trans):
+        cursor = self.db.execute(
+            'SELECT * FROM docs WHERE %s ORDER BY id' % trans.where,
+            trans.params)
+        return [doc.id for doc in trans.filter(cursor)]
+
+    def expected(self, variables):
+        return [doc.id for doc in self.documents
+                if self.policy.evaluate('get_doc',
+                                        dict(variables, doc=doc))]
+
+    def user(self, name, roles=()):
+        return collections.namedtuple('User', 'name roles')(name, roles)
+
+    def test_exact(self):
+        variables = {'user': self.user('alice'), 'limit': 100}
+        residual = self.policy.partial('get_doc', variables)
+
+        trans = sql.translate(residual, 'doc', not_null=['size'],
+                              numeric=['public'])
+
+        self.assertTrue(trans.exact)
+        self.assertEqual(self.select(trans), self.expected(variables))
+        self.assertEqual(self.select(trans), [1, 3, 6])
+
+    def test_nullable(self):
+        variables = {'user': self.user('bob'), 'limit': 100}
+        residual = self.policy.partial('get_doc', variables)
+
+        trans = sql.translate(residual, 'doc')
+
+        self.assertFalse(trans.exact)
+        self.assertEqual(self.select(trans), self.expected(variables))
+
+    def test_post_filter(self):
+        self.policy['get_doc'] = """
+            doc.owner == user.name or (doc.public and len(doc.state) < 5)
+        """
+        variables = {'user': self.user('carol')}
+        residual = self.policy.partial('get_doc', variables)
+
+        trans = sql.translate(residual, 'doc', numeric=['public'])
+
+        self.assertFalse(trans.exact)
+        self.assertEqual(trans.untranslated[0][0], residual.expr.rhs.rhs)
+        self.assertEqual(self.select(trans), self.expected(variables))
+        self.assertEqual(self.select(trans), [1, 5])
+
+    def test_admin(self):
+        variables = {'user': self.user('dave', ['admin']), 'limit': 100}
+        residual = self.policy.partial('get_doc', variables)
+
+        trans = sql.translate(residual, 'doc')
+
+        self.assertEqual(residual.decision, True)
+        self.assertEqual(trans.where, '(1 = 1)')
+        self.assertEqual(self.select(trans), [1, 2, 3, 4, 5, 6])
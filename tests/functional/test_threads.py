@@ -0,0 +1,85 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import mock
+
+import policies
+from policies import parser
+
+import tests
+
+
+def hammer(func, nthreads=8):
+    barrier = threading.Event()
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(func())
+
+    threads = [threading.Thread(target=worker) for _i in range(nthreads)]
+    for thread in threads:
+        thread.start()
+    barrier.set()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class TestConcurrentEvaluation(tests.TestCase):
+    def test_compiled_once(self):
+        real_parse_rule = parser.parse_rule
+
+        def slow_parse_rule(*args, **kwargs):
+            time.sleep(0.01)
+            return real_parse_rule(*args, **kwargs)
+
+        pol = policies.Policy()
+        pol['check'] = 'rule("nested") and a == 1'
+        pol['nested'] = 'True'
+
+        with mock.patch.object(parser, 'parse_rule',
+                               side_effect=slow_parse_rule) as mock_parse:
+            results = hammer(lambda: bool(pol.evaluate('check', {'a': 1})))
+
+        self.assertEqual(results, [True] * 8)
+        self.assertEqual(mock_parse.call_count, 2)
+
+    def test_resolved_once(self):
+        pol = policies.Policy(group='policies.test')
+
+        def slow_load(name):
+            time.sleep(0.01)
+            return lambda x: x * 2
+
+        with mock.patch.object(pol._entrypoints, 'load',
+                               side_effect=slow_load) as mock_load:
+            funcs = hammer(lambda: pol.resolve('double'))
+
+        self.assertEqual(len(set(funcs)), 1)
+        mock_load.assert_called_once_with('double')
+
+    def test_get_doc_shared(self):
+        pol = policies.Policy()
+
+        docs = hammer(lambda: pol.get_doc('undeclared'))
+
+        self.assertEqual(len(set(id(doc) for doc in docs)), 1)
+        self.assertTrue(pol.get_doc('undeclared') is docs[0])
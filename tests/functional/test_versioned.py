@@ -0,0 +1,58 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import threading
+
+import policies
+
+import tests
+
+
+class TestVersionedSwap(tests.TestCase):
+    def test_consistent_nested_rules(self):
+        handle = policies.VersionedPolicy()
+        with handle.update() as pol:
+            pol['check'] = ('rule("a") == rule("b") and '
+                            'rule("b") == rule("c")')
+            pol['a'] = pol['b'] = pol['c'] = 'True'
+
+        # Each version sets all nested rules to the same value, so an
+        # evaluation that mixed versions would return False
+        failures = []
+        done = threading.Event()
+
+        def reader():
+            while not done.is_set():
+                if not handle.evaluate('check'):
+                    failures.append(handle.version)
+
+        readers = [threading.Thread(target=reader) for _i in range(4)]
+        for thread in readers:
+            thread.start()
+
+        try:
+            for i in range(200):
+                with handle.update() as pol:
+                    text = 'True' if i % 2 else 'False'
+                    for name in ('a', 'b', 'c'):
+                        pol[name] = text
+        finally:
+            done.set()
+            for thread in readers:
+                thread.join()
+
+        self.assertEqual(failures, [])
+        self.assertEqual(handle.version, 202)
@@ -0,0 +1,625 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import mock
+
+try:
+    import asyncio
+
+    from policies import aio
+except (ImportError, SyntaxError):
+    aio = None
+from policies import cache
+from policies import instructions
+from policies import lazy
+from policies import policy
+
+import tests
+
+
+def resolved(loop, value):
+    fut = loop.create_future()
+    fut.set_result(value)
+    return fut
+
+
+class Once(object):
+    """
+    An awaitable which, like a coroutine, may only be awaited once.
+    """
+
+    def __init__(self, future):
+        self.future = future
+        self.awaited = False
+
+    def __await__(self):
+        if self.awaited:
+            raise RuntimeError('cannot reuse already awaited awaitable')
+        self.awaited = True
+        return self.future.__await__()
+
+
+class Pushes(object):
+    """
+    An awaitable which, like a coroutine of a function wanting the
+    evaluation context, pushes a value onto the stack when awaited.
+    """
+
+    def __init__(self, ctxt, value, future):
+        self.ctxt = ctxt
+        self.value = value
+        self.future = future
+
+    def __await__(self):
+        self.ctxt.stack.append(self.value)
+        return self.future.__await__()
+
+
+def failed(loop, exc):
+    fut = loop.create_future()
+    fut.set_exception(exc)
+    return fut
+
+
+@unittest.skipIf(aio is None, "asyncio support requires Python 3.5")
+class AioTestCase(tests.TestCase):
+    def setUp(self):
+        super(AioTestCase, self).setUp()
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+
+    def run_loop(self, coro):
+        return self.loop.run_until_complete(coro)
+
+
+class TestFailed(AioTestCase):
+    def test_resolve(self):
+        exc = IOError('unavailable')
+        var = aio._Failed(exc)
+
+        self.assertEqual(repr(var), "<_Failed OSError('unavailable')>")
+        with self.assertRaises(IOError) as cm:
+            var.resolve()
+        self.assertIs(cm.exception, exc)
+
+
+class TestCoalescer(AioTestCase):
+    def make_policy(self, key):
+        self.fetch = mock.Mock(side_effect=lambda x: resolved(self.loop, x),
+                               spec=[])
+        pol = policy.Policy(
+            builtins=dict(policy.Policy.builtins, fetch=self.fetch),
+            coalescer=aio.Coalescer(key))
+        pol['rule'] = 'fetch(user) == "alice"'
+        return pol
+
+    def test_init(self):
+        result = aio.Coalescer('key')
+
+        self.assertEqual(result.key, 'key')
+        self.assertEqual(result.evaluations, 0)
+        self.assertEqual(result.coalesced, 0)
+        self.assertEqual(result.bypasses, 0)
+        self.assertEqual(result.in_flight, 0)
+
+    def test_coalesced(self):
+        pol = self.make_policy(lambda v: v['user'])
+
+        results = self.run_loop(asyncio.gather(*[
+            pol.evaluate_async('rule', {'user': 'alice'}) for _i in range(5)
+        ]))
+
+        self.assertTrue(results[0])
+        for result in results[1:]:
+            self.assertIs(result, results[0])
+        self.fetch.assert_called_once_with('alice')
+        self.assertEqual(pol.coalescer.evaluations, 1)
+        self.assertEqual(pol.coalescer.coalesced, 4)
+        self.assertEqual(pol.coalescer.in_flight, 0)
+
+    def test_distinct(self):
+        pol = self.make_policy(lambda v: v['user'])
+        pol['other'] = 'fetch(user) == "bob"'
+
+        results = self.run_loop(asyncio.gather(
+            pol.evaluate_async('rule', {'user': 'alice'}),
+            pol.evaluate_async('rule', {'user': 'bob'}),
+            pol.evaluate_async('other', {'user': 'bob'}),
+            pol.freeze().evaluate_async('rule', {'user': 'alice'}),
+        ))
+
+        self.assertEqual([bool(result) for result in results],
+                         [True, False, True, True])
+        self.assertEqual(self.fetch.call_count, 4)
+        self.assertEqual(pol.coalescer.evaluations, 4)
+        self.assertEqual(pol.coalescer.coalesced, 0)
+
+    def test_sequential(self):
+        pol = self.make_policy(lambda v: v['user'])
+
+        for _i in range(2):
+            self.assertTrue(self.run_loop(
+                pol.evaluate_async('rule', {'user': 'alice'})))
+
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertEqual(pol.coalescer.evaluations, 2)
+
+    def test_bypass(self):
+        pol = self.make_policy(lambda v: None)
+
+        results = self.run_loop(asyncio.gather(*[
+            pol.evaluate_async('rule', {'user': 'alice'}) for _i in range(2)
+        ]))
+
+        self.assertTrue(all(results))
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertEqual(pol.coalescer.bypasses, 2)
+        self.assertEqual(pol.coalescer.evaluations, 0)
+
+    def test_generation(self):
+        pending = self.loop.create_future()
+        evaluate = mock.Mock(return_value=pending)
+        coalescer = aio.Coalescer(lambda v: 'key')
+        pol = mock.Mock(generation=1)
+
+        first = self.loop.create_task(
+            coalescer.evaluate(pol, 'rule', {}, evaluate))
+        self.run_loop(asyncio.sleep(0))
+        pol.generation = 2
+        second = self.loop.create_task(
+            coalescer.evaluate(pol, 'rule', {}, evaluate))
+        self.run_loop(asyncio.sleep(0))
+        pending.set_result('authz')
+
+        self.assertEqual(self.run_loop(asyncio.gather(first, second)),
+                         ['authz', 'authz'])
+        self.assertEqual(evaluate.call_count, 2)
+        self.assertEqual(coalescer.evaluations, 2)
+
+    def test_cancelled_caller(self):
+        pending = self.loop.create_future()
+        evaluate = mock.Mock(return_value=pending)
+        coalescer = aio.Coalescer(lambda v: 'key')
+
+        first = self.loop.create_task(
+            coalescer.evaluate('policy', 'rule', {}, evaluate))
+        second = self.loop.create_task(
+            coalescer.evaluate('policy', 'rule', {}, evaluate))
+        self.run_loop(asyncio.sleep(0))
+        first.cancel()
+        pending.set_result('authz')
+
+        self.assertEqual(self.run_loop(second), 'authz')
+        self.assertTrue(first.cancelled())
+        evaluate.assert_called_once_with('rule', {})
+        self.assertEqual(coalescer.coalesced, 1)
+        self.assertEqual(coalescer.in_flight, 0)
+
+
+class TestAsyncLazy(AioTestCase):
+    def test_sync_evaluate_fails_closed(self):
+        pol = policy.Policy()
+        pol['rule'] = 'allowed'
+
+        result = pol.evaluate('rule', {
+            'allowed': aio.AsyncLazy(lambda: resolved(self.loop, False)),
+        })
+
+        self.assertFalse(result)
+        self.assertEqual(pol.lazy_stats.errors, {'allowed': 1})
+
+
+class TestNeeded(AioTestCase):
+    def test_known(self):
+        pol = policy.Policy()
+        pol['rule'] = 'a and len(b) > 0'
+
+        result = aio.needed(pol, 'rule', {'a': 1, 'b': 2, 'c': 3})
+
+        self.assertEqual(result, set(['a', 'b']))
+
+    @mock.patch('policies.analysis.identifiers', return_value=None)
+    def test_unknown(self, mock_identifiers):
+        pol = policy.Policy()
+
+        result = aio.needed(pol, 'rule', {'a': 1, 'b': 2})
+
+        self.assertEqual(result, set(['a', 'b']))
+        mock_identifiers.assert_called_once_with(pol, 'rule')
+
+    def test_want_context(self):
+        @policy.want_context
+        def func(ctxt):
+            ctxt.stack.append(True)
+
+        pol = policy.Policy(builtins=dict(policy.Policy.builtins, func=func))
+        pol['rule'] = 'a and func()'
+
+        result = aio.needed(pol, 'rule', {'a': 1, 'b': 2})
+
+        self.assertEqual(result, set(['a', 'b']))
+
+
+class TestPrefetch(AioTestCase):
+    def test_no_tasks(self):
+        pol = policy.Policy()
+        pol['rule'] = 'a'
+        variables = {'a': 1}
+
+        result = self.run_loop(aio.prefetch(pol, 'rule', variables))
+
+        self.assertEqual(result, variables)
+        self.assertIsNot(result, variables)
+
+    @mock.patch('policies.aio.needed')
+    def test_nothing_pending(self, mock_needed):
+        pol = policy.Policy()
+
+        result = self.run_loop(aio.prefetch(pol, 'rule', {
+            'a': lazy.Lazy(mock.Mock()),
+        }))
+
+        self.assertEqual(list(result), ['a'])
+        self.assertFalse(mock_needed.called)
+
+    def test_resolves_needed(self):
+        pol = policy.Policy()
+        pol['rule'] = 'a and b and c'
+        provider = mock.Mock(return_value=resolved(self.loop, 'b'))
+        unneeded = mock.Mock()
+        sync = lazy.Lazy(mock.Mock())
+
+        result = self.run_loop(aio.prefetch(pol, 'rule', {
+            'a': resolved(self.loop, 'a'),
+            'b': aio.AsyncLazy(provider),
+            'c': sync,
+            'd': aio.AsyncLazy(unneeded),
+        }))
+
+        self.assertEqual(result['a'], 'a')
+        self.assertEqual(result['b'], 'b')
+        self.assertIs(result['c'], sync)
+        self.assertIsInstance(result['d'], aio.AsyncLazy)
+        provider.assert_called_once_with()
+        self.assertFalse(unneeded.called)
+        self.assertFalse(sync.provider.called)
+        self.assertEqual(pol.lazy_stats.counts, {'a': 1, 'b': 1})
+        self.assertEqual(pol.lazy_stats.errors, {})
+
+    def test_failure(self):
+        pol = policy.Policy()
+        pol['rule'] = 'a'
+        exc = IOError('unavailable')
+
+        result = self.run_loop(aio.prefetch(pol, 'rule', {
+            'a': failed(self.loop, exc),
+        }))
+
+        self.assertIsInstance(result['a'], aio._Failed)
+        self.assertIs(result['a'].exc, exc)
+        self.assertEqual(pol.lazy_stats.errors, {'a': 1})
+
+    def test_timeout(self):
+        pol = policy.Policy()
+        pol['rule'] = 'a and b'
+        pending = self.loop.create_future()
+
+        result = self.run_loop(aio.prefetch(pol, 'rule', {
+            'a': resolved(self.loop, 'a'),
+            'b': pending,
+        }, timeout=0.01))
+
+        self.assertEqual(result['a'], 'a')
+        self.assertIsInstance(result['b'], aio._Failed)
+        self.assertIsInstance(result['b'].exc, asyncio.TimeoutError)
+        self.assertTrue(pending.cancelled())
+
+
+class TestRun(AioTestCase):
+    def make_policy(self, **funcs):
+        return policy.Policy(builtins=dict(policy.Policy.builtins, **funcs))
+
+    def test_norule(self):
+        pol = policy.Policy()
+
+        result = self.run_loop(aio.run(pol, 'rule', None, None, {}))
+
+        self.assertFalse(result)
+
+    def test_awaits_calls(self):
+        pol = self.make_policy(
+            fetch=lambda x: resolved(self.loop, x * 2),
+            plain=lambda x: x + 1,
+        )
+        pol['rule'] = 'fetch(2) == 4 and plain(fetch(1)) == 3'
+
+        result = self.run_loop(pol.evaluate_async('rule'))
+
+        self.assertTrue(result)
+
+    def test_nested_rule(self):
+        pol = self.make_policy(fetch=lambda x: resolved(self.loop, x))
+        pol['inner'] = 'fetch(value)'
+        pol['rule'] = 'rule("inner") and rule("inner") and rule("missing")'
+
+        result = self.run_loop(pol.evaluate_async('rule', {'value': 1}))
+
+        self.assertFalse(result)
+
+    def test_nested_rule_cached(self):
+        fetch = mock.Mock(side_effect=lambda x: resolved(self.loop, x),
+                          spec=[])
+        pol = self.make_policy(fetch=fetch)
+        pol['inner'] = 'fetch(value)'
+        pol['rule'] = 'rule("inner") and rule("inner")'
+
+        result = self.run_loop(pol.evaluate_async('rule', {'value': 1}))
+
+        self.assertTrue(result)
+        fetch.assert_called_once_with(1)
+
+    def test_authz_attrs(self):
+        pol = self.make_policy(fetch=lambda x: resolved(self.loop, x))
+        pol['rule'] = 'True {{ level=fetch(5) }}'
+
+        result = self.run_loop(pol.evaluate_async('rule'))
+
+        self.assertTrue(result)
+        self.assertEqual(result.level, 5)
+
+    def test_pure(self):
+        calls = []
+
+        @policy.pure
+        def fetch(x):
+            calls.append(x)
+            return resolved(self.loop, x)
+
+        pol = self.make_policy(fetch=fetch)
+        pol['rule'] = 'fetch(1) + fetch(1) + len(fetch(l)) == 3'
+
+        result = self.run_loop(pol.evaluate_async('rule', {'l': [1]}))
+
+        self.assertTrue(result)
+        self.assertEqual(calls, [1, [1]])
+        self.assertEqual((fetch.pure_hits, fetch.pure_misses), (1, 1))
+
+    def test_cached(self):
+        calls = []
+
+        @cache.cached(ttl=None)
+        def fetch(x):
+            calls.append(x)
+            return Once(resolved(self.loop, x == 'alice'))
+
+        pol = self.make_policy(fetch=fetch)
+        pol['rule'] = 'fetch(user)'
+
+        results = [self.run_loop(pol.evaluate_async('rule', {'user': user}))
+                   for user in ('alice', 'alice', 'bob', 'bob')]
+
+        self.assertEqual([bool(result) for result in results],
+                         [True, True, False, False])
+        self.assertEqual(calls, ['alice', 'bob'])
+        self.assertEqual((fetch.cache.hits, fetch.cache.misses), (2, 2))
+
+    def test_cached_coalesced(self):
+        pending = self.loop.create_future()
+        calls = []
+
+        @cache.cached()
+        def fetch(x):
+            calls.append(x)
+            return pending
+
+        pol = self.make_policy(fetch=fetch)
+        pol['rule'] = 'fetch(1)'
+
+        tasks = [self.loop.create_task(pol.evaluate_async('rule'))
+                 for _i in range(3)]
+        self.run_loop(asyncio.sleep(0))
+        pending.set_result(True)
+        results = self.run_loop(asyncio.gather(*tasks))
+
+        self.assertTrue(all(results))
+        self.assertEqual(calls, [1])
+        self.assertEqual(fetch.cache.coalesced, 2)
+        self.assertEqual(fetch.cache._flights, {})
+
+    def test_cached_want_context(self):
+        @cache.cached(key=lambda ctxt, x: x)
+        @policy.want_context
+        def fetch(ctxt, x):
+            ctxt.stack.append(resolved(self.loop, x))
+
+        pol = self.make_policy(fetch=fetch)
+        pol['rule'] = 'fetch(1) == 1 and fetch(1) == 1'
+
+        result = self.run_loop(pol.evaluate_async('rule'))
+
+        self.assertTrue(result)
+        self.assertEqual(fetch.cache.hits, 1)
+
+    def test_cached_unhashable(self):
+        @cache.cached()
+        def fetch(x):
+            return resolved(self.loop, len(x))
+
+        pol = self.make_policy(fetch=fetch)
+        pol['rule'] = 'fetch(l) == 1'
+
+        result = self.run_loop(pol.evaluate_async('rule', {'l': [1]}))
+
+        self.assertTrue(result)
+        self.assertEqual(fetch.cache.bypasses, 1)
+
+    def test_cached_failure(self):
+        @cache.cached()
+        def fetch():
+            return failed(self.loop, IOError('unavailable'))
+
+        pol = self.make_policy(fetch=fetch)
+        pol['rule'] = 'fetch() or True'
+
+        result = self.run_loop(pol.evaluate_async('rule'))
+
+        self.assertFalse(result)
+        self.assertEqual(fetch.cache.errors, 1)
+        self.assertEqual(len(fetch.cache._entries), 0)
+
+    def test_want_context(self):
+        @policy.want_context
+        def fetch(ctxt, x):
+            ctxt.stack.append(resolved(self.loop, x))
+
+        pol = self.make_policy(fetch=fetch)
+        pol['rule'] = 'fetch(1) == 1'
+
+        result = self.run_loop(pol.evaluate_async('rule'))
+
+        self.assertTrue(result)
+
+    def test_want_context_coroutine(self):
+        @policy.want_context
+        def check(ctxt, x):
+            return Pushes(ctxt, x + 1, resolved(self.loop, None))
+
+        pol = self.make_policy(check=check)
+        pol['rule'] = '{1, check(1)} == {1}'
+
+        result = self.run_loop(pol.evaluate_async('rule'))
+
+        self.assertFalse(result)
+
+    def test_want_context_coroutine_sync(self):
+        awaitable = mock.Mock(spec=['__await__', 'close'])
+
+        @policy.want_context
+        def check(ctxt, x):
+            return awaitable
+
+        pol = self.make_policy(check=check)
+        pol['rule'] = '{1, check(1)} == {1}'
+
+        result = pol.evaluate('rule')
+
+        self.assertFalse(result)
+        awaitable.close.assert_called_once_with()
+
+    def test_memoize(self):
+        fetch = mock.Mock(side_effect=lambda x: resolved(self.loop, x),
+                          spec=[])
+        pol = self.make_policy()
+        memo = instructions.Memoize('slot', instructions.Instructions([
+            instructions.Constant(fetch),
+            instructions.Constant(1),
+            instructions.CallOperator(2),
+        ]))
+        compiled = instructions.Instructions([
+            memo, memo, instructions.eq_op, instructions.set_authz,
+        ])
+
+        result = self.run_loop(aio.run(pol, 'rule', compiled, {}, {}))
+
+        self.assertTrue(result)
+        fetch.assert_called_once_with(1)
+
+    def test_fails_closed(self):
+        pol = self.make_policy(
+            fetch=lambda: failed(self.loop, IOError('unavailable')))
+        pol['rule'] = 'fetch() or True'
+        pol.declare('rule', attrs={'level': 1})
+
+        result = self.run_loop(pol.evaluate_async('rule'))
+
+        self.assertFalse(result)
+        self.assertEqual(result.level, 1)
+
+    def test_prefetch(self):
+        pol = self.make_policy()
+        pol['rule'] = 'a == 1'
+
+        result = self.run_loop(pol.evaluate_async('rule', {
+            'a': aio.AsyncLazy(lambda: resolved(self.loop, 1)),
+        }))
+
+        self.assertTrue(result)
+
+    def test_other_engine(self):
+        pol = policy.Policy(engine=mock.Mock(**{
+            'evaluate.return_value': 'authz',
+        }))
+
+        result = self.run_loop(aio.run(pol, 'rule', 'compiled', {'a': 1},
+                                       {'v': 1}))
+
+        self.assertEqual(result, 'authz')
+        pol.engine.evaluate.assert_called_once_with(
+            pol, 'rule', 'compiled', {'a': 1}, {'v': 1})
+
+    def test_sync_fails_closed(self):
+        pol = self.make_policy(fetch=lambda: resolved(self.loop, False))
+        pol['rule'] = 'not fetch()'
+
+        self.assertFalse(pol.evaluate('rule'))
+        self.assertTrue(self.run_loop(pol.evaluate_async('rule')))
+
+
+class TestEvaluate(AioTestCase):
+    def test_evaluate(self):
+        pol = policy.Policy()
+        pol['rule'] = 'a == 1'
+
+        result = self.run_loop(aio.evaluate(pol, 'rule', {
+            'a': aio.AsyncLazy(lambda: resolved(self.loop, 1)),
+        }))
+
+        self.assertTrue(result)
+
+    def test_fails_closed(self):
+        pol = policy.Policy()
+        pol['rule'] = 'a == 1 or b'
+
+        result = self.run_loop(aio.evaluate(pol, 'rule', {
+            'a': failed(self.loop, IOError('unavailable')),
+            'b': True,
+        }))
+
+        self.assertFalse(result)
+
+    def test_unread_failure(self):
+        pol = policy.Policy()
+        pol['rule'] = 'b or a == 1'
+
+        result = self.run_loop(aio.evaluate(pol, 'rule', {
+            'a': failed(self.loop, IOError('unavailable')),
+            'b': True,
+        }))
+
+        self.assertTrue(result)
+
+    def test_no_variables(self):
+        pol = policy.Policy()
+        pol['rule'] = 'True'
+
+        result = self.run_loop(aio.evaluate(pol, 'rule'))
+
+        self.assertTrue(result)
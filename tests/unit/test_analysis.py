@@ -0,0 +1,207 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import mock
+
+from policies import analysis
+from policies import instructions as insts
+from policies import parser
+from policies import policy
+
+import tests
+
+
+def compile_text(text):
+    return parser.parse_rule('test', text, do_raise=True)
+
+
+class TestNode(tests.TestCase):
+    def test_key(self):
+        self.assertEqual(analysis.Name('a').key, ('Name', 'a'))
+        self.assertEqual(analysis.Attr(analysis.Name('a'), 'b').key,
+                         ('Attr', ('Name', 'a'), 'b'))
+        self.assertEqual(analysis.Const(1).key, ('Const', int, '1'))
+
+    def test_key_distinguishes_types(self):
+        self.assertNotEqual(analysis.Const(1), analysis.Const(True))
+        self.assertNotEqual(analysis.Const(1), analysis.Const(1.0))
+        self.assertEqual(analysis.Const(1), analysis.Const(1))
+
+    def test_eq_hash(self):
+        node1 = analysis.Op(insts.add_op, [analysis.Name('a'),
+                                           analysis.Const(1)])
+        node2 = analysis.Op(insts.add_op, [analysis.Name('a'),
+                                           analysis.Const(1)])
+        node3 = analysis.Op(insts.sub_op, [analysis.Name('a'),
+                                           analysis.Const(1)])
+
+        self.assertTrue(node1 == node2)
+        self.assertFalse(node1 != node2)
+        self.assertEqual(hash(node1), hash(node2))
+        self.assertFalse(node1 == node3)
+        self.assertFalse(node1 == 'node')
+
+    def test_repr(self):
+        node = analysis.Call(analysis.Name('len'), [analysis.Name('a')])
+
+        self.assertEqual(repr(node), "Call(Name('len'), (Name('a'),))")
+
+    def test_trivial(self):
+        self.assertTrue(analysis.Const(1).trivial)
+        self.assertTrue(analysis.Name('a').trivial)
+        self.assertFalse(analysis.Attr(analysis.Name('a'), 'b').trivial)
+
+    def test_walk(self):
+        a = analysis.Name('a')
+        attr = analysis.Attr(a, 'b')
+        node = analysis.And(attr, analysis.Const(1))
+
+        self.assertEqual(list(node.walk()),
+                         [node, attr, a, analysis.Const(1)])
+
+    def test_rebuild(self):
+        a = analysis.Name('a')
+        b = analysis.Name('b')
+
+        self.assertEqual(a.rebuild([]), a)
+        self.assertEqual(analysis.Attr(a, 'x').rebuild([b]),
+                         analysis.Attr(b, 'x'))
+        self.assertEqual(analysis.Op(insts.add_op, [a, a]).rebuild([a, b]),
+                         analysis.Op(insts.add_op, [a, b]))
+        self.assertEqual(analysis.Call(a, [a]).rebuild([b, a, a]),
+                         analysis.Call(b, [a, a]))
+        self.assertEqual(analysis.And(a, a).rebuild([a, b]),
+                         analysis.And(a, b))
+
+    def test_rule_name(self):
+        self.assertEqual(analysis.decompile_expr(
+            compile_text('rule("spam")').instructions[:-1]).rule_name,
+            'spam')
+        self.assertEqual(analysis.decompile_expr(
+            compile_text('rule(a)').instructions[:-1]).rule_name, None)
+        self.assertEqual(analysis.decompile_expr(
+            compile_text('other("spam")').instructions[:-1]).rule_name,
+            None)
+
+    def test_compile_memo(self):
+        attr = analysis.Attr(analysis.Name('a'), 'b')
+        node = analysis.Op(insts.eq_op, [attr, attr])
+
+        result = node.compile({attr.key: 7})
+
+        memo = insts.Memoize(7, insts.Instructions([insts.Ident('a'),
+                                                    insts.Attribute('b')]))
+        self.assertEqual(result, [memo, memo, insts.eq_op])
+
+
+class TestDecompile(tests.TestCase):
+    texts = [
+        'True',
+        'a',
+        'a.b.c',
+        'a[1] + b * -c',
+        '{1, 2, a}',
+        'len(a, b.c)',
+        'a and b',
+        'a or b and c',
+        'a if b else c',
+        '(a if b else c) if d or e else (f and g)',
+        'not (a == 1 or b in {1, 2}) {{ x=a, y=len(b) if c else d }}',
+        'rule("spam") {{ x=, y=1 }}',
+        '',
+    ]
+
+    def test_round_trip(self):
+        for text in self.texts:
+            compiled = compile_text(text)
+
+            expr, attrs = analysis.decompile(compiled)
+            result = analysis.compile_rule(expr, attrs)
+
+            self.assertEqual(result, compiled)
+
+    def test_structure(self):
+        expr, attrs = analysis.decompile(
+            compile_text('a.b if c else d(1) or e {{ x=f }}'))
+
+        self.assertEqual(expr, analysis.Cond(
+            analysis.Name('c'),
+            analysis.Attr(analysis.Name('a'), 'b'),
+            analysis.Or(
+                analysis.Call(analysis.Name('d'), [analysis.Const(1)]),
+                analysis.Name('e'),
+            ),
+        ))
+        self.assertEqual(attrs, [('x', analysis.Name('f'))])
+
+    def test_decompile_expr(self):
+        result = analysis.decompile_expr([insts.Ident('a'),
+                                          insts.Constant(1),
+                                          insts.add_op])
+
+        self.assertEqual(result, analysis.Op(
+            insts.add_op, [analysis.Name('a'), analysis.Const(1)]))
+
+    def test_errors(self):
+        bad = [
+            [insts.Ident('a'), insts.Ident('b')],
+            [insts.add_op],
+            [insts.Attribute('a')],
+            [insts.CallOperator(2)],
+            [insts.pop],
+            [insts.Ident('a'), insts.JumpIf(5), insts.pop, insts.Ident('b')],
+            [insts.JumpIf(1), insts.pop, insts.Ident('b')],
+            [insts.Ident('a'), insts.JumpIfNot(2), insts.Ident('b')],
+            [insts.Ident('a'), insts.Jump(1), insts.pop, insts.Ident('b')],
+        ]
+
+        for seq in bad:
+            self.assertRaises(analysis.DecompileError,
+                              analysis.decompile_expr, seq)
+
+    def test_decompile_no_authz(self):
+        self.assertRaises(analysis.DecompileError, analysis.decompile,
+                          insts.Instructions([insts.Ident('a')]))
+
+    def test_decompile_trailing(self):
+        self.assertRaises(analysis.DecompileError, analysis.decompile,
+                          insts.Instructions([insts.Ident('a'),
+                                              insts.set_authz,
+                                              insts.Ident('b')]))
+
+
+class TestIdentifiers(tests.TestCase):
+    def setUp(self):
+        self.policy = policy.Policy()
+        self.policy['is_admin'] = 'check(user)'
+        self.policy['edit'] = ('rule("is_admin") or rule("edit") '
+                               '{{ a=target.owner }}')
+
+    def test_identifiers(self):
+        self.assertEqual(analysis.identifiers(self.policy, 'edit'),
+                         frozenset(['rule', 'check', 'user', 'target']))
+        self.assertEqual(analysis.identifiers(self.policy, 'missing'),
+                         frozenset())
+
+    def test_dynamic(self):
+        self.policy['dynamic'] = 'rule("edit") and rule(name)'
+
+        self.assertEqual(analysis.identifiers(self.policy, 'dynamic'), None)
+
+    @mock.patch.object(analysis, 'decompile',
+                       side_effect=analysis.DecompileError())
+    def test_undecompilable(self, mock_decompile):
+        self.assertEqual(analysis.identifiers(self.policy, 'edit'), None)
@@ -0,0 +1,853 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import mock
+
+import policies
+from policies import analysis
+from policies import cache
+from policies import instructions as insts
+from policies import lazy
+
+import tests
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def key(variables):
+    return variables.get('user')
+
+
+class TestDecisionCache(tests.TestCase):
+    def test_init(self):
+        result = cache.DecisionCache(key)
+
+        self.assertEqual(result.key, key)
+        self.assertEqual(result.maxsize, 1024)
+        self.assertEqual(result.allow_ttl, 60.0)
+        self.assertEqual(result.deny_ttl, 60.0)
+        self.assertEqual(len(result), 0)
+        self.assertEqual(result.hit_ratio, None)
+
+    def test_init_ttls(self):
+        result = cache.DecisionCache(key, 5, 10, allow_ttl=20)
+
+        self.assertEqual(result.maxsize, 5)
+        self.assertEqual(result.allow_ttl, 20)
+        self.assertEqual(result.deny_ttl, 10)
+
+    def test_get_miss(self):
+        dcache = cache.DecisionCache(key)
+
+        self.assertEqual(dcache.get('rule', 'alice', 1), None)
+        self.assertEqual(dcache.misses, 1)
+        self.assertEqual(dcache.hit_ratio, 0.0)
+
+    @mock.patch.object(cache.timeit, 'default_timer', return_value=100.0)
+    def test_put_get(self, mock_default_timer):
+        dcache = cache.DecisionCache(key)
+
+        dcache.put('rule', 'alice', None, 'authz')
+        result = dcache.get('rule', 'alice', None)
+
+        self.assertEqual(result, 'authz')
+        self.assertEqual(dcache.hits, 1)
+        self.assertEqual(dcache.hit_ratio, 1.0)
+
+    @mock.patch.object(cache.timeit, 'default_timer')
+    def test_expiry(self, mock_default_timer):
+        mock_default_timer.return_value = 100.0
+        dcache = cache.DecisionCache(key, ttl=10, deny_ttl=2)
+        dcache.put('rule', 'alice', None, True)
+        dcache.put('rule', 'bob', None, False)
+
+        mock_default_timer.return_value = 105.0
+        results = [dcache.get('rule', 'alice', None),
+                   dcache.get('rule', 'bob', None)]
+
+        self.assertEqual(results, [True, None])
+        self.assertEqual(dcache.expirations, 1)
+        self.assertEqual(len(dcache), 1)
+
+    def test_no_ttl(self):
+        dcache = cache.DecisionCache(key, ttl=None)
+
+        dcache.put('rule', 'alice', None, True)
+
+        self.assertEqual(dcache._entries[('rule', 'alice')], (True, None))
+
+    def test_zero_ttl(self):
+        dcache = cache.DecisionCache(key, deny_ttl=0)
+
+        dcache.put('rule', 'alice', None, False)
+
+        self.assertEqual(len(dcache), 0)
+
+    def test_lru(self):
+        dcache = cache.DecisionCache(key, maxsize=2)
+        dcache.put('rule', 'a', None, True)
+        dcache.put('rule', 'b', None, True)
+        dcache.get('rule', 'a', None)
+
+        dcache.put('rule', 'c', None, True)
+
+        self.assertEqual(list(dcache._entries),
+                         [('rule', 'a'), ('rule', 'c')])
+        self.assertEqual(dcache.evictions, 1)
+
+    def test_generation(self):
+        dcache = cache.DecisionCache(key)
+        dcache.get('rule', 'a', 1)
+        dcache.put('rule', 'a', 1, True)
+
+        result = dcache.get('rule', 'a', 2)
+
+        self.assertEqual(result, None)
+        self.assertEqual(len(dcache), 0)
+        self.assertEqual(dcache.invalidations, 1)
+
+    def test_put_stale(self):
+        dcache = cache.DecisionCache(key)
+        dcache.get('rule', 'a', 2)
+
+        dcache.put('rule', 'a', 1, True)
+
+        self.assertEqual(len(dcache), 0)
+
+    def test_evaluate(self):
+        pol = mock.Mock(generation=3)
+        evaluate = mock.Mock(return_value='authz')
+        dcache = cache.DecisionCache(key)
+
+        results = [dcache.evaluate(pol, 'rule', {'user': 'a'}, evaluate)
+                   for _i in range(2)]
+
+        self.assertEqual(results, ['authz', 'authz'])
+        evaluate.assert_called_once_with('rule', {'user': 'a'})
+        self.assertEqual((dcache.hits, dcache.misses), (1, 1))
+
+    def test_evaluate_bypass(self):
+        pol = mock.Mock(generation=3)
+        evaluate = mock.Mock(return_value='authz')
+        dcache = cache.DecisionCache(key)
+
+        result = dcache.evaluate(pol, 'rule', {}, evaluate)
+
+        self.assertEqual(result, 'authz')
+        evaluate.assert_called_once_with('rule', {})
+        self.assertEqual(dcache.bypasses, 1)
+        self.assertEqual(len(dcache), 0)
+
+    def test_evaluate_shared(self):
+        pol1 = mock.Mock(generation=3)
+        pol2 = mock.Mock(generation=3)
+        evaluate = mock.Mock(return_value='authz')
+        dcache = cache.DecisionCache(key)
+        dcache.evaluate(pol1, 'rule', {'user': 'a'}, evaluate)
+
+        self.assertRaises(ValueError, dcache.evaluate, pol2, 'rule',
+                          {'user': 'a'}, evaluate)
+        self.assertEqual(evaluate.call_count, 1)
+
+    def test_bind_released(self):
+        pol1 = mock.Mock(generation=3)
+        pol2 = mock.Mock(generation=3)
+        evaluate = mock.Mock(side_effect=['authz1', 'authz2'])
+        dcache = cache.DecisionCache(key)
+        dcache.evaluate(pol1, 'rule', {'user': 'a'}, evaluate)
+        del pol1
+
+        result = dcache.evaluate(pol2, 'rule', {'user': 'a'}, evaluate)
+
+        self.assertEqual(result, 'authz2')
+        self.assertEqual(evaluate.call_count, 2)
+
+    def test_bind_policies(self):
+        dcache = cache.DecisionCache(key)
+        pol1 = policies.Policy(decision_cache=dcache)
+        pol1['rule'] = 'user == "a"'
+
+        self.assertTrue(pol1.evaluate('rule', {'user': 'a'}))
+        self.assertRaises(ValueError, policies.Policy,
+                          decision_cache=dcache)
+
+    def test_clear(self):
+        dcache = cache.DecisionCache(key)
+        dcache.put('rule', 'a', None, True)
+
+        dcache.clear()
+
+        self.assertEqual(len(dcache), 0)
+
+
+class TestFunctionCache(tests.TestCase):
+    def test_init(self):
+        func = mock.Mock()
+
+        result = cache.FunctionCache(func, 5, 10, negative_ttl=2)
+
+        self.assertEqual(result.func, func)
+        self.assertEqual(result.maxsize, 5)
+        self.assertEqual(result.allow_ttl, 10)
+        self.assertEqual(result.deny_ttl, 2)
+        self.assertEqual(result.error_ttl, 0)
+        self.assertEqual(result.key, None)
+        self.assertEqual(result.want_context, False)
+        self.assertEqual((result.coalesced, result.errors), (0, 0))
+
+    def test_make_key(self):
+        fcache = cache.FunctionCache(mock.Mock())
+
+        self.assertEqual(fcache._make_key((1, 'a')),
+                         ((1, 'a'), (int, str)))
+        self.assertNotEqual(fcache._make_key((1,)), fcache._make_key((True,)))
+        self.assertRaises(TypeError, fcache._make_key, ([1],))
+
+    def test_make_key_want_context(self):
+        fcache = cache.FunctionCache(mock.Mock(), want_context=True)
+
+        self.assertEqual(fcache._make_key(('ctxt', 1)), ((1,), (int,)))
+
+    def test_make_key_custom(self):
+        key = mock.Mock(return_value='key')
+        fcache = cache.FunctionCache(mock.Mock(), key=key)
+
+        self.assertEqual(fcache._make_key((1, 2)), 'key')
+        key.assert_called_once_with(1, 2)
+
+    def test_invoke_want_context(self):
+        func = mock.Mock(side_effect=lambda ctxt, x: ctxt.stack.append(x))
+        ctxt = mock.Mock(stack=['other'])
+        fcache = cache.FunctionCache(func, want_context=True)
+
+        result = fcache._invoke((ctxt, 5))
+
+        self.assertEqual(result, 5)
+        self.assertEqual(ctxt.stack, ['other'])
+
+    def test_invoke_want_context_bad_push(self):
+        ctxt = mock.Mock(stack=[])
+        fcache = cache.FunctionCache(mock.Mock(), want_context=True)
+
+        self.assertRaises(ValueError, fcache._invoke, (ctxt, 5))
+
+    def test_call(self):
+        func = mock.Mock(return_value='result')
+        fcache = cache.FunctionCache(func)
+
+        results = [fcache.call((1,)), fcache.call((1,)), fcache.call((2,))]
+
+        self.assertEqual(results, ['result'] * 3)
+        self.assertEqual(func.call_args_list, [mock.call(1), mock.call(2)])
+        self.assertEqual((fcache.hits, fcache.misses), (1, 2))
+        self.assertEqual(fcache._flights, {})
+
+    def test_call_bypass(self):
+        func = mock.Mock(return_value='result')
+        fcache = cache.FunctionCache(func)
+
+        results = [fcache.call(([1],)), fcache.call(([1],))]
+
+        self.assertEqual(results, ['result'] * 2)
+        self.assertEqual(func.call_count, 2)
+        self.assertEqual(fcache.bypasses, 2)
+
+    @mock.patch.object(cache.timeit, 'default_timer')
+    def test_call_negative(self, mock_default_timer):
+        mock_default_timer.return_value = 100.0
+        func = mock.Mock(side_effect=lambda x: x)
+        fcache = cache.FunctionCache(func, ttl=10, negative_ttl=2)
+        fcache.call((0,))
+        fcache.call((1,))
+
+        mock_default_timer.return_value = 105.0
+        results = [fcache.call((0,)), fcache.call((1,))]
+
+        self.assertEqual(results, [0, 1])
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(fcache.expirations, 1)
+
+    def test_call_error(self):
+        func = mock.Mock(side_effect=KeyError('spam'))
+        fcache = cache.FunctionCache(func)
+
+        for _i in range(2):
+            self.assertRaises(KeyError, fcache.call, (1,))
+
+        self.assertEqual(func.call_count, 2)
+        self.assertEqual(fcache.errors, 2)
+        self.assertEqual(len(fcache), 0)
+        self.assertEqual(fcache._flights, {})
+
+    def test_call_error_cached(self):
+        func = mock.Mock(side_effect=KeyError('spam'))
+        fcache = cache.FunctionCache(func, error_ttl=5)
+
+        for _i in range(2):
+            self.assertRaises(KeyError, fcache.call, (1,))
+
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual((fcache.errors, fcache.hits), (1, 1))
+
+    def test_call_coalesced(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def func(x):
+            started.set()
+            release.wait()
+            return x
+
+        fcache = cache.FunctionCache(func)
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(fcache.call((1,))))
+        leader.start()
+        started.wait()
+        waiter = threading.Thread(
+            target=lambda: results.append(fcache.call((1,))))
+        waiter.start()
+        while not fcache.coalesced:
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        waiter.join()
+
+        self.assertEqual(results, [1, 1])
+        self.assertEqual((fcache.misses, fcache.coalesced), (1, 1))
+
+    def test_call_awaitable(self):
+        result = mock.Mock(spec=['__await__', 'close'])
+        func = mock.Mock(return_value=result)
+        fcache = cache.FunctionCache(func, error_ttl=5)
+
+        self.assertRaises(TypeError, fcache.call, (1,))
+
+        result.close.assert_called_once_with()
+        self.assertEqual(len(fcache._entries), 0)
+        self.assertEqual(fcache._flights, {})
+
+    def test_call_interrupted(self):
+        func = mock.Mock(side_effect=[Interrupted(), 'result'])
+        fcache = cache.FunctionCache(func)
+
+        self.assertRaises(Interrupted, fcache.call, (1,))
+
+        self.assertEqual(fcache._flights, {})
+        self.assertEqual(len(fcache._entries), 0)
+        self.assertEqual(fcache.call((1,)), 'result')
+        self.assertEqual(func.call_count, 2)
+
+    def test_call_interrupted_waiter(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def func(x):
+            started.set()
+            release.wait()
+            raise Interrupted()
+
+        def call():
+            try:
+                results.append(fcache.call((1,)))
+            except BaseException as exc:
+                results.append(type(exc))
+
+        fcache = cache.FunctionCache(func)
+        results = []
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        waiter = threading.Thread(target=call)
+        waiter.start()
+        while not fcache.coalesced:
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        waiter.join()
+
+        self.assertEqual(sorted(results, key=lambda x: x.__name__),
+                         [Interrupted, RuntimeError])
+        self.assertEqual(len(fcache._entries), 0)
+
+
+class TestCached(tests.TestCase):
+    def test_cached(self):
+        func = mock.Mock(__name__='func', spec=['__name__'],
+                         return_value='result')
+
+        result = cache.cached(ttl=5)(func)
+
+        self.assertEqual(result(1, 2), 'result')
+        self.assertEqual(result(1, 2), 'result')
+        func.assert_called_once_with(1, 2)
+        self.assertEqual(result.cache.func, func)
+        self.assertEqual(result.cache.allow_ttl, 5)
+        self.assertEqual(result.cache.want_context, False)
+        self.assertFalse(getattr(result, '_policies_want_context', False))
+
+    def test_cached_want_context(self):
+        def func(ctxt, x):
+            ctxt.stack.append(x * 2)
+        func._policies_want_context = True
+        ctxt = mock.Mock(stack=[])
+
+        result = cache.cached()(func)
+        result(ctxt, 2)
+        result(ctxt, 2)
+
+        self.assertEqual(ctxt.stack, [4, 4])
+        self.assertTrue(result._policies_want_context)
+        self.assertEqual(result.cache.want_context, True)
+        self.assertEqual(result.cache.hits, 1)
+
+
+class TestTrace(tests.TestCase):
+    def test_read(self):
+        trace = cache.Trace()
+
+        trace.read(('a',), 1)
+        trace.read(('b', 'c'), 2)
+        trace.read(('a',), 3)
+
+        self.assertEqual(trace.reads, [(('a',), 1), (('b', 'c'), 2)])
+        self.assertEqual(trace.paths, (('a',), ('b', 'c')))
+        self.assertEqual(trace.calls, [])
+        self.assertEqual(trace.tags, set())
+
+
+class TestGetPath(tests.TestCase):
+    def test_follow(self):
+        result = cache._follow(mock.Mock(b={'c': 5}), ('b', ('c',)))
+
+        self.assertEqual(result, 5)
+
+    def test_get_path(self):
+        variables = {'a': mock.Mock(b={'c': 5})}
+
+        result = cache._get_path(variables, ('a', 'b', ('c',)), {})
+
+        self.assertEqual(result, 5)
+
+    def test_get_path_missing(self):
+        self.assertRaises(KeyError, cache._get_path, {'a': {}},
+                          ('a', ('b',)), {})
+
+    def test_get_path_lazy(self):
+        provider = mock.Mock(return_value={'b': 5})
+        memo = {}
+
+        result = cache._get_path({'a': lazy.Lazy(provider)}, ('a', ('b',)),
+                                 memo)
+
+        self.assertEqual(result, 5)
+        self.assertEqual(memo, {'a': {'b': 5}})
+
+
+class TestRead(tests.TestCase):
+    def test_want_context(self):
+        self.assertTrue(cache._read._policies_want_context)
+
+    def test_read(self):
+        ctxt = mock.Mock(stack=[], trace=None, **{
+            'resolve.return_value': mock.Mock(b=5),
+        })
+
+        cache._read(ctxt, ('a', 'b'))
+
+        self.assertEqual(ctxt.stack, [5])
+        ctxt.resolve.assert_called_once_with('a')
+
+    def test_read_traced(self):
+        ctxt = mock.Mock(stack=[], trace=cache.Trace(), **{
+            'resolve.return_value': mock.Mock(b=5),
+        })
+
+        cache._read(ctxt, ('a', 'b'))
+
+        self.assertEqual(ctxt.stack, [5])
+        self.assertEqual(ctxt.trace.reads, [(('a', 'b'), 5)])
+
+
+class TestCall(tests.TestCase):
+    def test_want_context(self):
+        self.assertTrue(cache._call._policies_want_context)
+
+    def test_call(self):
+        func = mock.Mock(spec=[], return_value=5)
+        ctxt = mock.Mock(stack=[1], trace=cache.Trace())
+
+        cache._call(ctxt, func, 2, 3)
+
+        self.assertEqual(ctxt.stack, [1, 5])
+        func.assert_called_once_with(2, 3)
+        self.assertFalse(ctxt.trace.untraceable)
+
+    def test_call_want_context(self):
+        func = mock.Mock(_policies_want_context=True, spec=[
+            '_policies_want_context'],
+            side_effect=lambda ctxt, x: ctxt.stack.append(x))
+        ctxt = mock.Mock(stack=[1], trace=cache.Trace())
+
+        cache._call(ctxt, func, 2)
+
+        self.assertEqual(ctxt.stack, [1, 2])
+        func.assert_called_once_with(ctxt, 2)
+        self.assertTrue(ctxt.trace.untraceable)
+
+    def test_call_tagged(self):
+        func = cache.tagged(lambda x: ['tag'])(mock.Mock(return_value=5))
+        ctxt = mock.Mock(stack=[], trace=cache.Trace())
+
+        cache._call(ctxt, func, 2)
+
+        self.assertEqual(ctxt.stack, [5])
+        self.assertFalse(ctxt.trace.untraceable)
+
+
+class TestTagged(tests.TestCase):
+    def test_tagged(self):
+        tags = mock.Mock(return_value=['tag'])
+        func = mock.Mock(__name__='func', return_value='result')
+
+        result = cache.tagged(tags)(func)
+
+        self.assertTrue(result._policies_want_context)
+        self.assertEqual(result._policies_tags, tags)
+        self.assertFalse(func.called)
+
+    def test_call(self):
+        tags = mock.Mock(return_value=['tag'])
+        func = mock.Mock(__name__='func', return_value='result')
+        ctxt = mock.Mock(stack=[], trace=None)
+
+        cache.tagged(tags)(func)(ctxt, 1, 2)
+
+        func.assert_called_once_with(1, 2)
+        self.assertFalse(tags.called)
+        self.assertEqual(ctxt.stack, ['result'])
+
+    def test_call_traced(self):
+        tags = mock.Mock(return_value=['tag'])
+        func = mock.Mock(__name__='func', return_value='result')
+        ctxt = mock.Mock(stack=[], trace=cache.Trace())
+
+        cache.tagged(tags)(func)(ctxt, 1, 2)
+
+        tags.assert_called_once_with(1, 2)
+        self.assertEqual(ctxt.stack, ['result'])
+        self.assertEqual(ctxt.trace.calls, [(func, (1, 2), 'result')])
+        self.assertEqual(ctxt.trace.tags, set(['tag']))
+
+
+class TestFreeze(tests.TestCase):
+    def test_scalar(self):
+        self.assertEqual(cache._freeze('a'), (str, 'a'))
+        self.assertNotEqual(cache._freeze(1), cache._freeze(True))
+
+    def test_containers(self):
+        self.assertEqual(cache._freeze([1, {'a': set([2])}]),
+                         (list, ((int, 1),
+                                 (dict, frozenset([
+                                     ((str, 'a'),
+                                      (set, frozenset([(int, 2)])))])))))
+        self.assertNotEqual(cache._freeze([1]), cache._freeze((1,)))
+
+    def test_unhashable(self):
+        self.assertRaises(TypeError, cache._freeze, [bytearray()])
+
+
+class TestTraceReads(tests.TestCase):
+    def test_path(self):
+        node = analysis.Op(insts.item_op, [
+            analysis.Attr(analysis.Name('a'), 'b'), analysis.Const('c')])
+
+        self.assertEqual(cache._path(node, set(['a'])),
+                         ('a', 'b', ('c',)))
+        self.assertEqual(cache._path(node, set(['b'])), None)
+
+    def test_path_unhashable(self):
+        node = analysis.Op(insts.item_op, [
+            analysis.Name('a'), analysis.Const([1])])
+
+        self.assertEqual(cache._path(node, set(['a'])), None)
+
+    def test_trace_reads(self):
+        node = analysis.Op(insts.add_op, [
+            analysis.Attr(analysis.Name('a'), 'b'), analysis.Name('c')])
+
+        result = cache._trace_reads(node, set(['a']))
+
+        self.assertEqual(result, analysis.Op(insts.add_op, [
+            analysis.Call(analysis.Const(cache._read),
+                          [analysis.Const(('a', 'b'))]),
+            analysis.Name('c')]))
+
+    def test_trace_reads_call(self):
+        node = analysis.Call(analysis.Name('f'), [analysis.Name('a')])
+
+        result = cache._trace_reads(node, set(['a', 'f']))
+
+        self.assertEqual(result, analysis.Call(analysis.Const(cache._call), [
+            analysis.Call(analysis.Const(cache._read),
+                          [analysis.Const(('f',))]),
+            analysis.Call(analysis.Const(cache._read),
+                          [analysis.Const(('a',))])]))
+
+    def test_traceable(self):
+        func = mock.Mock(spec=[])
+        ctxt_func = mock.Mock(_policies_want_context=True, spec=[
+            '_policies_want_context'])
+        tagged_func = cache.tagged(lambda: [])(func)
+
+        self.assertTrue(cache._traceable(analysis.Call(
+            analysis.Const(func), [])))
+        self.assertTrue(cache._traceable(analysis.Call(
+            analysis.Const(tagged_func), [])))
+        self.assertTrue(cache._traceable(analysis.Call(
+            analysis.Const(cache._read), [analysis.Const(('a',))])))
+        self.assertFalse(cache._traceable(analysis.And(
+            analysis.Name('a'),
+            analysis.Call(analysis.Const(ctxt_func), []))))
+
+
+class TestDependencyCache(tests.TestCase):
+    def setUp(self):
+        self.check = mock.Mock(spec=[],
+                               side_effect=lambda user: user == 'alice')
+        self.policy = policies.Policy(
+            builtins=dict(policies.Policy.builtins, check=self.check))
+        self.policy['is_admin'] = 'check(user)'
+        self.policy['edit'] = 'rule("is_admin") or user == target.owner'
+        self.evaluate = mock.Mock(side_effect=self.policy._evaluate)
+
+    def test_init(self):
+        tagger = mock.Mock()
+
+        result = cache.DependencyCache(5, 10, allow_ttl=20, tagger=tagger)
+
+        self.assertEqual(result.maxsize, 5)
+        self.assertEqual(result.allow_ttl, 20)
+        self.assertEqual(result.deny_ttl, 10)
+        self.assertEqual(result.tagger, tagger)
+        self.assertEqual(result.tag_invalidations, 0)
+        self.assertEqual(len(result), 0)
+
+    def test_get_program(self):
+        dcache = cache.DependencyCache()
+
+        result = dcache._get_program(self.policy, 'edit',
+                                     frozenset(['user', 'target']))
+
+        self.assertEqual(analysis.decompile(result)[0], analysis.Or(
+            analysis.Call(analysis.Const(self.check), [
+                analysis.Call(analysis.Const(cache._read),
+                              [analysis.Const(('user',))])]),
+            analysis.Op(insts.eq_op, [
+                analysis.Call(analysis.Const(cache._read),
+                              [analysis.Const(('user',))]),
+                analysis.Call(analysis.Const(cache._read),
+                              [analysis.Const(('target', 'owner'))])])))
+
+    def test_get_program_untraceable(self):
+        self.policy['dynamic'] = 'rule(name)'
+        dcache = cache.DependencyCache()
+
+        self.assertEqual(dcache._get_program(
+            self.policy, 'dynamic', frozenset(['name'])), None)
+        self.assertEqual(dcache._get_program(
+            self.policy, 'missing', frozenset()), None)
+
+    def test_evaluate(self):
+        dcache = cache.DependencyCache()
+        variables = [
+            {'user': 'bob', 'target': mock.Mock(owner='bob'), 'spam': 1},
+            {'user': 'bob', 'target': mock.Mock(owner='bob'), 'spam': 2},
+            {'user': 'bob', 'target': mock.Mock(owner='alice')},
+        ]
+
+        results = [bool(dcache.evaluate(self.policy, 'edit', v,
+                                        self.evaluate))
+                   for v in variables]
+
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual((dcache.hits, dcache.misses), (1, 2))
+        self.assertEqual(self.check.call_count, 2)
+        self.assertFalse(self.evaluate.called)
+        self.assertEqual(len(dcache), 2)
+
+    def test_evaluate_shapes(self):
+        dcache = cache.DependencyCache()
+        variables = [
+            {'user': 'alice', 'target': mock.Mock(owner='bob')},
+            {'user': 'bob', 'target': mock.Mock(owner='bob')},
+            {'user': 'alice', 'target': None},
+        ]
+
+        results = [bool(dcache.evaluate(self.policy, 'edit', v,
+                                        self.evaluate))
+                   for v in variables]
+
+        # The first result does not depend on the target
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual((dcache.hits, dcache.misses), (1, 2))
+        self.assertEqual(list(dcache._shapes.values())[0],
+                         {(('user',),): 1,
+                          (('user',), ('target', 'owner')): 1})
+
+    def test_evaluate_bypass(self):
+        self.policy['dynamic'] = 'rule(name)'
+        dcache = cache.DependencyCache()
+
+        result = dcache.evaluate(self.policy, 'dynamic',
+                                 {'name': 'is_admin', 'user': 'alice'},
+                                 self.evaluate)
+
+        self.assertTrue(result)
+        self.evaluate.assert_called_once_with(
+            'dynamic', {'name': 'is_admin', 'user': 'alice'})
+        self.assertEqual(dcache.bypasses, 1)
+
+    def test_evaluate_raises(self):
+        dcache = cache.DependencyCache()
+
+        result = dcache.evaluate(self.policy, 'edit', {'user': 'bob'},
+                                 self.evaluate)
+
+        self.assertFalse(result)
+        self.assertEqual(dcache.misses, 1)
+        self.assertEqual(len(dcache), 0)
+
+    def test_evaluate_unhashable(self):
+        self.policy['edit'] = 'user in target'
+        dcache = cache.DependencyCache()
+
+        result = dcache.evaluate(self.policy, 'edit',
+                                 {'user': 'bob', 'target': [bytearray()]},
+                                 self.evaluate)
+
+        self.assertFalse(result)
+        self.assertEqual(len(dcache), 0)
+
+    def test_evaluate_generation(self):
+        dcache = cache.DependencyCache()
+        variables = {'user': 'bob', 'target': mock.Mock(owner='bob')}
+        dcache.evaluate(self.policy, 'edit', variables, self.evaluate)
+
+        self.policy['edit'] = 'user != target.owner'
+        result = dcache.evaluate(self.policy, 'edit', variables,
+                                 self.evaluate)
+
+        self.assertFalse(result)
+        self.assertEqual(dcache.invalidations, 1)
+        self.assertEqual(len(dcache), 1)
+
+    def test_evaluate_want_context_variable(self):
+        @policies.want_context
+        def has_role(ctxt, user):
+            ctxt.stack.append(ctxt.variables['role'] == 'admin')
+
+        self.policy['edit'] = 'checker(user)'
+        dcache = cache.DependencyCache()
+        variables = [
+            {'user': 'bob', 'checker': has_role, 'role': 'admin'},
+            {'user': 'bob', 'checker': has_role, 'role': 'guest'},
+        ]
+
+        results = [bool(dcache.evaluate(self.policy, 'edit', v,
+                                        self.evaluate))
+                   for v in variables]
+
+        self.assertEqual(results, [True, False])
+        self.assertEqual(len(dcache), 0)
+
+    def test_evaluate_shared(self):
+        dcache = cache.DependencyCache()
+        other = policies.Policy()
+        other['edit'] = 'False'
+        variables = {'user': 'bob', 'target': mock.Mock(owner='bob')}
+        dcache.evaluate(self.policy, 'edit', variables, self.evaluate)
+
+        self.assertRaises(ValueError, dcache.evaluate, other, 'edit',
+                          variables, self.evaluate)
+
+    def test_trace(self):
+        dcache = cache.DependencyCache()
+
+        authz, trace = dcache.trace(
+            self.policy, 'edit',
+            {'user': 'bob', 'target': mock.Mock(owner='bob')})
+
+        self.assertTrue(authz)
+        self.assertEqual(trace.reads, [(('user',), 'bob'),
+                                       (('target', 'owner'), 'bob')])
+        self.assertEqual(len(dcache), 0)
+
+    def test_invalidate(self):
+        tagger = mock.Mock(side_effect=lambda path, value: [value])
+        dcache = cache.DependencyCache(tagger=tagger)
+        for user in ('alice', 'bob'):
+            dcache.evaluate(self.policy, 'edit',
+                            {'user': user, 'target': mock.Mock(owner='bob')},
+                            self.evaluate)
+
+        result = dcache.invalidate('alice', 'carol')
+
+        self.assertEqual(result, 1)
+        self.assertEqual(dcache.tag_invalidations, 1)
+        self.assertEqual(len(dcache), 1)
+        self.assertEqual(set(dcache._tags), set(['bob']))
+
+    def test_evicted(self):
+        dcache = cache.DependencyCache(maxsize=1, tagger=lambda p, v: [v])
+        for user in ('alice', 'bob'):
+            dcache.evaluate(self.policy, 'edit',
+                            {'user': user, 'target': mock.Mock(owner='bob')},
+                            self.evaluate)
+
+        self.assertEqual(dcache.evictions, 1)
+        self.assertEqual(set(dcache._tags), set(['bob']))
+        self.assertEqual(list(dcache._shapes.values())[0],
+                         {(('user',), ('target', 'owner')): 1})
+
+    def test_evaluate_lazy(self):
+        provider = mock.Mock(return_value=mock.Mock(owner='bob'))
+        dcache = cache.DependencyCache()
+        variables = {'user': 'bob', 'target': lazy.Lazy(provider)}
+
+        results = [bool(dcache.evaluate(self.policy, 'edit', variables,
+                                        self.evaluate))
+                   for _i in range(2)]
+
+        self.assertEqual(results, [True, True])
+        self.assertEqual(provider.call_count, 2)
+        self.assertEqual(dcache.hits, 1)
+
+    def test_clear(self):
+        dcache = cache.DependencyCache(tagger=lambda p, v: [v])
+        dcache.evaluate(self.policy, 'edit', {'user': 'alice'},
+                        self.evaluate)
+
+        dcache.clear()
+
+        self.assertEqual(len(dcache), 0)
+        self.assertEqual(dcache._tags, {})
+        self.assertEqual(dcache._shapes, {})
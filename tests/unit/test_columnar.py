@@ -0,0 +1,394 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import tempfile
+import unittest
+
+import mock
+
+from policies import analysis
+from policies import columnar
+from policies import instructions
+from policies import policy
+
+import tests
+
+numpy = columnar.numpy
+
+
+def make_evaluator(columns, variables=None, pol=None):
+    pol = pol or policy.Policy()
+    length = len(list(columns.values())[0]) if columns else 0
+    return columnar.ColumnarEvaluator(pol, 'test', columns,
+                                      variables or {}, length)
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestPrepare(tests.TestCase):
+    def test_widen(self):
+        self.assertEqual(
+            columnar._widen(numpy.array([1], dtype=numpy.int8)).dtype,
+            numpy.int64)
+        self.assertEqual(
+            columnar._widen(numpy.array([1.0], dtype=numpy.float32)).dtype,
+            numpy.float64)
+        self.assertEqual(columnar._widen(numpy.array([True])).dtype,
+                         numpy.int64)
+        self.assertEqual(columnar._widen(numpy.array([True]), False).dtype,
+                         numpy.bool_)
+        self.assertEqual(columnar._widen(numpy.array([u'a'])).dtype.kind,
+                         'U')
+
+    def test_prepare(self):
+        result = columnar._prepare(
+            [numpy.array([1], dtype=numpy.uint8), numpy.array([2.5])],
+            'biuf', 2 ** 31, True)
+
+        self.assertEqual([r.dtype for r in result],
+                         [numpy.int64, numpy.float64])
+
+    def test_prepare_kinds(self):
+        self.assertIsNone(columnar._prepare(
+            [numpy.array([1]), numpy.array([u'a'])], 'biufU', 2 ** 63,
+            False))
+        self.assertIsNone(columnar._prepare(
+            [numpy.array([1.5])], 'biu', 2 ** 63, False))
+
+    def test_prepare_bound(self):
+        self.assertIsNone(columnar._prepare(
+            [numpy.array([2 ** 40])], 'biuf', 2 ** 31, True))
+        self.assertIsNone(columnar._prepare(
+            [numpy.array([-2 ** 54]), numpy.array([1.0])], 'biuf',
+            2 ** 63, False))
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestColumn(tests.TestCase):
+    def test_int(self):
+        result = columnar.column([1, 2])
+
+        self.assertEqual(result.dtype, numpy.int64)
+        self.assertEqual(result.tolist(), [1, 2])
+
+    def test_int_large(self):
+        result = columnar.column([1, 2 ** 64])
+
+        self.assertEqual(result.dtype.kind, 'O')
+        self.assertEqual(result.tolist(), [1, 2 ** 64])
+
+    def test_str(self):
+        result = columnar.column([u'a', u'bc'])
+
+        self.assertEqual(result.dtype.kind, 'U')
+
+    def test_mixed(self):
+        result = columnar.column([1, 2.5])
+
+        self.assertEqual(result.dtype.kind, 'O')
+        self.assertEqual(result.tolist(), [1, 2.5])
+
+    def test_sequences(self):
+        result = columnar.column([(1, 2), (3, 4)])
+
+        self.assertEqual(result.shape, (2,))
+        self.assertEqual(result.tolist(), [(1, 2), (3, 4)])
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestRepeat(tests.TestCase):
+    def test_typed(self):
+        result = columnar.repeat(5, 3)
+
+        self.assertEqual(result.dtype, numpy.int64)
+        self.assertEqual(result.tolist(), [5, 5, 5])
+
+    def test_object(self):
+        value = [1, 2]
+
+        result = columnar.repeat(value, 2)
+
+        self.assertEqual(result.dtype.kind, 'O')
+        self.assertEqual(result.shape, (2,))
+        self.assertIs(result[1], value)
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestColumnarEvaluator(tests.TestCase):
+    def test_row_variables(self):
+        evaluator = make_evaluator({'a': numpy.array([1, 2])}, {'b': 3})
+
+        result = evaluator.row_variables(1)
+
+        self.assertEqual(result, {'a': 2, 'b': 3})
+        self.assertIsInstance(result['a'], int)
+
+    def test_elementwise(self):
+        evaluator = make_evaluator({'a': numpy.array([1, 0, 2])})
+        idx = numpy.arange(3)
+
+        result = evaluator.elementwise(lambda x: 4 // x, idx,
+                                       numpy.array([1, 0, 2]))
+
+        self.assertEqual(result.tolist(), [4, None, 2])
+        self.assertEqual(evaluator.failed.tolist(), [False, True, False])
+
+    def test_elementwise_skip_failed(self):
+        evaluator = make_evaluator({'a': numpy.array([1, 2])})
+        evaluator.failed[0] = True
+        func = mock.Mock(return_value=5)
+
+        result = evaluator.elementwise(func, numpy.arange(2),
+                                       numpy.array([1, 2]))
+
+        self.assertEqual(result.tolist(), [None, 5])
+        func.assert_called_once_with(2)
+
+    def test_truth(self):
+        evaluator = make_evaluator({'a': numpy.array([1, 2])})
+        idx = numpy.arange(2)
+
+        self.assertEqual(evaluator.truth(numpy.array([0, 3]), idx).tolist(),
+                         [False, True])
+        self.assertEqual(
+            evaluator.truth(numpy.array([u'', u'x']), idx).tolist(),
+            [False, True])
+        self.assertEqual(
+            evaluator.truth(columnar.column([[], [1]]), idx).tolist(),
+            [False, True])
+
+    def test_name(self):
+        evaluator = make_evaluator({'a': numpy.array([1, 2, 3])})
+
+        result = evaluator(analysis.Name('a'), numpy.array([0, 2]))
+
+        self.assertEqual(result.tolist(), [1, 3])
+
+    def test_name_missing(self):
+        evaluator = make_evaluator({'a': numpy.array([1, 2])})
+
+        result = evaluator(analysis.Name('b'), numpy.arange(2))
+
+        self.assertEqual(result.tolist(), [None, None])
+
+    def test_division_by_zero(self):
+        evaluator = make_evaluator({'a': numpy.array([4, 4]),
+                                    'b': numpy.array([2, 0])})
+        node = analysis.Op(instructions.floor_div_op,
+                           [analysis.Name('a'), analysis.Name('b')])
+
+        result = evaluator(node, numpy.arange(2))
+
+        self.assertEqual(result[0], 2)
+        self.assertEqual(evaluator.failed.tolist(), [False, True])
+
+    def test_arith_overflow(self):
+        big = numpy.array([2 ** 62, 1])
+        evaluator = make_evaluator({'a': big})
+        node = analysis.Op(instructions.mul_op,
+                           [analysis.Name('a'), analysis.Const(4)])
+
+        result = evaluator(node, numpy.arange(2))
+
+        self.assertEqual(result.tolist(), [2 ** 64, 4])
+
+    def test_membership(self):
+        evaluator = make_evaluator({'a': numpy.array([1, 2, 3])})
+        node = analysis.Op(instructions.in_op,
+                           [analysis.Name('a'), analysis.Const({1, 3})])
+
+        with mock.patch.object(evaluator, 'elementwise') as mock_elementwise:
+            result = evaluator(node, numpy.arange(3))
+
+        self.assertEqual(result.tolist(), [True, False, True])
+        self.assertFalse(mock_elementwise.called)
+
+    def test_membership_fallback(self):
+        evaluator = make_evaluator({'a': numpy.array([u'a', u'b'])})
+        node = analysis.Op(instructions.not_in_op,
+                           [analysis.Name('a'), analysis.Const(u'abc')])
+
+        result = evaluator(node, numpy.arange(2))
+
+        self.assertEqual(result.tolist(), [False, False])
+
+    def test_and_masked(self):
+        func = mock.Mock(spec=[], side_effect=lambda x: x * 10)
+        evaluator = make_evaluator({'a': numpy.array([0, 1, 0, 2])})
+        node = analysis.And(analysis.Name('a'), analysis.Call(
+            analysis.Const(func), [analysis.Name('a')]))
+
+        result = evaluator(node, numpy.arange(4))
+
+        self.assertEqual(result.tolist(), [0, 10, 0, 20])
+        self.assertEqual(func.call_args_list, [mock.call(1), mock.call(2)])
+
+    def test_or_masked(self):
+        func = mock.Mock(spec=[], side_effect=lambda x: x + 10)
+        evaluator = make_evaluator({'a': numpy.array([0, 1, 0, 2])})
+        node = analysis.Or(analysis.Name('a'), analysis.Call(
+            analysis.Const(func), [analysis.Name('a')]))
+
+        result = evaluator(node, numpy.arange(4))
+
+        self.assertEqual(result.tolist(), [10, 1, 10, 2])
+        self.assertEqual(func.call_args_list, [mock.call(0), mock.call(0)])
+
+    def test_and_failed(self):
+        func = mock.Mock(spec=[], return_value=True)
+        evaluator = make_evaluator({'a': numpy.array([1, 0])})
+        node = analysis.And(
+            analysis.Op(instructions.floor_div_op,
+                        [analysis.Const(1), analysis.Name('a')]),
+            analysis.Call(analysis.Const(func), [analysis.Name('a')]))
+
+        evaluator(node, numpy.arange(2))
+
+        self.assertEqual(evaluator.failed.tolist(), [False, True])
+        func.assert_called_once_with(1)
+
+    def test_cond(self):
+        if_true = mock.Mock(spec=[], return_value=u'yes')
+        if_false = mock.Mock(spec=[], return_value=u'no')
+        evaluator = make_evaluator({'a': numpy.array([1, 0, 1])})
+        node = analysis.Cond(
+            analysis.Name('a'),
+            analysis.Call(analysis.Const(if_true), []),
+            analysis.Call(analysis.Const(if_false), []))
+
+        result = evaluator(node, numpy.arange(3))
+
+        self.assertEqual(result.tolist(), [u'yes', u'no', u'yes'])
+        self.assertEqual(if_true.call_count, 2)
+        self.assertEqual(if_false.call_count, 1)
+
+    def test_per_row(self):
+        pol = policy.Policy()
+        pol['other'] = 'a > 1'
+        evaluator = make_evaluator({'a': numpy.array([1, 2])}, pol=pol)
+        node = analysis.Call(analysis.Const(pol.resolve('rule')),
+                             [analysis.Const('other')])
+
+        result = evaluator(node, numpy.arange(2))
+
+        self.assertEqual(result.tolist(), [False, True])
+
+    def test_is(self):
+        evaluator = make_evaluator({'a': columnar.column([None, 1])})
+        node = analysis.Op(instructions.is_op,
+                           [analysis.Name('a'), analysis.Const(None)])
+
+        result = evaluator(node, numpy.arange(2))
+
+        self.assertEqual(result.tolist(), [True, False])
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestEvaluate(tests.TestCase):
+    def make_policy(self):
+        pol = policy.Policy()
+        pol['big'] = 'a > limit and a % 2 == 0'
+        pol['allow'] = 'limit > 0'
+        pol['deny'] = 'limit > 0 and a > 5'
+        pol['attr'] = 'a > 0 {{ inv=10 // a }}'
+        pol['nested'] = 'rule("big") or b == "x"'
+        return pol
+
+    def test_mismatched(self):
+        pol = self.make_policy()
+
+        self.assertRaises(ValueError, columnar.evaluate, pol, 'big',
+                          {'a': numpy.arange(3), 'b': numpy.arange(4)})
+
+    def test_constant(self):
+        pol = self.make_policy()
+
+        result = columnar.evaluate(pol, 'allow', {'a': numpy.arange(3)},
+                                   {'limit': 1})
+
+        self.assertEqual(result.tolist(), [True, True, True])
+
+    def test_constant_deny(self):
+        pol = self.make_policy()
+
+        result = columnar.evaluate(pol, 'deny', {'a': numpy.arange(3)},
+                                   {'limit': 0})
+
+        self.assertEqual(result.tolist(), [False, False, False])
+
+    def test_missing(self):
+        pol = self.make_policy()
+
+        result = columnar.evaluate(pol, 'missing', {'a': numpy.arange(3)})
+
+        self.assertEqual(result.tolist(), [False, False, False])
+
+    def test_undecompilable(self):
+        pol = self.make_policy()
+        a = numpy.arange(4)
+
+        with mock.patch.object(columnar.partial, 'Residual') as mock_Residual:
+            mock_Residual.return_value.decision = None
+            mock_Residual.return_value.expr = None
+            result = columnar.evaluate(pol, 'big', {'a': a}, {'limit': 1})
+
+        self.assertEqual(result.tolist(), [False, False, True, False])
+
+    def test_chunked(self):
+        pol = self.make_policy()
+        a = numpy.arange(10)
+
+        result = columnar.evaluate(pol, 'big', {'a': a}, {'limit': 3},
+                                   chunk_size=3)
+
+        self.assertEqual(numpy.nonzero(result)[0].tolist(), [4, 6, 8])
+
+    def test_column_overrides_variable(self):
+        pol = self.make_policy()
+
+        result = columnar.evaluate(pol, 'big', {'a': numpy.arange(5)},
+                                   {'a': 100, 'limit': 1})
+
+        self.assertEqual(result.tolist(), [False, False, True, False, True])
+
+    def test_attr_fails(self):
+        pol = self.make_policy()
+
+        result = columnar.evaluate(pol, 'attr',
+                                   {'a': numpy.array([1, 0, -1, 11])})
+
+        self.assertEqual(result.tolist(), [True, False, False, True])
+
+    def test_nested(self):
+        pol = self.make_policy()
+
+        result = columnar.evaluate(pol, 'nested', {
+            'a': numpy.array([4, 5, 1]),
+            'b': numpy.array([u'y', u'y', u'x']),
+        }, {'limit': 2})
+
+        self.assertEqual(result.tolist(), [True, False, True])
+
+    def test_memmap(self):
+        pol = self.make_policy()
+        with tempfile.NamedTemporaryFile() as f:
+            a = numpy.memmap(f, dtype=numpy.int32, mode='w+', shape=(10,))
+            a[:] = numpy.arange(10)
+
+            result = columnar.evaluate(pol, 'big', {'a': a}, {'limit': 5},
+                                       chunk_size=4)
+
+        self.assertEqual(numpy.nonzero(result)[0].tolist(), [6, 8])
@@ -0,0 +1,177 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import mock
+
+from policies import engines
+
+import tests
+
+
+class TestStackEngine(tests.TestCase):
+    def test_compile(self):
+        rule = mock.Mock(instructions='instructions')
+        engine = engines.StackEngine()
+
+        result = engine.compile(rule)
+
+        self.assertEqual(result, 'instructions')
+
+    @mock.patch('policies.authorization.Authorization', return_value='authz')
+    def test_evaluate(self, mock_Authorization):
+        ctxt = mock.Mock(**{
+            'authz': 'ctxt_authz',
+            'push_rule.return_value': mock.MagicMock(),
+        })
+        pol = mock.Mock(**{'context_class.return_value': ctxt})
+        compiled = mock.Mock()
+        engine = engines.StackEngine()
+
+        result = engine.evaluate(pol, 'name', compiled, {'a': 1}, {'x': 2})
+
+        self.assertEqual(result, 'ctxt_authz')
+        self.assertFalse(mock_Authorization.called)
+        pol.context_class.assert_called_once_with(pol, {'a': 1}, {'x': 2})
+        ctxt.push_rule.assert_called_once_with('name')
+        compiled.assert_called_once_with(ctxt)
+
+    @mock.patch('policies.authorization.Authorization', return_value='authz')
+    def test_evaluate_exception(self, mock_Authorization):
+        ctxt = mock.Mock(**{
+            'authz': 'ctxt_authz',
+            'push_rule.return_value': mock.MagicMock(),
+        })
+        pol = mock.Mock(**{'context_class.return_value': ctxt})
+        compiled = mock.Mock(side_effect=tests.TestException('test'))
+        engine = engines.StackEngine()
+
+        result = engine.evaluate(pol, 'name', compiled, {'a': 1}, {'x': 2})
+
+        self.assertEqual(result, 'authz')
+        mock_Authorization.assert_called_once_with(False, {'a': 1})
+        compiled.assert_called_once_with(ctxt)
+
+    @mock.patch('logging.getLogger')
+    @mock.patch('policies.authorization.Authorization', return_value='authz')
+    def test_evaluate_many(self, mock_Authorization, mock_getLogger):
+        ctxt = mock.Mock(authz='ctxt_authz', reported=False)
+        pol = mock.Mock(**{'context_class.return_value': ctxt})
+        compiled = mock.Mock(side_effect=[None, tests.TestException('test'),
+                                          None])
+        engine = engines.StackEngine()
+
+        result = engine.evaluate_many(pol, 'name', compiled, {'a': 1},
+                                      iter([{'x': 1}, {'x': 2}, {'x': 3}]))
+
+        self.assertFalse(pol.context_class.called)
+        self.assertEqual(list(result), ['ctxt_authz', 'authz', 'ctxt_authz'])
+        pol.context_class.assert_called_once_with(pol, {'a': 1}, {})
+        ctxt.reset.assert_has_calls([
+            mock.call('name', {'x': 1}),
+            mock.call('name', {'x': 2}),
+            mock.call('name', {'x': 3}),
+        ])
+        self.assertEqual(compiled.call_count, 3)
+        mock_Authorization.assert_called_once_with(False, {'a': 1})
+        mock_getLogger.return_value.warn.assert_called_once_with(
+            "Exception raised while evaluating rule 'name': test")
+
+    @mock.patch('logging.getLogger')
+    @mock.patch('policies.authorization.Authorization', return_value='authz')
+    def test_evaluate_many_reported(self, mock_Authorization,
+                                    mock_getLogger):
+        ctxt = mock.Mock(authz='ctxt_authz', reported=True)
+        pol = mock.Mock(**{'context_class.return_value': ctxt})
+        compiled = mock.Mock(side_effect=tests.TestException('test'))
+        engine = engines.StackEngine()
+
+        result = engine.evaluate_many(pol, 'name', compiled, {'a': 1},
+                                      [{'x': 1}])
+
+        self.assertEqual(list(result), ['authz'])
+        self.assertFalse(mock_getLogger.called)
+
+    @mock.patch('logging.getLogger')
+    @mock.patch('policies.authorization.Authorization',
+                side_effect=lambda *a: ('authz',) + a)
+    def test_evaluate_all(self, mock_Authorization, mock_getLogger):
+        ctxt = mock.Mock(authz='ctxt_authz', reported=False)
+        pol = mock.Mock(**{'context_class.return_value': ctxt})
+        compiled_a = mock.Mock()
+        compiled_c = mock.Mock(side_effect=tests.TestException('test'))
+        engine = engines.StackEngine()
+
+        result = engine.evaluate_all(pol, [
+            ('a', compiled_a, {'x': 1}),
+            ('b', None, None),
+            ('c', compiled_c, {'y': 2}),
+        ], {'v': 1})
+
+        self.assertEqual(result, {
+            'a': 'ctxt_authz',
+            'b': ('authz', False),
+            'c': ('authz', False, {'y': 2}),
+        })
+        pol.context_class.assert_called_once_with(pol, None, {'v': 1})
+        ctxt.reset.assert_has_calls([
+            mock.call('a', {'v': 1}, clear_caches=False),
+            mock.call('c', {'v': 1}, clear_caches=False),
+        ])
+        self.assertEqual(ctxt.attrs, {'y': 2})
+        compiled_a.assert_called_once_with(ctxt)
+        compiled_c.assert_called_once_with(ctxt)
+        mock_getLogger.return_value.warn.assert_called_once_with(
+            "Exception raised while evaluating rule 'c': test")
+
+
+class TestEngine(tests.TestCase):
+    def test_evaluate_many(self):
+        class TestEngine(engines.Engine):
+            compile = mock.Mock()
+            evaluate = mock.Mock(side_effect=lambda p, n, c, a, v: v['x'])
+
+        engine = TestEngine()
+
+        result = engine.evaluate_many('pol', 'name', 'compiled', {'a': 1},
+                                      iter([{'x': 1}, {'x': 2}]))
+
+        self.assertFalse(engine.evaluate.called)
+        self.assertEqual(list(result), [1, 2])
+        engine.evaluate.assert_has_calls([
+            mock.call('pol', 'name', 'compiled', {'a': 1}, {'x': 1}),
+            mock.call('pol', 'name', 'compiled', {'a': 1}, {'x': 2}),
+        ])
+
+    @mock.patch('policies.authorization.Authorization', return_value='authz')
+    def test_evaluate_all(self, mock_Authorization):
+        class TestEngine(engines.Engine):
+            compile = mock.Mock()
+            evaluate = mock.Mock(side_effect=lambda p, n, c, a, v: (c, a, v))
+
+        engine = TestEngine()
+
+        result = engine.evaluate_all('pol', [
+            ('a', 'compiled_a', {'x': 1}),
+            ('b', None, None),
+        ], {'v': 1})
+
+        self.assertEqual(result, {
+            'a': ('compiled_a', {'x': 1}, {'v': 1}),
+            'b': 'authz',
+        })
+        mock_Authorization.assert_called_once_with(False)
+        self.assertFalse(engines.Engine.supports_memoize)
+        self.assertTrue(engines.StackEngine.supports_memoize)
@@ -0,0 +1,105 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import mock
+
+from policies import entrypoints
+
+import tests
+
+
+def make_ep(name, value=None, exc=None):
+    ep = mock.Mock(**{
+        'load.return_value': value,
+        'load.side_effect': exc,
+    })
+    ep.name = name
+    return ep
+
+
+class TestIterEntryPoints(tests.TestCase):
+    @mock.patch.object(entrypoints.importlib_metadata, 'entry_points',
+                       return_value=['ep1', 'ep2'])
+    def test_iter(self, mock_entry_points):
+        result = list(entrypoints.iter_entry_points('group'))
+
+        self.assertEqual(result, ['ep1', 'ep2'])
+        mock_entry_points.assert_called_once_with(group='group')
+
+
+class TestEntryPointIndex(tests.TestCase):
+    def test_init(self):
+        index = entrypoints.EntryPointIndex('group')
+
+        self.assertEqual(index.group, 'group')
+        self.assertEqual(index._index, None)
+        self.assertEqual(index.scan_time, None)
+        self.assertEqual(index.load_times, {})
+        self.assertEqual(index.failures, [])
+
+    @mock.patch.object(entrypoints, 'iter_entry_points')
+    def test_get_index(self, mock_iter_entry_points):
+        eps = [make_ep('a'), make_ep('b'), make_ep('a')]
+        mock_iter_entry_points.return_value = iter(eps)
+        index = entrypoints.EntryPointIndex('group')
+
+        result1 = index._get_index()
+        result2 = index._get_index()
+
+        self.assertEqual(result1, {'a': [eps[0], eps[2]], 'b': [eps[1]]})
+        self.assertTrue(result1 is result2)
+        self.assertTrue(index.scan_time >= 0.0)
+        mock_iter_entry_points.assert_called_once_with('group')
+
+    def test_contains(self):
+        index = entrypoints.EntryPointIndex('group')
+        index._index = {'a': []}
+
+        self.assertTrue('a' in index)
+        self.assertFalse('b' in index)
+
+    @mock.patch('logging.getLogger')
+    def test_load(self, mock_getLogger):
+        exc = ImportError('test')
+        eps = [make_ep('a', exc=exc), make_ep('a', 'value1'),
+               make_ep('a', 'value2')]
+        index = entrypoints.EntryPointIndex('group')
+        index._index = {'a': eps}
+
+        result = index.load('a')
+
+        self.assertEqual(result, 'value1')
+        self.assertFalse(eps[2].load.called)
+        self.assertEqual(list(index.load_times), ['a'])
+        self.assertEqual(len(index.failures), 1)
+        self.assertEqual(index.failures[0][:3], ('a', eps[0], exc))
+        mock_getLogger.assert_called_once_with('policies')
+        self.assertEqual(mock_getLogger.return_value.warn.call_count, 1)
+
+    def test_load_missing(self):
+        index = entrypoints.EntryPointIndex('group')
+        index._index = {}
+
+        self.assertEqual(index.load('a'), None)
+        self.assertEqual(index.load_times, {})
+
+    def test_invalidate(self):
+        index = entrypoints.EntryPointIndex('group')
+        index._index = {}
+
+        index.invalidate()
+
+        self.assertEqual(index._index, None)
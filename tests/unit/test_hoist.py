@@ -0,0 +1,138 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import mock
+
+from policies import analysis
+from policies import hoist
+from policies import instructions
+from policies import policy
+from policies import rules
+
+import tests
+
+
+class TestDependencies(tests.TestCase):
+    def make_policy(self):
+        pol = policy.Policy()
+        pol['fixed'] = 'user.admin'
+        pol['varies'] = 'item.public'
+        pol['loop'] = 'rule("loop")'
+        return pol
+
+    def test_name(self):
+        dependent = hoist.Dependencies(self.make_policy(), ['item'])
+
+        self.assertTrue(dependent(analysis.Name('item')))
+        self.assertFalse(dependent(analysis.Name('user')))
+        self.assertTrue(dependent(analysis.Attr(analysis.Name('item'), 'a')))
+        self.assertFalse(dependent(analysis.Const(1)))
+
+    def test_rule(self):
+        dependent = hoist.Dependencies(self.make_policy(), ['item'])
+
+        def call(name):
+            return analysis.Call(analysis.Name('rule'),
+                                 [analysis.Const(name)])
+
+        self.assertFalse(dependent(call('fixed')))
+        self.assertTrue(dependent(call('varies')))
+        self.assertTrue(dependent(call('loop')))
+        self.assertFalse(dependent(call('missing')))
+        self.assertTrue(dependent(analysis.Call(
+            analysis.Name('rule'), [analysis.Name('user')])))
+
+    def test_rule_undecompilable(self):
+        pol = self.make_policy()
+        pol.set_rule(rules.Rule('odd', 'user'))
+        pol['odd']._instructions = instructions.Instructions([
+            instructions.Ident('user'),
+            instructions.Jump(1),
+        ])
+        dependent = hoist.Dependencies(pol, ['item'])
+
+        self.assertTrue(dependent.rule('odd'))
+
+    def test_want_context(self):
+        func = mock.Mock(_policies_want_context=True)
+        dependent = hoist.Dependencies(self.make_policy(), ['item'],
+                                       {'func': func, 'other': len})
+
+        self.assertTrue(dependent(analysis.Call(analysis.Name('func'), [])))
+        self.assertFalse(dependent(analysis.Call(analysis.Name('other'),
+                                                 [])))
+        self.assertTrue(dependent(analysis.Call(
+            analysis.Attr(analysis.Name('user'), 'func'), [])))
+
+
+class TestInvariants(tests.TestCase):
+    def test_basic(self):
+        fixed = analysis.Attr(analysis.Name('user'), 'admin')
+        varies = analysis.Attr(analysis.Name('item'), 'public')
+        other = analysis.Op(instructions.eq_op, [
+            analysis.Attr(analysis.Name('item'), 'owner'),
+            analysis.Name('user'),
+        ])
+        expr = analysis.Or(analysis.And(fixed, varies), other)
+        dependent = hoist.Dependencies(policy.Policy(), ['item'])
+
+        result = hoist.invariants(expr, dependent)
+
+        self.assertEqual(result, [fixed])
+
+    def test_independent(self):
+        expr = analysis.Attr(analysis.Name('user'), 'admin')
+        dependent = hoist.Dependencies(policy.Policy(), ['item'])
+
+        self.assertEqual(hoist.invariants(expr, dependent), [expr])
+        self.assertEqual(hoist.invariants(analysis.Name('user'), dependent),
+                         [])
+
+
+class TestHoist(tests.TestCase):
+    def test_hoist(self):
+        pol = policy.Policy()
+        pol['a'] = 'user.admin or item.public {{ x=user.name }}'
+
+        result = hoist.hoist(pol, pol['a'], ['item'])
+
+        self.assertEqual(result, instructions.Instructions([
+            instructions.Memoize(0, instructions.Instructions([
+                instructions.Ident('user'),
+                instructions.Attribute('admin'),
+            ])),
+            instructions.JumpIf(3),
+            instructions.Pop(),
+            instructions.Ident('item'),
+            instructions.Attribute('public'),
+            instructions.set_authz,
+            instructions.Memoize(1, instructions.Instructions([
+                instructions.Ident('user'),
+                instructions.Attribute('name'),
+            ])),
+            instructions.AuthorizationAttr('x'),
+        ]))
+
+    def test_undecompilable(self):
+        rule = mock.Mock(instructions=instructions.Instructions([
+            instructions.Ident('user'),
+            instructions.Jump(1),
+        ]))
+
+        result = hoist.hoist(policy.Policy(), rule, ['item'])
+
+        self.assertIs(result, rule.instructions)
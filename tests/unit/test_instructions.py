@@ -486,6 +486,49 @@ class TestOperator(tests.TestCase):
         self.assertTrue(isinstance(result[0], instructions.Instructions))
         self.assertEqual(result[0].instructions, tuple(elems + [op]))
 
+    def test_fold_unfoldable(self):
+        elems = [instructions.Constant(i) for i in range(3)]
+        op = OperatorForTest(3, 'opstr')
+
+        with mock.patch.object(op, 'foldable', return_value=False) as \
+                mock_foldable:
+            result = op.fold(elems)
+
+        mock_foldable.assert_called_once_with(0, 1, 2)
+        self.assertEqual(len(result), 1)
+        self.assertTrue(isinstance(result[0], instructions.Instructions))
+        self.assertEqual(result[0].instructions, tuple(elems + [op]))
+
+    def test_fold_error(self):
+        elems = [instructions.Constant(i) for i in range(3)]
+        op = OperatorForTest(3, 'opstr')
+
+        with mock.patch.object(op, 'op',
+                               side_effect=ZeroDivisionError('test')):
+            result = op.fold(elems)
+
+        self.assertEqual(len(result), 1)
+        self.assertTrue(isinstance(result[0], instructions.Instructions))
+        self.assertEqual(result[0].instructions, tuple(elems + [op]))
+
+    def test_fold_oversize(self):
+        elems = [instructions.Constant(i) for i in range(3)]
+        op = OperatorForTest(3, 'opstr')
+
+        with mock.patch.object(op, 'op',
+                               return_value='x' *
+                               (instructions.FOLD_MAX_LENGTH + 1)):
+            result = op.fold(elems)
+
+        self.assertEqual(len(result), 1)
+        self.assertTrue(isinstance(result[0], instructions.Instructions))
+        self.assertEqual(result[0].instructions, tuple(elems + [op]))
+
+    def test_foldable(self):
+        op = OperatorForTest(3, 'opstr')
+
+        self.assertTrue(op.foldable(1, 2, 3))
+
 
 class TestGenericOperator(tests.TestCase):
     def test_init(self):
@@ -494,6 +537,12 @@ class TestGenericOperator(tests.TestCase):
         self.assertEqual(gen_op.count, 3)
         self.assertEqual(gen_op.opstr, 'opstr')
         self.assertEqual(gen_op._op, 'op')
+        self.assertEqual(gen_op._guard, None)
+
+    def test_init_guard(self):
+        gen_op = instructions.GenericOperator(3, 'op', 'opstr', 'guard')
+
+        self.assertEqual(gen_op._guard, 'guard')
 
     def test_hash(self):
         gen_op = instructions.GenericOperator(3, 'op', 'opstr')
@@ -525,6 +574,56 @@ class TestGenericOperator(tests.TestCase):
         self.assertEqual(result, 'value')
         op.assert_called_once_with(1, 2, 3)
 
+    def test_foldable_unguarded(self):
+        gen_op = instructions.GenericOperator(3, 'op', 'opstr')
+
+        self.assertTrue(gen_op.foldable(1, 2, 3))
+
+    def test_foldable_guarded(self):
+        guard = mock.Mock(return_value=False)
+        gen_op = instructions.GenericOperator(3, 'op', 'opstr', guard)
+
+        self.assertFalse(gen_op.foldable(1, 2, 3))
+        guard.assert_called_once_with(1, 2, 3)
+
+
+class TestFoldGuards(tests.TestCase):
+    def test_fold_bounded(self):
+        big = 1 << instructions.FOLD_MAX_BITS
+        long_str = 'x' * (instructions.FOLD_MAX_LENGTH + 1)
+
+        self.assertTrue(instructions._fold_bounded(big - 1))
+        self.assertFalse(instructions._fold_bounded(big))
+        self.assertTrue(instructions._fold_bounded(long_str[1:]))
+        self.assertFalse(instructions._fold_bounded(long_str))
+        self.assertFalse(instructions._fold_bounded(tuple(long_str)))
+        self.assertTrue(instructions._fold_bounded(1.5))
+
+    def test_pow_guard(self):
+        self.assertTrue(instructions._pow_guard(3, 2))
+        self.assertTrue(instructions._pow_guard(1, 10 ** 9))
+        self.assertTrue(instructions._pow_guard(-1, 10 ** 9))
+        self.assertTrue(instructions._pow_guard(2, -10 ** 9))
+        self.assertTrue(instructions._pow_guard(2.0, 10 ** 9))
+        self.assertFalse(instructions._pow_guard(2, 10 ** 9))
+
+    def test_mul_guard(self):
+        self.assertTrue(instructions._mul_guard(10 ** 9, 10 ** 9))
+        self.assertTrue(instructions._mul_guard('x', 10))
+        self.assertTrue(instructions._mul_guard(10, 'x'))
+        self.assertFalse(instructions._mul_guard('x', 10 ** 10))
+        self.assertFalse(instructions._mul_guard(10 ** 10, (1,)))
+
+    def test_lshift_guard(self):
+        self.assertTrue(instructions._lshift_guard(1, 10))
+        self.assertTrue(instructions._lshift_guard(1, -1))
+        self.assertFalse(instructions._lshift_guard(1, 10 ** 9))
+
+    def test_mod_guard(self):
+        self.assertTrue(instructions._mod_guard(5, 3))
+        self.assertFalse(instructions._mod_guard('%999999999d', 1))
+        self.assertFalse(instructions._mod_guard(b'%s', 1))
+
 
 class TestSetOperator(tests.TestCase):
     def test_init(self):
@@ -563,7 +662,8 @@ class TestCallOperator(tests.TestCase):
         func.assert_called_once_with(1, 2, 3, 4)
 
     def test_call_want_context_false(self):
-        func = mock.Mock(return_value='value', _policies_want_context=False)
+        func = mock.Mock(return_value='value', _policies_want_context=False,
+                         _policies_pure=False)
         ctxt = mock.Mock(stack=[func, 1, 2, 3, 4])
         call_op = instructions.CallOperator(5)
 
@@ -572,6 +672,37 @@ class TestCallOperator(tests.TestCase):
         self.assertEqual(ctxt.stack, ['value'])
         func.assert_called_once_with(1, 2, 3, 4)
 
+    def test_call_awaitable(self):
+        result = mock.Mock(spec=['__await__', 'close'])
+        func = mock.Mock(return_value=result, spec=[])
+        ctxt = mock.Mock(stack=[func, 1])
+        call_op = instructions.CallOperator(2)
+
+        self.assertRaises(TypeError, call_op, ctxt)
+        self.assertEqual(ctxt.stack, [func, 1])
+        result.close.assert_called_once_with()
+
+    def test_call_want_context_awaitable(self):
+        result = mock.Mock(spec=['__await__', 'close'])
+        func = mock.Mock(_policies_want_context=True,
+                         side_effect=lambda ctxt: ctxt.stack.append(result))
+        ctxt = mock.Mock(stack=[func])
+        call_op = instructions.CallOperator(1)
+
+        self.assertRaises(TypeError, call_op, ctxt)
+        self.assertEqual(ctxt.stack, [])
+        result.close.assert_called_once_with()
+
+    def test_call_want_context_returns_awaitable(self):
+        result = mock.Mock(spec=['__await__', 'close'])
+        func = mock.Mock(return_value=result, _policies_want_context=True)
+        ctxt = mock.Mock(stack=[1, func, 2])
+        call_op = instructions.CallOperator(2)
+
+        self.assertRaises(TypeError, call_op, ctxt)
+        self.assertEqual(ctxt.stack, [1])
+        result.close.assert_called_once_with()
+
     def test_call_want_context_true(self):
         func = mock.Mock(return_value='value', _policies_want_context=True)
         ctxt = mock.Mock(stack=[func, 1, 2, 3, 4])
@@ -582,6 +713,61 @@ class TestCallOperator(tests.TestCase):
         self.assertEqual(ctxt.stack, [])
         func.assert_called_once_with(ctxt, 1, 2, 3, 4)
 
+    def test_call_pure(self):
+        func = mock.Mock(return_value='value', _policies_want_context=False,
+                         _policies_pure=True, pure_hits=0, pure_misses=0)
+        ctxt = mock.Mock(stack=[func, 1, 2], call_cache={})
+        call_op = instructions.CallOperator(3)
+
+        call_op(ctxt)
+        ctxt.stack.extend([func, 1, 2])
+        call_op(ctxt)
+
+        self.assertEqual(ctxt.stack, ['value', 'value'])
+        func.assert_called_once_with(1, 2)
+        self.assertEqual((func.pure_hits, func.pure_misses), (1, 1))
+        self.assertEqual(ctxt.call_cache, {
+            (func, (1, 2), (int, int)): 'value',
+        })
+
+    def test_call_pure_types(self):
+        func = mock.Mock(side_effect=lambda x: x, _policies_want_context=False,
+                         _policies_pure=True, pure_hits=0, pure_misses=0)
+        ctxt = mock.Mock(stack=[func, 1], call_cache={})
+        call_op = instructions.CallOperator(2)
+
+        call_op(ctxt)
+        ctxt.stack.extend([func, True])
+        call_op(ctxt)
+
+        self.assertEqual(ctxt.stack, [1, True])
+        self.assertIs(ctxt.stack[1], True)
+        self.assertEqual(func.pure_misses, 2)
+
+    def test_call_pure_unhashable(self):
+        func = mock.Mock(return_value='value', _policies_want_context=False,
+                         _policies_pure=True, pure_hits=0, pure_misses=0)
+        ctxt = mock.Mock(stack=[func, [1]], call_cache={})
+        call_op = instructions.CallOperator(2)
+
+        call_op(ctxt)
+
+        self.assertEqual(ctxt.stack, ['value'])
+        func.assert_called_once_with([1])
+        self.assertEqual(ctxt.call_cache, {})
+        self.assertEqual((func.pure_hits, func.pure_misses), (0, 0))
+
+    def test_call_pure_awaitable(self):
+        result = mock.Mock(spec=['__await__'])
+        func = mock.Mock(return_value=result, _policies_want_context=False,
+                         _policies_pure=True, pure_hits=0, pure_misses=0)
+        ctxt = mock.Mock(stack=[func, 1], call_cache={})
+        call_op = instructions.CallOperator(2)
+
+        self.assertRaises(TypeError, call_op, ctxt)
+        self.assertEqual(ctxt.call_cache, {})
+        self.assertEqual((func.pure_hits, func.pure_misses), (0, 0))
+
     def test_hash(self):
         call_op = instructions.CallOperator(5)
 
@@ -677,6 +863,70 @@ class TestAuthorizationAttr(tests.TestCase):
         self.assertFalse(attr1.__eq__(attr4))
 
 
+class TestMemoize(tests.TestCase):
+    def test_init(self):
+        memo = instructions.Memoize(3, 'insts')
+
+        self.assertEqual(memo.slot, 3)
+        self.assertEqual(memo.instructions, 'insts')
+
+    def test_repr(self):
+        memo = instructions.Memoize(3, instructions.Instructions([
+            instructions.Ident('a'),
+        ]))
+
+        self.assertEqual(repr(memo),
+                         "Memoize(3, Instructions((Ident('a'),)))")
+
+    def test_call_cached(self):
+        ctxt = mock.Mock(stack=[1], memo={3: 'value'})
+        insts = mock.Mock()
+        memo = instructions.Memoize(3, insts)
+
+        memo(ctxt)
+
+        self.assertEqual(ctxt.stack, [1, 'value'])
+        self.assertFalse(insts.called)
+
+    def test_call_uncached(self):
+        ctxt = mock.Mock(stack=[1], memo={}, pc=5, step=3)
+
+        def compute(ctxt):
+            self.assertEqual(ctxt.pc, 0)
+            ctxt.stack.append('value')
+            ctxt.pc = 2
+            ctxt.step = 1
+
+        insts = mock.Mock(side_effect=compute)
+        memo = instructions.Memoize(3, insts)
+
+        memo(ctxt)
+
+        self.assertEqual(ctxt.stack, [1, 'value'])
+        self.assertEqual(ctxt.memo, {3: 'value'})
+        self.assertEqual(ctxt.pc, 5)
+        self.assertEqual(ctxt.step, 1)
+        insts.assert_called_once_with(ctxt)
+
+    def test_hash(self):
+        insts = instructions.Instructions([instructions.Ident('a')])
+        memo = instructions.Memoize(3, insts)
+
+        self.assertEqual(hash(memo), hash((instructions.Memoize, 3, insts)))
+
+    def test_eq(self):
+        insts1 = instructions.Instructions([instructions.Ident('a')])
+        insts2 = instructions.Instructions([instructions.Ident('b')])
+        memo1 = instructions.Memoize(3, insts1)
+        memo2 = instructions.Memoize(3, insts1)
+        memo3 = instructions.Memoize(4, insts1)
+        memo4 = instructions.Memoize(3, insts2)
+
+        self.assertTrue(memo1.__eq__(memo2))
+        self.assertFalse(memo1.__eq__(memo3))
+        self.assertFalse(memo1.__eq__(memo4))
+
+
 class TestTrinaryOperator(tests.TestCase):
     def test_fold_constant_true(self):
         elems = [instructions.Constant(True), instructions.Ident('a'),
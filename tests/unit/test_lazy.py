@@ -0,0 +1,125 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import mock
+
+from policies import lazy
+
+import tests
+
+
+class TestLazy(tests.TestCase):
+    def test_init(self):
+        result = lazy.Lazy('provider')
+
+        self.assertEqual(result.provider, 'provider')
+
+    def test_repr(self):
+        self.assertEqual(repr(lazy.Lazy('provider')), "<Lazy 'provider'>")
+
+    def test_resolve(self):
+        provider = mock.Mock(return_value='value')
+        var = lazy.Lazy(provider)
+
+        self.assertEqual(var.resolve(), 'value')
+        provider.assert_called_once_with()
+
+
+class TestLazyStats(tests.TestCase):
+    def test_init(self):
+        result = lazy.LazyStats()
+
+        self.assertEqual(result.counts, {})
+        self.assertEqual(result.errors, {})
+        self.assertEqual(result.total_time, {})
+        self.assertEqual(result.max_time, {})
+        self.assertEqual(result.mean_time('a'), None)
+
+    def test_record(self):
+        stats = lazy.LazyStats()
+
+        stats.record('a', 1.0)
+        stats.record('a', 3.0, True)
+        stats.record('b', 0.5)
+
+        self.assertEqual(stats.counts, {'a': 2, 'b': 1})
+        self.assertEqual(stats.errors, {'a': 1})
+        self.assertEqual(stats.total_time, {'a': 4.0, 'b': 0.5})
+        self.assertEqual(stats.max_time, {'a': 3.0, 'b': 0.5})
+        self.assertEqual(stats.mean_time('a'), 2.0)
+
+    def test_reset(self):
+        stats = lazy.LazyStats()
+        stats.record('a', 1.0, True)
+
+        stats.reset()
+
+        self.assertEqual(stats.counts, {})
+        self.assertEqual(stats.errors, {})
+        self.assertEqual(stats.total_time, {})
+        self.assertEqual(stats.max_time, {})
+
+
+class TestResolve(tests.TestCase):
+    def test_plain(self):
+        memo = {}
+
+        self.assertEqual(lazy.resolve('a', 'value', memo), 'value')
+        self.assertEqual(memo, {})
+
+    @mock.patch.object(lazy.timeit, 'default_timer', side_effect=[1.0, 3.0])
+    def test_lazy(self, mock_default_timer):
+        provider = mock.Mock(return_value='value')
+        memo = {}
+        stats = mock.Mock()
+
+        result = lazy.resolve('a', lazy.Lazy(provider), memo, stats)
+
+        self.assertEqual(result, 'value')
+        self.assertEqual(memo, {'a': 'value'})
+        stats.record.assert_called_once_with('a', 2.0)
+
+    def test_memoized(self):
+        provider = mock.Mock()
+
+        result = lazy.resolve('a', lazy.Lazy(provider), {'a': 'value'})
+
+        self.assertEqual(result, 'value')
+        self.assertFalse(provider.called)
+
+    @mock.patch.object(lazy.timeit, 'default_timer', side_effect=[1.0, 3.0])
+    def test_error(self, mock_default_timer):
+        provider = mock.Mock(side_effect=KeyError('a'))
+        memo = {}
+        stats = mock.Mock()
+
+        self.assertRaises(KeyError, lazy.resolve, 'a', lazy.Lazy(provider),
+                          memo, stats)
+        self.assertEqual(memo, {})
+        stats.record.assert_called_once_with('a', 2.0, True)
+
+    def test_awaitable(self):
+        awaitable = mock.Mock(spec=['__await__', 'close'])
+        memo = {}
+        stats = mock.Mock()
+
+        self.assertRaises(TypeError, lazy.resolve, 'a',
+                          lazy.Lazy(mock.Mock(return_value=awaitable)),
+                          memo, stats)
+        self.assertEqual(memo, {})
+        awaitable.close.assert_called_once_with()
+        stats.record.assert_called_once_with('a', mock.ANY, True)
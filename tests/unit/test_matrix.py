@@ -0,0 +1,301 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import mock
+
+from policies import analysis
+from policies import matrix
+from policies import policy
+
+import tests
+
+numpy = matrix.numpy
+
+
+def expr(text):
+    pol = policy.Policy()
+    pol['test'] = text
+    return analysis.decompile(pol['test'].instructions)[0]
+
+
+class TestSubstitute(tests.TestCase):
+    def test_substitute(self):
+        node = expr('a.b + f(a, c) if a else (a and [b][0])')
+
+        result = matrix.substitute(node, {'a': analysis.Name('x')})
+
+        self.assertEqual(result,
+                         expr('x.b + f(x, c) if x else (x and [b][0])'))
+
+    def test_unchanged(self):
+        node = expr('a + 1')
+
+        self.assertEqual(matrix.substitute(node, {}), node)
+
+
+class TestFactorizer(tests.TestCase):
+    def test_sides(self):
+        factorizer = matrix.Factorizer(['p'], ['r'])
+
+        self.assertEqual(factorizer.sides(expr('p.a + 1')), matrix.PRINCIPAL)
+        self.assertEqual(factorizer.sides(expr('r')), matrix.RESOURCE)
+        self.assertEqual(factorizer.sides(expr('p == r')),
+                         matrix.PRINCIPAL | matrix.RESOURCE)
+        self.assertEqual(factorizer.sides(expr('x + 1')), 0)
+
+    def test_sides_context(self):
+        func = mock.Mock(_policies_want_context=True)
+        node = analysis.Call(analysis.Const(func), [analysis.Name('p')])
+        factorizer = matrix.Factorizer(['p'], ['r'])
+
+        self.assertEqual(factorizer.sides(node),
+                         matrix.PRINCIPAL | matrix.CONTEXT)
+
+    def test_call(self):
+        factorizer = matrix.Factorizer(['p'], ['r'])
+
+        result = factorizer(expr('p.name == r.owner or '
+                                 '(p.admin and r.public) or '
+                                 'r.owner == p.name or x'))
+
+        self.assertEqual(result, matrix.substitute(
+            expr('p0 == r0 or (p1 and r1) or r0 == p0 or x'), {
+                'p0': analysis.Name('<principal 0>'),
+                'p1': analysis.Name('<principal 1>'),
+                'r0': analysis.Name('<resource 0>'),
+                'r1': analysis.Name('<resource 1>'),
+            }))
+        self.assertEqual(
+            sorted(factorizer.principal_atoms.values()),
+            [('<principal 0>', expr('p.name')),
+             ('<principal 1>', expr('p.admin'))])
+        self.assertEqual(
+            sorted(factorizer.resource_atoms.values()),
+            [('<resource 0>', expr('r.owner')),
+             ('<resource 1>', expr('r.public'))])
+
+    def test_call_context(self):
+        func = mock.Mock(_policies_want_context=True)
+        node = analysis.Call(analysis.Const(func), [analysis.Name('p')])
+        factorizer = matrix.Factorizer(['p'], ['r'])
+
+        self.assertRaises(matrix.FactorError, factorizer,
+                          analysis.And(analysis.Name('r'), node))
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestAuthorizationMatrix(tests.TestCase):
+    def make_matrix(self):
+        rows = [numpy.packbits([True] * 9),
+                numpy.packbits([False, True] + [False] * 7)]
+        return matrix.AuthorizationMatrix(
+            (3, 9), rows, numpy.array([1, 0, 1]))
+
+    def test_getitem(self):
+        result = self.make_matrix()
+
+        self.assertEqual(result[0, 1], True)
+        self.assertEqual(result[0, 0], False)
+        self.assertEqual(result[1, 8], True)
+        self.assertRaises(IndexError, lambda: result[1, 9])
+
+    def test_iter(self):
+        result = self.make_matrix()
+
+        self.assertEqual(list(result),
+                         [(0, 1)] + [(1, i) for i in range(9)] + [(2, 1)])
+
+    def test_packed(self):
+        result = self.make_matrix()
+
+        self.assertEqual(result.packed(0), b'\x40\x00')
+        self.assertEqual(result.packed(1), b'\xff\x80')
+
+    def test_row(self):
+        result = self.make_matrix()
+
+        self.assertEqual(result.row(0).tolist(),
+                         [False, True] + [False] * 7)
+
+    def test_allowed(self):
+        result = self.make_matrix()
+
+        self.assertEqual(result.allowed(2).tolist(), [1])
+
+    def test_count(self):
+        result = self.make_matrix()
+
+        self.assertEqual(result.count(), 11)
+
+    def test_toarray(self):
+        result = self.make_matrix().toarray()
+
+        self.assertEqual(result.shape, (3, 9))
+        self.assertEqual(result[1].tolist(), [True] * 9)
+        self.assertEqual(result[2].tolist(), [False, True] + [False] * 7)
+
+    def test_toarray_empty(self):
+        result = matrix.AuthorizationMatrix(
+            (0, 4), [], numpy.zeros(0, dtype=int)).toarray()
+
+        self.assertEqual(result.shape, (0, 4))
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestEvaluate(tests.TestCase):
+    def make_policy(self):
+        pol = policy.Policy()
+        pol['is_admin'] = '"admin" in roles'
+        pol['view'] = 'rule("is_admin") or owner == user or public'
+        pol['limit'] = 'quota > 0 and 10 // quota > size'
+        pol['attr'] = 'public {{ share=size // quota }}'
+        pol['allow'] = 'level > 0'
+        pol['dynamic'] = 'rule(which)'
+        return pol
+
+    def test_shared_variables(self):
+        pol = self.make_policy()
+
+        self.assertRaises(ValueError, matrix.evaluate, pol, 'view',
+                          [{'user': 1, 'x': 2}], [{'x': 3}])
+
+    def test_constant(self):
+        pol = self.make_policy()
+
+        result = matrix.evaluate(pol, 'allow', [{'user': 1}] * 3,
+                                 [{'owner': 1}] * 2, {'level': 1})
+
+        self.assertEqual(len(result.rows), 1)
+        self.assertEqual(result.toarray().tolist(), [[True, True]] * 3)
+
+    def test_missing(self):
+        pol = self.make_policy()
+
+        result = matrix.evaluate(pol, 'missing', [{'user': 1}],
+                                 [{'owner': 1}])
+
+        self.assertEqual(result.toarray().tolist(), [[False]])
+
+    def test_factorized(self):
+        pol = self.make_policy()
+        principals = [
+            {'user': 1, 'roles': []},
+            {'user': 2, 'roles': ['admin']},
+            {'user': 3, 'roles': []},
+            {'user': 1, 'roles': ['user']},
+        ]
+        resources = [
+            {'owner': 1, 'public': False},
+            {'owner': 2, 'public': False},
+            {'owner': 2, 'public': True},
+        ]
+
+        with mock.patch.object(matrix, '_evaluate_pairs') as mock_pairs:
+            result = matrix.evaluate(pol, 'view', principals, resources)
+
+        self.assertFalse(mock_pairs.called)
+        self.assertEqual(result.toarray().tolist(), [
+            [True, False, True],
+            [True, True, True],
+            [False, False, True],
+            [True, False, True],
+        ])
+        self.assertEqual(len(result.rows), 3)
+        self.assertEqual(result.index[0], result.index[3])
+
+    def test_failures(self):
+        pol = self.make_policy()
+        principals = [{'quota': 0}, {'quota': 2}, {'quota': 'x'}]
+        resources = [{'size': 1}, {'size': 9}, {'size': None}]
+
+        result = matrix.evaluate(pol, 'limit', principals, resources)
+
+        self.assertEqual(result.toarray().tolist(), [
+            [False, False, False],
+            [True, False, False],
+            [False, False, False],
+        ])
+
+    def test_attr_failures(self):
+        pol = self.make_policy()
+        principals = [{'quota': 0}, {'quota': 2}]
+        resources = [{'size': 1, 'public': True},
+                     {'size': None, 'public': True},
+                     {'size': 3, 'public': False}]
+
+        result = matrix.evaluate(pol, 'attr', principals, resources)
+
+        self.assertEqual(result.toarray().tolist(), [
+            [False, False, False],
+            [True, False, False],
+        ])
+
+    def test_missing_variable(self):
+        pol = self.make_policy()
+        principals = [{'user': 2}, {'roles': ['user']}]
+        resources = [{'owner': 1, 'public': False}]
+
+        result = matrix.evaluate(pol, 'view', principals, resources,
+                                 {'user': 1, 'roles': []})
+
+        self.assertEqual(result.toarray().tolist(), [[False], [True]])
+
+    def test_same_repr(self):
+        class User(object):
+            def __init__(self, admin):
+                self.admin = admin
+
+            def __repr__(self):
+                return 'User()'
+
+        pol = self.make_policy()
+        pol['check'] = 'check(user, doc)'
+        principals = [{'user': User(True)}, {'user': User(False)}]
+        resources = [{'doc': 1}]
+
+        result = matrix.evaluate(pol, 'check', principals, resources,
+                                 {'check': lambda user, doc: user.admin})
+
+        self.assertEqual(result.toarray().tolist(), [[True], [False]])
+
+    def test_pairs(self):
+        pol = self.make_policy()
+        principals = [{'which': 'is_admin', 'roles': ['admin']},
+                      {'which': 'is_admin', 'roles': []}]
+        resources = [{'x': 1}, {'x': 2}]
+
+        result = matrix.evaluate(pol, 'dynamic', principals, resources)
+
+        self.assertEqual(result.toarray().tolist(),
+                         [[True, True], [False, False]])
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestEvaluatePairs(tests.TestCase):
+    def test_evaluate_pairs(self):
+        pol = policy.Policy()
+        pol['test'] = 'a + b > c'
+
+        result = matrix._evaluate_pairs(pol, 'test', [{'a': 1}, {'a': 3}],
+                                        [{'b': 1}, {'b': 2}, {'b': 3}],
+                                        {'c': 3})
+
+        self.assertEqual(result.shape, (2, 3))
+        self.assertEqual(result.toarray().tolist(),
+                         [[False, False, True], [True, True, True]])
+        self.assertEqual(len(result.rows), 2)
@@ -0,0 +1,259 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import mock
+
+from policies import analysis
+from policies import authorization
+from policies import instructions
+from policies import lazy
+from policies import partial
+from policies import policy
+
+import tests
+
+
+def fold(text, variables, boolean=False, pol=None):
+    pol = pol or policy.Policy()
+    pol['test'] = text
+    expr = analysis.decompile(pol['test'].instructions)[0]
+    return partial.Folder(pol, variables)(expr, boolean)
+
+
+class TestFolder(tests.TestCase):
+    def test_name(self):
+        self.assertEqual(fold('a', {'a': 1}), analysis.Const(1))
+        self.assertEqual(fold('a', {}), analysis.Name('a'))
+        self.assertEqual(fold('len', {}), analysis.Const(len))
+
+    def test_name_lazy(self):
+        provider = mock.Mock(return_value=1)
+        variables = {'a': lazy.Lazy(provider), 'b': lazy.Lazy(
+            mock.Mock(side_effect=KeyError('b')))}
+
+        self.assertEqual(fold('a + a', variables), analysis.Const(2))
+        self.assertEqual(fold('b', variables), analysis.Name('b'))
+        provider.assert_called_once_with()
+
+    def test_name_unknown(self):
+        pol = policy.Policy()
+        pol['test'] = 'len'
+        expr = analysis.decompile(pol['test'].instructions)[0]
+
+        result = partial.Folder(pol, {}, unknowns=['len'])(expr)
+
+        self.assertEqual(result, analysis.Name('len'))
+
+    def test_attr(self):
+        self.assertEqual(fold('a.real', {'a': 1}), analysis.Const(1))
+        self.assertEqual(fold('a.real', {}),
+                         analysis.Attr(analysis.Name('a'), 'real'))
+        self.assertEqual(fold('a.missing', {'a': 1}),
+                         analysis.Attr(analysis.Const(1), 'missing'))
+
+    def test_op(self):
+        self.assertEqual(fold('a + b', {'a': 1, 'b': 2}), analysis.Const(3))
+        self.assertEqual(fold('a + b', {'a': 1}), analysis.Op(
+            instructions.add_op, [analysis.Const(1), analysis.Name('b')]))
+        self.assertEqual(fold('a / b', {'a': 1, 'b': 0}), analysis.Op(
+            instructions.true_div_op, [analysis.Const(1), analysis.Const(0)]))
+
+    def test_call(self):
+        self.assertEqual(fold('len(a)', {'a': 'abc'}), analysis.Const(3))
+        self.assertEqual(fold('len(a)', {}), analysis.Call(
+            analysis.Const(len), [analysis.Name('a')]))
+        self.assertEqual(fold('len(a)', {'a': 1}), analysis.Call(
+            analysis.Const(len), [analysis.Const(1)]))
+
+    def test_call_awaitable(self):
+        result = mock.Mock(spec=['__await__', 'close'])
+        func = mock.Mock(return_value=result, spec=[])
+
+        self.assertEqual(fold('func(1)', {'func': func}), analysis.Call(
+            analysis.Const(func), [analysis.Const(1)]))
+        result.close.assert_called_once_with()
+
+    def test_call_want_context(self):
+        func = mock.Mock(_policies_want_context=True)
+
+        result = fold('func(1)', {'func': func})
+
+        self.assertEqual(result, analysis.Call(analysis.Const(func),
+                                               [analysis.Const(1)]))
+        self.assertFalse(func.called)
+
+    def test_rule(self):
+        pol = policy.Policy()
+        pol['admin'] = '"admin" in roles'
+        pol['owner'] = 'user == target'
+
+        self.assertEqual(fold('rule("admin")', {'roles': ['admin']},
+                              pol=pol), analysis.Const(True))
+        self.assertEqual(fold('rule("owner")', {'user': 'a'}, pol=pol),
+                         analysis.Op(instructions.eq_op, [
+                             analysis.Const('a'), analysis.Name('target')]))
+        self.assertEqual(fold('rule("missing")', {}, pol=pol),
+                         analysis.Const(False))
+
+    def test_rule_recursive(self):
+        pol = policy.Policy()
+        pol['loop'] = 'rule("loop")'
+
+        result = fold('rule("loop")', {}, pol=pol)
+
+        self.assertEqual(result, analysis.Call(
+            analysis.Const(policy.rule), [analysis.Const('loop')]))
+
+    def test_and(self):
+        self.assertEqual(fold('a and b', {'a': 0}), analysis.Const(0))
+        self.assertEqual(fold('a and b', {'a': 1}), analysis.Name('b'))
+        self.assertEqual(fold('a and b', {'b': 1}), analysis.And(
+            analysis.Name('a'), analysis.Const(1)))
+        self.assertEqual(fold('a and b', {'b': 1}, True), analysis.Name('a'))
+
+    def test_or(self):
+        self.assertEqual(fold('a or b', {'a': 1}), analysis.Const(1))
+        self.assertEqual(fold('a or b', {'a': 0}), analysis.Name('b'))
+        self.assertEqual(fold('a or b', {'b': 0}), analysis.Or(
+            analysis.Name('a'), analysis.Const(0)))
+        self.assertEqual(fold('a or b', {'b': 0}, True), analysis.Name('a'))
+
+        # Could hide an exception raised while computing "a"
+        self.assertEqual(fold('a or b', {'b': 1}, True), analysis.Or(
+            analysis.Name('a'), analysis.Const(1)))
+
+    def test_cond(self):
+        self.assertEqual(fold('b if a else c', {'a': 1}), analysis.Name('b'))
+        self.assertEqual(fold('b if a else c', {'a': 0}), analysis.Name('c'))
+        self.assertEqual(fold('b if a else c', {'b': 1}), analysis.Cond(
+            analysis.Name('a'), analysis.Const(1), analysis.Name('c')))
+
+
+class TestResidual(tests.TestCase):
+    def make_policy(self):
+        pol = policy.Policy()
+        pol['admin'] = '"admin" in roles'
+        pol['get'] = ('rule("admin") or item.owner == user '
+                      '{{ admin=rule("admin"), owner=item.owner }}')
+        return pol
+
+    def test_init(self):
+        pol = self.make_policy()
+
+        result = partial.Residual(pol, 'get', pol['get'], {'a': 1},
+                                  {'roles': [], 'user': 'u'})
+
+        self.assertEqual(result.policy, pol)
+        self.assertEqual(result.name, 'get')
+        self.assertEqual(result.defaults, {'a': 1})
+        self.assertEqual(result.variables, {'roles': [], 'user': 'u'})
+        self.assertEqual(result.expr, analysis.Op(instructions.eq_op, [
+            analysis.Attr(analysis.Name('item'), 'owner'),
+            analysis.Const('u'),
+        ]))
+        self.assertEqual(result.attrs, [
+            ('admin', analysis.Const(False)),
+            ('owner', analysis.Attr(analysis.Name('item'), 'owner')),
+        ])
+        self.assertEqual(result.instructions,
+                         analysis.compile_rule(result.expr, result.attrs))
+        self.assertEqual(result.decision, None)
+        self.assertFalse(result.constant)
+
+    def test_init_norule(self):
+        result = partial.Residual('pol', 'get', None, None, {})
+
+        self.assertEqual(result.expr, analysis.Const(False))
+        self.assertEqual(result.attrs, [])
+        self.assertEqual(result.instructions, None)
+        self.assertEqual(result.decision, False)
+        self.assertTrue(result.constant)
+
+    def test_init_undecompilable(self):
+        rule = mock.Mock(instructions=instructions.Instructions([
+            instructions.Ident('user'),
+            instructions.Jump(1),
+        ]))
+
+        result = partial.Residual('pol', 'get', rule, {}, {})
+
+        self.assertEqual(result.expr, None)
+        self.assertEqual(result.attrs, [])
+        self.assertIs(result.instructions, rule.instructions)
+        self.assertEqual(result.decision, None)
+
+    def test_decision(self):
+        pol = self.make_policy()
+        pol['attr_raises'] = 'a {{ x=1 / b }}'
+
+        bad_attr = partial.Residual(pol, 'get', pol['get'], {},
+                                    {'roles': ['admin'], 'item': 'x'})
+        deny = partial.Residual(pol, 'attr_raises', pol['attr_raises'], {},
+                                {'a': False})
+        unknown = partial.Residual(pol, 'attr_raises', pol['attr_raises'],
+                                   {}, {'a': True})
+
+        self.assertEqual(bad_attr.decision, None)
+        self.assertEqual(deny.decision, False)
+        self.assertEqual(unknown.decision, None)
+
+    def test_decision_attrs(self):
+        pol = self.make_policy()
+        pol['plain'] = 'rule("admin") {{ x=1 }}'
+
+        result = partial.Residual(pol, 'plain', pol['plain'], {},
+                                  {'roles': ['admin']})
+
+        self.assertEqual(result.decision, True)
+        self.assertTrue(result.constant)
+
+    def test_evaluate(self):
+        pol = self.make_policy()
+        res = partial.Residual(pol, 'get', pol['get'], {'a': 1},
+                               {'roles': [], 'user': 'u'})
+
+        result = res.evaluate({'item': mock.Mock(owner='u')})
+
+        self.assertTrue(result)
+        self.assertEqual(result.a, 1)
+        self.assertEqual(result.admin, False)
+        self.assertEqual(result.owner, 'u')
+
+    def test_evaluate_norule(self):
+        res = partial.Residual('pol', 'get', None, None, {})
+
+        result = res.evaluate({'item': 'x'})
+
+        self.assertIsInstance(result, authorization.Authorization)
+        self.assertFalse(result)
+
+    def test_evaluate_many(self):
+        pol = self.make_policy()
+        res = partial.Residual(pol, 'get', pol['get'], {},
+                               {'roles': [], 'user': 'u'})
+
+        result = res.evaluate_many([{'item': mock.Mock(owner=owner)}
+                                    for owner in ('u', 'v', 'u')])
+
+        self.assertEqual([bool(a) for a in result], [True, False, True])
+
+    def test_evaluate_many_norule(self):
+        res = partial.Residual('pol', 'get', None, None, {})
+
+        result = res.evaluate_many([{}, {}])
+
+        self.assertEqual([bool(a) for a in result], [False, False])
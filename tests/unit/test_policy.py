@@ -14,11 +14,20 @@
 # along with this program.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+import unittest
+
 import mock
-import pkg_resources
 
+try:
+    from policies import aio
+except (ImportError, SyntaxError):
+    aio = None
+from policies import engines
+from policies import entrypoints
+from policies import lazy
 from policies import policy
 from policies import rules
+from policies import warmup
 
 import tests
 
@@ -36,6 +45,8 @@ class TestPolicyContext(tests.TestCase):
         self.assertEqual(ctxt._pc, [])
         self.assertEqual(ctxt._step, [])
         self.assertEqual(ctxt.rule_cache, {})
+        self.assertEqual(ctxt.call_cache, {})
+        self.assertEqual(ctxt.lazy_cache, {})
         self.assertEqual(ctxt.reported, False)
 
     def test_resolve_defined(self):
@@ -47,6 +58,19 @@ class TestPolicyContext(tests.TestCase):
         self.assertEqual(result, 1)
         self.assertFalse(pol.resolve.called)
 
+    def test_resolve_lazy(self):
+        pol = mock.Mock(lazy_stats=lazy.LazyStats())
+        provider = mock.Mock(return_value='value')
+        ctxt = policy.PolicyContext(pol, 'attrs', {'a': lazy.Lazy(provider)})
+
+        results = [ctxt.resolve('a'), ctxt.resolve('a')]
+
+        self.assertEqual(results, ['value', 'value'])
+        provider.assert_called_once_with()
+        self.assertEqual(ctxt.lazy_cache, {'a': 'value'})
+        self.assertEqual(pol.lazy_stats.counts, {'a': 1})
+        self.assertFalse(pol.resolve.called)
+
     def test_resolve_undefined(self):
         pol = mock.Mock(**{'resolve.return_value': 'value'})
         ctxt = policy.PolicyContext(pol, 'attrs', {'a': 1})
@@ -199,6 +223,47 @@ class TestPolicyContext(tests.TestCase):
 
         self.assertRaises(AttributeError, setattr, ctxt, 'step', 3)
 
+    def test_reset(self):
+        ctxt = policy.PolicyContext('policy', 'attrs', 'variables')
+        ctxt._name = ['a', 'b']
+        ctxt._pc = [5, 3]
+        ctxt._step = [2, 1]
+        ctxt.stack = [1, 2]
+        ctxt.authz = 'authz'
+        ctxt.rule_cache = {'a': True}
+        ctxt.call_cache = {'b': False}
+        ctxt.lazy_cache = {'c': 1}
+        ctxt.reported = True
+
+        ctxt.reset('rule', {'x': 1})
+
+        self.assertEqual(ctxt.policy, 'policy')
+        self.assertEqual(ctxt.attrs, 'attrs')
+        self.assertEqual(ctxt.variables, {'x': 1})
+        self.assertEqual(ctxt.stack, [])
+        self.assertEqual(ctxt.authz, None)
+        self.assertEqual(ctxt.rule_cache, {})
+        self.assertEqual(ctxt.call_cache, {})
+        self.assertEqual(ctxt.lazy_cache, {})
+        self.assertEqual(ctxt.reported, False)
+        self.assertEqual(ctxt.name, 'rule')
+        self.assertEqual(ctxt.pc, 0)
+        self.assertEqual(ctxt.step, 1)
+
+    def test_reset_keep_caches(self):
+        ctxt = policy.PolicyContext('policy', 'attrs', 'variables')
+        ctxt.rule_cache = {'a': True}
+        ctxt.memo = {1: 'value'}
+        ctxt.call_cache = {'b': False}
+        ctxt.reported = True
+
+        ctxt.reset('rule', {'x': 1}, clear_caches=False)
+
+        self.assertEqual(ctxt.rule_cache, {'a': True})
+        self.assertEqual(ctxt.memo, {1: 'value'})
+        self.assertEqual(ctxt.call_cache, {'b': False})
+        self.assertEqual(ctxt.reported, False)
+
 
 def item_setter(obj, item, value):
     obj[item] = value
@@ -212,26 +277,39 @@ class TestPolicy(tests.TestCase):
         pol = policy.Policy()
 
         self.assertEqual(pol._group, None)
+        self.assertEqual(pol._entrypoints, None)
+        self.assertTrue(isinstance(pol.engine, engines.StackEngine))
         self.assertEqual(pol._defaults, {})
         self.assertEqual(pol._docs, {})
         self.assertEqual(pol._rules, {})
         self.assertEqual(pol._resolve_cache, expected)
         self.assertNotEqual(id(pol._resolve_cache),
                             id(policy.Policy.builtins))
+        self.assertEqual(pol.generation, 0)
+        self.assertEqual(pol.decision_cache, None)
+        self.assertEqual(pol.coalescer, None)
+        self.assertTrue(isinstance(pol.lazy_stats, lazy.LazyStats))
 
     def test_init_full(self):
         builtins = {'a': 1, 'b': 2, 'c': 3}
         expected = builtins.copy()
         expected['rule'] = policy.rule
+        dcache = mock.Mock()
 
-        pol = policy.Policy('group', builtins)
+        pol = policy.Policy('group', builtins, 'engine', dcache,
+                            'coalescer')
 
         self.assertEqual(pol._group, 'group')
+        self.assertEqual(pol._entrypoints.group, 'group')
+        self.assertEqual(pol.engine, 'engine')
         self.assertEqual(pol._defaults, {})
         self.assertEqual(pol._docs, {})
         self.assertEqual(pol._rules, {})
         self.assertEqual(pol._resolve_cache, expected)
         self.assertNotEqual(id(pol._resolve_cache), id(builtins))
+        self.assertEqual(pol.decision_cache, dcache)
+        dcache.bind.assert_called_once_with(pol)
+        self.assertEqual(pol.coalescer, 'coalescer')
 
     def test_getitem_none(self):
         pol = policy.Policy()
@@ -259,6 +337,7 @@ class TestPolicy(tests.TestCase):
 
         self.assertEqual(pol._rules, {'rule': 'compiled'})
         self.assertEqual(pol._defaults, {})
+        self.assertEqual(pol.generation, 1)
         mock_Rule.assert_called_once_with('rule', 'test')
 
     def test_setitem_badname(self):
@@ -271,6 +350,7 @@ class TestPolicy(tests.TestCase):
                               pol, 'rule', rule)
 
         self.assertEqual(pol._defaults, {})
+        self.assertEqual(pol.generation, 0)
         self.assertFalse(mock_Rule.called)
 
     def test_setitem(self):
@@ -283,6 +363,7 @@ class TestPolicy(tests.TestCase):
 
         self.assertEqual(pol._rules, {'rule': rule})
         self.assertEqual(pol._defaults, {})
+        self.assertEqual(pol.generation, 1)
         self.assertFalse(mock_Rule.called)
 
     def test_delitem(self):
@@ -294,6 +375,7 @@ class TestPolicy(tests.TestCase):
 
         self.assertEqual(pol._rules, {'b': 2})
         self.assertEqual(pol._defaults, {'a': 3})
+        self.assertEqual(pol.generation, 1)
 
     def test_iter(self):
         pol = policy.Policy()
@@ -323,6 +405,7 @@ class TestPolicy(tests.TestCase):
         self.assertEqual(pol._defaults, {'name': 'rule'})
         self.assertEqual(pol._docs, {'name': 'doc'})
         self.assertEqual(pol._rules, {})
+        self.assertEqual(pol.generation, 1)
         mock_Rule.assert_called_once_with('name', '', None)
         mock_RuleDoc.assert_called_once_with('name', None, None)
 
@@ -349,6 +432,7 @@ class TestPolicy(tests.TestCase):
 
         self.assertEqual(pol._rules, {'name': rule})
         self.assertEqual(pol._defaults, {})
+        self.assertEqual(pol.generation, 1)
 
     def test_del_rule(self):
         rule = rules.Rule('name')
@@ -360,6 +444,7 @@ class TestPolicy(tests.TestCase):
 
         self.assertEqual(pol._rules, {'other': 'rule2'})
         self.assertEqual(pol._defaults, {'name': 'default'})
+        self.assertEqual(pol.generation, 1)
 
     @mock.patch.object(rules, 'RuleDoc', return_value='doc')
     def test_get_doc_exists(self, mock_RuleDoc):
@@ -410,62 +495,82 @@ class TestPolicy(tests.TestCase):
 
         self.assertRaises(KeyError, pol.get_default, 'a')
 
-    @mock.patch.object(pkg_resources, 'iter_entry_points', return_value=[
-        mock.Mock(**{'load.side_effect': ImportError()}),
-        mock.Mock(**{'load.side_effect': AttributeError()}),
-        mock.Mock(**{'load.side_effect': pkg_resources.UnknownExtra()}),
-        mock.Mock(**{'load.return_value': 'value1'}),
-        mock.Mock(**{'load.return_value': 'value2'}),
-    ])
-    def test_resolve_builtin(self, mock_iter_entry_points):
-        pol = policy.Policy()
+    @mock.patch.object(entrypoints.EntryPointIndex, 'load',
+                       return_value='value')
+    def test_resolve_builtin(self, mock_load):
+        pol = policy.Policy('group')
 
         result = pol.resolve('abs')
 
         self.assertEqual(result, abs)
-        self.assertFalse(mock_iter_entry_points.called)
+        self.assertFalse(mock_load.called)
 
-    @mock.patch.object(pkg_resources, 'iter_entry_points', return_value=[
-        mock.Mock(**{'load.side_effect': ImportError()}),
-        mock.Mock(**{'load.side_effect': AttributeError()}),
-        mock.Mock(**{'load.side_effect': pkg_resources.UnknownExtra()}),
-        mock.Mock(**{'load.return_value': 'value1'}),
-        mock.Mock(**{'load.return_value': 'value2'}),
-    ])
-    def test_resolve_nogroup(self, mock_iter_entry_points):
+    @mock.patch.object(entrypoints.EntryPointIndex, 'load',
+                       return_value='value')
+    def test_resolve_nogroup(self, mock_load):
         pol = policy.Policy()
 
         result = pol.resolve('other')
 
         self.assertEqual(result, None)
         self.assertEqual(pol._resolve_cache['other'], None)
-        self.assertFalse(mock_iter_entry_points.called)
-
-    @mock.patch.object(pkg_resources, 'iter_entry_points', return_value=[
-        mock.Mock(**{'load.side_effect': ImportError()}),
-        mock.Mock(**{'load.side_effect': AttributeError()}),
-        mock.Mock(**{'load.side_effect': pkg_resources.UnknownExtra()}),
-        mock.Mock(**{'load.return_value': 'value1'}),
-        mock.Mock(**{'load.return_value': 'value2'}),
-    ])
-    def test_resolve_withgroup(self, mock_iter_entry_points):
+        self.assertFalse(mock_load.called)
+
+    @mock.patch.object(entrypoints.EntryPointIndex, 'load',
+                       return_value='value')
+    def test_resolve_withgroup(self, mock_load):
         pol = policy.Policy('group')
 
         result = pol.resolve('other')
 
-        self.assertEqual(result, 'value1')
-        self.assertEqual(pol._resolve_cache['other'], 'value1')
-        mock_iter_entry_points.assert_called_once_with('group', 'other')
+        self.assertEqual(result, 'value')
+        self.assertEqual(pol._resolve_cache['other'], 'value')
+        mock_load.assert_called_once_with('other')
 
-    @mock.patch.object(pkg_resources, 'iter_entry_points', return_value=[])
-    def test_resolve_withgroup_noresolve(self, mock_iter_entry_points):
+    @mock.patch.object(entrypoints.EntryPointIndex, 'load',
+                       return_value=None)
+    def test_resolve_withgroup_noresolve(self, mock_load):
         pol = policy.Policy('group')
 
         result = pol.resolve('other')
 
         self.assertEqual(result, None)
         self.assertEqual(pol._resolve_cache['other'], None)
-        mock_iter_entry_points.assert_called_once_with('group', 'other')
+        mock_load.assert_called_once_with('other')
+
+    @mock.patch.object(entrypoints.EntryPointIndex, 'invalidate')
+    def test_invalidate_entrypoints(self, mock_invalidate):
+        expected = policy.Policy.builtins.copy()
+        expected['rule'] = policy.rule
+        pol = policy.Policy('group')
+        pol._resolve_cache['other'] = 'value'
+
+        pol.invalidate_entrypoints()
+
+        self.assertEqual(pol._resolve_cache, expected)
+        self.assertEqual(pol.generation, 1)
+        mock_invalidate.assert_called_once_with()
+
+    def test_invalidate_entrypoints_nogroup(self):
+        builtins = {'a': 1}
+        pol = policy.Policy(builtins=builtins)
+        pol._resolve_cache['other'] = 'value'
+
+        pol.invalidate_entrypoints()
+
+        self.assertEqual(pol._resolve_cache, {'a': 1, 'rule': policy.rule})
+
+    def test_evaluate_cached(self):
+        cache = mock.Mock(**{'evaluate.return_value': 'cached'})
+        pol = policy.Policy(decision_cache=cache)
+
+        with mock.patch.object(pol, '_evaluate') as mock_evaluate:
+            result = pol.evaluate('name', {'a': 1})
+
+        self.assertEqual(result, 'cached')
+        cache.evaluate.assert_called_once_with(pol, 'name', {'a': 1},
+                                               mock_evaluate)
+        self.assertFalse(mock_evaluate.called)
 
     @mock.patch('logging.getLogger')
     @mock.patch('policies.authorization.Authorization', return_value='authz')
@@ -625,6 +730,655 @@ class TestPolicy(tests.TestCase):
         rule.instructions.assert_called_once_with(
             mock_PolicyContext.return_value)
 
+    @unittest.skipIf(aio is None, "asyncio support requires Python 3.5")
+    @mock.patch('policies.aio.run', new_callable=mock.Mock,
+                return_value='coro')
+    def test_evaluate_async_norule(self, mock_run):
+        pol = policy.Policy(engine=mock.Mock())
+
+        result = pol.evaluate_async('name', {'x': 1})
+
+        self.assertEqual(result, 'coro')
+        mock_run.assert_called_once_with(pol, 'name', None, None, {'x': 1},
+                                         None)
+        self.assertFalse(pol.engine.compile.called)
+
+    @unittest.skipIf(aio is None, "asyncio support requires Python 3.5")
+    @mock.patch('policies.aio.run', new_callable=mock.Mock,
+                return_value='coro')
+    def test_evaluate_async(self, mock_run):
+        engine = mock.Mock(**{'compile.return_value': 'compiled'})
+        pol = policy.Policy(engine=engine)
+        pol._rules['name'] = mock.Mock(attrs={'a': 1})
+
+        result = pol.evaluate_async('name', timeout=5)
+
+        self.assertEqual(result, 'coro')
+        engine.compile.assert_called_once_with(pol._rules['name'])
+        mock_run.assert_called_once_with(pol, 'name', 'compiled', {'a': 1},
+                                         {}, 5)
+
+    @unittest.skipIf(aio is None, "asyncio support requires Python 3.5")
+    @mock.patch('policies.aio.run', new_callable=mock.Mock,
+                return_value='coro')
+    def test_evaluate_async_coalesced(self, mock_run):
+        coalescer = mock.Mock(**{
+            'evaluate.side_effect': lambda p, n, v, e: e(n, v),
+        })
+        pol = policy.Policy(engine=mock.Mock(), coalescer=coalescer)
+
+        result = pol.evaluate_async('name', timeout=5)
+
+        self.assertEqual(result, 'coro')
+        coalescer.evaluate.assert_called_once_with(pol, 'name', {}, mock.ANY)
+        mock_run.assert_called_once_with(pol, 'name', None, None, {}, 5)
+
+    @mock.patch('policies.authorization.Authorization', return_value='authz')
+    def test_evaluate_many_norule(self, mock_Authorization):
+        pol = policy.Policy(engine=mock.Mock())
+
+        result = pol.evaluate_many('name', iter([{'x': 1}, {'x': 2}]))
+
+        self.assertEqual(list(result), ['authz', 'authz'])
+        mock_Authorization.assert_has_calls([mock.call(False)] * 2)
+        self.assertFalse(pol.engine.evaluate_many.called)
+
+    def test_evaluate_many(self):
+        engine = mock.Mock(**{
+            'compile.return_value': 'compiled',
+            'evaluate_many.side_effect': lambda p, n, c, a, v: (
+                (a, x) for x in v),
+        })
+        pol = policy.Policy(engine=engine)
+        pol._rules['name'] = mock.Mock(attrs={'a': 1})
+
+        result = pol.evaluate_many('name', iter([{'x': 1}, None]))
+
+        self.assertEqual(list(result), [({'a': 1}, {'x': 1}),
+                                        ({'a': 1}, {})])
+        engine.compile.assert_called_once_with(pol._rules['name'])
+        engine.evaluate_many.assert_called_once_with(
+            pol, 'name', 'compiled', {'a': 1}, mock.ANY)
+
+    def test_evaluate_many_bitmap(self):
+        engine = mock.Mock(**{
+            'evaluate_many.side_effect': lambda p, n, c, a, v: (
+                x['x'] for x in v),
+        })
+        pol = policy.Policy(engine=engine)
+        pol._rules['name'] = mock.Mock(attrs={})
+
+        result = pol.evaluate_many('name', [{'x': True}, {'x': False},
+                                            {'x': 'yes'}], True)
+
+        self.assertEqual(result, bytearray([1, 0, 1]))
+
+    def test_evaluate_many_bitmap_norule(self):
+        pol = policy.Policy()
+
+        result = pol.evaluate_many('name', [{}, {}], bitmap=True)
+
+        self.assertEqual(result, bytearray([0, 0]))
+
+    def test_filter_norule(self):
+        pol = policy.Policy(engine=mock.Mock())
+
+        result = pol.filter('name', [1, 2])
+
+        self.assertEqual(list(result), [])
+        self.assertFalse(pol.engine.evaluate_many.called)
+
+    @mock.patch.object(policy.hoist, 'hoist', return_value='hoisted')
+    def test_filter(self, mock_hoist):
+        engine = mock.Mock(**{
+            'supports_memoize': True,
+            'evaluate_many.side_effect': lambda p, n, c, a, v, memo: [
+                x['i'] % 2 == 0 and x['f'] for x in v],
+        })
+        pol = policy.Policy(engine=engine)
+        pol._rules['name'] = mock.Mock(attrs={'a': 1})
+
+        result = pol.filter('name', iter(range(7)), 'i', {'f': True},
+                            chunk_size=3)
+
+        self.assertEqual(list(result), [0, 2, 4, 6])
+        mock_hoist.assert_called_once_with(
+            pol, pol._rules['name'], ['i'], {'f': True})
+        self.assertFalse(engine.compile.called)
+        self.assertEqual(engine.evaluate_many.call_count, 3)
+        memos = set(id(c[1]['memo'])
+                    for c in engine.evaluate_many.call_args_list)
+        self.assertEqual(len(memos), 1)
+        engine.evaluate_many.assert_called_with(
+            pol, 'name', 'hoisted', {'a': 1}, mock.ANY, memo={})
+
+    @mock.patch.object(policy.hoist, 'hoist')
+    def test_filter_no_memoize(self, mock_hoist):
+        engine = mock.Mock(**{
+            'supports_memoize': False,
+            'compile.return_value': 'compiled',
+            'evaluate_many.side_effect': lambda p, n, c, a, v, memo: [
+                x['item'] for x in v],
+        })
+        pol = policy.Policy(engine=engine)
+        pol._rules['name'] = mock.Mock(attrs={})
+
+        result = pol.filter('name', [True, False, 'yes'])
+
+        self.assertEqual(list(result), [True, 'yes'])
+        self.assertFalse(mock_hoist.called)
+        engine.compile.assert_called_once_with(pol._rules['name'])
+
+    @mock.patch.object(policy.columnar, 'evaluate', return_value='mask')
+    def test_evaluate_columns(self, mock_evaluate):
+        pol = policy.Policy()
+
+        result = pol.evaluate_columns('name', 'columns', 'variables', 5)
+
+        self.assertEqual(result, 'mask')
+        mock_evaluate.assert_called_once_with(pol, 'name', 'columns',
+                                              'variables', 5)
+
+    @mock.patch.object(policy.matrix, 'evaluate', return_value='matrix')
+    def test_evaluate_matrix(self, mock_evaluate):
+        pol = policy.Policy()
+
+        result = pol.evaluate_matrix('name', 'principals', 'resources',
+                                     'variables')
+
+        self.assertEqual(result, 'matrix')
+        mock_evaluate.assert_called_once_with(pol, 'name', 'principals',
+                                              'resources', 'variables')
+
+    @mock.patch.object(policy.partial_mod, 'Residual',
+                       return_value='residual')
+    def test_partial(self, mock_Residual):
+        pol = policy.Policy()
+        pol._rules['name'] = mock.Mock(attrs={'a': 1})
+        variables = {'v': 1}
+
+        result = pol.partial('name', variables)
+
+        self.assertEqual(result, 'residual')
+        mock_Residual.assert_called_once_with(
+            pol, 'name', pol._rules['name'], {'a': 1}, {'v': 1})
+        self.assertIsNot(mock_Residual.call_args[0][4], variables)
+
+    @mock.patch.object(policy.partial_mod, 'Residual',
+                       return_value='residual')
+    def test_partial_norule(self, mock_Residual):
+        pol = policy.Policy()
+
+        result = pol.partial('name')
+
+        self.assertEqual(result, 'residual')
+        mock_Residual.assert_called_once_with(pol, 'name', None, None, {})
+
+    @mock.patch.object(policy.shared, 'SharedRules')
+    def test_evaluate_all(self, mock_SharedRules):
+        view = mock_SharedRules.return_value
+        view.lookup.side_effect = lambda n: (
+            (None, None) if n == 'b' else ('rule_%s' % n, {'x': n}))
+        engine = mock.Mock(**{
+            'compile.side_effect': lambda r: 'compiled_%s' % r,
+            'evaluate_all.return_value': 'results',
+        })
+        pol = policy.Policy(engine=engine)
+        pol._rules = {'a': 'rule_a', 'b': 'rule_b'}
+
+        result = pol.evaluate_all({'v': 1})
+
+        self.assertEqual(result, 'results')
+        mock_SharedRules.assert_called_once_with(
+            pol, ('a', 'b'), engine.supports_memoize)
+        engine.evaluate_all.assert_called_once_with(view, [
+            ('a', 'compiled_rule_a', {'x': 'a'}),
+            ('b', None, None),
+        ], {'v': 1})
+        self.assertEqual(pol._shared, {('a', 'b'): view})
+
+    @mock.patch.object(policy.shared, 'SharedRules')
+    def test_evaluate_all_cached(self, mock_SharedRules):
+        view = mock.Mock(**{
+            'current.return_value': True,
+            'lookup.return_value': (None, None),
+        })
+        engine = mock.Mock()
+        pol = policy.Policy(engine=engine)
+        pol._shared[('c', 'a')] = view
+
+        pol.evaluate_all(names=['c', 'a'])
+
+        self.assertFalse(mock_SharedRules.called)
+        view.current.assert_called_once_with(pol)
+        engine.evaluate_all.assert_called_once_with(view, [
+            ('c', None, None),
+            ('a', None, None),
+        ], {})
+
+    @mock.patch.object(policy.shared, 'SharedRules')
+    def test_evaluate_all_stale(self, mock_SharedRules):
+        stale = mock.Mock(**{'current.return_value': False})
+        mock_SharedRules.return_value.lookup.return_value = (None, None)
+        pol = policy.Policy(engine=mock.Mock())
+        pol._shared[('a',)] = stale
+
+        pol.evaluate_all(names=['a'])
+
+        mock_SharedRules.assert_called_once_with(pol, ('a',), mock.ANY)
+        self.assertEqual(pol._shared,
+                         {('a',): mock_SharedRules.return_value})
+
+    @mock.patch.object(policy.shared, 'SharedRules')
+    def test_evaluate_all_bounded(self, mock_SharedRules):
+        mock_SharedRules.return_value.lookup.return_value = (None, None)
+        pol = policy.Policy(engine=mock.Mock())
+        pol.max_shared = 2
+        pol._shared = {('a',): 'a', ('b',): 'b'}
+
+        pol.evaluate_all(names=['c'])
+
+        self.assertEqual(pol._shared,
+                         {('c',): mock_SharedRules.return_value})
+
+    def test_lookup_none(self):
+        pol = policy.Policy()
+
+        self.assertEqual(pol._lookup('name'), (None, None))
+
+    def test_lookup_both(self):
+        rule = mock.Mock(attrs={'a': 1, 'b': 2})
+        default = mock.Mock(attrs={'b': 3, 'c': 4})
+        pol = policy.Policy()
+        pol._rules['name'] = rule
+        pol._defaults['name'] = default
+
+        result = pol._lookup('name')
+
+        self.assertEqual(result, (rule, {'a': 1, 'b': 2, 'c': 4}))
+
+    def test_lookup_default(self):
+        default = mock.Mock(attrs={'b': 3, 'c': 4})
+        pol = policy.Policy()
+        pol._defaults['name'] = default
+
+        result = pol._lookup('name')
+
+        self.assertEqual(result, (default, {'b': 3, 'c': 4}))
+
+    @mock.patch.object(warmup, 'warmup', return_value='report')
+    def test_warmup(self, mock_warmup):
+        pol = policy.Policy()
+
+        result = pol.warmup()
+
+        self.assertEqual(result, 'report')
+        mock_warmup.assert_called_once_with(pol)
+
+    @mock.patch.object(warmup, 'Warmup')
+    def test_warmup_background(self, mock_Warmup):
+        pol = policy.Policy()
+
+        result = pol.warmup(True)
+
+        self.assertEqual(result, mock_Warmup.return_value)
+        mock_Warmup.assert_called_once_with(pol)
+        mock_Warmup.return_value.start.assert_called_once_with()
+
+    @mock.patch.object(policy, 'FrozenPolicy', return_value='frozen')
+    def test_freeze(self, mock_FrozenPolicy):
+        pol = policy.Policy()
+
+        result = pol.freeze()
+
+        self.assertEqual(result, 'frozen')
+        mock_FrozenPolicy.assert_called_once_with(pol, None)
+
+    @mock.patch.object(policy, 'FrozenPolicy', return_value='frozen')
+    def test_freeze_version(self, mock_FrozenPolicy):
+        pol = policy.Policy()
+
+        result = pol.freeze(5)
+
+        self.assertEqual(result, 'frozen')
+        mock_FrozenPolicy.assert_called_once_with(pol, 5)
+
+    @mock.patch.object(policy, 'PolicyOverlay', return_value='overlay')
+    def test_overlay(self, mock_PolicyOverlay):
+        pol = policy.Policy()
+
+        result = pol.overlay()
+
+        self.assertEqual(result, 'overlay')
+        mock_PolicyOverlay.assert_called_once_with(pol)
+
+
+class TestFrozenPolicy(tests.TestCase):
+    def make_policy(self):
+        engine = mock.Mock(**{
+            'compile.side_effect': lambda r: 'compiled_%s' % r.name,
+            'evaluate.return_value': 'authz',
+        })
+        pol = policy.Policy(engine=engine)
+        pol._rules = {
+            'a': mock.Mock(attrs={'x': 1}),
+            'b': mock.Mock(attrs={}),
+        }
+        pol._rules['a'].name = 'a'
+        pol._rules['b'].name = 'b'
+        pol._defaults = {
+            'b': mock.Mock(attrs={'y': 2}),
+            'c': mock.Mock(attrs={'z': 3}),
+        }
+        pol._defaults['c'].name = 'c'
+
+        return pol
+
+    def test_init(self):
+        pol = self.make_policy()
+
+        frozen = policy.FrozenPolicy(pol, 3)
+
+        self.assertEqual(frozen.policy, pol)
+        self.assertEqual(frozen.version, 3)
+        self.assertEqual(frozen.context_class, pol.context_class)
+        self.assertEqual(frozen.engine, pol.engine)
+        self.assertEqual(frozen.lazy_stats, pol.lazy_stats)
+        self.assertEqual(frozen.coalescer, pol.coalescer)
+        self.assertEqual(frozen._entries, {
+            'a': (pol._rules['a'], 'compiled_a', {'x': 1}),
+            'b': (pol._rules['b'], 'compiled_b', {'y': 2}),
+            'c': (pol._defaults['c'], 'compiled_c', {'z': 3}),
+        })
+
+    def test_immutable(self):
+        pol = self.make_policy()
+        rule_a = pol._rules['a']
+        frozen = policy.FrozenPolicy(pol)
+
+        pol['d'] = 'True'
+        del pol['a']
+
+        self.assertEqual(sorted(frozen), ['a', 'b', 'c'])
+        self.assertEqual(len(frozen), 3)
+        self.assertEqual(frozen['a'], rule_a)
+        self.assertRaises(KeyError, frozen.__getitem__, 'd')
+        self.assertRaises(TypeError, item_setter, frozen, 'd', 'True')
+
+    def test_resolve(self):
+        pol = mock.Mock(**{
+            '__iter__': mock.Mock(return_value=iter([])),
+            'resolve.return_value': 'value',
+        })
+        frozen = policy.FrozenPolicy(pol)
+
+        result = frozen.resolve('spam')
+
+        self.assertEqual(result, 'value')
+        pol.resolve.assert_called_once_with('spam')
+
+    @mock.patch('policies.authorization.Authorization', return_value='denied')
+    def test_evaluate_norule(self, mock_Authorization):
+        pol = self.make_policy()
+        frozen = policy.FrozenPolicy(pol)
+
+        result = frozen.evaluate('d')
+
+        self.assertEqual(result, 'denied')
+        mock_Authorization.assert_called_once_with(False)
+        self.assertFalse(pol.engine.evaluate.called)
+
+    def test_evaluate(self):
+        pol = self.make_policy()
+        frozen = policy.FrozenPolicy(pol)
+
+        result = frozen.evaluate('b', {'v': 1})
+
+        self.assertEqual(result, 'authz')
+        pol.engine.evaluate.assert_called_once_with(
+            frozen, 'b', 'compiled_b', {'y': 2}, {'v': 1})
+
+    @unittest.skipIf(aio is None, "asyncio support requires Python 3.5")
+    @mock.patch('policies.aio.run', new_callable=mock.Mock,
+                return_value='coro')
+    def test_evaluate_async_norule(self, mock_run):
+        pol = self.make_policy()
+        frozen = policy.FrozenPolicy(pol)
+
+        result = frozen.evaluate_async('d', {'v': 1})
+
+        self.assertEqual(result, 'coro')
+        mock_run.assert_called_once_with(frozen, 'd', None, None, {}, None)
+
+    @unittest.skipIf(aio is None, "asyncio support requires Python 3.5")
+    @mock.patch('policies.aio.run', new_callable=mock.Mock,
+                return_value='coro')
+    def test_evaluate_async(self, mock_run):
+        pol = self.make_policy()
+        frozen = policy.FrozenPolicy(pol)
+
+        result = frozen.evaluate_async('b', {'v': 1}, 5)
+
+        self.assertEqual(result, 'coro')
+        mock_run.assert_called_once_with(frozen, 'b', 'compiled_b', {'y': 2},
+                                         {'v': 1}, 5)
+
+    @unittest.skipIf(aio is None, "asyncio support requires Python 3.5")
+    @mock.patch('policies.aio.run', new_callable=mock.Mock,
+                return_value='coro')
+    def test_evaluate_async_coalesced(self, mock_run):
+        pol = self.make_policy()
+        pol.coalescer = mock.Mock(**{
+            'evaluate.side_effect': lambda p, n, v, e: e(n, v),
+        })
+        frozen = policy.FrozenPolicy(pol)
+
+        result = frozen.evaluate_async('b', {'v': 1})
+
+        self.assertEqual(result, 'coro')
+        pol.coalescer.evaluate.assert_called_once_with(
+            frozen, 'b', {'v': 1}, mock.ANY)
+        mock_run.assert_called_once_with(frozen, 'b', 'compiled_b', {'y': 2},
+                                         {'v': 1}, None)
+
+    def test_evaluate_many_norule(self):
+        pol = self.make_policy()
+        frozen = policy.FrozenPolicy(pol)
+
+        result = frozen.evaluate_many('d', [{}, {}], bitmap=True)
+
+        self.assertEqual(result, bytearray([0, 0]))
+        self.assertFalse(pol.engine.evaluate_many.called)
+
+    def test_evaluate_many(self):
+        pol = self.make_policy()
+        pol.engine.evaluate_many.side_effect = lambda p, n, c, a, v: (
+            (c, a, x) for x in v)
+        frozen = policy.FrozenPolicy(pol)
+
+        result = frozen.evaluate_many('b', iter([{'v': 1}, None]))
+
+        self.assertEqual(list(result), [('compiled_b', {'y': 2}, {'v': 1}),
+                                        ('compiled_b', {'y': 2}, {})])
+
+
+class TestPolicyOverlay(tests.TestCase):
+    def make_parent(self):
+        parent = policy.Policy(group='spam', engine='engine')
+        parent.context_class = 'context'
+        parent._rules = {'a': 'rule_a', 'b': 'rule_b'}
+        parent._defaults = {'b': 'default_b', 'c': 'default_c'}
+        parent._docs = {
+            'b': mock.Mock(),
+            'c': mock.Mock(),
+        }
+        parent._docs['b'].name = 'b'
+        parent._docs['c'].name = 'c'
+
+        return parent
+
+    def test_init(self):
+        parent = self.make_parent()
+
+        result = policy.PolicyOverlay(parent)
+
+        self.assertEqual(result.parent, parent)
+        self.assertEqual(result._group, 'spam')
+        self.assertEqual(result._entrypoints, parent._entrypoints)
+        self.assertTrue(result._builtins is parent._builtins)
+        self.assertEqual(result.engine, 'engine')
+        self.assertEqual(result.context_class, 'context')
+        self.assertEqual(result._defaults, {})
+        self.assertEqual(result._docs, {})
+        self.assertEqual(result._rules, {})
+        self.assertEqual(result.decision_cache, None)
+        self.assertEqual(result.coalescer, None)
+        self.assertTrue(result.lazy_stats is parent.lazy_stats)
+        self.assertFalse(hasattr(result, '_resolve_cache'))
+
+    def test_getitem(self):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+        overlay._rules['b'] = 'override_b'
+        overlay._defaults['d'] = 'default_d'
+
+        self.assertEqual(overlay['a'], 'rule_a')
+        self.assertEqual(overlay['b'], 'override_b')
+        self.assertEqual(overlay['c'], 'default_c')
+        self.assertEqual(overlay['d'], 'default_d')
+        self.assertRaises(KeyError, overlay.__getitem__, 'e')
+
+    def test_setitem(self):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+
+        overlay['a'] = 'False'
+
+        self.assertEqual(overlay['a'].text, 'False')
+        self.assertEqual(parent._rules['a'], 'rule_a')
+
+    def test_generation(self):
+        parent = policy.Policy()
+        overlay = policy.PolicyOverlay(parent)
+        generations = [overlay.generation]
+
+        overlay['a'] = 'True'
+        generations.append(overlay.generation)
+        parent['b'] = 'True'
+        generations.append(overlay.generation)
+
+        self.assertEqual(generations, [0, 1, 2])
+        self.assertEqual(parent.generation, 1)
+
+    def test_delitem(self):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+        overlay._rules['a'] = 'override_a'
+
+        del overlay['a']
+
+        self.assertEqual(overlay['a'], 'rule_a')
+        self.assertRaises(KeyError, overlay.__delitem__, 'a')
+        self.assertEqual(parent._rules, {'a': 'rule_a', 'b': 'rule_b'})
+
+    def test_iter(self):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+        overlay._rules['d'] = 'rule_d'
+        overlay._defaults['e'] = 'default_e'
+
+        self.assertEqual(sorted(overlay), ['a', 'b', 'c', 'd', 'e'])
+
+    def test_len(self):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+        overlay._rules['a'] = 'override_a'
+        overlay._defaults['e'] = 'default_e'
+
+        self.assertEqual(len(overlay), 4)
+
+    def test_declared(self):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+        overlay._defaults['e'] = 'default_e'
+
+        self.assertTrue(overlay.declared('c'))
+        self.assertTrue(overlay.declared('e'))
+        self.assertFalse(overlay.declared('a'))
+
+    def test_get_default(self):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+        overlay._defaults['c'] = 'override_c'
+
+        self.assertEqual(overlay.get_default('b'), 'default_b')
+        self.assertEqual(overlay.get_default('c'), 'override_c')
+        self.assertRaises(KeyError, overlay.get_default, 'a')
+
+    @mock.patch.object(rules, 'RuleDoc', return_value='doc')
+    def test_get_doc(self, mock_RuleDoc):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+
+        self.assertEqual(overlay.get_doc('b'), parent._docs['b'])
+        self.assertEqual(overlay.get_doc('a'), 'doc')
+        mock_RuleDoc.assert_called_once_with('a')
+        self.assertEqual(overlay._docs, {'a': 'doc'})
+        self.assertEqual(sorted(parent._docs), ['b', 'c'])
+
+    def test_get_docs(self):
+        parent = self.make_parent()
+        overlay = policy.PolicyOverlay(parent)
+        overlay._docs['c'] = mock.Mock()
+        overlay._docs['c'].name = 'c'
+
+        result = overlay.get_docs()
+
+        self.assertEqual(len(result), 2)
+        self.assertTrue(parent._docs['b'] in result)
+        self.assertTrue(overlay._docs['c'] in result)
+
+    def test_lookup(self):
+        parent = policy.Policy()
+        parent._rules['a'] = mock.Mock(attrs={'x': 1})
+        parent._defaults['a'] = mock.Mock(attrs={'x': 0, 'y': 2})
+        overlay = policy.PolicyOverlay(parent)
+        overlay._rules['a'] = mock.Mock(attrs={'z': 3})
+
+        rule, attrs = overlay._lookup('a')
+
+        self.assertEqual(rule, overlay._rules['a'])
+        self.assertEqual(attrs, {'x': 0, 'y': 2, 'z': 3})
+
+    def test_resolve(self):
+        parent = mock.Mock(**{'resolve.return_value': 'value'})
+        overlay = policy.PolicyOverlay(parent)
+
+        result = overlay.resolve('spam')
+
+        self.assertEqual(result, 'value')
+        parent.resolve.assert_called_once_with('spam')
+
+    def test_invalidate_entrypoints(self):
+        parent = mock.Mock()
+        overlay = policy.PolicyOverlay(parent)
+
+        overlay.invalidate_entrypoints()
+
+        parent.invalidate_entrypoints.assert_called_once_with()
+
+    def test_nested(self):
+        parent = self.make_parent()
+        child = policy.PolicyOverlay(parent)
+        child._rules['a'] = 'override_a'
+        grandchild = policy.PolicyOverlay(child)
+        grandchild._rules['b'] = 'override_b'
+
+        self.assertEqual(grandchild['a'], 'override_a')
+        self.assertEqual(grandchild['b'], 'override_b')
+        self.assertEqual(grandchild['c'], 'default_c')
+        self.assertEqual(child['b'], 'rule_b')
+
 
 class TestWantContext(tests.TestCase):
     def test_decorator(self):
@@ -637,6 +1391,19 @@ class TestWantContext(tests.TestCase):
         self.assertEqual(result._policies_want_context, True)
 
 
+class TestPure(tests.TestCase):
+    def test_decorator(self):
+        def func():
+            pass
+
+        result = policy.pure(func)
+
+        self.assertEqual(result, func)
+        self.assertEqual(result._policies_pure, True)
+        self.assertEqual(result.pure_hits, 0)
+        self.assertEqual(result.pure_misses, 0)
+
+
 class TestRule(tests.TestCase):
     @mock.patch('logging.getLogger')
     def test_cached(self, mock_getLogger):
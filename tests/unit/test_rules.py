@@ -65,6 +65,31 @@ class TestRule(tests.TestCase):
         self.assertEqual(rule._instructions, 'instructions')
         mock_parse_rule.assert_called_once_with('name', 'text')
 
+    @mock.patch('policies.parser.parse_rule', return_value='instructions')
+    def test_compile(self, mock_parse_rule):
+        rule = rules.Rule('name', 'text')
+
+        self.assertEqual(rule.compile(), 'instructions')
+        self.assertEqual(rule._instructions, 'instructions')
+        mock_parse_rule.assert_called_once_with('name', 'text')
+
+    @mock.patch('policies.parser.parse_rule', return_value='instructions')
+    def test_compile_raise(self, mock_parse_rule):
+        rule = rules.Rule('name', 'text')
+
+        self.assertEqual(rule.compile(True), 'instructions')
+        self.assertEqual(rule._instructions, 'instructions')
+        mock_parse_rule.assert_called_once_with('name', 'text',
+                                                do_raise=True)
+
+    @mock.patch('policies.parser.parse_rule', return_value='instructions')
+    def test_compile_cached(self, mock_parse_rule):
+        rule = rules.Rule('name', 'text')
+        rule._instructions = 'cached'
+
+        self.assertEqual(rule.compile(True), 'cached')
+        self.assertFalse(mock_parse_rule.called)
+
 
 class TestRuleDoc(tests.TestCase):
     def test_init_basic(self):
@@ -0,0 +1,141 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import mock
+
+from policies import analysis
+from policies import instructions
+from policies import policy
+from policies import shared
+
+import tests
+
+
+class TestCommonSubexpressions(tests.TestCase):
+    def test_basic(self):
+        attr = analysis.Attr(analysis.Name('user'), 'roles')
+        test = analysis.Op(instructions.in_op, [analysis.Const('a'), attr])
+        other = analysis.Op(instructions.in_op, [analysis.Const('b'), attr])
+        trees = [
+            analysis.And(test, analysis.Name('x')),
+            analysis.Or(test, other),
+        ]
+
+        result = shared.common_subexpressions(trees)
+
+        self.assertEqual(result, {test.key: 0, attr.key: 1})
+
+    def test_none(self):
+        trees = [
+            analysis.Attr(analysis.Name('a'), 'b'),
+            analysis.Attr(analysis.Name('a'), 'c'),
+        ]
+
+        result = shared.common_subexpressions(trees)
+
+        self.assertEqual(result, {})
+
+
+class TestSharedRules(tests.TestCase):
+    def make_policy(self):
+        pol = policy.Policy()
+        pol['a'] = 'user.admin and rule("c") {{ x=user.admin }}'
+        pol['b'] = 'user.admin or target.public'
+        pol['c'] = 'target.public'
+        pol['d'] = 'rule("c")'
+        pol.declare('a', attrs={'x': 1, 'y': 2})
+        return pol
+
+    def test_init(self):
+        pol = self.make_policy()
+
+        result = shared.SharedRules(pol, ['a', 'b'])
+
+        self.assertEqual(result.policy, pol)
+        self.assertEqual(result.context_class, pol.context_class)
+        self.assertEqual(sorted(result._entries), ['a', 'b', 'c'])
+        self.assertEqual(result.slots, 2)
+        self.assertEqual(result._entries['a'][1], {'x': 1, 'y': 2})
+        self.assertEqual(result._entries['a'][0].text, pol['a'].text)
+        self.assertNotEqual(result._entries['a'][0], pol['a'])
+        self.assertTrue(any(isinstance(inst, instructions.Memoize)
+                            for inst in result['c'].instructions.instructions))
+
+    def test_init_nomemoize(self):
+        pol = self.make_policy()
+
+        result = shared.SharedRules(pol, ['a', 'b'], False)
+
+        self.assertEqual(result.slots, 0)
+        self.assertEqual(result._entries['a'], pol._lookup('a'))
+        self.assertEqual(result['b'], pol['b'])
+
+    def test_init_undecompilable(self):
+        pol = self.make_policy()
+        pol['c']._instructions = instructions.Instructions([
+            instructions.Ident('a'),
+        ])
+
+        result = shared.SharedRules(pol, ['a', 'b'])
+
+        self.assertEqual(result['c'], pol['c'])
+
+    def test_getitem(self):
+        pol = self.make_policy()
+        view = shared.SharedRules(pol, ['a', 'missing'])
+
+        self.assertEqual(view['c'].text, 'target.public')
+        self.assertEqual(view['b'], pol['b'])
+        self.assertRaises(KeyError, view.__getitem__, 'missing')
+        self.assertRaises(KeyError, view.__getitem__, 'other')
+
+    def test_current(self):
+        pol = self.make_policy()
+        view = shared.SharedRules(pol, ['a'])
+
+        self.assertTrue(view.current(pol))
+
+        pol['b'] = 'False'
+        self.assertTrue(view.current(pol))
+
+        pol['c'] = 'False'
+        self.assertFalse(view.current(pol))
+
+    def test_current_default(self):
+        pol = self.make_policy()
+        view = shared.SharedRules(pol, ['a'])
+
+        pol.declare('a', attrs={'x': 5})
+
+        self.assertFalse(view.current(pol))
+
+    def test_lookup(self):
+        pol = self.make_policy()
+        view = shared.SharedRules(pol, ['a', 'missing'])
+
+        self.assertEqual(view.lookup('a'), view._entries['a'])
+        self.assertEqual(view.lookup('missing'), (None, None))
+        self.assertEqual(view.lookup('b'), pol._lookup('b'))
+
+    def test_resolve(self):
+        pol = mock.Mock(**{
+            '_lookup.return_value': (None, None),
+            'resolve.return_value': 'value',
+        })
+        view = shared.SharedRules(pol, [])
+
+        self.assertEqual(view.resolve('spam'), 'value')
+        pol.resolve.assert_called_once_with('spam')
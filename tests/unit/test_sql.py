@@ -0,0 +1,237 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import mock
+
+from policies import analysis
+from policies import partial
+from policies import policy
+from policies import sql
+
+import tests
+
+
+def translate(text, variables=None, **kwargs):
+    pol = policy.Policy()
+    pol['test'] = text
+    residual = pol.partial('test', variables)
+    return sql.translate(residual, **kwargs)
+
+
+class TestTranslation(tests.TestCase):
+    def test_init(self):
+        result = sql.Translation('residual', 'row', 'where', ['params'],
+                                 ['untranslated'])
+
+        self.assertEqual(result.residual, 'residual')
+        self.assertEqual(result.row_var, 'row')
+        self.assertEqual(result.where, 'where')
+        self.assertEqual(result.params, ['params'])
+        self.assertEqual(result.untranslated, ['untranslated'])
+        self.assertFalse(result.exact)
+
+    def test_filter_exact(self):
+        residual = mock.Mock()
+        trans = sql.Translation(residual, 'row', 'where', [], [])
+
+        result = trans.filter([1, 2, 3])
+
+        self.assertEqual(list(result), [1, 2, 3])
+        self.assertFalse(residual.evaluate_many.called)
+
+    def test_filter(self):
+        residual = mock.Mock(**{
+            'evaluate_many.side_effect': lambda v: (x['r'] > 1 for x in v),
+        })
+        trans = sql.Translation(residual, 'r', 'where', [], ['untranslated'])
+
+        result = trans.filter(iter([1, 2, 3, 0]))
+
+        self.assertEqual(list(result), [2, 3])
+
+
+class TestQuote(tests.TestCase):
+    def test_quote(self):
+        self.assertEqual(sql._quote('order'), '"order"')
+        self.assertEqual(sql._quote('a" OR 1'), '"a"" OR 1"')
+
+
+class TestTranslate(tests.TestCase):
+    def test_compare(self):
+        result = translate('row.a == 1 and 2 < row.b and row.c != "x"')
+
+        self.assertEqual(result.where,
+                         '((("a" IS NOT NULL AND "a" = ?) AND '
+                         '("b" IS NOT NULL AND "b" > ?)) AND '
+                         '("c" IS NULL OR "c" <> ?))')
+        self.assertEqual(result.params, [1, 2, 'x'])
+        self.assertTrue(result.exact)
+
+    def test_compare_not_null(self):
+        result = translate('row.a == 1 or row.b >= 2', not_null=['a', 'b'])
+
+        self.assertEqual(result.where, '(("a" = ?) OR ("b" >= ?))')
+        self.assertTrue(result.exact)
+
+    def test_compare_none(self):
+        result = translate('row.a == None or row.b is not None or '
+                           'None is row.c')
+
+        self.assertEqual(result.where, '(("a" IS NULL OR "b" IS NOT NULL) OR '
+                         '"c" IS NULL)')
+        self.assertEqual(result.params, [])
+
+    def test_compare_none_not_null(self):
+        result = translate('row.a == None or row.b', not_null=['a', 'b'],
+                           numeric=['b'])
+
+        self.assertEqual(result.where, '("b" <> 0)')
+
+    def test_quoted(self):
+        result = translate('row.order == 1 and row.my_col == 2',
+                           not_null=['order', 'my_col'])
+
+        self.assertEqual(result.where, '(("order" = ?) AND ("my_col" = ?))')
+
+    def test_truth_not_numeric(self):
+        result = translate('row.a or row.b == 1', not_null=['a', 'b'])
+
+        self.assertEqual(result.where, '(1 = 1)')
+        self.assertFalse(result.exact)
+        self.assertIn('not declared numeric', result.untranslated[0][1])
+
+    def test_truth_nullable(self):
+        result = translate('row.a', numeric=['a'])
+
+        self.assertEqual(result.where, '("a" IS NOT NULL AND "a" <> 0)')
+        self.assertTrue(result.exact)
+
+    def test_ordering_negated(self):
+        result = translate('not row.a < 1')
+
+        self.assertEqual(result.where, 'NOT ("a" IS NOT NULL AND "a" < ?)')
+        self.assertFalse(result.exact)
+        self.assertEqual(len(result.untranslated), 1)
+        self.assertIn('NULL', result.untranslated[0][1])
+
+    def test_membership(self):
+        result = translate('row.a in s and row.b not in {None}',
+                           {'s': (1, None, 2)})
+
+        self.assertEqual(result.where,
+                         '(("a" IS NULL OR '
+                         '("a" IS NOT NULL AND "a" IN (?, ?))) '
+                         'AND NOT "b" IS NULL)')
+        self.assertEqual(result.params, [1, 2])
+        self.assertTrue(result.exact)
+
+    def test_membership_string(self):
+        result = translate('row.a in "abc"')
+
+        self.assertEqual(result.where, '(1 = 1)')
+        self.assertFalse(result.exact)
+
+    def test_cond(self):
+        result = translate('row.a == 1 if row.b else row.c == 2',
+                           not_null=['a', 'b', 'c'], numeric=['b'])
+
+        self.assertEqual(result.where,
+                         '(CASE WHEN ("b" <> 0) THEN ("a" = ?) '
+                         'ELSE ("c" = ?) END)')
+        self.assertEqual(result.params, [1, 2])
+
+    def test_cond_untranslatable(self):
+        result = translate('row.a if len(row.b) else row.c')
+
+        self.assertEqual(result.where, '(1 = 1)')
+        self.assertFalse(result.exact)
+
+    def test_constant(self):
+        self.assertEqual(translate('x', {'x': 1}).where, '(1 = 1)')
+        self.assertEqual(translate('x', {'x': 0}).where, '(1 = 0)')
+
+    def test_untranslatable(self):
+        result = translate('row.a == 1 and (row.b == 2 or len(row.c) > 2)')
+
+        self.assertEqual(result.where, '("a" IS NOT NULL AND "a" = ?)')
+        self.assertEqual(result.params, [1])
+        self.assertFalse(result.exact)
+        self.assertEqual(len(result.untranslated), 1)
+        self.assertIsInstance(result.untranslated[0][0], analysis.Op)
+        self.assertIn('len', result.untranslated[0][1])
+
+    def test_untranslatable_negated(self):
+        result = translate('row.a == 1 and not (row.b == 2 or row.c + 1)')
+
+        self.assertEqual(result.where, '(("a" IS NOT NULL AND "a" = ?) AND '
+                         'NOT ("b" IS NOT NULL AND "b" = ?))')
+        self.assertEqual(result.params, [1, 2])
+        self.assertFalse(result.exact)
+
+    def test_untranslatable_dropped(self):
+        result = translate('row.a == 1 and not (row.b == 2 and row.c + 1)')
+
+        self.assertEqual(result.where, '("a" IS NOT NULL AND "a" = ?)')
+        self.assertEqual(result.params, [1])
+        self.assertFalse(result.exact)
+
+    def test_untranslatable_params(self):
+        result = translate('(row.a == 1 or x) and row.b == 2')
+
+        self.assertEqual(result.where, '("b" IS NOT NULL AND "b" = ?)')
+        self.assertEqual(result.params, [2])
+        self.assertEqual(result.untranslated, [
+            (analysis.Name('x'), "refers to variable 'x'"),
+        ])
+
+    def test_columns(self):
+        result = translate('row.a == 1 and row.b == 2',
+                           columns={'a': 't.col_a'}, placeholder='%s')
+
+        self.assertEqual(result.where, '(t.col_a IS NOT NULL AND '
+                         't.col_a = %s)')
+        self.assertEqual(result.untranslated[0][1], "unknown column 'b'")
+
+    def test_row_var(self):
+        result = translate('item.a == 1 or row.a == 1', row_var='item',
+                           not_null=['a'])
+
+        self.assertEqual(result.where, '(1 = 1)')
+        self.assertFalse(result.exact)
+
+    def test_bind(self):
+        result = translate('row.a == x', {'x': object()})
+
+        self.assertEqual(result.where, '(1 = 1)')
+        self.assertIn('cannot bind', result.untranslated[0][1])
+
+    def test_attrs(self):
+        result = translate('row.a {{ x=row.b, y=1, z=row.c + 1 }}',
+                           not_null=['a'], numeric=['a'])
+
+        self.assertEqual(result.where, '("a" <> 0)')
+        self.assertEqual(len(result.untranslated), 1)
+        self.assertIn("'z'", result.untranslated[0][1])
+
+    def test_unanalyzable(self):
+        residual = mock.Mock(spec=partial.Residual, expr=None)
+
+        result = sql.translate(residual)
+
+        self.assertEqual(result.where, '(1 = 1)')
+        self.assertEqual(result.params, [])
+        self.assertFalse(result.exact)
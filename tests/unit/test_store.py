@@ -0,0 +1,293 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import mock
+
+from policies import policy
+from policies import store
+
+import tests
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class TestPolicySize(tests.TestCase):
+    def test_other(self):
+        self.assertEqual(store.policy_size('spam'),
+                         store.sys.getsizeof('spam'))
+
+    def test_policy(self):
+        pol = policy.Policy()
+        empty = store.policy_size(pol)
+
+        pol['a'] = 'user == "spam"'
+        result = store.policy_size(pol)
+
+        self.assertTrue(empty < result)
+        self.assertNotEqual(pol['a']._instructions, None)
+        self.assertEqual(store.policy_size(pol), result)
+
+    def test_overlay(self):
+        pol = policy.Policy()
+        pol['a'] = 'user == "spam"'
+        overlay = pol.overlay()
+
+        self.assertTrue(store.policy_size(overlay) < store.policy_size(pol))
+
+
+class TestPolicyStore(tests.TestCase):
+    def test_init(self):
+        result = store.PolicyStore('loader', 5, 1000, 'sizer', True)
+
+        self.assertEqual(result.loader, 'loader')
+        self.assertEqual(result.max_policies, 5)
+        self.assertEqual(result.max_size, 1000)
+        self.assertEqual(result.sizer, 'sizer')
+        self.assertEqual(result.warmup, True)
+        self.assertEqual(len(result), 0)
+        self.assertEqual(result.size, 0)
+        self.assertEqual(result.hits, 0)
+        self.assertEqual(result.misses, 0)
+        self.assertEqual(result.loads, 0)
+        self.assertEqual(result.load_errors, 0)
+        self.assertEqual(result.evictions, 0)
+
+    def test_get_miss(self):
+        pol = mock.Mock()
+        loader = mock.Mock(return_value=pol)
+        st = store.PolicyStore(loader, sizer=lambda p: 10)
+
+        result = st.get('tenant')
+
+        self.assertEqual(result, pol)
+        loader.assert_called_once_with('tenant')
+        self.assertFalse(pol.warmup.called)
+        self.assertTrue('tenant' in st)
+        self.assertEqual(len(st), 1)
+        self.assertEqual(st.size, 10)
+        self.assertEqual(st.hits, 0)
+        self.assertEqual(st.misses, 1)
+        self.assertEqual(st.loads, 1)
+        self.assertTrue(st.max_load_time <= st.load_time)
+
+    def test_get_hit(self):
+        loader = mock.Mock(side_effect=lambda t: 'policy_%s' % t)
+        st = store.PolicyStore(loader, sizer=lambda p: 10)
+        st.get('tenant')
+
+        result = st['tenant']
+
+        self.assertEqual(result, 'policy_tenant')
+        loader.assert_called_once_with('tenant')
+        self.assertEqual(st.hits, 1)
+        self.assertEqual(st.misses, 1)
+
+    def test_get_warmup(self):
+        pol = mock.Mock()
+        st = store.PolicyStore(mock.Mock(return_value=pol),
+                               sizer=lambda p: 10, warmup=True)
+
+        st.get('tenant')
+
+        pol.warmup.assert_called_once_with()
+
+    @mock.patch('logging.getLogger')
+    def test_get_failure(self, mock_getLogger):
+        loader = mock.Mock(side_effect=ValueError('bad'))
+        st = store.PolicyStore(loader)
+
+        self.assertRaises(ValueError, st.get, 'tenant')
+        self.assertRaises(ValueError, st.get, 'tenant')
+
+        self.assertEqual(loader.call_count, 2)
+        self.assertFalse('tenant' in st)
+        self.assertEqual(st.loads, 2)
+        self.assertEqual(st.load_errors, 2)
+        mock_getLogger.return_value.warn.assert_called_with(
+            "Failed to load policy for tenant 'tenant': bad")
+
+    def test_evict_count(self):
+        st = store.PolicyStore(lambda t: t, max_policies=2,
+                               sizer=lambda p: 10)
+        st.get('a')
+        st.get('b')
+        st.get('a')
+
+        st.get('c')
+
+        self.assertEqual(list(st._policies), ['a', 'c'])
+        self.assertEqual(st.size, 20)
+        self.assertEqual(st.evictions, 1)
+
+    def test_evict_size(self):
+        sizes = {'a': 10, 'b': 20, 'c': 30, 'd': 100}
+        st = store.PolicyStore(lambda t: t, max_size=50,
+                               sizer=lambda p: sizes[p])
+        st.get('a')
+        st.get('b')
+
+        st.get('c')
+
+        self.assertEqual(list(st._policies), ['b', 'c'])
+        self.assertEqual(st.size, 50)
+        self.assertEqual(st.evictions, 1)
+
+        # The newest policy is kept even if it alone exceeds the budget
+        st.get('d')
+
+        self.assertEqual(list(st._policies), ['d'])
+        self.assertEqual(st.size, 100)
+        self.assertEqual(st.evictions, 3)
+
+    def test_evict_size_uncompiled(self):
+        def loader(tenant):
+            pol = policy.Policy()
+            pol['rule'] = 'user == %r and "admin" in roles' % tenant
+            return pol
+
+        # The size of a policy whose rules have been evaluated
+        pol = loader('a')
+        pol['rule'].compile()
+        size = store.policy_size(pol)
+        st = store.PolicyStore(loader, max_size=2 * size - 1)
+        st.get('a')
+
+        st.get('b')
+
+        self.assertEqual(list(st._policies), ['b'])
+        self.assertEqual(st.evictions, 1)
+
+    def test_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def loader(tenant):
+            started.set()
+            release.wait()
+            return 'policy_%s' % tenant
+
+        loader = mock.Mock(side_effect=loader)
+        st = store.PolicyStore(loader, sizer=lambda p: 10)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            st.get('tenant'))) for _i in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while st.misses < 5:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['policy_tenant'] * 5)
+        loader.assert_called_once_with('tenant')
+        self.assertEqual(st.misses, 5)
+        self.assertEqual(st.loads, 1)
+
+    def test_get_interrupted(self):
+        loader = mock.Mock(side_effect=[Interrupted(), 'policy'])
+        st = store.PolicyStore(loader, sizer=lambda p: 10)
+
+        self.assertRaises(Interrupted, st.get, 'tenant')
+
+        self.assertEqual(st._flights, {})
+        self.assertEqual(list(st._policies), [])
+        self.assertEqual(st.load_errors, 1)
+        self.assertEqual(st.get('tenant'), 'policy')
+        self.assertEqual(loader.call_count, 2)
+
+    def test_get_interrupted_waiter(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def loader(tenant):
+            started.set()
+            release.wait()
+            raise Interrupted()
+
+        def get():
+            try:
+                results.append(st.get('tenant'))
+            except BaseException as exc:
+                results.append(type(exc))
+
+        st = store.PolicyStore(loader, sizer=lambda p: 10)
+        results = []
+        threads = [threading.Thread(target=get) for _i in range(2)]
+        threads[0].start()
+        started.wait()
+        threads[1].start()
+        while st.misses < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results, key=lambda x: x.__name__),
+                         [Interrupted, RuntimeError])
+        self.assertEqual(st._flights, {})
+        self.assertEqual(list(st._policies), [])
+
+    def test_invalidate(self):
+        st = store.PolicyStore(lambda t: t, sizer=lambda p: 10)
+        st.get('a')
+        st.get('b')
+
+        st.invalidate('a')
+        st.invalidate('c')
+
+        self.assertEqual(list(st._policies), ['b'])
+        self.assertEqual(st.size, 10)
+
+    def test_invalidate_during_load(self):
+        def loader(tenant):
+            st.invalidate(tenant)
+            return 'policy_%s' % tenant
+
+        st = store.PolicyStore(loader, sizer=lambda p: 10)
+
+        result = st.get('a')
+
+        self.assertEqual(result, 'policy_a')
+        self.assertFalse('a' in st)
+
+    def test_clear(self):
+        st = store.PolicyStore(lambda t: t, sizer=lambda p: 10)
+        st.get('a')
+        st.get('b')
+
+        st.clear()
+
+        self.assertEqual(len(st), 0)
+        self.assertEqual(st.size, 0)
+
+    def test_evaluate(self):
+        pol = mock.Mock(**{'evaluate.return_value': 'authz'})
+        st = store.PolicyStore(mock.Mock(return_value=pol),
+                               sizer=lambda p: 10)
+
+        result = st.evaluate('tenant', 'rule', {'a': 1})
+
+        self.assertEqual(result, 'authz')
+        pol.evaluate.assert_called_once_with('rule', {'a': 1})
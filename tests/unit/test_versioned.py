@@ -0,0 +1,117 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import gc
+
+import mock
+
+from policies import policy
+from policies import versioned
+
+import tests
+
+
+class TestVersionedPolicy(tests.TestCase):
+    def test_init_basic(self):
+        handle = versioned.VersionedPolicy()
+
+        self.assertTrue(isinstance(handle.policy, policy.Policy))
+        self.assertTrue(isinstance(handle.current, policy.FrozenPolicy))
+        self.assertEqual(handle.current.policy, handle.policy)
+        self.assertEqual(handle.version, 1)
+        self.assertEqual(handle.live_versions, [1])
+
+    def test_init_policy(self):
+        pol = policy.Policy()
+        pol['a'] = 'True'
+
+        handle = versioned.VersionedPolicy(pol)
+
+        self.assertEqual(handle.policy, pol)
+        self.assertEqual(list(handle.current), ['a'])
+
+    def test_publish(self):
+        handle = versioned.VersionedPolicy()
+        old = handle.current
+        handle.policy['a'] = 'True'
+
+        result = handle.publish()
+
+        self.assertEqual(result, 2)
+        self.assertEqual(handle.version, 2)
+        self.assertEqual(list(handle.current), ['a'])
+        self.assertEqual(list(old), [])
+
+    def test_publish_replace(self):
+        handle = versioned.VersionedPolicy()
+        pol = policy.Policy()
+        pol['b'] = 'True'
+
+        result = handle.publish(pol)
+
+        self.assertEqual(result, 2)
+        self.assertEqual(handle.policy, pol)
+        self.assertEqual(list(handle.current), ['b'])
+
+    def test_live_versions(self):
+        handle = versioned.VersionedPolicy()
+        in_flight = handle.current
+
+        handle.publish()
+        handle.publish()
+        gc.collect()
+
+        self.assertEqual(handle.live_versions, [1, 3])
+
+        del in_flight
+        gc.collect()
+
+        self.assertEqual(handle.live_versions, [3])
+
+    def test_update(self):
+        handle = versioned.VersionedPolicy()
+
+        with handle.update() as pol:
+            pol['a'] = 'True'
+            self.assertEqual(handle.version, 1)
+            self.assertEqual(list(handle.current), [])
+
+        self.assertEqual(handle.version, 2)
+        self.assertEqual(list(handle.current), ['a'])
+
+    def test_update_exception(self):
+        handle = versioned.VersionedPolicy()
+
+        try:
+            with handle.update() as pol:
+                pol['a'] = 'True'
+                raise tests.TestException('test')
+        except tests.TestException:
+            pass
+        else:
+            self.fail("TestException failed to bubble up")
+
+        self.assertEqual(handle.version, 1)
+        self.assertEqual(list(handle.current), [])
+
+    def test_evaluate(self):
+        handle = versioned.VersionedPolicy()
+        handle._current = mock.Mock(**{'evaluate.return_value': 'authz'})
+
+        result = handle.evaluate('name', {'a': 1})
+
+        self.assertEqual(result, 'authz')
+        handle._current.evaluate.assert_called_once_with('name', {'a': 1})
@@ -0,0 +1,94 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import mock
+import pyparsing
+
+from policies import instructions
+from policies import policy
+from policies import warmup
+
+import tests
+
+
+class TestIdentifiers(tests.TestCase):
+    def test_identifiers(self):
+        insts = instructions.Instructions([
+            instructions.Ident('a'), instructions.Constant('b'),
+            instructions.Ident('c'), instructions.Attribute('d'),
+            instructions.Ident('a'),
+        ])
+
+        self.assertEqual(warmup.identifiers(insts), set(['a', 'c']))
+
+
+class TestWarmup(tests.TestCase):
+    def test_warmup(self):
+        pol = policy.Policy(builtins={'func': len})
+        pol['a'] = 'func(user) and rule("b")'
+        pol['b'] = 'other.attr'
+        pol.declare('c', 'True')
+
+        report = warmup.warmup(pol)
+
+        self.assertEqual(sorted(report.compile_times), ['a', 'b', 'c'])
+        self.assertEqual(sorted(report.resolve_times),
+                         ['func', 'other', 'rule', 'user'])
+        self.assertEqual(report.unresolved, set(['other', 'user']))
+        self.assertEqual(report.errors, {})
+        self.assertTrue(report.elapsed >= 0.0)
+        for name in ('a', 'b', 'c'):
+            self.assertNotEqual(pol[name]._instructions, None)
+
+    def test_warmup_error(self):
+        exc = tests.TestException('test')
+        engine = mock.Mock(**{'compile.side_effect': exc})
+        pol = policy.Policy(engine=engine)
+        pol['a'] = 'True'
+
+        report = warmup.warmup(pol)
+
+        self.assertEqual(report.errors, {'a': exc})
+        self.assertEqual(list(report.compile_times), ['a'])
+        self.assertEqual(report.resolve_times, {})
+
+    def test_warmup_parse_error(self):
+        pol = policy.Policy()
+        pol['a'] = 'user == ('
+        pol['b'] = 'True'
+
+        report = warmup.warmup(pol)
+
+        self.assertEqual(list(report.errors), ['a'])
+        self.assertTrue(isinstance(report.errors['a'],
+                                   pyparsing.ParseException))
+        self.assertEqual(sorted(report.compile_times), ['a', 'b'])
+        self.assertFalse(pol.evaluate('a', {'user': 'alice'}))
+
+
+class TestWarmupThread(tests.TestCase):
+    @mock.patch.object(warmup, 'warmup', return_value='report')
+    def test_run(self, mock_warmup):
+        thread = warmup.Warmup('policy')
+
+        self.assertTrue(thread.daemon)
+        self.assertEqual(thread.report, None)
+
+        thread.start()
+        thread.join()
+
+        self.assertEqual(thread.report, 'report')
+        mock_warmup.assert_called_once_with('policy')
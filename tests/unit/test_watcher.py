@@ -0,0 +1,196 @@
+# Copyright (C) 2013 by Kevin L. Mitchell <klmitch@mit.edu>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+
+from policies import policy
+from policies import versioned
+from policies import watcher
+
+import tests
+
+
+class TestLoadJSON(tests.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load(self):
+        path = os.path.join(self.tmpdir, 'policy.json')
+        with open(path, 'w') as f:
+            json.dump({'a': 'True'}, f)
+
+        self.assertEqual(watcher.load_json(path), {'a': 'True'})
+
+    def test_load_notobject(self):
+        path = os.path.join(self.tmpdir, 'policy.json')
+        with open(path, 'w') as f:
+            json.dump(['a'], f)
+
+        self.assertRaises(ValueError, watcher.load_json, path)
+
+
+class TestPolicyWatcher(tests.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, fname, data):
+        path = os.path.join(self.tmpdir, fname)
+        with open(path, 'w') as f:
+            if isinstance(data, dict):
+                json.dump(data, f)
+            else:
+                f.write(data)
+        return path
+
+    def test_files(self):
+        self.write('b.json', {})
+        self.write('a.json', {})
+        self.write('c.txt', {})
+        other = tempfile.mkdtemp()
+        try:
+            extra = os.path.join(other, 'extra.conf')
+            with open(extra, 'w') as f:
+                f.write('{}')
+            watch = watcher.PolicyWatcher(
+                policy.Policy(),
+                [self.tmpdir, extra, os.path.join(other, 'missing')])
+
+            result = watch.files()
+        finally:
+            shutil.rmtree(other)
+
+        self.assertEqual(result, sorted([
+            os.path.join(self.tmpdir, 'a.json'),
+            os.path.join(self.tmpdir, 'b.json'),
+            extra,
+        ]))
+
+    def test_scan(self):
+        path = self.write('a.json', {'a': 'True'})
+        watch = watcher.PolicyWatcher(policy.Policy(), [self.tmpdir])
+
+        result = watch.scan()
+
+        self.assertEqual(result, ((path, os.stat(path).st_mtime,
+                                   os.stat(path).st_size),))
+
+    def test_reload_policy(self):
+        self.write('a.json', {'a': 'True', 'b': 'user.admin'})
+        self.write('b.json', {'b': 'False'})
+        pol = policy.Policy()
+        watch = watcher.PolicyWatcher(pol, [self.tmpdir])
+
+        self.assertTrue(watch.reload())
+
+        self.assertEqual(sorted(pol), ['a', 'b'])
+        self.assertEqual(pol['b'].text, 'False')
+        self.assertNotEqual(pol['a']._instructions, None)
+        self.assertEqual(watch.version, 1)
+        self.assertEqual(watch.errors, {})
+        self.assertEqual(watch.load_errors, {})
+        self.assertTrue(watch.reload_duration >= 0.0)
+
+    def test_reload_changes(self):
+        self.write('a.json', {'a': 'True', 'b': 'False', 'c': 'True'})
+        pol = policy.Policy()
+        pol.declare('c', 'False')
+        watch = watcher.PolicyWatcher(pol, [self.tmpdir])
+        watch.reload()
+        rule_a = pol['a']
+
+        self.write('a.json', {'a': 'True', 'b': 'True'})
+        watch.reload()
+
+        self.assertTrue(pol['a'] is rule_a)
+        self.assertEqual(pol['b'].text, 'True')
+        self.assertEqual(pol['c'].text, 'False')
+        self.assertEqual(watch.version, 2)
+
+    @mock.patch('logging.getLogger')
+    def test_reload_compile_error(self, mock_getLogger):
+        self.write('a.json', {'a': 'True', 'b': '(('})
+        pol = policy.Policy()
+        watch = watcher.PolicyWatcher(pol, [self.tmpdir])
+
+        self.assertTrue(watch.reload())
+
+        self.assertEqual(list(watch.errors), ['b'])
+        self.assertFalse(pol.evaluate('b'))
+        self.assertTrue(pol.evaluate('a'))
+
+    @mock.patch('logging.getLogger')
+    def test_reload_load_error(self, mock_getLogger):
+        path = self.write('a.json', '{"a": ')
+        pol = policy.Policy()
+        pol['a'] = 'True'
+        watch = watcher.PolicyWatcher(pol, [self.tmpdir])
+
+        self.assertFalse(watch.reload())
+
+        self.assertEqual(list(watch.load_errors), [path])
+        self.assertEqual(pol['a'].text, 'True')
+        self.assertEqual(watch.version, None)
+        self.assertTrue(mock_getLogger.return_value.warn.called)
+
+    def test_reload_versioned(self):
+        self.write('a.json', {'a': 'True'})
+        handle = versioned.VersionedPolicy()
+        watch = watcher.PolicyWatcher(handle, [self.tmpdir])
+
+        watch.reload()
+
+        self.assertEqual(watch.version, 2)
+        self.assertTrue(handle.evaluate('a'))
+
+    def run_watcher(self, use_inotify):
+        self.write('a.json', {'a': 'False'})
+        handle = versioned.VersionedPolicy()
+        watch = watcher.PolicyWatcher(handle, [self.tmpdir], interval=0.05,
+                                      debounce=0.05, use_inotify=use_inotify)
+        watch.start()
+        try:
+            deadline = time.time() + 10
+            while watch.version is None and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(handle.evaluate('a'))
+
+            # Make sure the modification time changes
+            time.sleep(0.05)
+            self.write('a.json', {'a': 'True'})
+            while not handle.evaluate('a') and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(handle.evaluate('a'))
+        finally:
+            watch.stop()
+            watch.join()
+
+    def test_run_polling(self):
+        self.run_watcher(False)
+
+    def test_run_inotify(self):
+        self.run_watcher(True)